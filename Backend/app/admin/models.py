@@ -19,6 +19,10 @@ class Local(BaseModel):
     )
     telefono: Optional[str] = None
     email: Optional[EmailStr] = None
+    festivos: Optional[List[str]] = Field(
+        default=None,
+        description="Días sin agenda en la sede (YYYY-MM-DD). Se descuentan de la disponibilidad y la ocupación"
+    )
     
     @validator('moneda')
     def validar_moneda(cls, v):
@@ -35,6 +39,15 @@ class Local(BaseModel):
                 raise ValueError(f"Tipo de comisión debe ser: {', '.join(tipos_validos)}")
         return v
 
+    @validator('festivos')
+    def validar_festivos(cls, v):
+        if v is None:
+            return v
+        try:
+            return sorted({datetime.strptime(f.strip(), "%Y-%m-%d").strftime("%Y-%m-%d") for f in v})
+        except ValueError:
+            raise ValueError("Los festivos deben tener formato YYYY-MM-DD")
+
 
 # =====================================================
 # 💇‍♀️ MODELO: Profesional / Estilista
@@ -13,6 +13,7 @@ from app.admin.models import Local
 from app.database.mongo import collection_locales
 from app.auth.routes import get_current_user
 from app.id_generator.generator import generar_id, validar_id
+from app.analytics.hechos_diarios import invalidar_hechos_sede
 
 logger = logging.getLogger(__name__)
 
@@ -68,6 +69,7 @@ async def crear_local(
         "reglas_comision": local.reglas_comision or {"tipo": "servicios"},  # ✅ NUEVO
         "telefono": local.telefono,
         "email": local.email,
+        "festivos": local.festivos or [],
         "sede_id": sede_id,
         "fecha_creacion": fecha_actual,
         "creado_por": current_user["email"],
@@ -171,14 +173,19 @@ async def update_local(
     # Construir datos a actualizar (solo campos proporcionados)
     update_data = {k: v for k, v in data.dict().items() if v is not None}
 
-    result = await collection_locales.update_one(
+    anterior = await collection_locales.find_one_and_update(
         {"sede_id": sede_id},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection={"nombre": 1}
     )
 
-    if result.matched_count == 0:
+    if anterior is None:
         raise HTTPException(status_code=404, detail="Local not found")
 
+    # Los hechos de analytics guardan el nombre de la sede
+    if "nombre" in update_data and update_data["nombre"] != anterior.get("nombre"):
+        await invalidar_hechos_sede(sede_id)
+
     # 🔍 Obtener el local actualizado
     updated_local = await collection_locales.find_one({"sede_id": sede_id})
 
@@ -14,6 +14,7 @@ from app.database.mongo import (
 )
 from app.id_generator.generator import generar_id, validar_id  # ⭐ Generador de IDs
 from app.auth.controllers import pwd_context
+from app.analytics.hechos_diarios import invalidar_hechos_profesional
 
 router = APIRouter(prefix="/admin/profesionales", tags=["Admin - Profesionales"])
 
@@ -538,6 +539,16 @@ async def update_professional(
             detail=f"Profesional no encontrado: {profesional_id}"
         )
 
+    # Las comisiones de días ya calculados en analytics cambian
+    if "comisiones_por_categoria" in update_data:
+        actualizado = await collection_estilista.find_one(
+            {"$or": [{"profesional_id": profesional_id}, {"unique_id": profesional_id}]
+                    + ([{"_id": ObjectId(profesional_id)}] if ObjectId.is_valid(profesional_id) else []),
+             "rol": "estilista"},
+            {"profesional_id": 1}
+        )
+        await invalidar_hechos_profesional((actualizado or {}).get("profesional_id"))
+
     return {
         "msg": "✅ Profesional actualizado correctamente",
         "profesional_id": profesional_id,
@@ -815,6 +826,8 @@ async def actualizar_comisiones_profesional(
         }}
     )
 
+    await invalidar_hechos_profesional(profesional.get("profesional_id"))
+
     return {
         "msg": "✅ Comisiones actualizadas correctamente",
         "profesional_id": profesional_id,
@@ -6,6 +6,7 @@ from app.admin.models import ServicioAdmin
 from app.auth.routes import get_current_user
 from app.database.mongo import collection_servicios, collection_locales
 from app.id_generator.generator import generar_id, validar_id
+from app.analytics.hechos_diarios import invalidar_hechos_servicio
 
 router = APIRouter(prefix="/admin/servicios", tags=["Admin - Servicios"])
 
@@ -242,6 +243,10 @@ async def actualizar_servicio(
     if result.matched_count == 0:
         raise HTTPException(404, f"Servicio no encontrado con ID: {servicio_id}")
 
+    # Los hechos de analytics guardan la categoría y el nombre del servicio
+    if any(campo in update_data and update_data[campo] != servicio_actual.get(campo) for campo in ("nombre", "categoria")):
+        await invalidar_hechos_servicio(servicio_actual.get("servicio_id"))
+
     return {"msg": "Servicio actualizado correctamente", "servicio_id": servicio_id}
 
 
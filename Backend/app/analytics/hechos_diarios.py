@@ -0,0 +1,1058 @@
+# ============================================================
+# hechos_diarios.py - Tablas de hechos diarios para analytics
+# Ubicación: app/analytics/hechos_diarios.py
+#
+# Los endpoints de analytics leen estos hechos en lugar de cargar todas
+# las citas y ventas del período:
+#
+#   analytics_daily_facts   sede × día × profesional × moneda
+#     {_id: "SEDE|YYYY-MM-DD|PROF|MONEDA", sede_id, sede_nombre, fecha,
+#      profesional_id, profesional_nombre, moneda,
+#      citas, por_estado {estado: n}, valor_por_estado {estado: valor},
+#      ingresos, citas_con_valor, minutos, comision,
+#      categorias [{categoria, cantidad, ingresos, comision}],
+#      servicios  [{nombre, cantidad, ingresos, comision}],
+#      clientes [cliente_id], clientes_nuevos, clientes_recurrentes}
+#   analytics_daily_sales   sede × día × moneda
+#     {_id: "SEDE|YYYY-MM-DD|MONEDA", ventas_totales, cantidad_ventas,
+#      ventas_servicios, ventas_productos, abonos, metodos_pago {...}}
+#   analytics_daily_status  control por sede × día
+#     {_id: "SEDE|YYYY-MM-DD", version, sucio, calculado_en}
+#   analytics_commission_rates  tasa por profesional × servicio
+#     {_id: "PROF|SERVICIO_ID", categoria, nombre, pct, actualizado_en}
+#
+# Los hechos de citas se agregan en MongoDB ($facet con una rama por
+# estado y otra con el $unwind de servicios unido por $lookup a las
+# tasas de comisión). Las tasas se recalculan con _comision_pct() antes
+# de cada agregación, solo para los pares del rango.
+#
+# Criterios (los mismos de analytics_performance y del overview):
+# - ingresos, minutos, comisión, categorías y servicios excluyen las
+#   citas canceladas y no asistidas.
+# - La categoría de servicio va dentro del hecho (categorias[]): solo
+#   las líneas de servicio dependen de ella; repartir conteos, minutos
+#   o clientes de la cita entre categorías los contaría dos veces.
+# - clientes: citas con estado distinto de "cancelada". Es nuevo el
+#   cliente cuya primera cita así en la sede es ese día.
+# - La comisión usa la tasa del profesional al momento del cálculo.
+# - Las ventas van al día de fecha_pago (guardada en hora de la sede).
+#
+# Frescura:
+# - Las escrituras de citas y ventas llaman a invalidar_hechos() con las
+#   fechas afectadas: el día queda sucio (version += 1).
+# - Editar la comisión de un estilista, la categoría o el nombre de un
+#   servicio o el nombre de una sede (sede_nombre se toma de locales)
+#   ensucia los días ya calculados que dependen de ellos
+#   (invalidar_hechos_profesional / _servicio / _sede).
+# - obtener_hechos_*() leen el estado del rango con una consulta; los
+#   días faltantes o sucios se recalculan en bloque por sede antes de
+#   leer. Los últimos DIAS_ABIERTOS días (y los futuros) además vencen a
+#   los HECHOS_MAX_EDAD_SEGUNDOS, red de seguridad para escrituras sin
+#   gancho.
+# - El rollup nocturno (scheduler_hechos.py) recalcula los últimos días
+#   y los que quedaron sucios.
+#
+# Uso por consola:
+#   python -m app.analytics.hechos_diarios --rebuild INICIO FIN [SEDE_ID]
+#   python -m app.analytics.hechos_diarios --paridad SEDE_ID INICIO FIN
+# ============================================================
+
+import asyncio
+import logging
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from app.database.mongo import (
+    db,
+    collection_citas,
+    collection_sales,
+    collection_servicios,
+    collection_estilista,
+    collection_locales,
+)
+from app.cash.accounting_logic import diferencias, fechas_rango
+from app.cash.resumen_diario import fecha_dia
+
+logger = logging.getLogger(__name__)
+
+collection_hechos_citas = db["analytics_daily_facts"]
+collection_hechos_ventas = db["analytics_daily_sales"]
+collection_hechos_estado = db["analytics_daily_status"]
+collection_tasas_comision = db["analytics_commission_rates"]
+
+HECHOS_MAX_EDAD_SEGUNDOS = int(os.getenv("ANALYTICS_HECHOS_MAX_EDAD", "600"))
+DIAS_ABIERTOS = int(os.getenv("ANALYTICS_DIAS_ABIERTOS", "2"))
+# Sedes recalculándose a la vez cuando faltan hechos
+CONCURRENCIA_SEDES = 4
+
+ESTADOS_CANCELADOS = ("cancelada", "no_asistio", "no asistio")
+
+# Métodos que suma el dashboard de ventas desde desglose_pagos
+METODOS_PAGO_VENTAS = [
+    "efectivo", "transferencia", "tarjeta", "tarjeta_credito", "tarjeta_debito",
+    "link_de_pago", "giftcard", "addi", "abonos", "abono_transferencia",
+    "descuento_nomina", "otros",
+]
+
+_PROYECCION_VENTAS = {
+    "_id": 0, "fecha_pago": 1, "moneda": 1, "desglose_pagos": 1,
+    "historial_pagos.tipo": 1, "historial_pagos.monto": 1,
+    "items.tipo": 1, "items.subtotal": 1,
+}
+
+
+# ============================================================
+# MÉTRICAS POR CITA (compartidas con projection_analytics)
+# ============================================================
+
+def _hhmm_to_min(hhmm: str) -> int:
+    """'09:30' → 570 minutos."""
+    try:
+        h, m = map(int, str(hhmm).split(":"))
+        return h * 60 + m
+    except Exception:
+        return 0
+
+
+def _minutos_cita(cita: dict) -> int:
+    """Calcula la duración real de una cita en minutos."""
+    try:
+        return max(
+            0,
+            _hhmm_to_min(cita.get("hora_fin", "00:00"))
+            - _hhmm_to_min(cita.get("hora_inicio", "00:00")),
+        )
+    except Exception:
+        return int(cita.get("servicio_duracion") or 0)
+
+
+def _es_cancelada(estado: str) -> bool:
+    return estado.strip().lower() in ESTADOS_CANCELADOS
+
+
+def _comision_pct(
+    categoria: str,
+    servicio_id: str,
+    prof_doc: dict,
+) -> float:
+    """
+    Determina el % de comisión del profesional para un servicio.
+
+    Prioridad de búsqueda en el documento del estilista:
+      1. comisiones_por_categoria[categoria]
+      2. comisiones[categoria]
+      3. comisiones[servicio_id]          (fallback por servicio_id)
+      4. comision_servicios               (tasa plana)
+      5. comision                         (tasa plana legacy)
+    """
+    comisiones_cat = (
+        prof_doc.get("comisiones_por_categoria")
+        or prof_doc.get("comisiones")
+        or {}
+    )
+    if isinstance(comisiones_cat, dict):
+        pct = (
+            comisiones_cat.get(categoria)
+            or comisiones_cat.get(servicio_id)
+        )
+        if pct is not None:
+            return float(pct)
+
+    return float(
+        prof_doc.get("comision_servicios")
+        or prof_doc.get("comision")
+        or 0
+    )
+
+
+def _numero(valor: Any) -> float:
+    try:
+        return float(valor or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _estado_id(sede_id: str, fecha: str) -> str:
+    return f"{sede_id}|{fecha}"
+
+
+# ============================================================
+# INVALIDACIÓN (llamada desde los endpoints que escriben)
+# ============================================================
+
+async def invalidar_hechos(sede_id: Optional[str], *fechas: Any) -> None:
+    """
+    Marca como sucios los hechos de la sede en esas fechas. Nunca lanza:
+    un día que no se pudo marcar se corrige por edad o en el rollup.
+    """
+    if not sede_id:
+        return
+    for fecha in {d for d in (fecha_dia(f) for f in fechas) if d}:
+        try:
+            await collection_hechos_estado.update_one(
+                {"_id": _estado_id(sede_id, fecha)},
+                {
+                    "$set": {"sede_id": sede_id, "fecha": fecha, "sucio": True, "invalidado_en": datetime.utcnow()},
+                    "$inc": {"version": 1},
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron invalidar los hechos {sede_id} {fecha}: {e}")
+
+
+async def _marcar_sucios(filtro: Dict[str, Any]) -> int:
+    """Ensucia los días ya calculados que cumplan el filtro; los demás se calculan frescos al leerlos."""
+    resultado = await collection_hechos_estado.update_many(
+        filtro,
+        {"$set": {"sucio": True, "invalidado_en": datetime.utcnow()}, "$inc": {"version": 1}},
+    )
+    return resultado.modified_count
+
+
+async def _invalidar_por_citas(filtro_citas: Dict[str, Any], descripcion: str) -> int:
+    """Ensucia los sede × día que tengan citas que cumplan el filtro. Nunca lanza."""
+    try:
+        grupos = await collection_citas.aggregate([
+            {"$match": filtro_citas},
+            {"$group": {"_id": "$sede_id", "fechas": {"$addToSet": "$fecha"}}},
+        ]).to_list(None)
+        total = 0
+        for g in grupos:
+            if g["_id"]:
+                total += await _marcar_sucios({"sede_id": g["_id"], "fecha": {"$in": g["fechas"]}})
+        logger.info(f"📊 Hechos invalidados por {descripcion}: {total} sede-día(s)")
+        return total
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron invalidar los hechos por {descripcion}: {e}")
+        return 0
+
+
+async def invalidar_hechos_profesional(profesional_id: Optional[str]) -> int:
+    """Tras cambiar las comisiones del estilista: días con citas suyas."""
+    if not profesional_id:
+        return 0
+    return await _invalidar_por_citas({"profesional_id": profesional_id}, f"profesional {profesional_id}")
+
+
+async def invalidar_hechos_servicio(servicio_id: Optional[str]) -> int:
+    """Tras cambiar la categoría o el nombre del servicio: días con citas que lo incluyen."""
+    if not servicio_id:
+        return 0
+    return await _invalidar_por_citas({"servicios.servicio_id": servicio_id}, f"servicio {servicio_id}")
+
+
+async def invalidar_hechos_sede(sede_id: Optional[str]) -> int:
+    """Tras renombrar la sede: todos sus días calculados. Nunca lanza."""
+    if not sede_id:
+        return 0
+    try:
+        return await _marcar_sucios({"sede_id": sede_id})
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron invalidar los hechos de la sede {sede_id}: {e}")
+        return 0
+
+
+# ============================================================
+# CÁLCULO DESDE appointments / sales
+# ============================================================
+
+def _hecho_citas_vacio(sede_id: str, fecha: str, profesional_id: str, moneda: str) -> Dict[str, Any]:
+    return {
+        "_id": f"{sede_id}|{fecha}|{profesional_id}|{moneda}",
+        "sede_id": sede_id,
+        "sede_nombre": None,
+        "fecha": fecha,
+        "profesional_id": profesional_id,
+        "profesional_nombre": None,
+        "moneda": moneda,
+        "citas": 0,
+        "por_estado": defaultdict(int),
+        "valor_por_estado": defaultdict(float),
+        "ingresos": 0.0,
+        "citas_con_valor": 0,
+        "minutos": 0,
+        "comision": 0.0,
+        "categorias": defaultdict(lambda: {"cantidad": 0, "ingresos": 0.0, "comision": 0.0}),
+        "servicios": defaultdict(lambda: {"cantidad": 0, "ingresos": 0.0, "comision": 0.0}),
+        "clientes": set(),
+    }
+
+
+def _cerrar_hecho_citas(h: Dict[str, Any], primeras: Dict[str, str], ahora: datetime) -> Dict[str, Any]:
+    nuevos = sum(1 for c in h["clientes"] if primeras.get(c) == h["fecha"])
+    return {
+        **h,
+        "por_estado": dict(h["por_estado"]),
+        "valor_por_estado": {k: round(v, 2) for k, v in h["valor_por_estado"].items()},
+        "ingresos": round(h["ingresos"], 2),
+        "comision": round(h["comision"], 2),
+        "categorias": [
+            {"categoria": k, "cantidad": v["cantidad"], "ingresos": round(v["ingresos"], 2), "comision": round(v["comision"], 2)}
+            for k, v in h["categorias"].items()
+        ],
+        "servicios": [
+            {"nombre": k, "cantidad": v["cantidad"], "ingresos": round(v["ingresos"], 2), "comision": round(v["comision"], 2)}
+            for k, v in h["servicios"].items()
+        ],
+        "clientes": sorted(h["clientes"]),
+        "clientes_nuevos": nuevos,
+        "clientes_recurrentes": len(h["clientes"]) - nuevos,
+        "calculado_en": ahora,
+    }
+
+
+async def _primeras_visitas(sede_id: str, clientes: List[str]) -> Dict[str, str]:
+    """cliente_id → fecha de su primera cita no cancelada en la sede."""
+    if not clientes:
+        return {}
+    filas = await collection_citas.aggregate([
+        {"$match": {"cliente_id": {"$in": clientes}, "sede_id": sede_id, "estado": {"$ne": "cancelada"}}},
+        {"$group": {"_id": "$cliente_id", "primera": {"$min": "$fecha"}}},
+    ]).to_list(None)
+    return {f["_id"]: f["primera"] for f in filas}
+
+
+async def _nombre_sede(sede_id: str) -> Optional[str]:
+    """Nombre actual de la sede; el sede_nombre copiado en la cita queda como respaldo."""
+    sede = await collection_locales.find_one({"sede_id": sede_id}, {"_id": 0, "nombre": 1})
+    return (sede or {}).get("nombre")
+
+
+def _o(expr: Any, defecto: Any) -> Dict[str, Any]:
+    """`expr or defecto` de Python como expresión de agregación."""
+    return {"$cond": [{"$in": [{"$ifNull": [expr, None]}, [None, "", 0, False]]}, defecto, expr]}
+
+
+def _numero_expr(expr: Any) -> Dict[str, Any]:
+    """_numero() como expresión de agregación."""
+    return {"$convert": {"input": expr, "to": "double", "onError": 0.0, "onNull": 0.0}}
+
+
+def _hhmm_expr(campo: str) -> Dict[str, Any]:
+    """_hhmm_to_min() como expresión de agregación (0 si no es HH:MM)."""
+    partes = {"$cond": [
+        {"$eq": [{"$type": campo}, "string"]}, {"$split": [campo, ":"]}, [],
+    ]}
+
+    def entero(i: int) -> Dict[str, Any]:
+        return {"$convert": {"input": {"$arrayElemAt": ["$$p", i]}, "to": "int", "onError": None, "onNull": None}}
+
+    return {"$let": {
+        "vars": {"p": partes},
+        "in": {"$cond": [
+            {"$ne": [{"$size": "$$p"}, 2]}, 0,
+            {"$let": {
+                "vars": {"h": entero(0), "m": entero(1)},
+                "in": {"$cond": [
+                    {"$or": [{"$eq": ["$$h", None]}, {"$eq": ["$$m", None]}]}, 0,
+                    {"$add": [{"$multiply": ["$$h", 60]}, "$$m"]},
+                ]},
+            }},
+        ]},
+    }}
+
+
+def _clave_tasa(profesional_id: str, servicio_id: Any) -> str:
+    return f"{profesional_id}|{servicio_id or ''}"
+
+
+async def _preparar_tasas_comision(sede_id: str, fechas: List[str]) -> None:
+    """
+    Llena analytics_commission_rates para los pares profesional × servicio
+    de las citas del rango: % de comisión (_comision_pct), categoría y
+    nombre del servicio. La agregación de hechos los une con $lookup.
+    """
+    pares = await collection_citas.aggregate([
+        {"$match": {"sede_id": sede_id, "fecha": {"$in": fechas}, "servicios.0": {"$exists": True}}},
+        {"$unwind": "$servicios"},
+        {"$group": {"_id": {"p": "$profesional_id", "s": "$servicios.servicio_id"}}},
+    ]).to_list(None)
+    if not pares:
+        return
+
+    servicio_ids = {p["_id"].get("s") for p in pares if p["_id"].get("s")}
+    prof_ids = {p["_id"].get("p") for p in pares if p["_id"].get("p")}
+    servicios_map: Dict[str, dict] = {}
+    if servicio_ids:
+        servicios_map = {
+            s["servicio_id"]: s
+            for s in await collection_servicios.find(
+                {"servicio_id": {"$in": list(servicio_ids)}},
+                {"_id": 0, "servicio_id": 1, "nombre": 1, "categoria": 1},
+            ).to_list(None)
+        }
+    profesionales_map: Dict[str, dict] = {}
+    if prof_ids:
+        profesionales_map = {
+            p["profesional_id"]: p
+            for p in await collection_estilista.find(
+                {"profesional_id": {"$in": list(prof_ids)}},
+                {"_id": 0, "profesional_id": 1, "comisiones_por_categoria": 1, "comisiones": 1,
+                 "comision_servicios": 1, "comision": 1},
+            ).to_list(None)
+        }
+
+    ahora = datetime.utcnow()
+    filas: Dict[str, Dict[str, Any]] = {}
+    for par in pares:
+        prof_id = str(par["_id"].get("p") or "sin_asignar")
+        s_id = par["_id"].get("s")
+        s_doc = servicios_map.get(s_id, {})
+        categoria = str(s_doc.get("categoria") or "Sin categoría")
+        clave = _clave_tasa(prof_id, s_id)
+        filas[clave] = {
+            "_id": clave,
+            "profesional_id": prof_id,
+            "servicio_id": s_id,
+            "categoria": categoria,
+            "nombre": s_doc.get("nombre"),
+            "pct": _comision_pct(categoria, s_id, profesionales_map.get(par["_id"].get("p"), {})),
+            "actualizado_en": ahora,
+        }
+    await collection_tasas_comision.bulk_write(
+        [ReplaceOne({"_id": f["_id"]}, f, upsert=True) for f in filas.values()], ordered=False
+    )
+
+
+def _pipeline_hechos_citas(sede_id: str, fechas: List[str]) -> List[Dict[str, Any]]:
+    """
+    $facet con dos ramas sobre las citas de la sede en esas fechas:
+    - estados: conteos, valor, minutos y clientes por día × profesional
+      × moneda × estado.
+    - lineas: $unwind de servicios de las citas no canceladas, unidas a
+      las tasas de comisión, agrupadas por categoría y servicio.
+    """
+    # str(cita.get("estado", "pendiente")): sin campo → "pendiente", null → "none"
+    estado = {"$toLower": {"$trim": {"input": {"$cond": [
+        {"$eq": [{"$type": "$estado"}, "missing"]}, "pendiente",
+        {"$ifNull": [{"$toString": "$estado"}, "none"]},
+    ]}}}}
+    clave_hecho = {"fecha": "$fecha", "profesional_id": "$profesional_id", "moneda": "$moneda"}
+    subtotal = _numero_expr(_o("$servicios.subtotal", "$servicios.precio"))
+    servicio_id = {"$ifNull": ["$servicios.servicio_id", ""]}
+
+    return [
+        {"$match": {"sede_id": sede_id, "fecha": {"$in": fechas}}},
+        {"$project": {
+            "_id": 0,
+            "fecha": 1,
+            "sede_nombre": 1,
+            "profesional_nombre": 1,
+            "servicios": 1,
+            "profesional_id": _o("$profesional_id", "sin_asignar"),
+            "moneda": _o("$moneda", "COP"),
+            "estado": estado,
+            "valor": _numero_expr("$valor_total"),
+            "minutos": {"$max": [0, {"$subtract": [_hhmm_expr("$hora_fin"), _hhmm_expr("$hora_inicio")]}]},
+            "cliente_id": {"$cond": [
+                {"$and": [
+                    {"$ne": [estado, "cancelada"]},
+                    {"$eq": [{"$type": "$cliente_id"}, "string"]},
+                    {"$ne": ["$cliente_id", ""]},
+                ]},
+                "$cliente_id", None,
+            ]},
+        }},
+        {"$facet": {
+            "estados": [
+                {"$group": {
+                    "_id": {**clave_hecho, "estado": "$estado"},
+                    "citas": {"$sum": 1},
+                    "valor": {"$sum": "$valor"},
+                    "citas_con_valor": {"$sum": {"$cond": [{"$gt": ["$valor", 0]}, 1, 0]}},
+                    "minutos": {"$sum": "$minutos"},
+                    "clientes": {"$addToSet": "$cliente_id"},
+                    "sede_nombre": {"$max": "$sede_nombre"},
+                    "profesional_nombre": {"$max": "$profesional_nombre"},
+                }},
+            ],
+            "lineas": [
+                {"$match": {"estado": {"$nin": list(ESTADOS_CANCELADOS)}}},
+                {"$unwind": "$servicios"},
+                {"$addFields": {
+                    "clave_tasa": {"$concat": [{"$toString": "$profesional_id"}, "|", {"$toString": servicio_id}]},
+                }},
+                {"$lookup": {
+                    "from": collection_tasas_comision.name,
+                    "localField": "clave_tasa",
+                    "foreignField": "_id",
+                    "as": "tasa",
+                }},
+                {"$addFields": {"tasa": {"$arrayElemAt": ["$tasa", 0]}, "subtotal": subtotal}},
+                {"$group": {
+                    "_id": {
+                        **clave_hecho,
+                        "categoria": {"$ifNull": ["$tasa.categoria", "Sin categoría"]},
+                        "nombre": _o("$tasa.nombre", _o("$servicios.nombre", _o(servicio_id, "Servicio"))),
+                    },
+                    "cantidad": {"$sum": {"$convert": {
+                        "input": _o("$servicios.cantidad", 1), "to": "int", "onError": 1, "onNull": 1,
+                    }}},
+                    "ingresos": {"$sum": "$subtotal"},
+                    "comision": {"$sum": {"$round": [
+                        {"$divide": [{"$multiply": ["$subtotal", {"$ifNull": ["$tasa.pct", 0]}]}, 100]}, 2,
+                    ]}},
+                }},
+            ],
+        }},
+    ]
+
+
+async def _hechos_citas_sede(sede_id: str, fechas: List[str]) -> Dict[str, List[Dict]]:
+    """{fecha: [hechos]} de la sede en esas fechas, agregados en MongoDB."""
+    await _preparar_tasas_comision(sede_id, fechas)
+    resultado = await collection_citas.aggregate(
+        _pipeline_hechos_citas(sede_id, fechas), allowDiskUse=True
+    ).to_list(None)
+    ramas = resultado[0] if resultado else {"estados": [], "lineas": []}
+
+    hechos: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    def _hecho(g: Dict[str, Any]) -> Dict[str, Any]:
+        clave = (g["_id"]["fecha"], g["_id"]["profesional_id"], g["_id"]["moneda"])
+        h = hechos.get(clave)
+        if h is None:
+            h = hechos[clave] = _hecho_citas_vacio(sede_id, *clave)
+        return h
+
+    for g in ramas["estados"]:
+        h = _hecho(g)
+        estado = g["_id"]["estado"]
+        h["sede_nombre"] = h["sede_nombre"] or g.get("sede_nombre")
+        h["profesional_nombre"] = h["profesional_nombre"] or g.get("profesional_nombre")
+        h["citas"] += g["citas"]
+        h["por_estado"][estado] += g["citas"]
+        h["valor_por_estado"][estado] += g["valor"]
+        h["clientes"].update(c for c in g["clientes"] if c)
+        if _es_cancelada(estado):
+            continue
+        h["ingresos"] += g["valor"]
+        h["citas_con_valor"] += g["citas_con_valor"]
+        h["minutos"] += g["minutos"]
+
+    for g in ramas["lineas"]:
+        h = _hecho(g)
+        h["comision"] += g["comision"]
+        for acumulado in (h["categorias"][g["_id"]["categoria"]], h["servicios"][g["_id"]["nombre"]]):
+            acumulado["cantidad"] += g["cantidad"]
+            acumulado["ingresos"] += g["ingresos"]
+            acumulado["comision"] += g["comision"]
+
+    primeras = await _primeras_visitas(sede_id, sorted({c for h in hechos.values() for c in h["clientes"]}))
+    sede_nombre = await _nombre_sede(sede_id)
+    ahora = datetime.utcnow()
+    por_fecha: Dict[str, List[Dict]] = {f: [] for f in fechas}
+    for h in hechos.values():
+        h["sede_nombre"] = sede_nombre or h["sede_nombre"]
+        por_fecha[h["fecha"]].append(_cerrar_hecho_citas(h, primeras, ahora))
+    return por_fecha
+
+
+def _hecho_ventas_vacio(sede_id: str, fecha: str, moneda: str) -> Dict[str, Any]:
+    return {
+        "_id": f"{sede_id}|{fecha}|{moneda}",
+        "sede_id": sede_id,
+        "fecha": fecha,
+        "moneda": moneda,
+        "ventas_totales": 0.0,
+        "cantidad_ventas": 0,
+        "ventas_servicios": 0.0,
+        "ventas_productos": 0.0,
+        "abonos": 0.0,
+        "metodos_pago": {metodo: 0.0 for metodo in METODOS_PAGO_VENTAS},
+    }
+
+
+def _rangos_contiguos(fechas: List[str]) -> List[Tuple[datetime, datetime]]:
+    """Fechas ordenadas → rangos [desde, hasta) de días consecutivos."""
+    rangos: List[Tuple[datetime, datetime]] = []
+    for fecha in fechas:
+        dia = datetime.strptime(fecha, "%Y-%m-%d")
+        if rangos and rangos[-1][1] == dia:
+            rangos[-1] = (rangos[-1][0], dia + timedelta(days=1))
+        else:
+            rangos.append((dia, dia + timedelta(days=1)))
+    return rangos
+
+
+async def _hechos_ventas_sede(sede_id: str, fechas: List[str]) -> Dict[str, List[Dict]]:
+    """{fecha: [hechos]} de la sede en esas fechas, desde sales."""
+    dias = set(fechas)
+    rangos = [
+        {"fecha_pago": {"$gte": desde, "$lt": hasta}} for desde, hasta in _rangos_contiguos(fechas)
+    ]
+    filtro = {"sede_id": sede_id, **(rangos[0] if len(rangos) == 1 else {"$or": rangos})}
+
+    hechos: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    async for venta in collection_sales.find(filtro, _PROYECCION_VENTAS):
+        fecha_pago = venta.get("fecha_pago")
+        if not isinstance(fecha_pago, datetime):
+            continue
+        fecha = fecha_pago.strftime("%Y-%m-%d")
+        if fecha not in dias:
+            continue
+        moneda = venta.get("moneda", "COP")
+        h = hechos.get((fecha, moneda))
+        if h is None:
+            h = hechos[(fecha, moneda)] = _hecho_ventas_vacio(sede_id, fecha, moneda)
+
+        desglose = venta.get("desglose_pagos") or {}
+        h["ventas_totales"] += _numero(desglose.get("total"))
+        h["cantidad_ventas"] += 1
+
+        for pago in venta.get("historial_pagos") or []:
+            if pago.get("tipo") == "abono_inicial":
+                h["abonos"] += _numero(pago.get("monto"))
+
+        for item in venta.get("items") or []:
+            tipo = item.get("tipo", "servicio")
+            if tipo == "servicio":
+                h["ventas_servicios"] += _numero(item.get("subtotal"))
+            elif tipo == "producto":
+                h["ventas_productos"] += _numero(item.get("subtotal"))
+
+        for metodo in METODOS_PAGO_VENTAS:
+            valor = _numero(desglose.get(metodo))
+            if valor > 0:
+                h["metodos_pago"][metodo] += valor
+
+    ahora = datetime.utcnow()
+    por_fecha: Dict[str, List[Dict]] = {f: [] for f in fechas}
+    for h in hechos.values():
+        for campo in ("ventas_totales", "ventas_servicios", "ventas_productos", "abonos"):
+            h[campo] = round(h[campo], 2)
+        h["metodos_pago"] = {k: round(v, 2) for k, v in h["metodos_pago"].items()}
+        h["calculado_en"] = ahora
+        por_fecha[h["fecha"]].append(h)
+    return por_fecha
+
+
+# ============================================================
+# GUARDADO
+# ============================================================
+
+async def _reemplazar(coleccion, sede_id: str, fechas: List[str], docs: List[Dict]) -> None:
+    """Deja en la colección exactamente `docs` para esos días de la sede."""
+    if docs:
+        await coleccion.bulk_write([ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs], ordered=False)
+    await coleccion.delete_many({
+        "sede_id": sede_id, "fecha": {"$in": fechas}, "_id": {"$nin": [d["_id"] for d in docs]}
+    })
+
+
+async def _marcar_calculado(sede_id: str, fecha: str, version: Optional[int]) -> bool:
+    """
+    Marca el día como vigente si nadie lo invalidó mientras se calculaba.
+    version=None significa que el documento de control no existía.
+    """
+    campos = {"sucio": False, "calculado_en": datetime.utcnow()}
+    if version is None:
+        try:
+            await collection_hechos_estado.insert_one(
+                {"_id": _estado_id(sede_id, fecha), "sede_id": sede_id, "fecha": fecha, "version": 0, **campos}
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+    resultado = await collection_hechos_estado.update_one(
+        {"_id": _estado_id(sede_id, fecha), "version": version}, {"$set": campos}
+    )
+    return resultado.matched_count == 1
+
+
+async def recalcular_hechos_sede(sede_id: str, fechas: List[str], versiones: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """
+    Recalcula y guarda los hechos de citas y ventas de la sede en esas
+    fechas. `versiones` son las del control leídas antes de calcular
+    (estado_id → version); si no se pasan se leen aquí.
+    """
+    fechas = sorted(set(fechas))
+    if not fechas:
+        return {"dias": 0, "omitidos": 0}
+    if versiones is None:
+        versiones = {
+            d["_id"]: d.get("version", 0)
+            for d in await collection_hechos_estado.find(
+                {"_id": {"$in": [_estado_id(sede_id, f) for f in fechas]}}, {"version": 1}
+            ).to_list(None)
+        }
+
+    citas, ventas = await asyncio.gather(
+        _hechos_citas_sede(sede_id, fechas),
+        _hechos_ventas_sede(sede_id, fechas),
+    )
+    await asyncio.gather(
+        _reemplazar(collection_hechos_citas, sede_id, fechas, [h for f in fechas for h in citas[f]]),
+        _reemplazar(collection_hechos_ventas, sede_id, fechas, [h for f in fechas for h in ventas[f]]),
+    )
+
+    conteo = {"dias": 0, "omitidos": 0}
+    for fecha in fechas:
+        if await _marcar_calculado(sede_id, fecha, versiones.get(_estado_id(sede_id, fecha))):
+            conteo["dias"] += 1
+        else:
+            # Invalidado mientras se calculaba: queda sucio y se recalcula al leerlo
+            conteo["omitidos"] += 1
+    return conteo
+
+
+# ============================================================
+# LECTURA
+# ============================================================
+
+async def sedes_todas() -> List[str]:
+    return [s for s in await collection_locales.distinct("sede_id") if s]
+
+
+def _vigente(doc: Dict, desde_abiertos: str) -> bool:
+    if doc.get("sucio") or not doc.get("calculado_en"):
+        return False
+    if doc.get("fecha", "") < desde_abiertos:
+        return True
+    return datetime.utcnow() - doc["calculado_en"] <= timedelta(seconds=HECHOS_MAX_EDAD_SEGUNDOS)
+
+
+async def asegurar_hechos(sede_ids: List[str], fecha_inicio: str, fecha_fin: str) -> int:
+    """
+    Recalcula los sede-días del rango sin hechos vigentes (faltantes,
+    sucios o abiertos y viejos). Devuelve cuántos se recalcularon.
+    """
+    if not sede_ids:
+        return 0
+    fechas = fechas_rango(fecha_inicio, fecha_fin)
+    desde_abiertos = (date.today() - timedelta(days=DIAS_ABIERTOS - 1)).strftime("%Y-%m-%d")
+
+    vigentes = set()
+    versiones: Dict[str, int] = {}
+    async for doc in collection_hechos_estado.find(
+        {"sede_id": {"$in": list(sede_ids)}, "fecha": {"$gte": fechas[0], "$lte": fechas[-1]}},
+        {"fecha": 1, "sucio": 1, "calculado_en": 1, "version": 1},
+    ):
+        if _vigente(doc, desde_abiertos):
+            vigentes.add(doc["_id"])
+        else:
+            versiones[doc["_id"]] = doc.get("version", 0)
+
+    pendientes = {
+        sede: [f for f in fechas if _estado_id(sede, f) not in vigentes]
+        for sede in sede_ids
+    }
+    pendientes = {sede: dias for sede, dias in pendientes.items() if dias}
+    if not pendientes:
+        return 0
+
+    semaforo = asyncio.Semaphore(CONCURRENCIA_SEDES)
+
+    async def _una(sede: str, dias: List[str]) -> None:
+        async with semaforo:
+            await recalcular_hechos_sede(sede, dias, versiones)
+
+    await asyncio.gather(*(_una(s, d) for s, d in pendientes.items()))
+    total = sum(len(d) for d in pendientes.values())
+    logger.info(f"📊 Hechos de analytics calculados: {total} sede-día(s) en {len(pendientes)} sede(s)")
+    return total
+
+
+async def obtener_hechos_citas(
+    sede_ids: List[str],
+    fecha_inicio: str,
+    fecha_fin: str,
+    profesional_id: Optional[str] = None,
+    proyeccion: Optional[Dict[str, int]] = None,
+) -> List[Dict]:
+    """Hechos de citas del rango (ordenados por fecha), recalculando los que no estén vigentes."""
+    await asegurar_hechos(sede_ids, fecha_inicio, fecha_fin)
+    filtro: Dict[str, Any] = {"sede_id": {"$in": list(sede_ids)}, "fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}}
+    if profesional_id:
+        filtro["profesional_id"] = profesional_id
+    return await collection_hechos_citas.find(filtro, proyeccion).sort("fecha", 1).to_list(None)
+
+
+async def obtener_hechos_ventas(sede_ids: List[str], fecha_inicio: str, fecha_fin: str) -> List[Dict]:
+    """Hechos de ventas del rango, recalculando los que no estén vigentes."""
+    await asegurar_hechos(sede_ids, fecha_inicio, fecha_fin)
+    return await collection_hechos_ventas.find(
+        {"sede_id": {"$in": list(sede_ids)}, "fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}}
+    ).to_list(None)
+
+
+
+def _grupo_ventas_por_moneda() -> Dict[str, Any]:
+    """$group de hechos de ventas por moneda, con la misma forma del hecho."""
+    campos = ("ventas_totales", "cantidad_ventas", "ventas_servicios", "ventas_productos", "abonos")
+    return {"$group": {
+        "_id": {"$ifNull": ["$moneda", "COP"]},
+        **{campo: {"$sum": f"${campo}"} for campo in campos},
+        **{f"metodo_{metodo}": {"$sum": f"$metodos_pago.{metodo}"} for metodo in METODOS_PAGO_VENTAS},
+    }}
+
+
+async def resumir_ventas_periodos(
+    sede_ids: List[str],
+    periodos: Dict[str, Tuple[str, str]],
+) -> Dict[str, List[Dict]]:
+    """
+    Totales de ventas por moneda de varios períodos {nombre: (inicio, fin)}
+    en una sola agregación sobre analytics_daily_sales ($facet con una rama
+    por período). Cada fila tiene la forma de un hecho de ventas:
+    {moneda, ventas_totales, cantidad_ventas, ..., metodos_pago {...}}.
+    """
+    if not sede_ids or not periodos:
+        return {nombre: [] for nombre in periodos}
+    inicio = min(p[0] for p in periodos.values())
+    fin = max(p[1] for p in periodos.values())
+    await asegurar_hechos(sede_ids, inicio, fin)
+
+    resultado = await collection_hechos_ventas.aggregate([
+        {"$match": {"sede_id": {"$in": list(sede_ids)}, "fecha": {"$gte": inicio, "$lte": fin}}},
+        {"$facet": {
+            nombre: [
+                {"$match": {"fecha": {"$gte": desde, "$lte": hasta}}},
+                _grupo_ventas_por_moneda(),
+                {"$sort": {"_id": 1}},
+            ]
+            for nombre, (desde, hasta) in periodos.items()
+        }},
+    ]).to_list(None)
+    ramas = resultado[0] if resultado else {}
+
+    return {
+        nombre: [
+            {
+                "moneda": g["_id"],
+                **{k: v for k, v in g.items() if k != "_id" and not k.startswith("metodo_")},
+                "metodos_pago": {metodo: g[f"metodo_{metodo}"] for metodo in METODOS_PAGO_VENTAS},
+            }
+            for g in ramas.get(nombre, [])
+        ]
+        for nombre in periodos
+    }
+
+
+# ============================================================
+# RECONSTRUCCIÓN (rollup y backfill)
+# ============================================================
+
+async def reconstruir_hechos(fecha_inicio: str, fecha_fin: str, sede_id: Optional[str] = None) -> Dict[str, int]:
+    """Recalcula y guarda los hechos del rango (una sede o todas)."""
+    sedes = [sede_id] if sede_id else await sedes_todas()
+    fechas = fechas_rango(fecha_inicio, fecha_fin)
+    conteo = {"sedes": 0, "dias": 0, "omitidos": 0}
+
+    for sede in sedes:
+        # Por meses, para no cargar años de citas de una vez
+        for i in range(0, len(fechas), 31):
+            parcial = await recalcular_hechos_sede(sede, fechas[i:i + 31])
+            conteo["dias"] += parcial["dias"]
+            conteo["omitidos"] += parcial["omitidos"]
+        conteo["sedes"] += 1
+        logger.info(f"✅ Hechos de analytics reconstruidos: {sede} {fechas[0]} → {fechas[-1]}")
+
+    return conteo
+
+
+async def recalcular_sucios() -> int:
+    """Recalcula todos los sede-días marcados como sucios."""
+    por_sede: Dict[str, List[str]] = defaultdict(list)
+    versiones: Dict[str, int] = {}
+    async for doc in collection_hechos_estado.find({"sucio": True}, {"sede_id": 1, "fecha": 1, "version": 1}):
+        if doc.get("sede_id") and doc.get("fecha"):
+            por_sede[doc["sede_id"]].append(doc["fecha"])
+            versiones[doc["_id"]] = doc.get("version", 0)
+
+    total = 0
+    for sede, fechas in por_sede.items():
+        total += (await recalcular_hechos_sede(sede, fechas, versiones))["dias"]
+    return total
+
+
+# ============================================================
+# PARIDAD CON EL CÁLCULO ORIGINAL DE analytics_performance
+# ============================================================
+
+# No se comparan: la capacidad (ahora descuenta festivos y bloqueos), el
+# sede_nombre (ahora de locales) ni la moneda global (ahora la de más
+# ingresos, antes la de la última cita leída).
+_CAMPOS_NO_COMPARADOS = {"tasa_ocupacion_pct", "minutos_disponibles", "horas_disponibles", "sede_nombre", "moneda"}
+
+
+async def _performance_base(sede_id: str, fecha_inicio: str, fecha_fin: str) -> Dict[str, Any]:
+    """
+    El cálculo de analytics_performance antes de los hechos diarios: todas
+    las citas del período a Python y un ciclo por servicio. Única
+    diferencia: los montos pasan por _numero() (float() fallaba con textos).
+    """
+    citas = await collection_citas.find(
+        {"sede_id": sede_id, "fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}}
+    ).to_list(None)
+
+    servicio_ids = set()
+    prof_ids = set()
+    for c in citas:
+        prof_ids.add(c.get("profesional_id"))
+        for s in c.get("servicios", []):
+            if s.get("servicio_id"):
+                servicio_ids.add(s["servicio_id"])
+
+    servicios_docs = await collection_servicios.find(
+        {"servicio_id": {"$in": list(servicio_ids)}}
+    ).to_list(None)
+    servicios_map: Dict[str, dict] = {s["servicio_id"]: s for s in servicios_docs}
+
+    profesionales_docs = await collection_estilista.find(
+        {"profesional_id": {"$in": list(prof_ids)}}
+    ).to_list(None)
+    profesionales_map: Dict[str, dict] = {p["profesional_id"]: p for p in profesionales_docs}
+
+    por_prof: Dict[str, list] = defaultdict(list)
+    for c in citas:
+        pid = c.get("profesional_id") or "sin_asignar"
+        por_prof[pid].append(c)
+
+    resultados = []
+    for prof_id, citas_prof in por_prof.items():
+        prof_doc = profesionales_map.get(prof_id, {})
+
+        cnt_estados: Dict[str, int] = defaultdict(int)
+        ingresos_total = 0.0
+        comision_total = 0.0
+        minutos_agendados = 0
+        citas_con_valor = 0
+
+        servicios_cnt: Dict[str, dict] = defaultdict(
+            lambda: {"cantidad": 0, "ingresos": 0.0, "comision": 0.0}
+        )
+        categorias_cnt: Dict[str, dict] = defaultdict(
+            lambda: {"cantidad": 0, "ingresos": 0.0, "comision": 0.0}
+        )
+
+        for cita in citas_prof:
+            estado = str(cita.get("estado", "pendiente")).strip().lower()
+            cnt_estados[estado] += 1
+
+            if _es_cancelada(estado):
+                continue
+
+            valor = _numero(cita.get("valor_total"))
+            ingresos_total += valor
+            if valor > 0:
+                citas_con_valor += 1
+
+            minutos_agendados += _minutos_cita(cita)
+
+            for s_item in cita.get("servicios", []):
+                s_id = s_item.get("servicio_id", "")
+                s_doc = servicios_map.get(s_id, {})
+                subtotal = _numero(s_item.get("subtotal") or s_item.get("precio"))
+                categoria = str(s_doc.get("categoria") or "Sin categoría")
+                nombre_s = s_doc.get("nombre") or s_item.get("nombre") or s_id or "Servicio"
+                cantidad = int(s_item.get("cantidad") or 1)
+
+                pct = _comision_pct(categoria, s_id, prof_doc)
+                comision_item = round(subtotal * pct / 100, 2)
+                comision_total += comision_item
+
+                for acumulado in (servicios_cnt[nombre_s], categorias_cnt[categoria]):
+                    acumulado["cantidad"] += cantidad
+                    acumulado["ingresos"] = round(acumulado["ingresos"] + subtotal, 2)
+                    acumulado["comision"] = round(acumulado["comision"] + comision_item, 2)
+
+        citas_activas = sum(v for k, v in cnt_estados.items() if not _es_cancelada(k))
+        ticket_promedio = round(ingresos_total / citas_con_valor, 2) if citas_con_valor > 0 else 0
+
+        nombre_prof = prof_doc.get("nombre") or next(
+            (c.get("profesional_nombre") for c in citas_prof if c.get("profesional_nombre")),
+            prof_id,
+        )
+        resultados.append({
+            "profesional_id": prof_id,
+            "nombre": nombre_prof,
+            "sede_id": prof_doc.get("sede_id") or citas_prof[0].get("sede_id"),
+            "kpis": {
+                "ingresos_generados": round(ingresos_total, 2),
+                "comision_proyectada": round(comision_total, 2),
+                "ticket_promedio": ticket_promedio,
+                "minutos_agendados": minutos_agendados,
+                "horas_agendadas": round(minutos_agendados / 60, 1),
+            },
+            "citas": {"total": len(citas_prof), "activas": citas_activas, "por_estado": dict(cnt_estados)},
+            "por_categoria": [{"categoria": k, **v} for k, v in categorias_cnt.items()],
+            "top_servicios": [{"nombre": k, **v} for k, v in servicios_cnt.items()],
+        })
+
+    total_ingresos = round(sum(r["kpis"]["ingresos_generados"] for r in resultados), 2)
+    total_activas = sum(r["citas"]["activas"] for r in resultados)
+    return {
+        "resumen_global": {
+            "total_ingresos": total_ingresos,
+            "total_comision": round(sum(r["kpis"]["comision_proyectada"] for r in resultados), 2),
+            "ticket_promedio_global": round(total_ingresos / total_activas, 2) if total_activas > 0 else 0,
+            "total_citas": sum(r["citas"]["total"] for r in resultados),
+            "total_citas_activas": total_activas,
+            "total_profesionales": len(resultados),
+        },
+        "profesionales": resultados,
+    }
+
+
+def _comparable(performance: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Resultado de performance indexado por profesional, categoría y
+    servicio (el orden entre empates no importa), sin los campos que
+    cambiaron a propósito y con el top 10 de servicios.
+    """
+    def _sin(d: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in d.items() if k not in _CAMPOS_NO_COMPARADOS}
+
+    profesionales = {}
+    for r in performance["profesionales"]:
+        top = sorted(r["top_servicios"], key=lambda x: (-x["ingresos"], str(x["nombre"])))[:10]
+        profesionales[r["profesional_id"]] = {
+            **_sin({k: v for k, v in r.items() if k not in ("por_categoria", "top_servicios")}),
+            "kpis": _sin(r["kpis"]),
+            "por_categoria": {c["categoria"]: c for c in r["por_categoria"]},
+            "top_servicios": {s["nombre"]: s for s in top},
+        }
+    return {"resumen_global": _sin(performance["resumen_global"]), "profesionales": profesionales}
+
+
+async def verificar_paridad_hechos(sede_id: str, fecha_inicio: str, fecha_fin: str) -> List[str]:
+    """
+    Compara GET /analytics/performance de la sede (que lee los hechos)
+    con el cálculo original sobre las citas. Recalcula antes los hechos
+    del rango para comparar el cálculo y no su frescura. Lista vacía = idénticos.
+    """
+    # Import local: projection_analytics importa este módulo
+    from app.analytics.projection_analytics import analytics_performance
+
+    await recalcular_hechos_sede(sede_id, fechas_rango(fecha_inicio, fecha_fin))
+    obtenido = await analytics_performance(
+        fecha_desde=fecha_inicio,
+        fecha_hasta=fecha_fin,
+        sede_id=sede_id,
+        profesional_id=None,
+        current_user={"rol": "super_admin"},
+    )
+    esperado = await _performance_base(sede_id, fecha_inicio, fecha_fin)
+    return diferencias(_comparable(esperado), _comparable(obtenido))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) in (3, 4) and args[0] == "--rebuild":
+        print(asyncio.run(reconstruir_hechos(args[1], args[2], args[3] if len(args) == 4 else None)))
+    elif len(args) == 4 and args[0] == "--paridad":
+        difs = asyncio.run(verificar_paridad_hechos(args[1], args[2], args[3]))
+        print("✅ Idénticos" if not difs else "\n".join(difs[:200]))
+        sys.exit(1 if difs else 0)
+    else:
+        print("Uso:\n"
+              "  python -m app.analytics.hechos_diarios --rebuild INICIO FIN [SEDE_ID]\n"
+              "  python -m app.analytics.hechos_diarios --paridad SEDE_ID INICIO FIN")
@@ -8,18 +8,23 @@ Dos endpoints de Business Intelligence para la app de agendamiento:
 """
 
 from fastapi import APIRouter, HTTPException, Depends, Query
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 from typing import Optional, Dict, Any
 from collections import defaultdict
 
 from app.auth.routes import get_current_user
 from app.database.mongo import (
     collection_citas,
-    collection_servicios,
     collection_estilista,
-    collection_horarios,
     collection_locales,
 )
+from app.analytics.hechos_diarios import (
+    _minutos_cita,
+    _es_cancelada,
+    obtener_hechos_citas,
+    sedes_todas,
+)
+from app.scheduling.submodules.quotes.availability import calcular_capacidad
 
 router = APIRouter()
 
@@ -47,59 +52,6 @@ def _parse_date(value: str) -> date:
     )
 
 
-def _hhmm_to_min(hhmm: str) -> int:
-    """'09:30' → 570 minutos."""
-    try:
-        h, m = map(int, str(hhmm).split(":"))
-        return h * 60 + m
-    except Exception:
-        return 0
-
-
-def _minutos_disponibles_dia(disponibilidad: list, iso_weekday: int) -> int:
-    """
-    Retorna cuántos minutos tiene disponible un profesional en un día
-    de la semana dado (1 = lunes … 7 = domingo).
-    """
-    for dia in disponibilidad:
-        if (
-            int(dia.get("dia_semana", 0)) == iso_weekday
-            and dia.get("activo", True) is True
-        ):
-            return max(
-                0,
-                _hhmm_to_min(dia.get("hora_fin", "00:00"))
-                - _hhmm_to_min(dia.get("hora_inicio", "00:00")),
-            )
-    return 0
-
-
-def _minutos_disponibles_periodo(disponibilidad: list, desde: date, hasta: date) -> int:
-    """Suma los minutos disponibles de un profesional en todo el período."""
-    total = 0
-    d = desde
-    while d <= hasta:
-        total += _minutos_disponibles_dia(disponibilidad, d.isoweekday())
-        d += timedelta(days=1)
-    return total
-
-
-def _minutos_cita(cita: dict) -> int:
-    """Calcula la duración real de una cita en minutos."""
-    try:
-        return max(
-            0,
-            _hhmm_to_min(cita.get("hora_fin", "00:00"))
-            - _hhmm_to_min(cita.get("hora_inicio", "00:00")),
-        )
-    except Exception:
-        return int(cita.get("servicio_duracion") or 0)
-
-
-def _es_cancelada(estado: str) -> bool:
-    return estado.strip().lower() in ("cancelada", "no_asistio", "no asistio")
-
-
 # ─── Scope dinámico ─────────────────────────────────────────────────────────
 async def _build_scope_filter(
     current_user: dict,
@@ -172,39 +124,14 @@ async def _build_scope_filter(
     return filtro
 
 
-def _comision_pct(
-    categoria: str,
-    servicio_id: str,
-    prof_doc: dict,
-) -> float:
-    """
-    Determina el % de comisión del profesional para un servicio.
-
-    Prioridad de búsqueda en el documento del estilista:
-      1. comisiones_por_categoria[categoria]
-      2. comisiones[categoria]
-      3. comisiones[servicio_id]          (fallback por servicio_id)
-      4. comision_servicios               (tasa plana)
-      5. comision                         (tasa plana legacy)
-    """
-    comisiones_cat = (
-        prof_doc.get("comisiones_por_categoria")
-        or prof_doc.get("comisiones")
-        or {}
-    )
-    if isinstance(comisiones_cat, dict):
-        pct = (
-            comisiones_cat.get(categoria)
-            or comisiones_cat.get(servicio_id)
-        )
-        if pct is not None:
-            return float(pct)
-
-    return float(
-        prof_doc.get("comision_servicios")
-        or prof_doc.get("comision")
-        or 0
-    )
+async def _sedes_del_scope(filtro: Dict[str, Any]) -> list:
+    """Sedes que cubre el filtro de _build_scope_filter (sin sede_id → todas)."""
+    if "sede_id" not in filtro:
+        return await sedes_todas()
+    sede = filtro["sede_id"]
+    if isinstance(sede, dict):
+        return list(sede.get("$in", []))
+    return [sede] if sede else []
 
 
 # ═══════════════════════════════════════════════════════════════════════
@@ -245,7 +172,8 @@ async def analytics_performance(
       plana en `comision_servicios` o `comision`.
     - **ticket_promedio** — ingresos / número de citas activas
     - **tasa_ocupacion_pct** — (minutos agendados / minutos disponibles según
-      horario) × 100.  `null` si el profesional no tiene horario configurado.
+      horario, menos festivos de la sede y bloqueos) × 100.  `null` si el
+      profesional no tiene horario configurado.
     - **horas_agendadas / horas_disponibles** — para visualizar la ocupación
 
     ### Volumen
@@ -255,6 +183,12 @@ async def analytics_performance(
     - **por_categoria** — ingresos y comisiones agrupados por categoría de servicio
     - **top_servicios** — los 10 servicios que más ingresos generaron
 
+    ### Resumen global
+    - **moneda** — la moneda con más ingresos en el período (`COP` si no hay
+      ingresos).  Los totales suman todas las monedas tal como antes; con
+      varias monedas en el scope, `moneda` indica la predominante.  Antes era
+      la moneda de la última cita leída, que dependía del orden de lectura.
+
     ### Scope dinámico
     | Rol               | Scope                                    |
     |-------------------|------------------------------------------|
@@ -283,16 +217,19 @@ async def analytics_performance(
 
     # ── 2. Filtro con scope dinámico ───────────────────────────────────
     filtro = await _build_scope_filter(current_user, sede_id)
-    filtro["fecha"] = {"$gte": str_desde, "$lte": str_hasta}
 
     # Filtro adicional por profesional (si no es estilista, ya está forzado)
     if profesional_id and current_user["rol"] != "estilista":
         filtro["profesional_id"] = profesional_id
 
-    # ── 3. Cargar citas ────────────────────────────────────────────────
-    citas = await collection_citas.find(filtro).to_list(None)
+    # ── 3. Hechos diarios del período (ver hechos_diarios) ─────────────
+    hechos = []
+    if filtro.get("profesional_id") or "profesional_id" not in filtro:
+        hechos = await obtener_hechos_citas(
+            await _sedes_del_scope(filtro), str_desde, str_hasta, filtro.get("profesional_id")
+        )
 
-    if not citas:
+    if not hechos:
         return {
             "periodo": {"desde": str_desde, "hasta": str_hasta, "dias": dias_periodo},
             "resumen_global": {
@@ -306,41 +243,27 @@ async def analytics_performance(
             "profesionales": [],
         }
 
-    # ── 4. Cargar en batch: servicios, profesionales, horarios ────────
-    servicio_ids = set()
-    prof_ids = set()
-    for c in citas:
-        prof_ids.add(c.get("profesional_id"))
-        for s in c.get("servicios", []):
-            if s.get("servicio_id"):
-                servicio_ids.add(s["servicio_id"])
-
-    servicios_docs = await collection_servicios.find(
-        {"servicio_id": {"$in": list(servicio_ids)}}
-    ).to_list(None)
-    servicios_map: Dict[str, dict] = {s["servicio_id"]: s for s in servicios_docs}
+    # ── 4. Agrupar hechos por profesional ─────────────────────────────
+    por_prof: Dict[str, list] = defaultdict(list)
+    for h in hechos:
+        por_prof[h["profesional_id"]].append(h)
 
+    # ── 5. Cargar en batch: profesionales, capacidad ──────────────────
+    prof_ids = list(por_prof)
     profesionales_docs = await collection_estilista.find(
-        {"profesional_id": {"$in": list(prof_ids)}}
+        {"profesional_id": {"$in": prof_ids}},
+        {"_id": 0, "profesional_id": 1, "nombre": 1, "sede_id": 1},
     ).to_list(None)
     profesionales_map: Dict[str, dict] = {p["profesional_id"]: p for p in profesionales_docs}
 
-    horarios_docs = await collection_horarios.find(
-        {"profesional_id": {"$in": list(prof_ids)}}
-    ).to_list(None)
-    horarios_map: Dict[str, dict] = {h["profesional_id"]: h for h in horarios_docs}
-
-    # ── 5. Agrupar citas por profesional ──────────────────────────────
-    por_prof: Dict[str, list] = defaultdict(list)
-    for c in citas:
-        pid = c.get("profesional_id") or "sin_asignar"
-        por_prof[pid].append(c)
+    # Minutos laborables del período (horario − festivos − bloqueos)
+    capacidad = await calcular_capacidad(prof_ids, d_desde, d_hasta)
 
     # ── 6. Calcular métricas por profesional ──────────────────────────
     resultados = []
-    moneda_global = "COP"
+    ingresos_por_moneda: Dict[str, float] = defaultdict(float)
 
-    for prof_id, citas_prof in por_prof.items():
+    for prof_id, hechos_prof in por_prof.items():
         prof_doc = profesionales_map.get(prof_id, {})
 
         # Contadores
@@ -349,6 +272,7 @@ async def analytics_performance(
         comision_total = 0.0
         minutos_agendados = 0
         citas_con_valor = 0
+        total_citas = 0
 
         servicios_cnt: Dict[str, dict] = defaultdict(
             lambda: {"cantidad": 0, "ingresos": 0.0, "comision": 0.0}
@@ -357,72 +281,33 @@ async def analytics_performance(
             lambda: {"cantidad": 0, "ingresos": 0.0, "comision": 0.0}
         )
 
-        for cita in citas_prof:
-            estado = str(cita.get("estado", "pendiente")).strip().lower()
-            cnt_estados[estado] += 1
-
-            if _es_cancelada(estado):
-                continue  # las canceladas no cuentan para ingresos
-
-            valor = float(cita.get("valor_total") or 0)
-            ingresos_total += valor
-            if valor > 0:
-                citas_con_valor += 1
-
-            minutos_agendados += _minutos_cita(cita)
-
-            if cita.get("moneda"):
-                moneda_global = cita["moneda"]
-
-            # ── Servicios de la cita ───────────────────────────────────
-            for s_item in cita.get("servicios", []):
-                s_id = s_item.get("servicio_id", "")
-                s_doc = servicios_map.get(s_id, {})
-                subtotal = float(
-                    s_item.get("subtotal")
-                    or s_item.get("precio")
-                    or 0
-                )
-                categoria = str(s_doc.get("categoria") or "Sin categoría")
-                nombre_s = (
-                    s_doc.get("nombre")
-                    or s_item.get("nombre")
-                    or s_id
-                    or "Servicio"
-                )
-                cantidad = int(s_item.get("cantidad") or 1)
-
-                pct = _comision_pct(categoria, s_id, prof_doc)
-                comision_item = round(subtotal * pct / 100, 2)
-                comision_total += comision_item
-
-                # Por servicio
-                servicios_cnt[nombre_s]["cantidad"] += cantidad
-                servicios_cnt[nombre_s]["ingresos"] = round(
-                    servicios_cnt[nombre_s]["ingresos"] + subtotal, 2
-                )
-                servicios_cnt[nombre_s]["comision"] = round(
-                    servicios_cnt[nombre_s]["comision"] + comision_item, 2
-                )
-
-                # Por categoría
-                categorias_cnt[categoria]["cantidad"] += cantidad
-                categorias_cnt[categoria]["ingresos"] = round(
-                    categorias_cnt[categoria]["ingresos"] + subtotal, 2
-                )
-                categorias_cnt[categoria]["comision"] = round(
-                    categorias_cnt[categoria]["comision"] + comision_item, 2
-                )
+        for h in hechos_prof:
+            total_citas += h["citas"]
+            for estado, n in h["por_estado"].items():
+                cnt_estados[estado] += n
+            ingresos_total += h["ingresos"]
+            comision_total += h["comision"]
+            minutos_agendados += h["minutos"]
+            citas_con_valor += h["citas_con_valor"]
+            if h["ingresos"]:
+                ingresos_por_moneda[h["moneda"]] += h["ingresos"]
+
+            for destino, filas, clave in (
+                (servicios_cnt, h["servicios"], "nombre"),
+                (categorias_cnt, h["categorias"], "categoria"),
+            ):
+                for fila in filas:
+                    acumulado = destino[fila[clave]]
+                    acumulado["cantidad"] += fila["cantidad"]
+                    acumulado["ingresos"] += fila["ingresos"]
+                    acumulado["comision"] += fila["comision"]
+
+        for acumulado in (*servicios_cnt.values(), *categorias_cnt.values()):
+            acumulado["ingresos"] = round(acumulado["ingresos"], 2)
+            acumulado["comision"] = round(acumulado["comision"], 2)
 
         # ── Ocupación ─────────────────────────────────────────────────
-        horario = horarios_map.get(prof_id)
-        minutos_disponibles = (
-            _minutos_disponibles_periodo(
-                horario.get("disponibilidad", []), d_desde, d_hasta
-            )
-            if horario
-            else 0
-        )
+        minutos_disponibles = capacidad.get(prof_id, 0)
         tasa_ocupacion = (
             round((minutos_agendados / minutos_disponibles) * 100, 1)
             if minutos_disponibles > 0
@@ -439,11 +324,10 @@ async def analytics_performance(
             round(ingresos_total / citas_con_valor, 2) if citas_con_valor > 0 else 0
         )
 
-        # Top 10 servicios por ingresos
+        # Top 10 servicios por ingresos (empates por nombre)
         top_servicios = sorted(
             [{"nombre": k, **v} for k, v in servicios_cnt.items()],
-            key=lambda x: x["ingresos"],
-            reverse=True,
+            key=lambda x: (-x["ingresos"], str(x["nombre"])),
         )[:10]
 
         # Por categoría ordenado por ingresos
@@ -453,9 +337,9 @@ async def analytics_performance(
             reverse=True,
         )
 
-        # Nombre del profesional: primero del doc, luego de la cita
+        # Nombre del profesional: primero del doc, luego de los hechos
         nombre_prof = prof_doc.get("nombre") or next(
-            (c.get("profesional_nombre") for c in citas_prof if c.get("profesional_nombre")),
+            (h.get("profesional_nombre") for h in hechos_prof if h.get("profesional_nombre")),
             prof_id,
         )
 
@@ -463,10 +347,8 @@ async def analytics_performance(
             {
                 "profesional_id": prof_id,
                 "nombre": nombre_prof,
-                "sede_id": prof_doc.get("sede_id") or (
-                    citas_prof[0].get("sede_id") if citas_prof else None
-                ),
-                "sede_nombre": citas_prof[0].get("sede_nombre") if citas_prof else None,
+                "sede_id": prof_doc.get("sede_id") or hechos_prof[0].get("sede_id"),
+                "sede_nombre": hechos_prof[0].get("sede_nombre"),
                 # ── KPIs principales ───────────────────────────────────
                 "kpis": {
                     "ingresos_generados": round(ingresos_total, 2),
@@ -480,7 +362,7 @@ async def analytics_performance(
                 },
                 # ── Volumen ────────────────────────────────────────────
                 "citas": {
-                    "total": len(citas_prof),
+                    "total": total_citas,
                     "activas": citas_activas,
                     "por_estado": dict(cnt_estados),
                 },
@@ -492,6 +374,8 @@ async def analytics_performance(
 
     # Ordenar por ingresos descendente
     resultados.sort(key=lambda x: x["kpis"]["ingresos_generados"], reverse=True)
+    # Moneda con más ingresos (ver "Resumen global" en el docstring)
+    moneda_global = max(ingresos_por_moneda, key=ingresos_por_moneda.get, default="COP")
 
     # ── 7. Resumen global ──────────────────────────────────────────────
     total_ingresos = round(sum(r["kpis"]["ingresos_generados"] for r in resultados), 2)
@@ -595,18 +479,8 @@ async def resumen_agenda(
                 profs_con_citas_hoy.add(c["profesional_id"])
 
     # Tasa de ocupación del día
-    horarios_hoy = await collection_horarios.find(
-        {"profesional_id": {"$in": list(profs_con_citas_hoy)}}
-    ).to_list(None)
-    horarios_hoy_map = {h["profesional_id"]: h for h in horarios_hoy}
-
     minutos_disponibles_dia = sum(
-        _minutos_disponibles_dia(
-            horarios_hoy_map[pid].get("disponibilidad", []),
-            dia.isoweekday(),
-        )
-        for pid in profs_con_citas_hoy
-        if pid in horarios_hoy_map
+        (await calcular_capacidad(profs_con_citas_hoy, dia, dia)).values()
     )
     tasa_dia = (
         round((minutos_ocupados_dia / minutos_disponibles_dia) * 100, 1)
@@ -637,40 +511,51 @@ async def resumen_agenda(
         if len(proximas) >= 5:
             break
 
-    # ── 4. Citas del mes ──────────────────────────────────────────────
-    filtro_mes = {
-        **filtro_scope,
-        "fecha": {"$gte": mes_inicio_str, "$lte": mes_hasta_str},
-    }
-    citas_mes = await collection_citas.find(filtro_mes).to_list(None)
+    # ── 4. Citas del mes (hechos diarios, ver hechos_diarios) ─────────
+    hechos_mes = []
+    if filtro_scope.get("profesional_id") or "profesional_id" not in filtro_scope:
+        hechos_mes = await obtener_hechos_citas(
+            await _sedes_del_scope(filtro_scope),
+            mes_inicio_str,
+            mes_hasta_str,
+            filtro_scope.get("profesional_id"),
+            {"_id": 0, "fecha": 1, "profesional_id": 1, "profesional_nombre": 1,
+             "moneda": 1, "citas": 1, "por_estado": 1, "ingresos": 1, "minutos": 1},
+        )
 
+    total_citas_mes = 0
     cnt_mes: Dict[str, int] = defaultdict(int)
     ingresos_mes = 0.0
     citas_activas_mes = 0
+    citas_por_dia: Dict[str, int] = defaultdict(int)
 
     ranking_data: Dict[str, dict] = defaultdict(
         lambda: {"nombre": "", "citas": 0, "ingresos": 0.0, "minutos": 0}
     )
 
-    for c in citas_mes:
-        estado = str(c.get("estado", "")).strip().lower()
-        cnt_mes[estado] += 1
-        if _es_cancelada(estado):
+    for h in hechos_mes:
+        total_citas_mes += h["citas"]
+        activas = 0
+        for estado, n in h["por_estado"].items():
+            cnt_mes[estado] += n
+            if not _es_cancelada(estado):
+                activas += n
+        if not activas:
             continue
 
-        valor = float(c.get("valor_total") or 0)
-        ingresos_mes += valor
-        citas_activas_mes += 1
+        ingresos_mes += h["ingresos"]
+        citas_activas_mes += activas
+        citas_por_dia[h["fecha"]] += activas
 
-        pid = c.get("profesional_id") or "sin_asignar"
-        ranking_data[pid]["citas"] += 1
+        pid = h["profesional_id"]
+        ranking_data[pid]["citas"] += activas
         ranking_data[pid]["ingresos"] = round(
-            ranking_data[pid]["ingresos"] + valor, 2
+            ranking_data[pid]["ingresos"] + h["ingresos"], 2
         )
-        ranking_data[pid]["minutos"] += _minutos_cita(c)
+        ranking_data[pid]["minutos"] += h["minutos"]
         if not ranking_data[pid]["nombre"]:
             ranking_data[pid]["nombre"] = (
-                c.get("profesional_nombre") or pid
+                h.get("profesional_nombre") or pid
             )
 
     ticket_mes = (
@@ -685,10 +570,6 @@ async def resumen_agenda(
     )[:10]
 
     # ── 5. Citas del mes por día (sparkline data) ─────────────────────
-    citas_por_dia: Dict[str, int] = defaultdict(int)
-    for c in citas_mes:
-        if not _es_cancelada(str(c.get("estado", "")).strip().lower()):
-            citas_por_dia[str(c.get("fecha", ""))] += 1
     citas_por_dia_list = sorted(
         [{"fecha": k, "citas": v} for k, v in citas_por_dia.items()],
         key=lambda x: x["fecha"],
@@ -697,7 +578,7 @@ async def resumen_agenda(
     moneda = (
         citas_dia[0].get("moneda")
         if citas_dia
-        else (citas_mes[0].get("moneda") if citas_mes else "COP")
+        else (hechos_mes[0].get("moneda") if hechos_mes else "COP")
     )
 
     return {
@@ -721,7 +602,7 @@ async def resumen_agenda(
 
         # ── Mes ───────────────────────────────────────────────────────
         "mes": {
-            "total_citas": len(citas_mes),
+            "total_citas": total_citas_mes,
             "activas": citas_activas_mes,
             "por_estado": dict(cnt_mes),
             "ingresos": round(ingresos_mes, 2),
@@ -7,7 +7,7 @@ from datetime import datetime
 from typing import Optional
 import logging
 
-from app.analytics.services_analytics import get_kpi_overview
+from app.analytics.services_analytics import get_kpi_overview, analytics_cache
 from app.auth.routes import get_current_user
 
 logger = logging.getLogger(__name__)
@@ -234,4 +234,21 @@ async def analytics_overview(
             status_code=500,
             detail=f"Error interno al obtener KPIs. Por favor contacte al administrador."
         )
-    
\ No newline at end of file
+
+
+@router.get("/cache/stats")
+async def analytics_cache_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Contadores de la caché de KPIs compartida por /analytics/overview
+    y /analytics/dashboard (hits, misses, cálculos, peticiones deduplicadas).
+    """
+    if current_user.get("rol") not in ["admin_franquicia", "super_admin"]:
+        raise HTTPException(status_code=403, detail="No autorizado")
+
+    stats = analytics_cache.stats()
+    if hasattr(analytics_cache, "shared_stats"):
+        try:
+            stats["cluster"] = await analytics_cache.shared_stats()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron leer contadores compartidos: {e}")
+    return {"success": True, "cache": stats}
@@ -1,15 +1,41 @@
 """
-VERSIÓN CORREGIDA de routes_churn.py
-✅ FIX: TypeError al sumar string + timedelta (línea 270)
+Clientes en churn (riesgo de abandono).
+
+Un cliente está en churn si su última visita (cita no cancelada con
+fecha <= hoy) fue hace más de CHURN_DAYS días y no tiene ninguna cita
+programada a futuro.
+
+Sin rango de fechas (el caso del dashboard) es un rango por índice
+sobre client_visit_stats (ver visitas_clientes): ultima_cita <= hoy -
+CHURN_DAYS. Con rango se resuelve en UNA agregación sobre appointments:
+por cliente se calcula la última visita, la próxima cita y si tuvo
+citas en el rango pedido. En ambos casos los datos del cliente se traen
+con $lookup. Antes se hacía un find_one por cada candidato (N+1).
+Mientras el arranque no registre la primera reconstrucción de
+client_visit_stats, el caso sin rango usa la agregación sobre
+appointments.
+
+Benchmark contra el cálculo anterior (datos sintéticos en una base de
+pruebas, MONGODB_BENCH_URI; las colecciones se borran al terminar):
+    MONGODB_BENCH_URI=... python -m app.analytics.routes_churn --bench [CLIENTES]
 """
-from fastapi import APIRouter, Response, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List
-import pandas as pd
-from io import BytesIO
+from typing import Any, AsyncIterator, Dict, List, Optional
+import asyncio
+import csv
+import io
 import logging
+import os
+import random
+import sys
+import time
 
-from app.database.mongo import collection_clients, collection_citas
+from app.auth.routes import get_current_user
+from app.database.mongo import collection_clients, collection_citas, collection_locales
+from app.analytics.services_analytics import analytics_cache, get_cache_key
+from app.analytics.visitas_clientes import collection_visitas, TODAS_LAS_SEDES, visitas_al_dia
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +43,16 @@ router = APIRouter(prefix="/analytics", tags=["Analytics"])
 
 CHURN_DAYS = 60
 
+ROLES_CHURN = ["admin_sede", "admin_franquicia", "super_admin"]
+
+COLUMNAS_CSV = [
+    "cliente_id", "nombre", "correo", "telefono",
+    "sede_id", "ultima_visita", "dias_inactivo"
+]
+
+# Filas por bloque al transmitir el CSV
+FILAS_POR_BLOQUE = 500
+
 
 # === HELPER PARA CONVERSIÓN DE FECHAS ===
 
@@ -28,182 +64,262 @@ def datetime_to_date_string(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%d")
 
 
-# === FUNCIONES HELPER OPTIMIZADAS ===
+# === SCOPE ===
 
-async def get_clientes_activos_periodo(
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
-    sede_id: Optional[str] = None
-) -> List[str]:
+async def _sedes_autorizadas(current_user: dict, sede_id: Optional[str]) -> Optional[List[str]]:
     """
-    ✅ FIXED: Convierte datetime a string para comparación
+    Sedes que puede analizar el usuario (None = todas).
+
+    - admin_sede: solo su sede
+    - admin_franquicia: una sede de su franquicia o todas las de ella
+    - super_admin: la sede pedida o todas
     """
-    try:
-        match_query = {
-            "estado": {"$ne": "cancelada"},
-            "cliente_id": {"$exists": True, "$ne": None}
-        }
-        
+    rol = current_user.get("rol")
+    if rol not in ROLES_CHURN:
+        raise HTTPException(
+            status_code=403,
+            detail="No autorizado. Se requiere rol de administrador."
+        )
+
+    if rol == "admin_sede":
+        user_sede_id = current_user.get("sede_id")
+        if not user_sede_id:
+            raise HTTPException(
+                status_code=403,
+                detail="Usuario admin_sede sin sede asignada. Contacte al administrador."
+            )
+        if sede_id and sede_id != user_sede_id:
+            raise HTTPException(
+                status_code=403,
+                detail="No tiene permisos para ver el churn de otra sede"
+            )
+        return [user_sede_id]
+
+    if rol == "admin_franquicia":
+        sedes_docs = await collection_locales.find(
+            {"franquicia_id": current_user.get("franquicia_id")}, {"sede_id": 1}
+        ).to_list(None)
+        sedes_fran = [s["sede_id"] for s in sedes_docs if s.get("sede_id")]
         if sede_id:
-            match_query["sede_id"] = sede_id
-        
-        # 🔧 Convertir datetime a string
-        if start_date and end_date:
-            start_str = datetime_to_date_string(start_date)
-            end_str = datetime_to_date_string(end_date)
-            match_query["fecha"] = {"$gte": start_str, "$lte": end_str}
-        
-        pipeline = [
-            {"$match": match_query},
-            {"$group": {"_id": "$cliente_id"}},
-            {"$project": {"cliente_id": "$_id"}}
-        ]
-        
-        result = await collection_citas.aggregate(pipeline).to_list(None)
-        
-        clientes_ids = []
-        for doc in result:
-            cliente_id = doc.get("cliente_id")
-            if cliente_id and isinstance(cliente_id, str):
-                clientes_ids.append(cliente_id)
-        
-        return clientes_ids
-    
-    except Exception as e:
-        logger.error(f"Error en get_clientes_activos_periodo: {e}")
-        return []
+            if sede_id not in sedes_fran:
+                raise HTTPException(
+                    status_code=403,
+                    detail="Esa sede no pertenece a tu franquicia"
+                )
+            return [sede_id]
+        return sedes_fran
+
+    return [sede_id] if sede_id else None
+
 
+# === AGREGACIÓN ===
 
-async def get_ultima_visita_clientes(
-    clientes_ids: List[str],
-    sede_id: Optional[str] = None
-) -> Dict[str, datetime]:
+def pipeline_churn(
+    sedes: Optional[List[str]],
+    hoy: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> List[Dict[str, Any]]:
     """
-    ✅ FIXED: Convierte fecha string a datetime en el resultado
-    🔧 CRÍTICO: Ahora retorna datetime, NO string
+    Pipeline que devuelve los clientes en churn ordenados por inactividad
+    (más inactivo primero). Fechas en YYYY-MM-DD.
+
+    Con start/end solo se consideran clientes con alguna cita no cancelada
+    en ese rango; la última visita y la próxima cita se miran en todo su
+    historial (igual que antes).
     """
-    try:
-        match_query = {
-            "cliente_id": {"$in": clientes_ids},
-            "estado": {"$ne": "cancelada"}
-        }
-        if sede_id:
-            match_query["sede_id"] = sede_id
-        
-        pipeline = [
-            {"$match": match_query},
-            {"$sort": {"fecha": -1}},
-            {"$group": {
-                "_id": "$cliente_id",
-                "ultima_visita": {"$first": "$fecha"}
-            }}
-        ]
-        
-        result = await collection_citas.aggregate(pipeline).to_list(None)
-        
-        # 🔧 CRÍTICO: Convertir string a datetime
-        ultimas_visitas = {}
-        for doc in result:
-            cliente_id = doc["_id"]
-            fecha_str = doc["ultima_visita"]
-            
-            try:
-                # Convertir "2025-10-01" a datetime
-                fecha_dt = datetime.fromisoformat(fecha_str)
-                ultimas_visitas[cliente_id] = fecha_dt
-            except (ValueError, TypeError) as e:
-                logger.warning(
-                    f"⚠️ Fecha inválida para cliente {cliente_id}: {fecha_str} - {e}"
-                )
-                continue
-        
-        logger.info(f"📅 Últimas visitas obtenidas: {len(ultimas_visitas)}/{len(clientes_ids)}")
-        return ultimas_visitas
-    
-    except Exception as e:
-        logger.error(f"❌ Error en get_ultima_visita_clientes: {e}", exc_info=True)
-        return {}
+    limite = datetime_to_date_string(datetime.fromisoformat(hoy) - timedelta(days=CHURN_DAYS))
+
+    match: Dict[str, Any] = {
+        "estado": {"$ne": "cancelada"},
+        "cliente_id": {"$type": "string"},
+    }
+    if sedes is not None:
+        match["sede_id"] = sedes[0] if len(sedes) == 1 else {"$in": sedes}
 
+    grupo: Dict[str, Any] = {
+        "_id": "$cliente_id",
+        # $max / $min ignoran los null del $cond
+        "ultima_visita": {"$max": {"$cond": [{"$lte": ["$fecha", hoy]}, "$fecha", None]}},
+        "proxima_visita": {"$min": {"$cond": [{"$gt": ["$fecha", hoy]}, "$fecha", None]}},
+    }
+    filtro_churn: Dict[str, Any] = {
+        "proxima_visita": None,
+        "ultima_visita": {"$ne": None, "$lte": limite},
+    }
+    if start and end:
+        grupo["en_rango"] = {"$max": {"$and": [
+            {"$gte": ["$fecha", start]}, {"$lte": ["$fecha", end]}
+        ]}}
+        filtro_churn["en_rango"] = True
 
-async def verificar_visitas_futuras(
-    clientes_ids: List[str],
-    fecha_corte: datetime,
-    sede_id: Optional[str] = None
-) -> Dict[str, bool]:
+    return [
+        {"$match": match},
+        {"$group": grupo},
+        {"$match": filtro_churn},
+        {"$sort": {"ultima_visita": 1, "_id": 1}},
+    ] + _etapas_datos_cliente()
+
+
+def pipeline_churn_visitas(sedes: Optional[List[str]], hoy: str) -> List[Dict[str, Any]]:
     """
-    ✅ FIXED: Convierte datetime a string para comparación
+    Lo mismo que pipeline_churn sin rango, sobre client_visit_stats.
+    Con varias sedes se descartan los clientes que tienen una cita más
+    reciente en otra de ellas.
     """
+    limite = datetime_to_date_string(datetime.fromisoformat(hoy) - timedelta(days=CHURN_DAYS))
+
+    if sedes is None or len(sedes) == 1:
+        return [
+            {"$match": {
+                "sede_id": sedes[0] if sedes else TODAS_LAS_SEDES,
+                "ultima_cita": {"$lte": limite},
+            }},
+            {"$sort": {"ultima_cita": 1, "cliente_id": 1}},
+            {"$project": {"_id": "$cliente_id", "ultima_visita": "$ultima_cita"}},
+        ] + _etapas_datos_cliente()
+
+    return [
+        {"$match": {"sede_id": {"$in": sedes}, "ultima_cita": {"$lte": limite}}},
+        {"$group": {"_id": "$cliente_id", "ultima_visita": {"$max": "$ultima_cita"}}},
+        {"$lookup": {
+            "from": collection_visitas.name,
+            "localField": "_id",
+            "foreignField": "cliente_id",
+            "as": "otras",
+        }},
+        {"$match": {"otras": {"$not": {"$elemMatch": {
+            "sede_id": {"$in": sedes}, "ultima_cita": {"$gt": limite}
+        }}}}},
+        {"$project": {"otras": 0}},
+        {"$sort": {"ultima_visita": 1, "_id": 1}},
+    ] + _etapas_datos_cliente()
+
+
+def _etapas_datos_cliente() -> List[Dict[str, Any]]:
+    """$lookup de clients sobre documentos {_id: cliente_id, ultima_visita}."""
+    return [
+        {"$lookup": {
+            "from": collection_clients.name,
+            "localField": "_id",
+            "foreignField": "cliente_id",
+            "as": "cliente",
+        }},
+        {"$project": {
+            "_id": 0,
+            "cliente_id": "$_id",
+            "ultima_visita": 1,
+            "cliente": {"$arrayElemAt": ["$cliente", 0]},
+            "encontrado": {"$gt": [{"$size": "$cliente"}, 0]},
+        }},
+        {"$project": {
+            "cliente_id": 1,
+            "ultima_visita": 1,
+            "nombre": "$cliente.nombre",
+            "correo": "$cliente.correo",
+            "telefono": "$cliente.telefono",
+            "sede_id": "$cliente.sede_id",
+            "encontrado": 1,
+        }},
+    ]
+
+
+def _fila_churn(doc: Dict[str, Any], hoy: datetime, sede_id: Optional[str]) -> Dict[str, Any]:
+    """Documento de la agregación → fila de la respuesta."""
+    ultima = doc["ultima_visita"]
     try:
-        # 🔧 Convertir datetime a string
-        fecha_corte_str = datetime_to_date_string(fecha_corte)
-        
-        match_query = {
-            "cliente_id": {"$in": clientes_ids},
-            "fecha": {"$gt": fecha_corte_str},
-            "estado": {"$ne": "cancelada"}
+        dias_inactivo = (hoy - datetime.fromisoformat(ultima[:10])).days
+    except (ValueError, TypeError):
+        dias_inactivo = None
+
+    if not doc.get("encontrado"):
+        return {
+            "cliente_id": doc["cliente_id"],
+            "nombre": "Desconocido",
+            "correo": "N/A",
+            "telefono": "N/A",
+            "sede_id": sede_id or "N/A",
+            "ultima_visita": ultima,
+            "dias_inactivo": dias_inactivo,
+            "nota": "Cliente no encontrado en base de datos"
         }
-        if sede_id:
-            match_query["sede_id"] = sede_id
-        
-        pipeline = [
-            {"$match": match_query},
-            {"$group": {"_id": "$cliente_id"}},
-            {"$project": {"cliente_id": "$_id"}}
-        ]
-        
-        result = await collection_citas.aggregate(pipeline).to_list(None)
-        
-        clientes_con_visitas = set(doc["cliente_id"] for doc in result)
-        
-        return {cid: cid in clientes_con_visitas for cid in clientes_ids}
-    
-    except Exception as e:
-        logger.error(f"❌ Error en verificar_visitas_futuras: {e}")
-        return {cid: False for cid in clientes_ids}
+    return {
+        "cliente_id": doc["cliente_id"],
+        "nombre": doc.get("nombre", "N/A"),
+        "correo": doc.get("correo", "N/A"),
+        "telefono": doc.get("telefono", "N/A"),
+        "sede_id": doc.get("sede_id", "N/A"),
+        "ultima_visita": ultima,
+        "dias_inactivo": dias_inactivo,
+    }
 
 
-async def get_datos_clientes_batch(clientes_ids: List[str]) -> Dict[str, Dict]:
+async def iterar_churn(
+    sedes: Optional[List[str]],
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    sede_id: Optional[str] = None,
+    citas=None,
+    visitas=None,
+) -> AsyncIterator[Dict[str, Any]]:
     """
-    ✅ Busca por cliente_id (string) con fallback a _id
+    Filas de clientes en churn directamente del cursor de la agregación.
+    Las colecciones son las de la app salvo que se indiquen (benchmark).
     """
-    try:
-        clientes = await collection_clients.find(
-            {"cliente_id": {"$in": clientes_ids}}
-        ).to_list(None)
-        
-        return {c["cliente_id"]: c for c in clientes if c.get("cliente_id")}
-    
-    except Exception as e:
-        logger.error(f"❌ Error en get_datos_clientes_batch: {e}")
-        
-        # ⚠️ FALLBACK: Intentar buscar por _id (compatibilidad con datos antiguos)
-        try:
-            logger.warning("Intentando fallback con búsqueda por _id...")
-            from bson import ObjectId
-            
-            object_ids = []
-            for cid in clientes_ids:
-                try:
-                    if len(cid) == 24:
-                        object_ids.append(ObjectId(cid))
-                except:
-                    pass
-            
-            if object_ids:
-                clientes = await collection_clients.find(
-                    {"_id": {"$in": object_ids}}
-                ).to_list(None)
-                
-                result = {}
-                for c in clientes:
-                    key = c.get("cliente_id") or str(c.get("_id"))
-                    result[key] = c
-                
-                return result
-        except Exception as fallback_error:
-            logger.error(f"❌ Error en fallback: {fallback_error}")
-        
-        return {}
+    hoy = datetime.now()
+    hoy_str = datetime_to_date_string(hoy)
+    if citas is None:
+        citas = collection_citas
+    if visitas is None:
+        # Hasta que el arranque registre la primera reconstrucción de
+        # client_visit_stats, el mismo resultado sale de appointments
+        visitas = collection_visitas if await visitas_al_dia() else None
+    if start and end:
+        cursor = citas.aggregate(pipeline_churn(sedes, hoy_str, start, end), allowDiskUse=True)
+    elif visitas is None:
+        cursor = citas.aggregate(pipeline_churn(sedes, hoy_str), allowDiskUse=True)
+    else:
+        cursor = visitas.aggregate(pipeline_churn_visitas(sedes, hoy_str), allowDiskUse=True)
+    async for doc in cursor:
+        yield _fila_churn(doc, hoy, sede_id)
+
+
+async def calcular_churn(
+    sedes: Optional[List[str]],
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    sede_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Lista de clientes en churn (cacheada por día, single-flight por clave)."""
+    async def _calcular() -> List[Dict[str, Any]]:
+        return [fila async for fila in iterar_churn(sedes, start, end, sede_id)]
+
+    cache_key = get_cache_key(
+        "churn",
+        sedes=",".join(sorted(sedes)) if sedes is not None else None,
+        start=start,
+        end=end,
+        hoy=datetime_to_date_string(datetime.now()),
+    )
+    return await analytics_cache.get_or_compute(cache_key, _calcular)
+
+
+async def _csv_churn(filas: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """CSV por bloques de FILAS_POR_BLOQUE filas (con BOM para Excel)."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNAS_CSV, extrasaction="ignore")
+    buffer.write("\ufeff")
+    writer.writeheader()
+    pendientes = 0
+    async for fila in filas:
+        writer.writerow(fila)
+        pendientes += 1
+        if pendientes >= FILAS_POR_BLOQUE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+            pendientes = 0
+    yield buffer.getvalue().encode("utf-8")
 
 
 # === ENDPOINT PRINCIPAL ===
@@ -213,24 +329,24 @@ async def obtener_churn_clientes(
     export: bool = False,
     sede_id: Optional[str] = Query(None, description="Filtrar por sede específica"),
     start_date: Optional[str] = Query(None, description="Fecha inicio para análisis (YYYY-MM-DD)"),
-    end_date: Optional[str] = Query(None, description="Fecha fin para análisis (YYYY-MM-DD)")
+    end_date: Optional[str] = Query(None, description="Fecha fin para análisis (YYYY-MM-DD)"),
+    current_user: dict = Depends(get_current_user)
 ):
     """
-    ✅ FIXED: TypeError corregido - ahora suma datetime + timedelta correctamente
-    
     Obtiene lista de clientes en riesgo de abandono (churn).
-    
+
     Un cliente está en churn si:
     - Su última visita fue hace más de CHURN_DAYS (60 días)
     - No tiene citas programadas a futuro
+
+    Con export=true devuelve un CSV transmitido por bloques.
+    Requiere rol admin_sede, admin_franquicia o super_admin.
     """
-    
+
     try:
-        hoy = datetime.now()
-        
         start = None
         end = None
-        
+
         if start_date and end_date:
             try:
                 start = datetime.fromisoformat(start_date)
@@ -240,172 +356,46 @@ async def obtener_churn_clientes(
                     status_code=400,
                     detail="Formato de fecha inválido. Use YYYY-MM-DD"
                 )
-            
+
             if start > end:
                 raise HTTPException(
                     status_code=400,
                     detail="La fecha de inicio debe ser menor o igual a la fecha fin"
                 )
-        
-        # ✅ PASO 1: Obtener clientes únicos del período
-        clientes_ids = await get_clientes_activos_periodo(start, end, sede_id)
-        
-        if not clientes_ids:
-            return {
-                "total_churn": 0,
-                "clientes": [],
-                "parametros": {
-                    "sede_id": sede_id,
-                    "rango_fechas": f"{start_date} a {end_date}" if start_date and end_date else "Todos los registros",
-                    "dias_churn": CHURN_DAYS
-                },
-                "mensaje": "No hay clientes en el rango especificado"
-            }
-        
-        logger.info(f"📊 Analizando churn de {len(clientes_ids)} clientes...")
-        
-        # ✅ PASO 2: Obtener última visita de todos los clientes
-        # 🔧 CRÍTICO: Esta función ahora retorna datetime, NO string
-        ultimas_visitas = await get_ultima_visita_clientes(clientes_ids, sede_id)
-        
-        # ✅ PASO 3: Filtrar clientes que superaron el límite de churn
-        clientes_candidatos_churn = []
-        
-        for cliente_id, ultima_visita in ultimas_visitas.items():
-            # 🔧 FIX: Ahora ultima_visita es datetime, NO string
-            # Por lo tanto, esta suma funciona correctamente
-            fecha_limite = ultima_visita + timedelta(days=CHURN_DAYS)
-            
-            if fecha_limite >= hoy:
-                continue
-            
-            clientes_candidatos_churn.append(cliente_id)
-        
-        if not clientes_candidatos_churn:
-            return {
-                "total_churn": 0,
-                "clientes": [],
-                "parametros": {
-                    "sede_id": sede_id,
-                    "rango_fechas": f"{start_date} a {end_date}" if start_date and end_date else "Todos los registros",
-                    "dias_churn": CHURN_DAYS
-                },
-                "mensaje": "No hay clientes en churn"
-            }
-        
-        logger.info(f"⚠️ {len(clientes_candidatos_churn)} clientes candidatos a churn")
-        
-        # ✅ PASO 4: Verificar si tienen visitas futuras
-        tienen_visitas_futuras = {}
-        for cliente_id in clientes_candidatos_churn:
-            ultima = ultimas_visitas[cliente_id]  # Ahora es datetime
-            
-            # 🔧 Convertir datetime a string para la query
-            ultima_str = datetime_to_date_string(ultima)
-            
-            match_query = {
-                "cliente_id": cliente_id,
-                "fecha": {"$gt": ultima_str},
-                "estado": {"$ne": "cancelada"}
-            }
-            if sede_id:
-                match_query["sede_id"] = sede_id
-            
-            visita_futura = await collection_citas.find_one(match_query)
-            tienen_visitas_futuras[cliente_id] = visita_futura is not None
-        
-        clientes_en_churn = [
-            cid for cid in clientes_candidatos_churn 
-            if not tienen_visitas_futuras.get(cid, False)
-        ]
-        
-        if not clientes_en_churn:
-            return {
-                "total_churn": 0,
-                "clientes": [],
-                "parametros": {
-                    "sede_id": sede_id,
-                    "rango_fechas": f"{start_date} a {end_date}" if start_date and end_date else "Todos los registros",
-                    "dias_churn": CHURN_DAYS
-                },
-                "mensaje": "Todos los clientes tienen visitas futuras programadas"
-            }
-        
-        logger.info(f"🔴 {len(clientes_en_churn)} clientes en churn real")
-        
-        # ✅ PASO 5: Obtener datos de clientes en batch
-        clientes_data_map = await get_datos_clientes_batch(clientes_en_churn)
-        
-        # ✅ PASO 6: Construir resultado
-        clientes_perdidos = []
-        
-        for cliente_id in clientes_en_churn:
-            cliente_data = clientes_data_map.get(cliente_id)
-            
-            if not cliente_data:
-                logger.warning(f"⚠️ Cliente {cliente_id} no encontrado en BD de clientes")
-                clientes_perdidos.append({
-                    "cliente_id": cliente_id,
-                    "nombre": "Desconocido",
-                    "correo": "N/A",
-                    "telefono": "N/A",
-                    "sede_id": sede_id or "N/A",
-                    "ultima_visita": ultimas_visitas[cliente_id].strftime("%Y-%m-%d"),
-                    "dias_inactivo": (hoy - ultimas_visitas[cliente_id]).days,
-                    "nota": "Cliente no encontrado en base de datos"
-                })
-                continue
-            
-            ultima_visita = ultimas_visitas[cliente_id]  # datetime
-            dias_inactivo = (hoy - ultima_visita).days
-            
-            clientes_perdidos.append({
-                "cliente_id": cliente_id,
-                "nombre": cliente_data.get("nombre", "N/A"),
-                "correo": cliente_data.get("correo", "N/A"),
-                "telefono": cliente_data.get("telefono", "N/A"),
-                "sede_id": cliente_data.get("sede_id", "N/A"),
-                "ultima_visita": ultima_visita.strftime("%Y-%m-%d"),
-                "dias_inactivo": dias_inactivo
-            })
-        
-        clientes_perdidos.sort(key=lambda x: x["dias_inactivo"], reverse=True)
-        
-        logger.info(f"✅ Análisis de churn completado: {len(clientes_perdidos)} clientes en riesgo")
-        
-        # ✅ PASO 7: Exportar a Excel si se solicita
+
+        sedes = await _sedes_autorizadas(current_user, sede_id)
+        if sedes is not None and len(sedes) == 1:
+            sede_id = sedes[0]
+        start_str = datetime_to_date_string(start) if start else None
+        end_str = datetime_to_date_string(end) if end else None
+
+        parametros = {
+            "sede_id": sede_id,
+            "rango_fechas": f"{start_date} a {end_date}" if start_date and end_date else "Todos los registros",
+            "dias_churn": CHURN_DAYS
+        }
+
+        # ✅ Exportar a CSV directamente desde el cursor
         if export:
-            if not clientes_perdidos:
-                df = pd.DataFrame(columns=[
-                    "cliente_id", "nombre", "correo", "telefono",
-                    "sede_id", "ultima_visita", "dias_inactivo"
-                ])
-            else:
-                df = pd.DataFrame(clientes_perdidos)
-            
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Clientes en Churn')
-            
-            output.seek(0)
-            
-            return Response(
-                content=output.read(),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": "attachment; filename=clientes_churn.xlsx"}
+            return StreamingResponse(
+                _csv_churn(iterar_churn(sedes, start_str, end_str, sede_id)),
+                media_type="text/csv; charset=utf-8",
+                headers={"Content-Disposition": "attachment; filename=clientes_churn.csv"}
             )
-        
-        # ✅ Devolver JSON
-        return {
+
+        clientes_perdidos = await calcular_churn(sedes, start_str, end_str, sede_id) if sedes != [] else []
+
+        logger.info(f"✅ Análisis de churn completado: {len(clientes_perdidos)} clientes en riesgo")
+
+        respuesta = {
             "total_churn": len(clientes_perdidos),
-            "parametros": {
-                "sede_id": sede_id,
-                "rango_fechas": f"{start_date} a {end_date}" if start_date and end_date else "Todos los registros",
-                "dias_churn": CHURN_DAYS
-            },
+            "parametros": parametros,
             "clientes": clientes_perdidos
         }
-    
+        if not clientes_perdidos:
+            respuesta["mensaje"] = "No hay clientes en churn"
+        return respuesta
+
     except HTTPException:
         raise
     except Exception as e:
@@ -414,4 +404,155 @@ async def obtener_churn_clientes(
             status_code=500,
             detail=f"Error al obtener clientes en churn: {str(e)}"
         )
-    
\ No newline at end of file
+
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+
+async def _churn_anterior(citas, clientes, sede_id: Optional[str]) -> List[Dict[str, Any]]:
+    """El cálculo anterior: agregaciones + un find_one por candidato (N+1)."""
+    hoy = datetime.now()
+    match: Dict[str, Any] = {"estado": {"$ne": "cancelada"}, "cliente_id": {"$exists": True, "$ne": None}}
+    if sede_id:
+        match["sede_id"] = sede_id
+    ids = [
+        d["_id"] for d in await citas.aggregate([
+            {"$match": match}, {"$group": {"_id": "$cliente_id"}}
+        ], allowDiskUse=True).to_list(None)
+        if isinstance(d["_id"], str)
+    ]
+    ultimas = {
+        d["_id"]: datetime.fromisoformat(d["ultima_visita"])
+        for d in await citas.aggregate([
+            {"$match": {**match, "cliente_id": {"$in": ids}}},
+            {"$sort": {"fecha": -1}},
+            {"$group": {"_id": "$cliente_id", "ultima_visita": {"$first": "$fecha"}}},
+        ], allowDiskUse=True).to_list(None)
+    }
+    en_churn = []
+    for cid, ultima in ultimas.items():
+        if ultima + timedelta(days=CHURN_DAYS) >= hoy:
+            continue
+        futura = await citas.find_one({**match, "cliente_id": cid, "fecha": {"$gt": datetime_to_date_string(ultima)}})
+        if futura is None:
+            en_churn.append(cid)
+    datos = {
+        c["cliente_id"]: c
+        for c in await clientes.find({"cliente_id": {"$in": en_churn}}).to_list(None)
+    }
+    filas = [
+        {
+            "cliente_id": cid,
+            "nombre": datos.get(cid, {}).get("nombre", "Desconocido"),
+            "ultima_visita": datetime_to_date_string(ultimas[cid]),
+            "dias_inactivo": (hoy - ultimas[cid]).days,
+        }
+        for cid in en_churn
+    ]
+    filas.sort(key=lambda x: (-x["dias_inactivo"], x["cliente_id"]))
+    return filas
+
+
+async def benchmark_churn(
+    citas, clientes, ventas, visitas, n_clientes: int = 100_000, sede_id: str = "SD-BENCH"
+) -> Dict[str, Any]:
+    """
+    Siembra n_clientes con 1-5 citas cada uno en las colecciones dadas
+    (vacías, de una base de pruebas y con los nombres de las de la app:
+    los $lookup los usan) y mide el cálculo anterior, la
+    agregación sobre appointments (camino con rango, aquí sin acotar) y
+    la lectura de client_visit_stats. Verifica que los tres den el mismo
+    resultado. Al terminar elimina las colecciones.
+    """
+    from app.analytics.visitas_clientes import reconstruir_visitas
+
+    for coleccion in (citas, clientes, ventas, visitas):
+        if await coleccion.find_one({}, {"_id": 1}):
+            raise ValueError(f"La colección {coleccion.name} debe estar vacía para el benchmark")
+
+    random.seed(42)
+    hoy = datetime.now()
+    try:
+        await citas.create_index([("sede_id", 1), ("fecha", 1)])
+        await citas.create_index([("cliente_id", 1), ("fecha", -1)])
+        await clientes.create_index([("cliente_id", 1)], unique=True)
+        await visitas.create_index([("sede_id", 1), ("ultima_cita", 1), ("cliente_id", 1)])
+        await visitas.create_index([("cliente_id", 1)])
+
+        lote_clientes, lote_citas = [], []
+        for i in range(n_clientes):
+            cid = f"CL-{i:06d}"
+            lote_clientes.append({"cliente_id": cid, "nombre": f"Cliente {i}", "sede_id": sede_id})
+            for _ in range(random.randint(1, 5)):
+                fecha = hoy + timedelta(days=random.randint(-720, 30))
+                lote_citas.append({
+                    "cliente_id": cid,
+                    "sede_id": sede_id,
+                    "fecha": datetime_to_date_string(fecha),
+                    "estado": random.choice(["confirmada", "completada", "completada", "cancelada"]),
+                })
+            if len(lote_citas) >= 20_000:
+                await citas.insert_many(lote_citas, ordered=False)
+                await clientes.insert_many(lote_clientes, ordered=False)
+                lote_clientes, lote_citas = [], []
+        if lote_citas:
+            await citas.insert_many(lote_citas, ordered=False)
+        if lote_clientes:
+            await clientes.insert_many(lote_clientes, ordered=False)
+
+        t0 = time.perf_counter()
+        anterior = await _churn_anterior(citas, clientes, sede_id)
+        t_anterior = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        por_agregacion = [
+            fila async for fila in iterar_churn([sede_id], "0000-01-01", "9999-12-31", sede_id, citas, visitas)
+        ]
+        t_agregacion = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        await reconstruir_visitas(citas=citas, ventas=ventas, visitas=visitas)
+        t_reconstruccion = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        por_proyeccion = [fila async for fila in iterar_churn([sede_id], sede_id=sede_id, citas=citas, visitas=visitas)]
+        t_proyeccion = time.perf_counter() - t0
+
+        clave = lambda f: (f["cliente_id"], f["nombre"], f["ultima_visita"], f["dias_inactivo"])
+        esperado = [clave(f) for f in anterior]
+        return {
+            "clientes": n_clientes,
+            "citas": await citas.count_documents({}),
+            "en_churn": len(por_proyeccion),
+            "anterior_s": round(t_anterior, 3),
+            "agregacion_s": round(t_agregacion, 3),
+            "reconstruccion_visitas_s": round(t_reconstruccion, 3),
+            "proyeccion_s": round(t_proyeccion, 3),
+            "aceleracion": round(t_anterior / t_proyeccion, 1) if t_proyeccion else None,
+            "identicos": esperado == [clave(f) for f in por_agregacion] == [clave(f) for f in por_proyeccion],
+        }
+    finally:
+        for coleccion in (citas, clientes, ventas, visitas):
+            await coleccion.drop()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args and args[0] == "--bench":
+        # El benchmark siembra y elimina colecciones: nunca en la base de la app
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from app.database.mongo import collection_sales
+
+        bench_uri = os.getenv("MONGODB_BENCH_URI")
+        if not bench_uri:
+            sys.exit("Defina MONGODB_BENCH_URI con una base de pruebas (no la de la app)")
+        bench_db = AsyncIOMotorClient(bench_uri)[os.getenv("MONGODB_BENCH_NAME", "bench_churn")]
+        print(asyncio.run(benchmark_churn(
+            bench_db[collection_citas.name], bench_db[collection_clients.name],
+            bench_db[collection_sales.name], bench_db[collection_visitas.name],
+            int(args[1]) if len(args) > 1 else 100_000,
+        )))
+    else:
+        print("Uso:\n"
+              "  MONGODB_BENCH_URI=... python -m app.analytics.routes_churn --bench [CLIENTES]")
@@ -256,7 +256,8 @@ async def analytics_dashboard(
             export=False,
             sede_id=sede_id,
             start_date=None,
-            end_date=None
+            end_date=None,
+            current_user=current_user
         )
         
         # ========= DETERMINAR CALIDAD DE DATOS =========
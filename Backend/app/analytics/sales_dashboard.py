@@ -8,8 +8,8 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, List
 import logging
 
-from app.database.mongo import collection_sales 
 from app.auth.routes import get_current_user
+from app.analytics.hechos_diarios import METODOS_PAGO_VENTAS, resumir_ventas_periodos, sedes_todas
 
 logger = logging.getLogger(__name__)
 
@@ -78,42 +78,41 @@ def get_date_range(
     )
 
 
-async def get_ventas_periodo(
-    start_date: datetime,
-    end_date: datetime,
+async def get_ventas_periodos(
+    periodos: Dict[str, tuple[datetime, datetime]],
     sede_id: Optional[str] = None
-) -> List[Dict]:
+) -> Dict[str, List[Dict]]:
     """
-    Obtiene ventas del período desde collection_sales.
+    Totales por moneda de cada período {nombre: (inicio, fin)}, en una
+    sola agregación $facet sobre los hechos diarios de ventas (ver
+    hechos_diarios.resumir_ventas_periodos). El costo no depende de la
+    cantidad de ventas.
     
     🎯 CRÍTICO: 
     - Usa desglose_pagos.total (no suma de items)
     - Items separados por tipo para análisis
     """
     try:
-        query = {
-            "fecha_pago": {
-                "$gte": start_date,
-                "$lte": end_date
-            }
-        }
-        
-        if sede_id:
-            query["sede_id"] = sede_id
-        
-        ventas = await collection_sales.find(query).to_list(None)
+        sede_ids = [sede_id] if sede_id else await sedes_todas()
+        resumen = await resumir_ventas_periodos(sede_ids, {
+            nombre: (inicio.strftime("%Y-%m-%d"), fin.strftime("%Y-%m-%d"))
+            for nombre, (inicio, fin) in periodos.items()
+        })
         
-        logger.info(f"💰 Ventas encontradas: {len(ventas)} (sede: {sede_id or 'TODAS'})")
-        return ventas
+        conteo = {nombre: len(filas) for nombre, filas in resumen.items()}
+        logger.info(f"💰 Monedas con ventas por período: {conteo} (sede: {sede_id or 'TODAS'})")
+        return resumen
     
     except Exception as e:
-        logger.error(f"❌ Error en get_ventas_periodo: {e}", exc_info=True)
-        return []
+        logger.error(f"❌ Error en get_ventas_periodos: {e}", exc_info=True)
+        return {nombre: [] for nombre in periodos}
 
 
-def calcular_metricas_financieras(ventas: List[Dict]) -> Dict:
+def calcular_metricas_financieras(hechos: List[Dict]) -> Dict:
     """
-    Calcula métricas financieras correctas por moneda.
+    Calcula métricas financieras correctas por moneda a partir de los
+    hechos diarios de ventas o de sus totales por moneda
+    (get_ventas_periodos), que tienen la misma forma.
     
     💱 MULTI-MONEDA: 
     - Detecta automáticamente COP, USD, MXN
@@ -128,14 +127,14 @@ def calcular_metricas_financieras(ventas: List[Dict]) -> Dict:
     - ticket_promedio: ventas_totales / cantidad_ventas
     - ventas_servicios: Sum de items tipo "servicio"
     - ventas_productos: Sum de items tipo "producto"
+    - abonos: Sum de historial_pagos con tipo = "abono_inicial"
     - metodos_pago: Por método desde desglose_pagos
     """
     metricas_por_moneda = {}
-    #organizar abonos seria tomar historial_pagos.tipo = abono_inicial 
     
-    # ========= PROCESAR VENTAS =========
-    for venta in ventas:
-        moneda = venta.get("moneda", "COP")
+    # ========= PROCESAR HECHOS =========
+    for hecho in hechos:
+        moneda = hecho.get("moneda", "COP")
         
         # Inicializar moneda si no existe
         if moneda not in metricas_por_moneda:
@@ -145,52 +144,15 @@ def calcular_metricas_financieras(ventas: List[Dict]) -> Dict:
                 "ventas_servicios": 0,
                 "ventas_productos": 0,
                 "abonos": 0,
-                "metodos_pago": {
-                    "efectivo": 0,
-                    "transferencia": 0,
-                    "tarjeta": 0,
-                    "sin_pago": 0,
-                    "otros": 0,
-                    "addi": 0,
-                    "giftcard": 0,
-                    "link_de_pago": 0,
-                    "tarjeta_credito": 0,
-                    "tarjeta_debito": 0,
-                    "descuento_nomina": 0,
-                    "abono_transferencia"
-                    "abonos": 0
-                }
+                "metodos_pago": {"sin_pago": 0, **{metodo: 0 for metodo in METODOS_PAGO_VENTAS}}
             }
         
-        # Total de la venta (desde desglose_pagos)
-        desglose_pagos = venta.get("desglose_pagos", {})
-        total_venta = desglose_pagos.get("total", 0)
+        datos = metricas_por_moneda[moneda]
+        for campo in ("ventas_totales", "cantidad_ventas", "ventas_servicios", "ventas_productos", "abonos"):
+            datos[campo] += hecho.get(campo, 0)
         
-        metricas_por_moneda[moneda]["ventas_totales"] += total_venta
-        metricas_por_moneda[moneda]["cantidad_ventas"] += 1
-
-        # ✅ Solo tipo = "abono_inicial", sin importar el método usado
-        historial_pagos = venta.get("historial_pagos", [])
-        for pago in historial_pagos:
-            if pago.get("tipo") == "abono_inicial":
-                metricas_por_moneda[moneda]["abonos"] += pago.get("monto", 0)
-        
-        # Separar servicios vs productos (desde items)
-        items = venta.get("items", [])
-        for item in items:
-            tipo = item.get("tipo", "servicio")
-            subtotal = item.get("subtotal", 0)
-            
-            if tipo == "servicio":
-                metricas_por_moneda[moneda]["ventas_servicios"] += subtotal
-            elif tipo == "producto":
-                metricas_por_moneda[moneda]["ventas_productos"] += subtotal
-        
-        # Métodos de pago desde desglose_pagos
-        for metodo in ["efectivo", "transferencia","tarjeta", "tarjeta_credito", "tarjeta_debito", "link_de_pago", "giftcard", "addi", "abonos","abono_transferencia", "descuento_nomina", "otros"]:
-            valor = desglose_pagos.get(metodo, 0)
-            if valor > 0:
-                metricas_por_moneda[moneda]["metodos_pago"][metodo] += valor
+        for metodo, valor in (hecho.get("metodos_pago") or {}).items():
+            datos["metodos_pago"][metodo] = datos["metodos_pago"].get(metodo, 0) + valor
     
     # ========= CALCULAR PROMEDIOS Y REDONDEAR =========
     for moneda, datos in metricas_por_moneda.items():
@@ -429,15 +391,18 @@ async def ventas_dashboard(
         )
         
         # ========= OBTENER DATOS =========
-        # Período actual
-        ventas_actuales = await get_ventas_periodo(start_date_dt, end_date_dt, sede_id)
-        
-        # Período anterior
-        ventas_anteriores = await get_ventas_periodo(start_anterior, end_anterior, sede_id)
+        # Período actual y anterior en una sola agregación
+        ventas = await get_ventas_periodos(
+            {"actual": (start_date_dt, end_date_dt), "anterior": (start_anterior, end_anterior)},
+            sede_id
+        )
+        ventas_actuales = ventas["actual"]
+        ventas_anteriores = ventas["anterior"]
         
         # ========= CALCULAR MÉTRICAS =========
         metricas_actuales = calcular_metricas_financieras(ventas_actuales)
         metricas_anteriores = calcular_metricas_financieras(ventas_anteriores)
+        cantidad_ventas = sum(h.get("cantidad_ventas", 0) for h in ventas_actuales)
         
         crecimientos = calcular_crecimiento(metricas_actuales, metricas_anteriores)
         
@@ -452,7 +417,7 @@ async def ventas_dashboard(
         advertencias = []
         
         # Sin ventas
-        if not ventas_actuales:
+        if not cantidad_ventas:
             advertencias.append({
                 "tipo": "SIN_VENTAS",
                 "severidad": "CRÍTICA",
@@ -461,11 +426,11 @@ async def ventas_dashboard(
             })
         
         # Pocas ventas
-        elif len(ventas_actuales) < 5:
+        elif cantidad_ventas < 5:
             advertencias.append({
                 "tipo": "POCAS_VENTAS",
                 "severidad": "ALTA",
-                "mensaje": f"Solo {len(ventas_actuales)} ventas en el período",
+                "mensaje": f"Solo {cantidad_ventas} ventas en el período",
                 "recomendacion": "Amplíe el período para análisis más estable"
             })
         
@@ -531,7 +496,7 @@ async def ventas_dashboard(
             },
             "metricas_por_moneda": metricas_actuales,
             "debug_info": {
-                "ventas_registradas": len(ventas_actuales),
+                "ventas_registradas": cantidad_ventas,
                 "monedas_en_ventas": monedas_detectadas
             },
             "calidad_datos": calidad_datos
@@ -543,7 +508,7 @@ async def ventas_dashboard(
         logger.info(
             f"✅ Dashboard ventas generado - "
             f"Período: {dias_periodo} días, "
-            f"Ventas: {len(ventas_actuales)}, "
+            f"Ventas: {cantidad_ventas}, "
             f"Monedas: {', '.join(monedas_detectadas)}, "
             f"Calidad: {calidad_datos}"
         )
@@ -0,0 +1,144 @@
+# ============================================================
+# scheduler_hechos.py - Rollup nocturno de hechos de analytics
+# Ubicación: app/analytics/scheduler_hechos.py
+# ============================================================
+#
+# Igual que el scheduler de caja: cada proceso arranca el suyo y solo el
+# líder del lease "analytics_rollup" ejecuta el job. La corrida del día
+# se reclama en scheduler_runs con _id "rollup_hechos|FECHA", así se
+# hace una sola vez por cluster aunque cambie el líder.
+#
+# El rollup recalcula, para todas las sedes, los últimos DIAS_REPROCESO
+# días (cambios tardíos de estado sin gancho de invalidación) y luego
+# todos los sede-días que quedaron sucios, y reconstruye las estadísticas
+# de visitas por cliente (visitas_clientes.py). Al ganar el liderazgo y
+# cada hora se ejecuta si ya pasó la hora y la corrida del día no se hizo.
+#
+# Configuración por entorno:
+#   ANALYTICS_ROLLUP_HORA      (default: 3)               hora local del job
+#   ANALYTICS_ROLLUP_ZONA      (default: America/Bogota)
+#   ANALYTICS_DIAS_REPROCESO   (default: 3)
+# ============================================================
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+import os
+import time
+import pytz
+import logging
+
+from app.database.mongo import db
+from app.utils.leader_lease import INSTANCIA_ID, es_lider, iniciar_eleccion, detener_eleccion
+from .hechos_diarios import reconstruir_hechos, recalcular_sucios
+from .visitas_clientes import reconstruir_visitas
+
+logger = logging.getLogger(__name__)
+
+scheduler_runs = db["scheduler_runs"]
+
+LIDERAZGO = "analytics_rollup"
+JOB_ROLLUP = "rollup_hechos"
+
+HORA_ROLLUP = int(os.getenv("ANALYTICS_ROLLUP_HORA", "3"))
+ZONA_ROLLUP = os.getenv("ANALYTICS_ROLLUP_ZONA", "America/Bogota")
+DIAS_REPROCESO = int(os.getenv("ANALYTICS_DIAS_REPROCESO", "3"))
+
+scheduler = AsyncIOScheduler(job_defaults={"coalesce": True, "misfire_grace_time": 3600})
+
+
+async def rollup_nocturno(dias: int = DIAS_REPROCESO) -> str:
+    """
+    Corre el rollup del día si este proceso es líder y nadie lo hizo ya.
+    Devuelve el estado final de la corrida ("no_lider" / "ya_ejecutado"
+    si no le tocaba).
+    """
+    if not es_lider(LIDERAZGO):
+        return "no_lider"
+
+    hoy = datetime.now(pytz.timezone(ZONA_ROLLUP)).date()
+    run_id = f"{JOB_ROLLUP}|{hoy.isoformat()}"
+    try:
+        await scheduler_runs.insert_one({
+            "_id": run_id,
+            "job": JOB_ROLLUP,
+            "fecha": hoy.isoformat(),
+            "estado": "ejecutando",
+            "lider": INSTANCIA_ID,
+            "iniciado_en": datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        return "ya_ejecutado"
+
+    inicio = time.monotonic()
+    try:
+        conteo = await reconstruir_hechos(
+            (hoy - timedelta(days=dias)).isoformat(), (hoy - timedelta(days=1)).isoformat()
+        )
+        conteo["sucios"] = await recalcular_sucios()
+        conteo["visitas_clientes"] = await reconstruir_visitas()
+    except Exception as e:
+        logger.error(f"❌ Error en el rollup de hechos de analytics: {e}", exc_info=True)
+        # Se borra el reclamo para que la recuperación horaria lo reintente
+        await scheduler_runs.delete_one({"_id": run_id})
+        return "fallido"
+
+    await scheduler_runs.update_one({"_id": run_id}, {"$set": {
+        "estado": "completado",
+        "resultado": conteo,
+        "duracion_ms": int((time.monotonic() - inicio) * 1000),
+        "finalizado_en": datetime.utcnow(),
+    }})
+    logger.info(f"✅ Rollup de hechos de analytics: {conteo}")
+    return "completado"
+
+
+async def _rollup_en_segundo_plano() -> None:
+    try:
+        await rollup_nocturno()
+    except Exception as e:
+        logger.error(f"❌ Error lanzando el rollup de hechos: {e}", exc_info=True)
+
+
+async def _recuperar_rollup() -> None:
+    """Corre el rollup de hoy si ya pasó su hora (no hace nada si ya se hizo)."""
+    if datetime.now(pytz.timezone(ZONA_ROLLUP)).hour >= HORA_ROLLUP:
+        await _rollup_en_segundo_plano()
+
+
+async def iniciar_rollup() -> None:
+    """Registra el job nocturno y compite por el liderazgo. Llamar desde el lifespan."""
+    try:
+        if scheduler.running:
+            logger.warning("⚠️ Scheduler de hechos de analytics ya estaba iniciado")
+            return
+        scheduler.add_job(
+            _rollup_en_segundo_plano,
+            trigger=CronTrigger(hour=HORA_ROLLUP, minute=0, timezone=pytz.timezone(ZONA_ROLLUP)),
+            id=JOB_ROLLUP,
+            name="Rollup nocturno de hechos de analytics",
+            replace_existing=True,
+        )
+        # Reintento horario si la corrida de hoy falló o no se hizo
+        scheduler.add_job(
+            _recuperar_rollup,
+            trigger=CronTrigger(minute=41, timezone=pytz.timezone(ZONA_ROLLUP)),
+            id=f"{JOB_ROLLUP}_recuperacion",
+            name="Recuperar rollup de hechos de analytics",
+            replace_existing=True,
+        )
+        scheduler.start()
+        await iniciar_eleccion(LIDERAZGO, al_ganar=_recuperar_rollup)
+        logger.info(f"✅ Scheduler de hechos de analytics INICIADO ({INSTANCIA_ID})")
+    except Exception as e:
+        logger.error(f"❌ Error iniciando el scheduler de hechos: {e}", exc_info=True)
+
+
+async def detener_rollup() -> None:
+    try:
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        await detener_eleccion(LIDERAZGO)
+    except Exception as e:
+        logger.error(f"❌ Error deteniendo el scheduler de hechos: {e}", exc_info=True)
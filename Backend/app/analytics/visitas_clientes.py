@@ -0,0 +1,361 @@
+# ============================================================
+# visitas_clientes.py - Estadísticas de visita por cliente
+# Ubicación: app/analytics/visitas_clientes.py
+#
+# Proyección que evita recorrer appointments/sales en cada petición
+# de churn, recurrencia y perfil del cliente:
+#
+#   client_visit_stats   cliente × sede (y "*" = todas las sedes)
+#     {_id: "CLIENTE|SEDE", cliente_id, sede_id,
+#      primera_cita, ultima_cita, visitas,      ← citas no canceladas
+#      compras, gasto {moneda: total}, ultima_compra,  ← ventas no canceladas
+#      version, actualizado_en}
+#
+# Criterios:
+# - visitas: citas con estado distinto de "cancelada" (el mismo criterio
+#   del churn). ultima_cita puede ser futura: un cliente está en churn
+#   si ultima_cita + CHURN_DAYS ya pasó (no hay visita posterior).
+# - gasto: desglose_pagos.total de las ventas (las citas facturadas
+#   generan su venta), por moneda.
+#
+# Mantenimiento:
+# - Las escrituras de citas y ventas llaman a actualizar_visitas_cliente()
+#   que recalcula ese cliente con dos agregaciones por índice.
+# - Cada recálculo primero sube la version del cliente (en su documento
+#   "*") y escribe solo sobre documentos con version <= la suya: un
+#   recálculo lento que empezó antes no pisa uno más reciente.
+# - reconstruir_visitas() recalcula todos los clientes por lotes y borra
+#   los documentos que ya no corresponden; corre con el rollup nocturno
+#   (scheduler_hechos.py).
+# - La primera reconstrucción la lanza el arranque de la API como
+#   migración (MIGRACION_VISITAS en schema_meta). Hasta que quede
+#   registrada, la lectura calcula desde appointments/sales.
+#
+# Uso por consola (backfill):
+#   python -m app.analytics.visitas_clientes --rebuild
+# ============================================================
+
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.database.migraciones import migracion_aplicada
+from app.database.mongo import db, collection_citas, collection_sales
+
+logger = logging.getLogger(__name__)
+
+collection_visitas = db["client_visit_stats"]
+
+# sede_id de los documentos que agregan todas las sedes del cliente
+TODAS_LAS_SEDES = "*"
+
+LOTE_CLIENTES = 1000
+
+DUPLICATE_KEY = 11000
+
+# Migración de arranque (schema_meta) con la primera reconstrucción
+MIGRACION_VISITAS = "client_visit_stats"
+VERSION_VISITAS = 1
+
+_visitas_al_dia = False
+
+
+def visitas_id(cliente_id: str, sede_id: Optional[str] = None) -> str:
+    return f"{cliente_id}|{sede_id or TODAS_LAS_SEDES}"
+
+
+def filtro_ultima_cita(cliente_inactivo_desde: datetime, dias: int) -> Dict[str, str]:
+    """
+    Condición sobre ultima_cita equivalente a
+    datetime(ultima_cita) + dias < cliente_inactivo_desde.
+    """
+    limite = cliente_inactivo_desde - timedelta(days=dias)
+    limite_str = limite.strftime("%Y-%m-%d")
+    if limite == datetime(limite.year, limite.month, limite.day):
+        return {"$lt": limite_str}
+    return {"$lte": limite_str}
+
+
+async def visitas_al_dia() -> bool:
+    """True cuando schema_meta registra la reconstrucción inicial."""
+    global _visitas_al_dia
+    if not _visitas_al_dia:
+        _visitas_al_dia = await migracion_aplicada(MIGRACION_VISITAS, VERSION_VISITAS)
+    return _visitas_al_dia
+
+
+# ============================================================
+# CÁLCULO
+# ============================================================
+
+def _stats_vacias(cliente_id: str, sede_id: str) -> Dict[str, Any]:
+    return {
+        "_id": visitas_id(cliente_id, sede_id),
+        "cliente_id": cliente_id,
+        "sede_id": sede_id,
+        "primera_cita": None,
+        "ultima_cita": None,
+        "visitas": 0,
+        "compras": 0,
+        "gasto": {},
+        "ultima_compra": None,
+    }
+
+
+def _acumular(doc: Dict[str, Any], primera, ultima, visitas=0, compras=0,
+              gasto: Optional[Dict[str, float]] = None, ultima_compra=None) -> None:
+    if primera and (doc["primera_cita"] is None or primera < doc["primera_cita"]):
+        doc["primera_cita"] = primera
+    if ultima and (doc["ultima_cita"] is None or ultima > doc["ultima_cita"]):
+        doc["ultima_cita"] = ultima
+    doc["visitas"] += visitas
+    doc["compras"] += compras
+    for moneda, total in (gasto or {}).items():
+        doc["gasto"][moneda] = round(doc["gasto"].get(moneda, 0) + total, 2)
+    if ultima_compra and (doc["ultima_compra"] is None or ultima_compra > doc["ultima_compra"]):
+        doc["ultima_compra"] = ultima_compra
+
+
+async def _calcular_visitas(cliente_ids: List[str], citas=None, ventas=None) -> List[Dict[str, Any]]:
+    """Documentos de client_visit_stats de esos clientes (por sede y "*")."""
+    citas = collection_citas if citas is None else citas
+    ventas = collection_sales if ventas is None else ventas
+    citas_pipeline = [
+        {"$match": {"cliente_id": {"$in": cliente_ids}, "estado": {"$ne": "cancelada"}}},
+        {"$group": {
+            "_id": {"cliente_id": "$cliente_id", "sede_id": "$sede_id"},
+            "primera_cita": {"$min": "$fecha"},
+            "ultima_cita": {"$max": "$fecha"},
+            "visitas": {"$sum": 1},
+        }},
+    ]
+    ventas_pipeline = [
+        {"$match": {"cliente_id": {"$in": cliente_ids}, "estado_factura": {"$ne": "cancelado"}}},
+        {"$group": {
+            "_id": {
+                "cliente_id": "$cliente_id",
+                "sede_id": "$sede_id",
+                "moneda": {"$ifNull": ["$moneda", "COP"]},
+            },
+            "total": {"$sum": {"$ifNull": ["$desglose_pagos.total", 0]}},
+            "compras": {"$sum": 1},
+            "ultima_compra": {"$max": "$fecha_pago"},
+        }},
+    ]
+    grupos_citas, grupos_ventas = await asyncio.gather(
+        citas.aggregate(citas_pipeline, allowDiskUse=True).to_list(None),
+        ventas.aggregate(ventas_pipeline, allowDiskUse=True).to_list(None),
+    )
+
+    docs: Dict[str, Dict[str, Any]] = {}
+
+    def _doc(cliente_id: str, sede_id: str) -> Dict[str, Any]:
+        clave = visitas_id(cliente_id, sede_id)
+        if clave not in docs:
+            docs[clave] = _stats_vacias(cliente_id, sede_id)
+        return docs[clave]
+
+    for g in grupos_citas:
+        cliente_id, sede_id = g["_id"]["cliente_id"], g["_id"].get("sede_id")
+        campos = (g["primera_cita"], g["ultima_cita"], g["visitas"])
+        # Una cita sin sede cuenta solo en el total del cliente
+        if sede_id:
+            _acumular(_doc(cliente_id, sede_id), *campos)
+        _acumular(_doc(cliente_id, TODAS_LAS_SEDES), *campos)
+
+    for g in grupos_ventas:
+        cliente_id, sede_id = g["_id"]["cliente_id"], g["_id"].get("sede_id")
+        campos = dict(compras=g["compras"], gasto={g["_id"]["moneda"]: float(g["total"] or 0)},
+                      ultima_compra=g.get("ultima_compra"))
+        if sede_id:
+            _acumular(_doc(cliente_id, sede_id), None, None, **campos)
+        _acumular(_doc(cliente_id, TODAS_LAS_SEDES), None, None, **campos)
+
+    return list(docs.values())
+
+
+async def _subir_versiones(cliente_ids: List[str], visitas=None) -> Dict[str, int]:
+    """
+    Sube la version de cada cliente y la devuelve. El cálculo que sigue
+    ve todas las escrituras previas a la subida.
+    """
+    visitas = collection_visitas if visitas is None else visitas
+    await visitas.bulk_write([
+        UpdateOne(
+            {"_id": visitas_id(c)},
+            {"$inc": {"version": 1}, "$setOnInsert": {"cliente_id": c, "sede_id": TODAS_LAS_SEDES}},
+            upsert=True,
+        )
+        for c in cliente_ids
+    ], ordered=False)
+    return {
+        d["cliente_id"]: d["version"]
+        async for d in visitas.find(
+            {"_id": {"$in": [visitas_id(c) for c in cliente_ids]}}, {"cliente_id": 1, "version": 1}
+        )
+    }
+
+
+async def _guardar(
+    cliente_ids: List[str], docs: List[Dict[str, Any]], versiones: Dict[str, int], visitas=None
+) -> int:
+    """
+    Deja `docs` como estadísticas de esos clientes salvo donde ya escribió
+    un recálculo con version mayor. Devuelve cuántos documentos se omitieron.
+    """
+    visitas = collection_visitas if visitas is None else visitas
+    ahora = datetime.utcnow()
+    operaciones = []
+    for d in docs:
+        d["version"] = versiones.get(d["cliente_id"], 0)
+        d["actualizado_en"] = ahora
+        # Sin coincidencia el upsert choca con el _id existente (más reciente)
+        operaciones.append(ReplaceOne({"_id": d["_id"], "version": {"$not": {"$gt": d["version"]}}}, d, upsert=True))
+
+    omitidos = 0
+    if operaciones:
+        try:
+            await visitas.bulk_write(operaciones, ordered=False)
+        except BulkWriteError as e:
+            errores = e.details.get("writeErrors", [])
+            if not errores or any(err.get("code") != DUPLICATE_KEY for err in errores):
+                raise
+            omitidos = len(errores)
+
+    # Documentos que ya no corresponden, solo de la version propia o anteriores
+    por_version: Dict[int, List[str]] = {}
+    for c in cliente_ids:
+        por_version.setdefault(versiones.get(c, 0), []).append(c)
+    await visitas.delete_many({
+        "_id": {"$nin": [d["_id"] for d in docs]},
+        "$or": [
+            {"cliente_id": {"$in": ids}, "version": {"$not": {"$gt": version}}}
+            for version, ids in por_version.items()
+        ],
+    })
+    if omitidos:
+        logger.info(f"ℹ️ {omitidos} estadísticas de visitas omitidas: ya había un recálculo más reciente")
+    return omitidos
+
+
+async def actualizar_visitas_cliente(*cliente_ids: Any) -> None:
+    """
+    Recalcula las estadísticas de esos clientes. Nunca lanza: lo que no
+    se pudo actualizar lo corrige la reconstrucción nocturna.
+    """
+    ids = sorted({c for c in cliente_ids if c and isinstance(c, str)})
+    if not ids:
+        return
+    try:
+        versiones = await _subir_versiones(ids)
+        await _guardar(ids, await _calcular_visitas(ids), versiones)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron actualizar las visitas de {ids}: {e}")
+
+
+# ============================================================
+# LECTURA
+# ============================================================
+
+async def _calculadas(cliente_ids: List[str], sede_id: Optional[str]) -> List[Dict[str, Any]]:
+    """Las estadísticas de la sede calculadas en el momento (sin la proyección)."""
+    sede = sede_id or TODAS_LAS_SEDES
+    return [d for d in await _calcular_visitas(cliente_ids) if d["sede_id"] == sede]
+
+
+async def obtener_visitas(cliente_ids: Iterable[str], sede_id: Optional[str] = None) -> Dict[str, Dict]:
+    """Estadísticas por cliente_id en la sede (o en todas si sede_id es None)."""
+    cliente_ids = list(cliente_ids)
+    ids = [visitas_id(c, sede_id) for c in cliente_ids]
+    if not ids:
+        return {}
+    if not await visitas_al_dia():
+        return {d["cliente_id"]: d for d in await _calculadas(cliente_ids, sede_id)}
+    return {
+        d["cliente_id"]: d
+        async for d in collection_visitas.find({"_id": {"$in": ids}}, {"actualizado_en": 0, "version": 0})
+    }
+
+
+async def contar_inactivos(
+    cliente_ids: Iterable[str],
+    cliente_inactivo_desde: datetime,
+    dias: int,
+    sede_id: Optional[str] = None,
+) -> int:
+    """Cuántos de esos clientes no tienen citas desde hace más de `dias` días."""
+    cliente_ids = list(cliente_ids)
+    ids = [visitas_id(c, sede_id) for c in cliente_ids]
+    if not ids:
+        return 0
+    if not await visitas_al_dia():
+        filtro = filtro_ultima_cita(cliente_inactivo_desde, dias)
+        inactivo = (lambda u: u < filtro["$lt"]) if "$lt" in filtro else (lambda u: u <= filtro["$lte"])
+        return sum(1 for d in await _calculadas(cliente_ids, sede_id) if d["ultima_cita"] and inactivo(d["ultima_cita"]))
+    return await collection_visitas.count_documents({
+        "_id": {"$in": ids},
+        "ultima_cita": filtro_ultima_cita(cliente_inactivo_desde, dias),
+    })
+
+
+# ============================================================
+# RECONSTRUCCIÓN (rollup y backfill)
+# ============================================================
+
+async def reconstruir_visitas(
+    lote: int = LOTE_CLIENTES, citas=None, ventas=None, visitas=None
+) -> Dict[str, int]:
+    """
+    Recalcula las estadísticas de todos los clientes con citas o ventas.
+    Las colecciones son las de la app salvo que se indiquen (benchmark).
+    """
+    citas = collection_citas if citas is None else citas
+    ventas = collection_sales if ventas is None else ventas
+    visitas = collection_visitas if visitas is None else visitas
+    inicio = datetime.utcnow()
+    vistos: set = set()
+    pendientes: List[str] = []
+    conteo = {"clientes": 0, "documentos": 0, "borrados": 0}
+
+    async def _procesar() -> None:
+        versiones = await _subir_versiones(pendientes, visitas)
+        docs = await _calcular_visitas(pendientes, citas, ventas)
+        await _guardar(pendientes, docs, versiones, visitas)
+        conteo["clientes"] += len(pendientes)
+        conteo["documentos"] += len(docs)
+        pendientes.clear()
+
+    for coleccion in (citas, ventas):
+        cursor = coleccion.aggregate([
+            {"$match": {"cliente_id": {"$type": "string"}}},
+            {"$group": {"_id": "$cliente_id"}},
+        ], allowDiskUse=True)
+        async for g in cursor:
+            if g["_id"] in vistos:
+                continue
+            vistos.add(g["_id"])
+            pendientes.append(g["_id"])
+            if len(pendientes) >= lote:
+                await _procesar()
+    if pendientes:
+        await _procesar()
+
+    # Clientes que ya no tienen citas ni ventas
+    resultado = await visitas.delete_many({"actualizado_en": {"$lt": inicio}})
+    conteo["borrados"] = resultado.deleted_count
+    logger.info(f"✅ Estadísticas de visitas reconstruidas: {conteo}")
+    return conteo
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args == ["--rebuild"]:
+        print(asyncio.run(reconstruir_visitas()))
+    else:
+        print("Uso:\n"
+              "  python -m app.analytics.visitas_clientes --rebuild")
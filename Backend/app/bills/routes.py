@@ -10,6 +10,9 @@ from pydantic import BaseModel, Field
 from app.database.mongo import collection_giftcards
 from app.giftcards.routes_giftcards import _estado_giftcard
 from app.cash.utils_cash import fecha_a_datetime
+from app.cash.resumen_diario import invalidar_por_pagos
+from app.analytics.hechos_diarios import invalidar_hechos
+from app.analytics.visitas_clientes import actualizar_visitas_cliente
 from app.utils.timezone import today_str, today
 from app.bills.alegra_integration import emit_invoice_to_alegra, initialize_manual_electronic_status
 
@@ -451,6 +454,11 @@ async def facturar_cita_o_venta(
         )
         print("✅ Cita actualizada")
 
+    # La cita facturada sale del cálculo de citas y entra como venta
+    await invalidar_por_pagos(sede_id, historial_pagos, fecha_actual)
+    await invalidar_hechos(sede_id, fecha_actual, documento.get("fecha"), documento.get("fecha_pago"))
+    await actualizar_visitas_cliente(cliente_id)
+
     # ====================================
     # 🔟 CREAR FACTURA EN INVOICES
     # ====================================
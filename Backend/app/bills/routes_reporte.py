@@ -28,13 +28,11 @@ from fastapi import APIRouter, HTTPException, Depends, Query
 from fastapi.responses import StreamingResponse
 from datetime import datetime
 from typing import Optional
-import io
 
-from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
 
 from app.auth.routes import get_current_user
+from app.utils.excel_stream import LibroStream, HojaStream, stream_xlsx, MEDIA_TYPE_XLSX
 from app.database.mongo import (
     collection_sales,
     collection_citas,
@@ -52,7 +50,7 @@ from app.scheduling.submodules.quotes.controllers import (
     crear_html_correo_ficha,
     enviar_correo_con_pdf,
     descargar_imagen,           # ← agregar
-    comprimir_imagen_para_pdf,  # ← agregar
+    comprimir_imagen_async,
 )
 
 router = APIRouter()
@@ -75,50 +73,66 @@ DAT = "DD/MM/YYYY"
  
  
 # ── Helpers de estilo ─────────────────────────────────────────────
- 
+# Estilos con nombre: uno por combinación usada, registrado una vez
+# por libro; las celdas solo guardan la referencia.
+
+_FMT_NOMBRE = {None: "gen", MNY: "mny", PCT: "pct", DAT: "dat"}
+
+
 def _bord():
     s = Side(style="thin", color="D0D0D0")
     return Border(top=s, bottom=s, left=s, right=s)
- 
- 
-def _cell(ws, row, col, val, bg=_BLANCO, fg=_NEGRO, bold=False,
+
+
+def _estilo(libro: LibroStream, bg=_BLANCO, fg=_NEGRO, bold=False,
+            fmt=None, align="left") -> str:
+    nombre = f"com_{bg}_{fg}_{'b' if bold else 'n'}_{_FMT_NOMBRE[fmt]}_{align}"
+    if not libro.tiene_estilo(nombre):
+        libro.estilo(
+            nombre,
+            font=Font(name="Arial", size=9, bold=bold, color=fg),
+            fill=PatternFill("solid", fgColor=bg),
+            alignment=Alignment(horizontal=align, vertical="center"),
+            border=_bord(),
+            **({"number_format": fmt} if fmt else {}),
+        )
+    return nombre
+
+
+def _cell(h: HojaStream, val, bg=_BLANCO, fg=_NEGRO, bold=False,
           fmt=None, align="left"):
-    c = ws.cell(row=row, column=col, value=val)
-    c.font      = Font(name="Arial", size=9, bold=bold, color=fg)
-    c.fill      = PatternFill("solid", fgColor=bg)
-    c.alignment = Alignment(horizontal=align, vertical="center")
-    c.border    = _bord()
-    if fmt:
-        c.number_format = fmt
-    return c
- 
- 
-def _banner(ws, row, text, bg, ncols, height=36):
-    ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=ncols)
-    c = ws.cell(row=row, column=1, value=text)
-    c.font      = Font(name="Arial", size=14, bold=True, color=_BLANCO)
-    c.fill      = PatternFill("solid", fgColor=bg)
-    c.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[row].height = height
- 
- 
-def _meta(ws, row, text, ncols, color="555555", height=18):
-    ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=ncols)
-    c = ws.cell(row=row, column=1, value=text)
-    c.font      = Font(name="Arial", size=10, color=color)
-    c.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[row].height = height
- 
- 
-def _hdr(ws, row, col, text, bg):
-    c = ws.cell(row=row, column=col, value=text)
-    c.font      = Font(name="Arial", size=9, bold=True, color=_BLANCO)
-    c.fill      = PatternFill("solid", fgColor=bg)
-    c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    c.border    = _bord()
-    return c
- 
- 
+    return h.celda(val, _estilo(h.libro, bg, fg, bold, fmt, align))
+
+
+def _banner(h: HojaStream, text, bg, ncols, height=36):
+    estilo = h.libro.estilo(
+        f"com_banner_{bg}",
+        font=Font(name="Arial", size=14, bold=True, color=_BLANCO),
+        fill=PatternFill("solid", fgColor=bg),
+        alignment=Alignment(horizontal="center", vertical="center"),
+    )
+    h.combinada(text, ncols, estilo, alto=height)
+
+
+def _meta(h: HojaStream, text, ncols, color="555555", height=18):
+    estilo = h.libro.estilo(
+        f"com_meta_{color}",
+        font=Font(name="Arial", size=10, color=color),
+        alignment=Alignment(horizontal="center", vertical="center"),
+    )
+    h.combinada(text, ncols, estilo, alto=height)
+
+
+def _hdr(h: HojaStream, text, bg):
+    estilo = h.libro.estilo(
+        f"com_hdr_{bg}",
+        font=Font(name="Arial", size=9, bold=True, color=_BLANCO),
+        fill=PatternFill("solid", fgColor=bg),
+        alignment=Alignment(horizontal="center", vertical="center", wrap_text=True),
+        border=_bord(),
+    )
+    return h.celda(text, estilo)
+
 # ── Helpers de lógica ─────────────────────────────────────────────
  
 def _parse_fecha(valor: str) -> datetime:
@@ -233,7 +247,7 @@ async def reporte_comisiones(
             pid_a_nombre[pid]            = nombre
             nombre_a_pid[nombre.lower()] = pid
  
-    # ── Obtener ventas del período ────────────────────────────────
+    # ── Ventas del período ────────────────────────────────────────
     # Citas: se filtra por fecha de la cita (agenda), no por fecha_pago
     citas_docs = await collection_citas.find(
         {
@@ -243,39 +257,49 @@ async def reporte_comisiones(
         },
         {"_id": 1, "fecha": 1},
     ).to_list(None)
- 
+
     cita_id_a_fecha: dict = {}
     cita_ids_str = []
     for c in citas_docs:
         oid = str(c["_id"])
         cita_ids_str.append(oid)
         cita_id_a_fecha[oid] = c.get("fecha", "")
- 
-    ventas_citas = []
-    if cita_ids_str:
-        ventas_citas = await collection_sales.find(
+
+    # Las ventas se recorren dos veces con cursores (niveles de
+    # comisión y luego filas del Excel) en vez de cargarlas con to_list()
+    async def ventas_periodo(proyeccion: Optional[dict] = None):
+        if cita_ids_str:
+            async for v in collection_sales.find(
+                {
+                    "sede_id":     sede_id,
+                    "tipo_origen": "cita",
+                    "origen_id":   {"$in": cita_ids_str},
+                },
+                proyeccion,
+            ):
+                yield v
+        async for v in collection_sales.find(
             {
-                "sede_id":     sede_id,
-                "tipo_origen": "cita",
-                "origen_id":   {"$in": cita_ids_str},
-            }
-        ).to_list(None)
- 
-    ventas_directas = await collection_sales.find(
-        {
-            "sede_id":        sede_id,
-            "estado_factura": "facturado",
-            "tipo_origen":    {"$ne": "cita"},
-            "fecha_pago":     {"$gte": dt_desde, "$lte": dt_hasta},
-        }
-    ).to_list(None)
- 
-    ventas = ventas_citas + ventas_directas
- 
+                "sede_id":        sede_id,
+                "estado_factura": "facturado",
+                "tipo_origen":    {"$ne": "cita"},
+                "fecha_pago":     {"$gte": dt_desde, "$lte": dt_hasta},
+            },
+            proyeccion,
+        ):
+            yield v
+
     # ── Nombres que no son personas reales ───────────────────────
     nombres_sede = {sede_nombre.strip().lower(), sede_id.strip().lower()}
     ROLES_PROPIOS = {"recepcionista", "call_center", "admin_sede"}
- 
+
+    TIPO_PERMITIDO = {
+        "servicios": {"servicio"},
+        "productos":  {"producto"},
+        "ambos":      {"servicio", "producto"},
+    }
+    tipos_validos = TIPO_PERMITIDO[tipo_item]
+
     # ── Helper: resolver responsable de productos en una venta ────
     def _responsable_producto(v: dict, item: dict, responsable_srv: Optional[str]) -> Optional[str]:
         """
@@ -288,42 +312,48 @@ async def reporte_comisiones(
         agr_rol   = str(item.get("agregado_por_rol", "") or "")
         agr_email = str(item.get("agregado_por_email", "") or "").strip()
         tipo_origen = v.get("tipo_origen", v.get("tipo_venta", ""))
- 
+
         if agr_rol in ROLES_PROPIOS and agr_email:
             return resolver_email(agr_email)
- 
+
         vendido_raw = str(v.get("vendido_por", "") or "").strip()
         vendido     = resolver_email(vendido_raw)
         local_venta = str(v.get("local", "") or "").strip().lower()
         if vendido.strip().lower() in nombres_sede or vendido.strip().lower() == local_venta:
             vendido = ""
- 
+
         if tipo_origen != "cita" and vendido and "," not in vendido:
             return vendido
- 
+
         return responsable_srv  # fallback: estilista de la cita
- 
+
     # ══════════════════════════════════════════════════════════════
     # PASO 1: contar unidades de productos por persona (por nombre
-    # normalizado) para determinar el nivel de comisión.
+    # normalizado) para determinar el nivel de comisión, y los ítems
+    # que irán al Excel (el encabezado muestra el total).
     # Se agrupa por nombre resuelto, sin importar si tiene o no
     # profesional_id, para cubrir todos los casos edge.
     # ══════════════════════════════════════════════════════════════
     prod_unidades: dict[str, int] = {}  # nombre_norm → total unidades
- 
-    for v in ventas:
-        tipo_origen  = v.get("tipo_origen", v.get("tipo_venta", ""))
+    total_items = 0
+
+    async for v in ventas_periodo({
+        "profesional_id": 1, "profesional_nombre": 1,
+        "vendido_por": 1, "facturado_por": 1, "local": 1,
+        "items.tipo": 1, "items.cantidad": 1,
+        "items.agregado_por_rol": 1, "items.agregado_por_email": 1,
+    }):
         pid_doc      = str(v.get("profesional_id", "") or "")
         vendido_raw  = str(v.get("vendido_por",   "") or "").strip()
         facturado_raw = str(v.get("facturado_por", "") or "").strip()
         local_venta  = str(v.get("local", "") or "").strip().lower()
- 
+
         vendido  = resolver_email(vendido_raw)
         facturado = resolver_email(facturado_raw)
- 
+
         if vendido.strip().lower() in nombres_sede or vendido.strip().lower() == local_venta:
             vendido = ""
- 
+
         # Resolver responsable de servicio (para fallback de producto en cita)
         if pid_doc.startswith("ES-"):
             nom_srv = pid_a_nombre.get(pid_doc) or v.get("profesional_nombre", "") or pid_doc
@@ -333,37 +363,31 @@ async def reporte_comisiones(
             nom_srv = facturado
         else:
             nom_srv = None
- 
+
         for item in v.get("items", []):
+            if item.get("tipo", "") in tipos_validos:
+                total_items += 1
             if item.get("tipo") != "producto":
                 continue
- 
+
             resp_prod = _responsable_producto(v, item, nom_srv)
             if not resp_prod:
                 continue
- 
+
             key_n = resp_prod.strip().lower()
             cant  = int(item.get("cantidad", 1))
             prod_unidades[key_n] = prod_unidades.get(key_n, 0) + cant
- 
+
     # Mapa nombre_norm → tasa de comisión y etiqueta de nivel
     com_rate_map: dict[str, float] = {k: _tier_rate(v) for k, v in prod_unidades.items()}
     nivel_map:    dict[str, str]   = {k: _nivel_label(v) for k, v in prod_unidades.items()}
- 
+
     # ══════════════════════════════════════════════════════════════
-    # PASO 2: construir filas de detalle con comisiones de productos
+    # PASO 2: filas de detalle con comisiones de productos
     # recalculadas según el nivel alcanzado por cada persona.
+    # Se generan venta por venta mientras se escribe el Excel.
     # ══════════════════════════════════════════════════════════════
-    detalles = []
- 
-    TIPO_PERMITIDO = {
-        "servicios": {"servicio"},
-        "productos":  {"producto"},
-        "ambos":      {"servicio", "producto"},
-    }
-    tipos_validos = TIPO_PERMITIDO[tipo_item]
- 
-    for v in ventas:
+    def detalles_venta(v: dict):
         tipo_origen   = v.get("tipo_origen", v.get("tipo_venta", ""))
         pid_v         = str(v.get("profesional_id", "") or "")
         pnombre_v     = v.get("profesional_nombre", "") or ""
@@ -373,12 +397,11 @@ async def reporte_comisiones(
         comp          = v.get("numero_comprobante", "") or ""
         fecha_v       = v.get("fecha_pago")
         local_venta   = str(v.get("local", "") or "").strip().lower()
- 
+
         vendido  = resolver_email(vendido_raw)
-        facturado = resolver_email(facturado_raw)
         if vendido.strip().lower() in nombres_sede or vendido.strip().lower() == local_venta:
             vendido = ""
- 
+
         # Responsable principal (servicios / fallback productos en cita)
         if tipo_origen == "cita":
             responsable_srv = pnombre_v or pid_a_nombre.get(pid_v, pid_v) or ""
@@ -396,15 +419,15 @@ async def reporte_comisiones(
             else:
                 responsable_srv = resolver_email(facturado_raw)
             tipo_label = "Venta directa"
- 
+
         for item in v.get("items", []):
             tipo_i = item.get("tipo", "")
             if tipo_i not in tipos_validos:
                 continue
- 
+
             sub  = float(item.get("subtotal", 0))
             cant = int(item.get("cantidad", 1))
- 
+
             if tipo_i == "servicio":
                 # Comisión de servicio: se respeta la almacenada en BD
                 com_raw = float(item.get("comision", 0))
@@ -416,7 +439,7 @@ async def reporte_comisiones(
                 com = com_raw
                 responsable = responsable_srv
                 nivel_txt   = ""
- 
+
             else:  # producto
                 responsable = _responsable_producto(v, item, responsable_srv) or ""
                 key_n       = responsable.strip().lower()
@@ -424,8 +447,8 @@ async def reporte_comisiones(
                 com         = round(sub * rate, 2)
                 pct         = rate * 100
                 nivel_txt   = nivel_map.get(key_n, "Nv.1 (2%)")
- 
-            detalles.append({
+
+            yield {
                 "fecha":       fecha_v,
                 "comprobante": comp,
                 "tipo":        tipo_label,
@@ -439,37 +462,37 @@ async def reporte_comisiones(
                 "pct":         pct / 100,
                 "comision":    com,
                 "cliente":     cliente,
-            })
- 
-    # ════════════════════════════════════════════════════════════════
-    # EXCEL — una sola hoja: Detalle de transacciones
-    # ════════════════════════════════════════════════════════════════
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Detalle de transacciones"
-    ws.sheet_view.showGridLines = False
-    ws.freeze_panes = "A5"
-    N = 13  # columnas
- 
-    # Subtítulo de filtro aplicado
-    filtro_label = {
-        "servicios": "Solo servicios",
-        "productos":  "Solo productos",
-        "ambos":      "Servicios y productos",
-    }[tipo_item]
- 
-    _banner(ws, 1, "RIZOS FELICES — DETALLE DE TRANSACCIONES", _VERDE, N)
-    _meta(ws, 2, f"Sede: {sede_nombre}", N, color=_VERDE_M)
-    _meta(
-        ws, 3,
-        f"Período: {desde_display}  →  {hasta_display}   ·   "
-        f"{filtro_label}   ·   "
-        f"{len(detalles)} ítems   ·   "
-        f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
-        N, color="666666", height=16,
+            }
+
+    def escribir(libro: LibroStream, ventas):
+        detalles = (det for v in libro.iterar(ventas) for det in detalles_venta(v))
+        _escribir_hoja_comisiones(
+            libro, detalles, total_items, sede_nombre,
+            desde_display, hasta_display, tipo_item,
+        )
+
+    # ── Respuesta ─────────────────────────────────────────────────
+    nombre_archivo = (
+        f"comisiones_{sede_nombre.replace(' ', '_')}_"
+        f"{dt_desde.strftime('%Y%m%d')}_"
+        f"{dt_hasta.strftime('%Y%m%d')}.xlsx"
     )
-    ws.row_dimensions[4].height = 38
- 
+    return StreamingResponse(
+        stream_xlsx(escribir, ventas_periodo()),
+        media_type=MEDIA_TYPE_XLSX,
+        headers={"Content-Disposition": f"attachment; filename={nombre_archivo}"},
+    )
+
+
+# ════════════════════════════════════════════════════════════════
+# EXCEL — una sola hoja: Detalle de transacciones
+# ════════════════════════════════════════════════════════════════
+
+def _escribir_hoja_comisiones(libro: LibroStream, detalles, total_items: int,
+                              sede_nombre: str, desde_display: str,
+                              hasta_display: str, tipo_item: str) -> None:
+    N = 13  # columnas
+
     # Encabezados de columna
     h_cols = [
         ("Fecha",                11),
@@ -486,118 +509,94 @@ async def reporte_comisiones(
         ("Comisión (COP)",       15),
         ("Cliente",              22),
     ]
-    for ci, (t, w) in enumerate(h_cols, start=1):
-        ws.column_dimensions[get_column_letter(ci)].width = w
-        _hdr(ws, 4, ci, t, _VERDE_M)
- 
+    h = libro.hoja(
+        "Detalle de transacciones",
+        anchos=[w for _, w in h_cols],
+        congelar="A5",
+        cuadricula=False,
+    )
+
+    # Subtítulo de filtro aplicado
+    filtro_label = {
+        "servicios": "Solo servicios",
+        "productos":  "Solo productos",
+        "ambos":      "Servicios y productos",
+    }[tipo_item]
+
+    _banner(h, "RIZOS FELICES — DETALLE DE TRANSACCIONES", _VERDE, N)
+    _meta(h, f"Sede: {sede_nombre}", N, color=_VERDE_M)
+    _meta(
+        h,
+        f"Período: {desde_display}  →  {hasta_display}   ·   "
+        f"{filtro_label}   ·   "
+        f"{total_items} ítems   ·   "
+        f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+        N, color="666666", height=16,
+    )
+    h.fila(*(_hdr(h, t, _VERDE_M) for t, _ in h_cols), alto=38)
+
     TIPO_COLOR = {
         "Cita":          ("EFF6FF", "1E40AF"),
         "Venta directa": ("F0FDF4", "166534"),
     }
     ITEM_BG = {"Servicio": "FEFCE8", "Producto": _BLANCO}
- 
-    r = 5
+
     for i, det in enumerate(detalles):
         bg = _GRIS_B if i % 2 == 0 else _BLANCO
- 
-        _cell(ws, r, 1, det["fecha"],       bg=bg, fmt=DAT, align="center")
-        _cell(ws, r, 2, det["comprobante"], bg=bg,          align="center")
- 
+
         # Columna Tipo — color según cita / venta directa
         bg_t, fg_t = TIPO_COLOR.get(det["tipo"], (_BLANCO, _NEGRO))
-        ct = ws.cell(row=r, column=3, value=det["tipo"])
-        ct.font      = Font(name="Arial", size=9, bold=True, color=fg_t)
-        ct.fill      = PatternFill("solid", fgColor=bg_t)
-        ct.alignment = Alignment(horizontal="center", vertical="center")
-        ct.border    = _bord()
- 
-        _cell(ws, r, 4, det["responsable"], bg=bg)
- 
-        # Columna Tipo ítem — color diferenciado
-        bg_i = ITEM_BG.get(det["tipo_item"], _BLANCO)
-        ci_c = ws.cell(row=r, column=5, value=det["tipo_item"])
-        ci_c.font      = Font(name="Arial", size=9, color=_NEGRO)
-        ci_c.fill      = PatternFill("solid", fgColor=bg_i)
-        ci_c.alignment = Alignment(horizontal="center", vertical="center")
-        ci_c.border    = _bord()
- 
+
         # Columna Nivel comisión (solo productos; vacío para servicios)
         bg_nv = "EDE9FE" if det["nivel_com"] else bg   # lavanda suave para productos
         fg_nv = "5B21B6" if det["nivel_com"] else _NEGRO
-        c_nv  = ws.cell(row=r, column=6, value=det["nivel_com"] or "—")
-        c_nv.font      = Font(name="Arial", size=9, bold=bool(det["nivel_com"]), color=fg_nv)
-        c_nv.fill      = PatternFill("solid", fgColor=bg_nv)
-        c_nv.alignment = Alignment(horizontal="center", vertical="center")
-        c_nv.border    = _bord()
- 
-        _cell(ws, r, 7,  det["item_nom"], bg=bg)
-        _cell(ws, r, 8,  det["cant"],     bg=bg, fmt=INT, align="center")
-        _cell(ws, r, 9,  det["precio"],   bg=bg, fmt=MNY, align="right")
-        _cell(ws, r, 10, det["subtotal"], bg=bg, fmt=MNY, align="right")
- 
+
         # % comisión — ámbar si es 0 pero hay comisión (dato raro en BD)
         bg_pct = _AMBAR if det["pct"] == 0 and det["comision"] > 0 else bg
-        _cell(ws, r, 11, det["pct"],      bg=bg_pct, fmt=PCT, align="center")
- 
+
         # Comisión — verde si > 0
         bg_com = _VERDE_L if det["comision"] > 0 else bg
         fg_com = _VERDE_M if det["comision"] > 0 else _NEGRO
-        _cell(ws, r, 12, det["comision"], bg=bg_com, fg=fg_com,
-              bold=det["comision"] > 0, fmt=MNY, align="right")
- 
-        _cell(ws, r, 13, det["cliente"], bg=bg)
-        r += 1
- 
+
+        h.fila(
+            _cell(h, det["fecha"],       bg=bg, fmt=DAT, align="center"),
+            _cell(h, det["comprobante"], bg=bg,          align="center"),
+            _cell(h, det["tipo"],        bg=bg_t, fg=fg_t, bold=True, align="center"),
+            _cell(h, det["responsable"], bg=bg),
+            _cell(h, det["tipo_item"],   bg=ITEM_BG.get(det["tipo_item"], _BLANCO), align="center"),
+            _cell(h, det["nivel_com"] or "—", bg=bg_nv, fg=fg_nv,
+                  bold=bool(det["nivel_com"]), align="center"),
+            _cell(h, det["item_nom"], bg=bg),
+            _cell(h, det["cant"],     bg=bg, fmt=INT, align="center"),
+            _cell(h, det["precio"],   bg=bg, fmt=MNY, align="right"),
+            _cell(h, det["subtotal"], bg=bg, fmt=MNY, align="right"),
+            _cell(h, det["pct"],      bg=bg_pct, fmt=PCT, align="center"),
+            _cell(h, det["comision"], bg=bg_com, fg=fg_com,
+                  bold=det["comision"] > 0, fmt=MNY, align="right"),
+            _cell(h, det["cliente"], bg=bg),
+        )
+
     # Fila de totales al final
-    ws.row_dimensions[r].height = 20
-    for ci in range(1, N + 1):
-        c = ws.cell(row=r, column=ci)
-        c.fill   = PatternFill("solid", fgColor="E8F5E9")
-        c.font   = Font(name="Arial", size=9, bold=True, color=_VERDE_M)
-        c.border = _bord()
-    ws.cell(row=r, column=1, value="TOTALES").alignment = Alignment(
-        horizontal="left", vertical="center"
-    )
-    ws.cell(row=r, column=1).fill = PatternFill("solid", fgColor="E8F5E9")
-    ws.cell(row=r, column=1).font = Font(name="Arial", size=9, bold=True, color=_VERDE_M)
+    r = h.fila_actual
+    tot = {"bg": "E8F5E9", "fg": _VERDE_M, "bold": True}
+    fila_tot = [_cell(h, None, **tot) for _ in range(N)]
+    fila_tot[0] = _cell(h, "TOTALES", **tot)
     for ci, cl in [(10, "J"), (12, "L")]:
-        ws.cell(row=r, column=ci, value=f"=SUM({cl}5:{cl}{r - 1})").number_format = MNY
-        ws.cell(row=r, column=ci).fill      = PatternFill("solid", fgColor="E8F5E9")
-        ws.cell(row=r, column=ci).font      = Font(name="Arial", size=9, bold=True, color=_VERDE_M)
-        ws.cell(row=r, column=ci).border    = _bord()
-        ws.cell(row=r, column=ci).alignment = Alignment(horizontal="right", vertical="center")
- 
+        fila_tot[ci - 1] = _cell(h, f"=SUM({cl}5:{cl}{r - 1})", fmt=MNY, align="right", **tot)
+    h.fila(*fila_tot, alto=20)
+
     # ── Nota al pie ───────────────────────────────────────────────
-    r += 1
-    ws.merge_cells(start_row=r, start_column=1, end_row=r, end_column=N)
     nota = (
         "NOTA: Comisiones de productos calculadas por niveles según unidades vendidas en el período "
         "(Nv.1 ≤5 uds → 2 % · Nv.2 6-10 → 3 % · Nv.3 11-20 → 4 % · Nv.4 >20 → 5 %). "
         "Comisiones de servicios respetan el porcentaje registrado en la venta."
     )
-    ws.cell(row=r, column=1, value=nota).font = Font(
-        name="Arial", size=8, italic=True, color="888888"
-    )
-    ws.cell(row=r, column=1).alignment = Alignment(
-        horizontal="left", vertical="center", wrap_text=True
-    )
-    ws.row_dimensions[r].height = 32
- 
-    # ── Respuesta ─────────────────────────────────────────────────
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
- 
-    nombre_archivo = (
-        f"comisiones_{sede_nombre.replace(' ', '_')}_"
-        f"{dt_desde.strftime('%Y%m%d')}_"
-        f"{dt_hasta.strftime('%Y%m%d')}.xlsx"
-    )
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={nombre_archivo}"},
+    estilo_nota = libro.estilo(
+        "com_nota",
+        font=Font(name="Arial", size=8, italic=True, color="888888"),
+        alignment=Alignment(horizontal="left", vertical="center", wrap_text=True),
     )
+    h.combinada(nota, N, estilo_nota, alto=32)
 
 @router.post("/reparar-fotos/{ficha_id}", response_model=dict)
 async def reparar_fotos_ficha(
@@ -651,7 +650,7 @@ async def reparar_fotos_ficha(
                 continue
 
             # Convertir con la misma función que ya tienes
-            jpeg_buf = comprimir_imagen_para_pdf(buf, max_px=2000, quality=85)
+            jpeg_buf = await comprimir_imagen_async(buf, max_px=2000, quality=85)
             if not jpeg_buf:
                 print(f"  ⚠️ No se pudo convertir: {url}")
                 nuevas_urls.append(url)
@@ -728,10 +727,8 @@ GET /reportes/citas/excel?sede_id=SD-40203&fecha_inicio=2026-03-01&fecha_fin=202
 from fastapi import FastAPI, Query, HTTPException
 from fastapi.responses import StreamingResponse
 from datetime import date, datetime
-from io import BytesIO
-import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+from app.utils.excel_stream import construir_xlsx
 
 # ── Conexión real a MongoDB ────────────────────────────────────────────────────
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -776,28 +773,51 @@ def thin_border():
     s = Side(style="thin", color=COLOR_BORDER)
     return Border(left=s, right=s, top=s, bottom=s)
 
-def hc(ws, row, col, value, bg=COLOR_HEADER, fg="FFFFFF", bold=True, size=10, wrap=False):
-    cell = ws.cell(row=row, column=col, value=value)
-    cell.font = Font(name="Arial", bold=bold, color=fg, size=size)
-    cell.fill = PatternFill("solid", fgColor=bg)
-    cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=wrap)
-    cell.border = thin_border()
-    return cell
-
-def dc(ws, row, col, value, bold=False, center=False, bg=None, fg="000000", fmt=None, wrap=False):
-    cell = ws.cell(row=row, column=col, value=value)
-    cell.font = Font(name="Arial", bold=bold, color=fg, size=9)
-    cell.alignment = Alignment(horizontal="center" if center else "left", vertical="center", wrap_text=wrap)
-    if bg:
-        cell.fill = PatternFill("solid", fgColor=bg)
-    if fmt:
-        cell.number_format = fmt
-    cell.border = thin_border()
-    return cell
-
-def estado_c(ws, row, col, estado, catalog):
+# Estilos con nombre por combinación, registrados una vez por libro
+
+def hc(h, value, bg=COLOR_HEADER, fg="FFFFFF", bold=True, size=10, wrap=False):
+    nombre = f"citas_hc_{bg}_{fg}_{int(bold)}_{size}_{int(wrap)}"
+    if not h.libro.tiene_estilo(nombre):
+        h.libro.estilo(
+            nombre,
+            font=Font(name="Arial", bold=bold, color=fg, size=size),
+            fill=PatternFill("solid", fgColor=bg),
+            alignment=Alignment(horizontal="center", vertical="center", wrap_text=wrap),
+            border=thin_border(),
+        )
+    return h.celda(value, nombre)
+
+def dc(h, value, bold=False, center=False, bg=None, fg="000000", fmt=None, wrap=False):
+    nombre = f"citas_dc_{bg}_{fg}_{int(bold)}_{int(center)}_{fmt}_{int(wrap)}"
+    if not h.libro.tiene_estilo(nombre):
+        extra = {}
+        if bg:
+            extra["fill"] = PatternFill("solid", fgColor=bg)
+        if fmt:
+            extra["number_format"] = fmt
+        h.libro.estilo(
+            nombre,
+            font=Font(name="Arial", bold=bold, color=fg, size=9),
+            alignment=Alignment(horizontal="center" if center else "left", vertical="center", wrap_text=wrap),
+            border=thin_border(),
+            **extra,
+        )
+    return h.celda(value, nombre)
+
+def estado_c(h, estado, catalog):
     bg, fg = catalog.get(estado, ("FFFFFF", "000000"))
-    return dc(ws, row, col, estado.replace("_", " ").upper(), bold=True, center=True, bg=bg, fg=fg)
+    return dc(h, estado.replace("_", " ").upper(), bold=True, center=True, bg=bg, fg=fg)
+
+def titulo_c(h, value, ncols, bg, size, alto, italic=False):
+    nombre = f"citas_titulo_{bg}_{size}_{int(italic)}"
+    if not h.libro.tiene_estilo(nombre):
+        h.libro.estilo(
+            nombre,
+            font=Font(name="Arial", bold=not italic, italic=italic, size=size, color="FFFFFF"),
+            fill=PatternFill("solid", fgColor=bg),
+            alignment=Alignment(horizontal="center", vertical="center"),
+        )
+    h.combinada(value, ncols, nombre, alto=alto)
 
 def cop(v):
     return int(v) if v else 0
@@ -820,89 +840,64 @@ def parse_fecha_pago(fp):
 
 
 # ── Constructores de hojas ─────────────────────────────────────────────────────
+# Cada hoja recorre su propia fuente (lista o cursor de motor) y
+# escribe las filas en orden sobre una hoja write-only.
 
-def build_hoja_citas(ws, citas, sede_nombre, f_ini, f_fin):
-    ws.title = "Citas"
-    ws.sheet_view.showGridLines = False
-
-    ws.merge_cells("A1:P1")
-    t = ws["A1"]
-    t.value = f"REPORTE DE CITAS — {sede_nombre.upper()}"
-    t.font = Font(name="Arial", bold=True, size=13, color="FFFFFF")
-    t.fill = PatternFill("solid", fgColor=COLOR_HEADER)
-    t.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[1].height = 28
-
-    ws.merge_cells("A2:P2")
-    s = ws["A2"]
-    s.value = f"Período: {f_ini}  →  {f_fin}    |    Generado: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    s.font = Font(name="Arial", size=9, color="FFFFFF", italic=True)
-    s.fill = PatternFill("solid", fgColor=COLOR_ACCENT)
-    s.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[2].height = 16
-    ws.row_dimensions[3].height = 4
-
+def build_hoja_citas(libro, citas, sede_nombre, f_ini, f_fin):
     COLS = [
         ("#",              5),  ("Fecha",       11), ("Inicio",     9),  ("Fin",        9),
         ("Cliente",       26),  ("Teléfono",    14), ("Email",     28),  ("Profesional",16),
         ("Servicio",      32),  ("Dur. (min)",  11), ("Estado",    13),  ("Abono",      13),
         ("Total",         13),  ("Saldo",       13), ("Pago",      13),  ("Notas",      30),
     ]
-    for i, (label, width) in enumerate(COLS, 1):
-        hc(ws, 4, i, label, bg=COLOR_SUBHEADER, size=9, wrap=True)
-        ws.column_dimensions[get_column_letter(i)].width = width
-    ws.row_dimensions[4].height = 30
+    h = libro.hoja("Citas", anchos=[w for _, w in COLS], congelar="A5", cuadricula=False)
+
+    titulo_c(h, f"REPORTE DE CITAS — {sede_nombre.upper()}", 16, COLOR_HEADER, 13, 28)
+    titulo_c(
+        h,
+        f"Período: {f_ini}  →  {f_fin}    |    Generado: {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+        16, COLOR_ACCENT, 9, 16, italic=True,
+    )
+    h.vacia(alto=4)
+    h.fila(*(hc(h, label, bg=COLOR_SUBHEADER, size=9, wrap=True) for label, _ in COLS), alto=30)
 
-    for i, c in enumerate(citas, 1):
-        r = i + 4
+    for i, c in enumerate(libro.iterar(citas), 1):
         bg = COLOR_ALT_ROW if i % 2 == 0 else "FFFFFF"
-        ws.row_dimensions[r].height = 18
-        dc(ws, r, 1,  i,                              center=True, bg=bg)
-        dc(ws, r, 2,  c.get("fecha"),                 center=True, bg=bg)
-        dc(ws, r, 3,  c.get("hora_inicio"),           center=True, bg=bg)
-        dc(ws, r, 4,  c.get("hora_fin"),              center=True, bg=bg)
-        dc(ws, r, 5,  c.get("cliente_nombre"),        bg=bg)
-        dc(ws, r, 6,  c.get("cliente_telefono"),      center=True, bg=bg)
-        dc(ws, r, 7,  c.get("cliente_email"),         bg=bg)
-        dc(ws, r, 8,  c.get("profesional_nombre"),    bg=bg)
-        dc(ws, r, 9,  c.get("servicio_nombre"),       bg=bg, wrap=True)
-        dc(ws, r, 10, c.get("servicio_duracion"),     center=True, bg=bg)
-        estado_c(ws, r, 11, c.get("estado", ""),      ESTADO_COLORES)
-        dc(ws, r, 12, cop(c.get("abono")),            center=True, bg=bg, fmt='#,##0')
-        dc(ws, r, 13, cop(c.get("valor_total")),      center=True, bg=bg, fmt='#,##0')
-        dc(ws, r, 14, cop(c.get("saldo_pendiente")),  center=True, bg=bg, fmt='#,##0')
-        estado_c(ws, r, 15, c.get("estado_pago", ""), ESTADO_PAGO_COLORES)
-        dc(ws, r, 16, c.get("notas", ""),             bg=bg, wrap=True)
-
-    ws.freeze_panes = "A5"
-
-
-def build_hoja_detalle(ws, citas):
-    ws.title = "Servicios y Productos"
-    ws.sheet_view.showGridLines = False
-
-    ws.merge_cells("A1:K1")
-    t = ws["A1"]
-    t.value = "DETALLE DE SERVICIOS Y PRODUCTOS POR CITA"
-    t.font = Font(name="Arial", bold=True, size=12, color="FFFFFF")
-    t.fill = PatternFill("solid", fgColor=COLOR_HEADER)
-    t.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[1].height = 26
-    ws.row_dimensions[2].height = 4
+        h.fila(
+            dc(h, i,                              center=True, bg=bg),
+            dc(h, c.get("fecha"),                 center=True, bg=bg),
+            dc(h, c.get("hora_inicio"),           center=True, bg=bg),
+            dc(h, c.get("hora_fin"),              center=True, bg=bg),
+            dc(h, c.get("cliente_nombre"),        bg=bg),
+            dc(h, c.get("cliente_telefono"),      center=True, bg=bg),
+            dc(h, c.get("cliente_email"),         bg=bg),
+            dc(h, c.get("profesional_nombre"),    bg=bg),
+            dc(h, c.get("servicio_nombre"),       bg=bg, wrap=True),
+            dc(h, c.get("servicio_duracion"),     center=True, bg=bg),
+            estado_c(h, c.get("estado", ""),      ESTADO_COLORES),
+            dc(h, cop(c.get("abono")),            center=True, bg=bg, fmt='#,##0'),
+            dc(h, cop(c.get("valor_total")),      center=True, bg=bg, fmt='#,##0'),
+            dc(h, cop(c.get("saldo_pendiente")),  center=True, bg=bg, fmt='#,##0'),
+            estado_c(h, c.get("estado_pago", ""), ESTADO_PAGO_COLORES),
+            dc(h, c.get("notas", ""),             bg=bg, wrap=True),
+            alto=18,
+        )
+
 
+def build_hoja_detalle(libro, citas):
     COLS = [
         ("Fecha", 11), ("Hora", 9), ("Cliente", 26), ("Profesional", 16),
         ("Tipo", 11), ("Ítem", 36), ("Cant.", 7),
         ("Precio Unit.", 14), ("Subtotal", 14), ("Estado Cita", 13), ("# Comprobante", 16),
     ]
-    for i, (label, width) in enumerate(COLS, 1):
-        hc(ws, 3, i, label, bg=COLOR_SUBHEADER, size=9, wrap=True)
-        ws.column_dimensions[get_column_letter(i)].width = width
-    ws.row_dimensions[3].height = 28
+    h = libro.hoja("Servicios y Productos", anchos=[w for _, w in COLS], congelar="A4", cuadricula=False)
+
+    titulo_c(h, "DETALLE DE SERVICIOS Y PRODUCTOS POR CITA", 11, COLOR_HEADER, 12, 26)
+    h.vacia(alto=4)
+    h.fila(*(hc(h, label, bg=COLOR_SUBHEADER, size=9, wrap=True) for label, _ in COLS), alto=28)
 
-    row = 4
     alt = False
-    for c in citas:
+    for c in libro.iterar(citas):
         items = []
         for sv in c.get("servicios", []):
             items.append(("SERVICIO", sv.get("nombre"), sv.get("cantidad", 1),
@@ -913,80 +908,67 @@ def build_hoja_detalle(ws, citas):
         bg = COLOR_ALT_ROW if alt else "FFFFFF"
         alt = not alt
         for tipo, nombre, cant, precio, subtotal in items:
-            ws.row_dimensions[row].height = 16
             bg_t = "E8F4FD" if tipo == "SERVICIO" else "FFF8E1"
             fg_t = "0D47A1" if tipo == "SERVICIO" else "E65100"
-            dc(ws, row, 1,  c.get("fecha"),              center=True, bg=bg)
-            dc(ws, row, 2,  c.get("hora_inicio"),        center=True, bg=bg)
-            dc(ws, row, 3,  c.get("cliente_nombre"),     bg=bg)
-            dc(ws, row, 4,  c.get("profesional_nombre"), bg=bg)
-            dc(ws, row, 5,  tipo, center=True, bg=bg_t, fg=fg_t, bold=True)
-            dc(ws, row, 6,  nombre, bg=bg, wrap=True)
-            dc(ws, row, 7,  cant,     center=True, bg=bg)
-            dc(ws, row, 8,  precio,   center=True, bg=bg, fmt='#,##0')
-            dc(ws, row, 9,  subtotal, center=True, bg=bg, fmt='#,##0')
-            estado_c(ws, row, 10, c.get("estado", ""), ESTADO_COLORES)
-            dc(ws, row, 11, c.get("numero_comprobante") or "—", center=True, bg=bg)
-            row += 1
-    ws.freeze_panes = "A4"
-
-
-def build_hoja_pagos(ws, citas):
-    ws.title = "Historial de Pagos"
-    ws.sheet_view.showGridLines = False
-
-    ws.merge_cells("A1:J1")
-    t = ws["A1"]
-    t.value = "HISTORIAL DE PAGOS POR CITA"
-    t.font = Font(name="Arial", bold=True, size=12, color="FFFFFF")
-    t.fill = PatternFill("solid", fgColor=COLOR_HEADER)
-    t.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[1].height = 26
-    ws.row_dimensions[2].height = 4
-
+            h.fila(
+                dc(h, c.get("fecha"),              center=True, bg=bg),
+                dc(h, c.get("hora_inicio"),        center=True, bg=bg),
+                dc(h, c.get("cliente_nombre"),     bg=bg),
+                dc(h, c.get("profesional_nombre"), bg=bg),
+                dc(h, tipo, center=True, bg=bg_t, fg=fg_t, bold=True),
+                dc(h, nombre, bg=bg, wrap=True),
+                dc(h, cant,     center=True, bg=bg),
+                dc(h, precio,   center=True, bg=bg, fmt='#,##0'),
+                dc(h, subtotal, center=True, bg=bg, fmt='#,##0'),
+                estado_c(h, c.get("estado", ""), ESTADO_COLORES),
+                dc(h, c.get("numero_comprobante") or "—", center=True, bg=bg),
+                alto=16,
+            )
+
+
+def build_hoja_pagos(libro, citas):
     COLS = [
         ("Fecha Cita", 11), ("Hora", 9), ("Cliente", 26), ("Profesional", 16),
         ("Fecha Pago", 18), ("Monto", 13), ("Método", 14),
         ("Tipo", 16), ("Registrado por", 30), ("Saldo Después", 14),
     ]
-    for i, (label, width) in enumerate(COLS, 1):
-        hc(ws, 3, i, label, bg=COLOR_SUBHEADER, size=9, wrap=True)
-        ws.column_dimensions[get_column_letter(i)].width = width
-    ws.row_dimensions[3].height = 28
+    h = libro.hoja("Historial de Pagos", anchos=[w for _, w in COLS], congelar="A4", cuadricula=False)
+
+    titulo_c(h, "HISTORIAL DE PAGOS POR CITA", 10, COLOR_HEADER, 12, 26)
+    h.vacia(alto=4)
+    h.fila(*(hc(h, label, bg=COLOR_SUBHEADER, size=9, wrap=True) for label, _ in COLS), alto=28)
 
-    row = 4
     alt = False
-    for c in citas:
+    for c in libro.iterar(citas):
         pagos = c.get("historial_pagos", [])
         if not pagos:
             continue
         bg = COLOR_ALT_ROW if alt else "FFFFFF"
         alt = not alt
         for p in pagos:
-            ws.row_dimensions[row].height = 16
-            dc(ws, row, 1,  c.get("fecha"),                     center=True, bg=bg)
-            dc(ws, row, 2,  c.get("hora_inicio"),               center=True, bg=bg)
-            dc(ws, row, 3,  c.get("cliente_nombre"),            bg=bg)
-            dc(ws, row, 4,  c.get("profesional_nombre"),        bg=bg)
-            dc(ws, row, 5,  parse_fecha_pago(p.get("fecha")),   center=True, bg=bg)
-            dc(ws, row, 6,  cop(p.get("monto")),                center=True, bg=bg, fmt='#,##0')
-            dc(ws, row, 7,  p.get("metodo", "").replace("_", " "), center=True, bg=bg)
-            dc(ws, row, 8,  p.get("tipo",   "").replace("_", " "), center=True, bg=bg)
-            dc(ws, row, 9,  p.get("registrado_por", ""),        bg=bg)
-            dc(ws, row, 10, cop(p.get("saldo_despues")),        center=True, bg=bg, fmt='#,##0')
-            row += 1
-    ws.freeze_panes = "A4"
+            h.fila(
+                dc(h, c.get("fecha"),                     center=True, bg=bg),
+                dc(h, c.get("hora_inicio"),               center=True, bg=bg),
+                dc(h, c.get("cliente_nombre"),            bg=bg),
+                dc(h, c.get("profesional_nombre"),        bg=bg),
+                dc(h, parse_fecha_pago(p.get("fecha")),   center=True, bg=bg),
+                dc(h, cop(p.get("monto")),                center=True, bg=bg, fmt='#,##0'),
+                dc(h, p.get("metodo", "").replace("_", " "), center=True, bg=bg),
+                dc(h, p.get("tipo",   "").replace("_", " "), center=True, bg=bg),
+                dc(h, p.get("registrado_por", ""),        bg=bg),
+                dc(h, cop(p.get("saldo_despues")),        center=True, bg=bg, fmt='#,##0'),
+                alto=16,
+            )
+
+
+def escribir_reporte_citas(libro, citas, citas_detalle, citas_pagos, sede_nombre, f_ini, f_fin):
+    build_hoja_citas(libro, citas, sede_nombre, f_ini, f_fin)
+    build_hoja_detalle(libro, citas_detalle)
+    build_hoja_pagos(libro, citas_pagos)
 
 
 def generar_excel(citas, sede_nombre, f_ini, f_fin):
-    wb = openpyxl.Workbook()
-    build_hoja_citas(wb.active, citas, sede_nombre, f_ini, f_fin)
-    build_hoja_detalle(wb.create_sheet(), citas)
-    build_hoja_pagos(wb.create_sheet(), citas)
-    buf = BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-    return buf
+    return construir_xlsx(escribir_reporte_citas, citas, citas, citas, sede_nombre, f_ini, f_fin)
 
 
 # ── Endpoint ───────────────────────────────────────────────────────────────────
@@ -1003,33 +985,48 @@ async def reporte_citas_excel(
     # ── Query real a MongoDB ───────────────────────────────────────────────────
     # El campo `fecha` en appointments es un string "YYYY-MM-DD",
     # la comparación lexicográfica funciona perfectamente.
-    cursor = collection_citas.find(
-        {
-            "sede_id": sede_id,
-            "fecha": {
-                "$gte": str(fecha_inicio),
-                "$lte": str(fecha_fin),
-            },
+    filtro = {
+        "sede_id": sede_id,
+        "fecha": {
+            "$gte": str(fecha_inicio),
+            "$lte": str(fecha_fin),
         },
-        {"_id": 0},                           # excluimos _id
-    ).sort([("fecha", 1), ("hora_inicio", 1)])
-
-    citas = await cursor.to_list(length=None)  # trae todos los documentos
-    # ──────────────────────────────────────────────────────────────────────────
+    }
+    orden = [("fecha", 1), ("hora_inicio", 1)]
 
-    if not citas:
+    primera = await collection_citas.find_one(filtro, {"_id": 0, "sede_nombre": 1}, sort=orden)
+    if not primera:
         raise HTTPException(
             404,
             f"No hay citas para la sede {sede_id} entre {fecha_inicio} y {fecha_fin}",
         )
 
-    sede_nombre = citas[0].get("sede_nombre", sede_id)
-    buf = generar_excel(citas, sede_nombre, str(fecha_inicio), str(fecha_fin))
+    # Un cursor por hoja, cada uno solo con los campos que usa; las
+    # filas se escriben a medida que llegan (sin to_list)
+    citas = collection_citas.find(
+        filtro, {"_id": 0, "servicios": 0, "productos": 0, "historial_pagos": 0},
+    ).sort(orden)
+    citas_detalle = collection_citas.find(
+        filtro,
+        {"_id": 0, "fecha": 1, "hora_inicio": 1, "cliente_nombre": 1, "profesional_nombre": 1,
+         "servicios": 1, "productos": 1, "estado": 1, "numero_comprobante": 1},
+    ).sort(orden)
+    citas_pagos = collection_citas.find(
+        {**filtro, "historial_pagos.0": {"$exists": True}},
+        {"_id": 0, "fecha": 1, "hora_inicio": 1, "cliente_nombre": 1, "profesional_nombre": 1,
+         "historial_pagos": 1},
+    ).sort(orden)
+    # ──────────────────────────────────────────────────────────────────────────
+
+    sede_nombre = primera.get("sede_nombre", sede_id)
     fname = f"reporte_citas_{sede_id}_{fecha_inicio}_al_{fecha_fin}.xlsx"
 
     return StreamingResponse(
-        buf,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        stream_xlsx(
+            escribir_reporte_citas, citas, citas_detalle, citas_pagos,
+            sede_nombre, str(fecha_inicio), str(fecha_fin),
+        ),
+        media_type=MEDIA_TYPE_XLSX,
         headers={"Content-Disposition": f'attachment; filename="{fname}"'},
     )
 
@@ -11,8 +11,14 @@
 # con los datos nuevos sin tocar la lógica existente.
 # ============================================================
 
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+import asyncio
+import contextvars
+import math
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from app.database.mongo import (
     collection_citas as appointments,
     collection_sales as sales,
@@ -162,6 +168,97 @@ def _fecha_query(fecha: str) -> dict:
 
     return {"$in": [fecha, fecha_invertida]}
 
+# ============================================================
+# CONSULTAS CONCURRENTES
+# Las consultas de un día son independientes entre sí: se lanzan
+# juntas con _reunir(), acotado por operación para no acaparar el
+# pool de conexiones de motor (compartido con toda la app).
+# ============================================================
+
+CONSULTAS_CONCURRENTES = int(os.getenv("CASH_CONSULTAS_CONCURRENTES", "6"))
+
+# El benchmark lo baja a 1 para medir la ejecución en serie
+_limite_consultas = contextvars.ContextVar("limite_consultas", default=CONSULTAS_CONCURRENTES)
+# Semáforo de la operación en curso (lo comparten los _reunir anidados)
+_semaforo_consultas: contextvars.ContextVar[Optional[asyncio.Semaphore]] = contextvars.ContextVar(
+    "semaforo_consultas", default=None
+)
+# True dentro de una consulta que ya tiene un permiso del semáforo
+_con_permiso = contextvars.ContextVar("con_permiso_consultas", default=False)
+
+
+async def _reunir(*fabricas: Callable[[], Awaitable[Any]]) -> List[Any]:
+    """
+    asyncio.gather con como máximo _limite_consultas consultas a la vez
+    en toda la operación.
+
+    Recibe funciones sin argumentos (lambda: coleccion.find(...).to_list(None)),
+    no futuros ya creados: motor lanza la consulta al crear el futuro, así
+    que se crea dentro del semáforo. Un _reunir anidado usa el mismo
+    semáforo y cede el permiso de quien lo llama mientras espera.
+    """
+    semaforo = _semaforo_consultas.get()
+    token = None
+    if semaforo is None:
+        semaforo = asyncio.Semaphore(max(1, _limite_consultas.get()))
+        token = _semaforo_consultas.set(semaforo)
+
+    async def _uno(fabrica):
+        async with semaforo:
+            _con_permiso.set(True)
+            return await fabrica()
+
+    cede = _con_permiso.get()
+    if cede:
+        semaforo.release()
+    try:
+        return list(await asyncio.gather(*(_uno(f) for f in fabricas)))
+    finally:
+        if cede:
+            await semaforo.acquire()
+        if token is not None:
+            _semaforo_consultas.reset(token)
+
+
+async def contexto_dia(sede_id: str, fecha: str) -> Dict[str, Any]:
+    """
+    Entradas compartidas por el resumen y los listados de un día:
+    {"sede", "apertura", "migrado", "ingresos_manuales"}.
+    Se consultan una vez y se pasan como `contexto` a las funciones
+    públicas para que no las vuelvan a pedir.
+    """
+    sede, apertura, migrado, ingresos_manuales = await _reunir(
+        lambda: locales.find_one({"sede_id": sede_id}),
+        lambda: _buscar_apertura(sede_id, fecha),
+        lambda: _tiene_data_migrada(sede_id, fecha),
+        lambda: _ingresos_manuales_docs(sede_id, fecha),
+    )
+    return {
+        "sede"             : sede,
+        "apertura"         : apertura,
+        "migrado"          : migrado,
+        "ingresos_manuales": ingresos_manuales,
+    }
+
+
+async def _apertura_ctx(sede_id: str, fecha: str, contexto: Optional[Dict]) -> Optional[Dict]:
+    if contexto is not None:
+        return contexto["apertura"]
+    return await _buscar_apertura(sede_id, fecha)
+
+
+async def _migrado_ctx(sede_id: str, fecha: str, contexto: Optional[Dict]) -> bool:
+    if contexto is not None:
+        return contexto["migrado"]
+    return await _tiene_data_migrada(sede_id, fecha)
+
+
+async def _ingresos_manuales_ctx(sede_id: str, fecha: str, contexto: Optional[Dict]) -> List[Dict]:
+    if contexto is not None:
+        return contexto["ingresos_manuales"]
+    return await _ingresos_manuales_docs(sede_id, fecha)
+
+
 async def _buscar_apertura(sede_id: str, fecha: str):
     """
     Busca la apertura de caja con múltiples estrategias:
@@ -221,9 +318,8 @@ async def _ingresos_manuales_docs(sede_id: str, fecha: str) -> List[Dict]:
     }).sort("creado_en", 1).to_list(None)
 
 
-async def _ingresos_manuales_por_metodo(sede_id: str, fecha: str) -> Dict[str, float]:
+def _ingresos_manuales_metodos(docs: List[Dict]) -> Dict[str, float]:
     metodos = _metodos_pago_base()
-    docs = await _ingresos_manuales_docs(sede_id, fecha)
 
     for ingreso in docs:
         metodo_norm = _normalizar_metodo(ingreso.get("metodo_pago", ""))
@@ -268,18 +364,16 @@ def _formatear_ingresos_manuales_para_flujo(
 # ── RAMA MIGRADA: leer desde cash_expenses / cash_closures ──
 # ============================================================
 
-async def _ingresos_efectivo_migrado(sede_id: str, fecha: str) -> Dict:
-    """
-    Calcula ingresos en efectivo desde cash_expenses (migrado).
-    Busca documentos con categoria=INGRESO y medio_de_pago=efectivo.
-    """
-    docs = await cash_expenses.find({
+async def _ingresos_docs_migrado(sede_id: str, fecha: str) -> List[Dict]:
+    return await cash_expenses.find({
         "sede_id"   : sede_id,
         "fecha"     : _fecha_query(fecha),
         "categoria" : "INGRESO",
         "origen"    : "migracion"
     }).to_list(None)
 
+
+def _resumen_efectivo_migrado(docs: List[Dict]) -> Dict:
     total     = 0
     cantidad  = 0
     for d in docs:
@@ -295,20 +389,9 @@ async def _ingresos_efectivo_migrado(sede_id: str, fecha: str) -> Dict:
     }
 
 
-async def _ingresos_por_metodo_migrado(sede_id: str, fecha: str) -> Dict:
-    """
-    Calcula ingresos discriminados por método desde cash_expenses (migrado).
-    Solo considera categoria=INGRESO.
-    """
+def _metodos_migrado(docs: List[Dict]) -> Dict:
     metodos = _metodos_pago_base()
 
-    docs = await cash_expenses.find({
-        "sede_id"   : sede_id,
-        "fecha"     : _fecha_query(fecha),
-        "categoria" : "INGRESO",
-        "origen"    : "migracion"
-    }).to_list(None)
-
     for d in docs:
         metodo_norm = _normalizar_metodo(d.get("medio_de_pago", ""))
         if metodo_norm not in metodos:
@@ -322,9 +405,36 @@ async def _ingresos_por_metodo_migrado(sede_id: str, fecha: str) -> Dict:
 
 
 async def _egresos_efectivo_migrado(sede_id: str, fecha: str) -> Dict:
-    agrupados = { ... }  # igual que antes
-    
-    # ← AGREGAR esto al final, antes del return
+    docs = await cash_expenses.find({
+        "sede_id"   : sede_id,
+        "fecha"     : _fecha_query(fecha),
+        "categoria" : "EGRESO",
+        "origen"    : "migracion"
+    }).to_list(None)
+    return _resumen_egresos_migrado(docs)
+
+
+def _resumen_egresos_migrado(docs: List[Dict]) -> Dict:
+    """
+    Egresos migrados (categoria=EGRESO) agrupados como calcular_egresos_efectivo.
+    El campo tipo del sistema anterior solo se respeta si coincide con una
+    categoría conocida; el resto va a "otros".
+    """
+    agrupados = {
+        "compras_internas" : {"total": 0, "cantidad": 0},
+        "gastos_operativos": {"total": 0, "cantidad": 0},
+        "retiros_caja"     : {"total": 0, "cantidad": 0},
+        "otros"            : {"total": 0, "cantidad": 0},
+    }
+    total = 0
+    for d in docs:
+        monto     = d.get("monto", 0) or 0
+        categoria = d.get("tipo") if d.get("tipo") in agrupados else "otros"
+        agrupados[categoria]["total"]    += monto
+        agrupados[categoria]["cantidad"] += 1
+        total += monto
+    agrupados["total"] = total
+
     por_metodo = {
         "efectivo": 0, "tarjeta_credito": 0, "tarjeta_debito": 0,
         "pos": 0, "transferencia": 0, "link_de_pago": 0,
@@ -349,7 +459,10 @@ async def _ventas_dia_migrado(sede_id: str, fecha: str) -> List[Dict]:
         "categoria" : "INGRESO",
         "origen"    : "migracion"
     }).sort("creado_en", 1).to_list(None)
+    return _formatear_ventas_migrado(docs, fecha)
+
 
+def _formatear_ventas_migrado(docs: List[Dict], fecha: str) -> List[Dict]:
     ventas = []
     for d in docs:
         # Prioridad: _raw.fecha (tiene hora real) → fecha del doc → fallback
@@ -385,7 +498,10 @@ async def _egresos_dia_migrado(sede_id: str, fecha: str) -> List[Dict]:
         "categoria" : "EGRESO",
         "origen"    : "migracion"
     }).sort("creado_en", 1).to_list(None)
+    return _formatear_egresos_migrado(docs, fecha)
 
+
+def _formatear_egresos_migrado(docs: List[Dict], fecha: str) -> List[Dict]:
     egresos = []
     for d in docs:
         # Prioridad: _raw.fecha (tiene hora real) → fecha del doc → fallback
@@ -405,22 +521,32 @@ async def _egresos_dia_migrado(sede_id: str, fecha: str) -> List[Dict]:
     return egresos
 
 
-async def _movimientos_efectivo_migrado(sede_id: str, fecha: str) -> Dict:
+async def _movimientos_efectivo_migrado(sede_id: str, fecha: str, contexto: Optional[Dict] = None) -> Dict:
     """
     Obtiene movimientos en efectivo desde cash_expenses (migrado).
     Usa categoria=EFECTIVO que tiene el campo flujo ('+' o '-').
     """
     # Saldo inicial desde cash_closures
-    apertura     = await _buscar_apertura(sede_id, fecha)
+    apertura, docs, ingresos_manuales = await _reunir(
+        lambda: _apertura_ctx(sede_id, fecha, contexto),
+        lambda: cash_expenses.find({
+            "sede_id"   : sede_id,
+            "fecha"     : _fecha_query(fecha),
+            "categoria" : "EFECTIVO",
+            "origen"    : "migracion"
+        }).sort("creado_en", 1).to_list(None),
+        lambda: _ingresos_manuales_ctx(sede_id, fecha, contexto),
+    )
     saldo_inicial = apertura.get("efectivo_inicial", 0) if apertura else 0
+    return _movimientos_migrado(saldo_inicial, docs, ingresos_manuales, fecha)
 
-    docs = await cash_expenses.find({
-        "sede_id"   : sede_id,
-        "fecha"     : _fecha_query(fecha),
-        "categoria" : "EFECTIVO",
-        "origen"    : "migracion"
-    }).sort("creado_en", 1).to_list(None)
 
+def _movimientos_migrado(
+    saldo_inicial: float,
+    docs: List[Dict],
+    ingresos_manuales: List[Dict],
+    fecha: str
+) -> Dict:
     movimientos = []
     for d in docs:
         es_ingreso = str(d.get("flujo", "+")).strip() == "+"
@@ -441,7 +567,12 @@ async def _movimientos_efectivo_migrado(sede_id: str, fecha: str) -> Dict:
             "saldo"      : 0,
         })
 
-    ingresos_manuales = await _ingresos_manuales_docs(sede_id, fecha)
+    movimientos.extend(_movimientos_ingresos_manuales(ingresos_manuales, fecha))
+    return _saldo_corrido(saldo_inicial, movimientos)
+
+
+def _movimientos_ingresos_manuales(ingresos_manuales: List[Dict], fecha: str) -> List[Dict]:
+    movimientos = []
     for ingreso in ingresos_manuales:
         if _normalizar_metodo(ingreso.get("metodo_pago", "")) != "efectivo":
             continue
@@ -459,7 +590,10 @@ async def _movimientos_efectivo_migrado(sede_id: str, fecha: str) -> Dict:
             "egreso": 0,
             "saldo": 0,
         })
+    return movimientos
+
 
+def _saldo_corrido(saldo_inicial: float, movimientos: List[Dict]) -> Dict:
     # Calcular saldo corrido
     movimientos.sort(key=lambda x: x["fecha"] if x["fecha"] else datetime.min)
     saldo = saldo_inicial
@@ -571,16 +705,15 @@ async def calcular_ingresos_efectivo_sales(
         }
     ]
 
-    resultado = await sales.aggregate(
-        pipeline, allowDiskUse=True
-    ).to_list(None)
-
-    ventas_migradas = await sales.find({
-        "sede_id"  : sede_id,
-        "fecha_pago": {"$gte": fecha_inicio, "$lte": fecha_fin},
-        "historial_pagos": {"$exists": False},
-        "desglose_pagos.efectivo": {"$exists": True, "$gt": 0}
-    }).to_list(None)
+    resultado, ventas_migradas = await _reunir(
+        lambda: sales.aggregate(pipeline, allowDiskUse=True).to_list(None),
+        lambda: sales.find({
+            "sede_id"  : sede_id,
+            "fecha_pago": {"$gte": fecha_inicio, "$lte": fecha_fin},
+            "historial_pagos": {"$exists": False},
+            "desglose_pagos.efectivo": {"$exists": True, "$gt": 0}
+        }).to_list(None),
+    )
 
     total_migrado     = sum(v.get("desglose_pagos", {}).get("efectivo", 0) for v in ventas_migradas)
     cantidad_migradas = len(ventas_migradas)
@@ -607,8 +740,6 @@ async def calcular_ingresos_por_metodo_pago(
     fecha_inicio = fecha_dt.replace(hour=0,  minute=0,  second=0,  microsecond=0)
     fecha_fin    = fecha_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-    metodos = _metodos_pago_base()
-
     # 1. Appointments NO facturadas
     pipeline_appointments = [
         {
@@ -639,12 +770,6 @@ async def calcular_ingresos_por_metodo_pago(
         }
     ]
 
-    for item in await appointments.aggregate(pipeline_appointments, allowDiskUse=True).to_list(None):
-        metodo_norm = _normalizar_metodo(item["_id"])
-        if metodo_norm not in metodos:
-            metodos[metodo_norm] = 0
-        metodos[metodo_norm] += item["total"]
-
     # 2. Sales con historial_pagos
     pipeline_sales = [
     {
@@ -672,32 +797,15 @@ async def calcular_ingresos_por_metodo_pago(
     }
 ]
 
-    for item in await sales.aggregate(pipeline_sales, allowDiskUse=True).to_list(None):
-        metodo_norm = _normalizar_metodo(item["_id"])
-        if metodo_norm not in metodos:
-            metodos[metodo_norm] = 0
-        metodos[metodo_norm] += item["total"]
-
     # 3. Sales migradas (desglose_pagos)
-    for venta in await sales.find({
+    filtro_migradas = {
         "sede_id"  : sede_id,
         "fecha_pago": {"$gte": fecha_inicio, "$lte": fecha_fin},
         "historial_pagos": {"$exists": False},
         "desglose_pagos" : {"$exists": True}
-    }).to_list(None):
-        for metodo, monto in venta.get("desglose_pagos", {}).items():
-            if metodo == "total":
-                continue
-            metodo_norm = _normalizar_metodo(metodo)
-            if metodo_norm not in metodos:
-                metodos[metodo_norm] = 0
-            metodos[metodo_norm] += monto
-
-    # ❌ ELIMINAR estas líneas al final de calcular_ingresos_por_metodo_pago
-    abonos_valor = metodos.pop("abonos", 0)
-    metodos["abonos_informativos"] = abonos_valor
+    }
 
-    # ✅ REEMPLAZAR por esto — query que filtra por TIPO, no por método
+    # ✅ Abonos: query que filtra por TIPO, no por método
     pipeline_abonos = [
         {
             "$match": {
@@ -727,11 +835,6 @@ async def calcular_ingresos_por_metodo_pago(
         }
     ]
 
-    total_abonos = 0
-    resultado_abonos = await appointments.aggregate(pipeline_abonos, allowDiskUse=True).to_list(None)
-    if resultado_abonos:
-        total_abonos += resultado_abonos[0]["total"]
-
     # Lo mismo para sales
     pipeline_abonos_sales = [
         {
@@ -758,10 +861,57 @@ async def calcular_ingresos_por_metodo_pago(
         }
     ]
 
-    resultado_abonos_sales = await sales.aggregate(pipeline_abonos_sales, allowDiskUse=True).to_list(None)
+    (
+        resultado_citas, resultado_sales, ventas_migradas,
+        resultado_abonos, resultado_abonos_sales
+    ) = await _reunir(
+        lambda: appointments.aggregate(pipeline_appointments, allowDiskUse=True).to_list(None),
+        lambda: sales.aggregate(pipeline_sales, allowDiskUse=True).to_list(None),
+        lambda: sales.find(filtro_migradas).to_list(None),
+        lambda: appointments.aggregate(pipeline_abonos, allowDiskUse=True).to_list(None),
+        lambda: sales.aggregate(pipeline_abonos_sales, allowDiskUse=True).to_list(None),
+    )
+
+    grupos_citas = [(item["_id"], item["total"]) for item in resultado_citas]
+    grupos_sales = [(item["_id"], item["total"]) for item in resultado_sales]
+
+    total_abonos = 0
+    if resultado_abonos:
+        total_abonos += resultado_abonos[0]["total"]
     if resultado_abonos_sales:
         total_abonos += resultado_abonos_sales[0]["total"]
 
+    return _armar_metodos_sistema(grupos_citas, grupos_sales, ventas_migradas, total_abonos)
+
+
+def _armar_metodos_sistema(
+    grupos_citas: List[tuple],
+    grupos_sales: List[tuple],
+    ventas_migradas: List[Dict],
+    total_abonos: float
+) -> Dict:
+    """
+    Ingresos por método a partir de los totales (metodo, total) de citas y
+    sales y de las ventas migradas. `abonos` pasa a abonos_informativos.
+    """
+    metodos = _metodos_pago_base()
+
+    for metodo_raw, total in list(grupos_citas) + list(grupos_sales):
+        metodo_norm = _normalizar_metodo(metodo_raw)
+        if metodo_norm not in metodos:
+            metodos[metodo_norm] = 0
+        metodos[metodo_norm] += total
+
+    for venta in ventas_migradas:
+        for metodo, monto in venta.get("desglose_pagos", {}).items():
+            if metodo == "total":
+                continue
+            metodo_norm = _normalizar_metodo(metodo)
+            if metodo_norm not in metodos:
+                metodos[metodo_norm] = 0
+            metodos[metodo_norm] += monto
+
+    metodos.pop("abonos", 0)
     metodos["abonos_informativos"] = total_abonos
 
     # total_general NO cambia — los abonos ya están sumados en su método real
@@ -775,6 +925,16 @@ async def calcular_egresos_efectivo(
     sede_id: str,
     fecha: str
 ) -> Dict:
+    docs = await cash_expenses.find({
+        "sede_id": sede_id,
+        "fecha"  : _fecha_query(fecha),
+        "origen" : {"$ne": "migracion"},
+        "eliminado": {"$ne": True}
+    }).to_list(None)
+    return _resumen_egresos_sistema(docs)
+
+
+def _resumen_egresos_sistema(docs: List[Dict]) -> Dict:
     agrupados = {
         "compras_internas" : {"total": 0, "cantidad": 0},
         "gastos_operativos": {"total": 0, "cantidad": 0},
@@ -789,12 +949,7 @@ async def calcular_egresos_efectivo(
         "giftcard": 0, "addi": 0, "abonos": 0, "otros": 0,
     }
 
-    for egreso in await cash_expenses.find({
-    "sede_id": sede_id,
-    "fecha"  : _fecha_query(fecha),
-    "origen" : {"$ne": "migracion"},
-    "eliminado": {"$ne": True}
-    }).to_list(None):
+    for egreso in docs:
         tipo  = egreso.get("tipo", "otro")
         monto = egreso.get("monto", 0)
         metodo = _normalizar_metodo(egreso.get("metodo_pago", "efectivo"))  # ← NUEVO
@@ -822,8 +977,6 @@ async def _obtener_ventas_dia_sistema(
     fecha_inicio = fecha_dt.replace(hour=0,  minute=0,  second=0,  microsecond=0)
     fecha_fin    = fecha_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-    ventas_formateadas = []
-
     # =========================================================
     # 1. APPOINTMENTS NO FACTURADAS
     # Igual que calcular_ingresos_por_metodo_pago rama appointments
@@ -849,24 +1002,6 @@ async def _obtener_ventas_dia_sistema(
             }
         }
     ]
-
-    async for cita in appointments.aggregate(pipeline_appointments, allowDiskUse=True):
-        pago = cita["historial_pagos"]
-        ventas_formateadas.append({
-            "fecha"               : pago.get("fecha"),
-            "nombre_cliente"      : cita.get("cliente_nombre", ""),
-            "cedula_cliente"      : cita.get("cedula_cliente", ""),
-            "email_cliente"       : cita.get("cliente_email", ""),
-            "telefono_cliente"    : cita.get("cliente_telefono", ""),
-            "medio_pago"          : pago.get("metodo", "").replace("_", " ").title(),
-            "tipo_movimiento"     : pago.get("tipo", ""),
-            "id_movimiento"       : str(cita.get("_id", "")),
-            "nro_comprobante"     : cita.get("numero_comprobante", ""),
-            "flujo_periodo"       : pago.get("monto", 0),
-            "usuario_modificacion": pago.get("registrado_por", ""),
-            "notas"               : pago.get("notas", ""),
-        })
-
     # =========================================================
     # 2. SALES CON HISTORIAL_PAGOS
     # Filtra por fecha REAL del pago, no por fecha_pago (cierre)
@@ -890,8 +1025,50 @@ async def _obtener_ventas_dia_sistema(
             }
         }
     ]
+    # =========================================================
+    # 3. SALES MIGRADAS (sin historial_pagos, usando desglose_pagos)
+    # Estas sí se buscan por fecha_pago porque no tienen historial
+    # =========================================================
+    pagos_citas, pagos_sales, ventas_migradas = await _reunir(
+        lambda: appointments.aggregate(pipeline_appointments, allowDiskUse=True).to_list(None),
+        lambda: sales.aggregate(pipeline_sales, allowDiskUse=True).to_list(None),
+        lambda: sales.find({
+            "sede_id"        : sede_id,
+            "fecha_pago"     : {"$gte": fecha_inicio, "$lte": fecha_fin},
+            "historial_pagos": {"$exists": False},
+            "desglose_pagos" : {"$exists": True}
+        }).to_list(None),
+    )
+
+    return _formatear_ventas_sistema(pagos_citas, pagos_sales, ventas_migradas)
+
+
+def _formatear_ventas_sistema(
+    pagos_citas: List[Dict],
+    pagos_sales: List[Dict],
+    ventas_migradas: List[Dict]
+) -> List[Dict]:
+    """Filas de la Hoja 2 a partir de los pagos ya desenrollados ($unwind)."""
+    ventas_formateadas = []
+
+    for cita in pagos_citas:
+        pago = cita["historial_pagos"]
+        ventas_formateadas.append({
+            "fecha"               : pago.get("fecha"),
+            "nombre_cliente"      : cita.get("cliente_nombre", ""),
+            "cedula_cliente"      : cita.get("cedula_cliente", ""),
+            "email_cliente"       : cita.get("cliente_email", ""),
+            "telefono_cliente"    : cita.get("cliente_telefono", ""),
+            "medio_pago"          : pago.get("metodo", "").replace("_", " ").title(),
+            "tipo_movimiento"     : pago.get("tipo", ""),
+            "id_movimiento"       : str(cita.get("_id", "")),
+            "nro_comprobante"     : cita.get("numero_comprobante", ""),
+            "flujo_periodo"       : pago.get("monto", 0),
+            "usuario_modificacion": pago.get("registrado_por", ""),
+            "notas"               : pago.get("notas", ""),
+        })
 
-    async for venta in sales.aggregate(pipeline_sales, allowDiskUse=True):
+    for venta in pagos_sales:
         pago = venta["historial_pagos"]
         ventas_formateadas.append({
             "fecha"               : pago.get("fecha"),
@@ -908,17 +1085,6 @@ async def _obtener_ventas_dia_sistema(
             "notas"               : pago.get("notas", ""),
         })
 
-    # =========================================================
-    # 3. SALES MIGRADAS (sin historial_pagos, usando desglose_pagos)
-    # Estas sí se buscan por fecha_pago porque no tienen historial
-    # =========================================================
-    ventas_migradas = await sales.find({
-        "sede_id"        : sede_id,
-        "fecha_pago"     : {"$gte": fecha_inicio, "$lte": fecha_fin},
-        "historial_pagos": {"$exists": False},
-        "desglose_pagos" : {"$exists": True}
-    }).to_list(None)
-
     for venta in ventas_migradas:
         for metodo, monto in venta.get("desglose_pagos", {}).items():
             if metodo == "total" or not monto:
@@ -950,14 +1116,19 @@ async def _obtener_egresos_dia_sistema(
     sede_id: str,
     fecha: str
 ) -> List[Dict]:
-    egresos_formateados = []
-
-    for e in await cash_expenses.find({
+    docs = await cash_expenses.find({
         "sede_id": sede_id,
         "fecha"  : _fecha_query(fecha),
         "origen" : {"$ne": "migracion"},
         "eliminado": {"$ne": True}
-    }).sort("creado_en", 1).to_list(None):
+    }).sort("creado_en", 1).to_list(None)
+    return _formatear_egresos_sistema(docs)
+
+
+def _formatear_egresos_sistema(docs: List[Dict]) -> List[Dict]:
+    egresos_formateados = []
+
+    for e in docs:
         egresos_formateados.append({
             "fecha"          : e.get("creado_en", ""),
             "concepto"       : e.get("concepto", ""),
@@ -974,17 +1145,13 @@ async def _obtener_egresos_dia_sistema(
 
 async def _obtener_movimientos_efectivo_dia_sistema(
     sede_id: str,
-    fecha: str
+    fecha: str,
+    contexto: Optional[Dict] = None
 ) -> Dict:
-    apertura      = await _buscar_apertura(sede_id, fecha)
-    saldo_inicial = apertura.get("efectivo_inicial", 0) if apertura else 0
-
     fecha_dt     = datetime.strptime(fecha, "%Y-%m-%d")
     fecha_inicio = fecha_dt.replace(hour=0,  minute=0,  second=0,  microsecond=0)
     fecha_fin    = fecha_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-    movimientos = []
-
     # =========================================================
     # 1. APPOINTMENTS NO FACTURADAS (efectivo)
     # ✅ Fix Bug 1: incluye citas como ZULMA que no están en sales
@@ -1012,19 +1179,6 @@ async def _obtener_movimientos_efectivo_dia_sistema(
             }
         }
     ]
-
-    async for cita in appointments.aggregate(pipeline_appointments, allowDiskUse=True):
-        pago = cita["historial_pagos"]
-        movimientos.append({
-            "fecha"      : pago.get("fecha"),
-            "tipo"       : "INGRESO",
-            "descripcion": f"{cita.get('cliente_nombre', '')} - cita",
-            "comprobante": cita.get("numero_comprobante", ""),
-            "ingreso"    : pago.get("monto", 0),
-            "egreso"     : 0,
-            "saldo"      : 0
-        })
-
     # =========================================================
     # 2. SALES CON HISTORIAL_PAGOS (incluye citas facturadas)
     # ✅ Fix Bug 2 y 3: unwind + re-filtro, solo sales (no duplicar appointments)
@@ -1049,8 +1203,67 @@ async def _obtener_movimientos_efectivo_dia_sistema(
             }
         }
     ]
+    # =========================================================
+    # 3. SALES MIGRADAS (sin historial_pagos)
+    # Estas sí usan fecha_pago porque no tienen historial
+    # =========================================================
+    (
+        apertura, pagos_citas, pagos_sales, ventas_migradas,
+        ingresos_manuales, egresos_docs
+    ) = await _reunir(
+        lambda: _apertura_ctx(sede_id, fecha, contexto),
+        lambda: appointments.aggregate(pipeline_appointments, allowDiskUse=True).to_list(None),
+        lambda: sales.aggregate(pipeline_sales, allowDiskUse=True).to_list(None),
+        lambda: sales.find({
+            "sede_id"        : sede_id,
+            "fecha_pago"     : {"$gte": fecha_inicio, "$lte": fecha_fin},
+            "historial_pagos": {"$exists": False},
+            "desglose_pagos.efectivo": {"$exists": True, "$gt": 0}
+        }).to_list(None),
+        lambda: _ingresos_manuales_ctx(sede_id, fecha, contexto),
+        lambda: cash_expenses.find({
+            "sede_id": sede_id,
+            "fecha"  : _fecha_query(fecha),
+            "origen" : {"$ne": "migracion"},
+            "eliminado": {"$ne": True}
+        }).sort("creado_en", 1).to_list(None),
+    )
+    saldo_inicial = apertura.get("efectivo_inicial", 0) if apertura else 0
 
-    async for venta in sales.aggregate(pipeline_sales, allowDiskUse=True):
+    return _movimientos_sistema(
+        saldo_inicial, pagos_citas, pagos_sales, ventas_migradas,
+        ingresos_manuales, egresos_docs, fecha
+    )
+
+
+def _movimientos_sistema(
+    saldo_inicial: float,
+    pagos_citas: List[Dict],
+    pagos_sales: List[Dict],
+    ventas_migradas: List[Dict],
+    ingresos_manuales: List[Dict],
+    egresos_docs: List[Dict],
+    fecha: str
+) -> Dict:
+    """
+    Hoja 4 a partir de los pagos en efectivo ya desenrollados, las ventas
+    migradas con efectivo, los ingresos manuales y los egresos del día.
+    """
+    movimientos = []
+
+    for cita in pagos_citas:
+        pago = cita["historial_pagos"]
+        movimientos.append({
+            "fecha"      : pago.get("fecha"),
+            "tipo"       : "INGRESO",
+            "descripcion": f"{cita.get('cliente_nombre', '')} - cita",
+            "comprobante": cita.get("numero_comprobante", ""),
+            "ingreso"    : pago.get("monto", 0),
+            "egreso"     : 0,
+            "saldo"      : 0
+        })
+
+    for venta in pagos_sales:
         pago = venta["historial_pagos"]
         movimientos.append({
             "fecha"      : pago.get("fecha"),
@@ -1062,16 +1275,7 @@ async def _obtener_movimientos_efectivo_dia_sistema(
             "saldo"      : 0
         })
 
-    # =========================================================
-    # 3. SALES MIGRADAS (sin historial_pagos)
-    # Estas sí usan fecha_pago porque no tienen historial
-    # =========================================================
-    for venta in await sales.find({
-        "sede_id"        : sede_id,
-        "fecha_pago"     : {"$gte": fecha_inicio, "$lte": fecha_fin},
-        "historial_pagos": {"$exists": False},
-        "desglose_pagos.efectivo": {"$exists": True, "$gt": 0}
-    }).to_list(None):
+    for venta in ventas_migradas:
         movimientos.append({
             "fecha"      : venta.get("fecha_pago"),
             "tipo"       : "INGRESO",
@@ -1085,32 +1289,12 @@ async def _obtener_movimientos_efectivo_dia_sistema(
     # =========================================================
     # 4. INGRESOS MANUALES EN EFECTIVO
     # =========================================================
-    ingresos_manuales = await _ingresos_manuales_docs(sede_id, fecha)
-    for ingreso in ingresos_manuales:
-        if _normalizar_metodo(ingreso.get("metodo_pago", "")) != "efectivo":
-            continue
-        monto = float(ingreso.get("monto", 0) or 0)
-        if monto <= 0:
-            continue
-        movimientos.append({
-            "fecha"      : _fecha_para_manual(ingreso, fecha),
-            "tipo"       : "INGRESO",
-            "descripcion": f"Ingreso manual - {ingreso.get('motivo', '')}".strip(" -"),
-            "comprobante": ingreso.get("comprobante_numero", ""),
-            "ingreso"    : monto,
-            "egreso"     : 0,
-            "saldo"      : 0,
-        })
+    movimientos.extend(_movimientos_ingresos_manuales(ingresos_manuales, fecha))
 
     # =========================================================
     # 5. EGRESOS (sin cambios)
     # =========================================================
-    for e in await cash_expenses.find({
-        "sede_id": sede_id,
-        "fecha"  : _fecha_query(fecha),
-        "origen" : {"$ne": "migracion"},
-        "eliminado": {"$ne": True}
-    }).sort("creado_en", 1).to_list(None):
+    for e in egresos_docs:
         metodo = _normalizar_metodo(e.get("metodo_pago", "efectivo"))
         if metodo != "efectivo":
             continue   # ← transferencias, tarjetas, etc. NO tocan la caja física
@@ -1125,18 +1309,7 @@ async def _obtener_movimientos_efectivo_dia_sistema(
         })
 
     # Ordenar y calcular saldo corrido
-    movimientos.sort(key=lambda x: x["fecha"] if x["fecha"] else datetime.min)
-    saldo = saldo_inicial
-    for mov in movimientos:
-        saldo       += mov["ingreso"]
-        saldo       -= mov["egreso"]
-        mov["saldo"] = saldo
-
-    return {
-        "saldo_inicial": saldo_inicial,
-        "movimientos"  : movimientos,
-        "saldo_final"  : saldo  # ✅ Debería dar 49,100
-    }
+    return _saldo_corrido(saldo_inicial, movimientos)
 
 
 # ============================================================
@@ -1148,55 +1321,75 @@ async def _obtener_movimientos_efectivo_dia_sistema(
 
 async def calcular_resumen_dia(
     sede_id: str,
-    fecha: str
+    fecha: str,
+    contexto: Optional[Dict] = None
 ) -> Dict:
     """
     Resumen completo del día.
     Si existe data migrada en cash_expenses → usa rama migrada.
     Si no → usa appointments + sales (flujo normal).
+    contexto: resultado de contexto_dia() si el llamador ya lo tiene.
     """
-    sede            = await locales.find_one({"sede_id": sede_id})
-    sede_nombre     = sede.get("nombre") if sede else "Sede desconocida"
-    moneda          = sede.get("moneda", "COP") if sede else "COP"
-
-    apertura         = await _buscar_apertura(sede_id, fecha)
-    efectivo_inicial = apertura.get("efectivo_inicial", 0) if apertura else 0
-    
-
-    migrado = await _tiene_data_migrada(sede_id, fecha)
+    if contexto is None:
+        contexto = await contexto_dia(sede_id, fecha)
+    migrado = contexto["migrado"]
 
     if migrado:
         # ── Rama migrada ──────────────────────────────────────
-        ingresos_efectivo    = await _ingresos_efectivo_migrado(sede_id, fecha)
-        ingresos_discriminados = await _ingresos_por_metodo_migrado(sede_id, fecha)
-        egresos              = await _egresos_efectivo_migrado(sede_id, fecha)
-
-        total_ingresos_efectivo = ingresos_efectivo["total"]
-
-        ingresos_info = {
-            "appointments_no_facturadas": 0,
-            "sales_facturadas"          : total_ingresos_efectivo,
-            "total"                     : total_ingresos_efectivo,
-            "fuente"                    : "migracion"
-        }
+        ingresos_docs, egresos = await _reunir(
+            lambda: _ingresos_docs_migrado(sede_id, fecha),
+            lambda: _egresos_efectivo_migrado(sede_id, fecha),
+        )
+        ingresos_discriminados = _metodos_migrado(ingresos_docs)
+        efectivo_citas         = 0
+        efectivo_sales         = _resumen_efectivo_migrado(ingresos_docs)["total"]
 
     else:
         # ── Rama normal ───────────────────────────────────────
-        ingresos_appointments  = await calcular_ingresos_efectivo_appointments(sede_id, fecha)
-        ingresos_sales         = await calcular_ingresos_efectivo_sales(sede_id, fecha)
-        ingresos_discriminados = await calcular_ingresos_por_metodo_pago(sede_id, fecha)
-        egresos                = await calcular_egresos_efectivo(sede_id, fecha)
-
-        total_ingresos_efectivo = ingresos_appointments["total"] + ingresos_sales["total"]
-
-        ingresos_info = {
-            "appointments_no_facturadas": ingresos_appointments["total"],
-            "sales_facturadas"          : ingresos_sales["total"],
-            "total"                     : total_ingresos_efectivo,
-            "fuente"                    : "sistema"
-        }
+        (
+            ingresos_appointments, ingresos_sales, ingresos_discriminados, egresos
+        ) = await _reunir(
+            lambda: calcular_ingresos_efectivo_appointments(sede_id, fecha),
+            lambda: calcular_ingresos_efectivo_sales(sede_id, fecha),
+            lambda: calcular_ingresos_por_metodo_pago(sede_id, fecha),
+            lambda: calcular_egresos_efectivo(sede_id, fecha),
+        )
+        efectivo_citas         = ingresos_appointments["total"]
+        efectivo_sales         = ingresos_sales["total"]
+
+    ingresos_manuales = _ingresos_manuales_metodos(contexto["ingresos_manuales"])
+
+    return _armar_resumen_dia(
+        sede_id, fecha, contexto["sede"], contexto["apertura"], migrado,
+        efectivo_citas, efectivo_sales, ingresos_discriminados, egresos, ingresos_manuales
+    )
+
+
+def _armar_resumen_dia(
+    sede_id: str,
+    fecha: str,
+    sede: Optional[Dict],
+    apertura: Optional[Dict],
+    migrado: bool,
+    efectivo_citas: float,
+    efectivo_sales: float,
+    ingresos_discriminados: Dict,
+    egresos: Dict,
+    ingresos_manuales: Dict
+) -> Dict:
+    """Arma el resumen del día a partir de los totales ya calculados."""
+    sede_nombre      = sede.get("nombre") if sede else "Sede desconocida"
+    moneda           = sede.get("moneda", "COP") if sede else "COP"
+    efectivo_inicial = apertura.get("efectivo_inicial", 0) if apertura else 0
+
+    total_ingresos_efectivo = efectivo_citas + efectivo_sales
+    ingresos_info = {
+        "appointments_no_facturadas": efectivo_citas,
+        "sales_facturadas"          : efectivo_sales,
+        "total"                     : total_ingresos_efectivo,
+        "fuente"                    : "migracion" if migrado else "sistema"
+    }
 
-    ingresos_manuales = await _ingresos_manuales_por_metodo(sede_id, fecha)
     total_manual = float(ingresos_manuales.get("total_general", 0) or 0)
     total_manual_efectivo = float(ingresos_manuales.get("efectivo", 0) or 0)
 
@@ -1253,19 +1446,19 @@ async def calcular_resumen_dia(
 
 async def obtener_ventas_dia(
     sede_id: str,
-    fecha: str
+    fecha: str,
+    contexto: Optional[Dict] = None
 ) -> List[Dict]:
     """
     Devuelve el listado de ingresos del día (Hoja 2 - Flujo de Ingresos).
     Si existe data migrada → usa cash_expenses.
     Si no → usa sales.
     """
-    if await _tiene_data_migrada(sede_id, fecha):
-        ventas = await _ventas_dia_migrado(sede_id, fecha)
-    else:
-        ventas = await _obtener_ventas_dia_sistema(sede_id, fecha)
-
-    ingresos_manuales = await _ingresos_manuales_docs(sede_id, fecha)
+    migrado = await _migrado_ctx(sede_id, fecha, contexto)
+    ventas, ingresos_manuales = await _reunir(
+        lambda: _ventas_dia_migrado(sede_id, fecha) if migrado else _obtener_ventas_dia_sistema(sede_id, fecha),
+        lambda: _ingresos_manuales_ctx(sede_id, fecha, contexto),
+    )
     ventas.extend(_formatear_ingresos_manuales_para_flujo(ingresos_manuales, fecha))
     ventas.sort(key=lambda item: item.get("fecha") or datetime.min)
     return ventas
@@ -1273,27 +1466,533 @@ async def obtener_ventas_dia(
 
 async def obtener_egresos_dia(
     sede_id: str,
-    fecha: str
+    fecha: str,
+    contexto: Optional[Dict] = None
 ) -> List[Dict]:
     """
     Devuelve el listado de egresos del día (Hoja 3 - Flujo de Egresos).
     Si existe data migrada → usa cash_expenses con categoria=EGRESO.
     Si no → usa cash_expenses normal (ya lo hace obtener_egresos_dia).
     """
-    if await _tiene_data_migrada(sede_id, fecha):
+    if await _migrado_ctx(sede_id, fecha, contexto):
         return await _egresos_dia_migrado(sede_id, fecha)
     return await _obtener_egresos_dia_sistema(sede_id, fecha)
 
 
 async def obtener_movimientos_efectivo_dia(
     sede_id: str,
-    fecha: str
+    fecha: str,
+    contexto: Optional[Dict] = None
 ) -> Dict:
     """
     Devuelve movimientos en efectivo con saldo corrido (Hoja 4).
     Si existe data migrada → usa cash_expenses con categoria=EFECTIVO.
     Si no → usa sales + cash_expenses normal.
     """
-    if await _tiene_data_migrada(sede_id, fecha):
-        return await _movimientos_efectivo_migrado(sede_id, fecha)
-    return await _obtener_movimientos_efectivo_dia_sistema(sede_id, fecha)
+    if await _migrado_ctx(sede_id, fecha, contexto):
+        return await _movimientos_efectivo_migrado(sede_id, fecha, contexto)
+    return await _obtener_movimientos_efectivo_dia_sistema(sede_id, fecha, contexto)
+
+
+async def calcular_dia_completo(sede_id: str, fecha: str) -> Dict[str, Any]:
+    """
+    Resumen y listados de un día con las entradas compartidas consultadas
+    una sola vez. Mismo formato que un día de calcular_periodo().
+    """
+    contexto = await contexto_dia(sede_id, fecha)
+    resumen, ventas, egresos, movimientos = await _reunir(
+        lambda: calcular_resumen_dia(sede_id, fecha, contexto),
+        lambda: obtener_ventas_dia(sede_id, fecha, contexto),
+        lambda: obtener_egresos_dia(sede_id, fecha, contexto),
+        lambda: obtener_movimientos_efectivo_dia(sede_id, fecha, contexto),
+    )
+    return {
+        "resumen"             : resumen,
+        "ventas"              : ventas,
+        "egresos"             : egresos,
+        "movimientos_efectivo": movimientos,
+    }
+
+
+# ============================================================
+# ── MOTOR DE PERIODO ────────────────────────────────────────
+# Calcula todos los días de un rango con unas pocas consultas
+# (agrupadas por fecha) en lugar de llamar a las funciones por
+# día una y otra vez. Usa los mismos helpers de armado que las
+# funciones por día, así que el resultado de cada día es igual.
+#
+# Verificación y benchmark:
+#   python -m app.cash.accounting_logic --paridad SEDE_ID INICIO FIN
+#   python -m app.cash.accounting_logic --bench SEDE_ID FECHA_FIN
+#   python -m app.cash.accounting_logic --bench-dia SEDE_ID FECHA
+# ============================================================
+
+def fechas_rango(fecha_inicio: str, fecha_fin: str) -> List[str]:
+    """Lista de fechas YYYY-MM-DD entre ambas (inclusive, en cualquier orden)."""
+    inicio_dt = datetime.strptime(fecha_inicio, "%Y-%m-%d")
+    fin_dt    = datetime.strptime(fecha_fin, "%Y-%m-%d")
+    if inicio_dt > fin_dt:
+        inicio_dt, fin_dt = fin_dt, inicio_dt
+    return [
+        (inicio_dt + timedelta(days=offset)).strftime("%Y-%m-%d")
+        for offset in range((fin_dt - inicio_dt).days + 1)
+    ]
+
+
+def _fechas_query_rango(fechas: List[str]) -> Dict[str, str]:
+    """{valor_guardado: YYYY-MM-DD} con los dos formatos que tolera _fecha_query."""
+    mapa = {}
+    for fecha in fechas:
+        for valor in _fecha_query(fecha)["$in"]:
+            mapa[valor] = fecha
+    return mapa
+
+
+def _es_monto_positivo(valor: Any) -> bool:
+    # Equivale a {"$gt": 0} de MongoDB: solo números
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool) and valor > 0
+
+
+def _filtro_sedes(sede_ids: List[str]) -> Any:
+    return sede_ids[0] if len(sede_ids) == 1 else {"$in": sede_ids}
+
+
+def _pipeline_pagos_rango(sede_ids: List[str], inicio: datetime, fin: datetime, es_cita: bool) -> List[Dict]:
+    match: Dict[str, Any] = {
+        "sede_id": _filtro_sedes(sede_ids),
+        "historial_pagos": {"$exists": True, "$ne": []},
+        # Mismo resultado que sin este filtro (se re-filtra tras el unwind),
+        # pero descarta temprano los documentos sin pagos en el rango
+        "historial_pagos.fecha": {"$gte": inicio, "$lte": fin},
+    }
+    if es_cita:
+        match["$or"] = [
+            {"estado_factura": {"$exists": False}},
+            {"estado_factura": {"$ne": "facturado"}}
+        ]
+    return [
+        {"$match": match},
+        {"$unwind": "$historial_pagos"},
+        {"$match": {"historial_pagos.fecha": {"$gte": inicio, "$lte": fin}}},
+    ]
+
+
+_DIA_PAGO = {"$dateToString": {"format": "%Y-%m-%d", "date": "$historial_pagos.fecha"}}
+
+_CAMPOS_FILA_CITA = {
+    "sede_id": 1, "historial_pagos": 1, "cliente_nombre": 1, "cedula_cliente": 1,
+    "cliente_email": 1, "cliente_telefono": 1, "numero_comprobante": 1,
+}
+_CAMPOS_FILA_SALE = {
+    "sede_id": 1, "historial_pagos": 1, "nombre_cliente": 1, "cedula_cliente": 1,
+    "email_cliente": 1, "telefono_cliente": 1, "numero_comprobante": 1,
+    "identificador": 1, "facturado_por": 1, "tipo_origen": 1,
+}
+
+
+async def _totales_pagos_rango(coleccion, sede_ids: List[str], inicio: datetime, fin: datetime, es_cita: bool) -> List[Dict]:
+    """Totales por (sede, día, método, tipo) de historial_pagos en el rango."""
+    pipeline = _pipeline_pagos_rango(sede_ids, inicio, fin, es_cita) + [
+        {
+            "$group": {
+                "_id": {
+                    "sede"  : "$sede_id",
+                    "dia"   : _DIA_PAGO,
+                    "metodo": "$historial_pagos.metodo",
+                    "tipo"  : "$historial_pagos.tipo",
+                },
+                "total": {"$sum": "$historial_pagos.monto"}
+            }
+        }
+    ]
+    return await coleccion.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+
+async def _filas_pagos_rango(coleccion, sede_ids: List[str], inicio: datetime, fin: datetime, es_cita: bool) -> List[Dict]:
+    """Cada pago del rango (desenrollado) con los campos que usan las hojas."""
+    pipeline = _pipeline_pagos_rango(sede_ids, inicio, fin, es_cita) + [
+        {"$project": _CAMPOS_FILA_CITA if es_cita else _CAMPOS_FILA_SALE}
+    ]
+    return await coleccion.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+
+def _elegir_apertura(aperturas: List[Dict], sede_id: str, fecha: str) -> Optional[Dict]:
+    """Mismas tres estrategias (y prioridad) que _buscar_apertura."""
+    apertura_id = f"AP-{fecha}-{sede_id}"
+    formatos    = _fecha_query(fecha)["$in"]
+    for cumple in (
+        lambda a: a.get("apertura_id") == apertura_id,
+        lambda a: a.get("sede_id") == sede_id and a.get("tipo") == "apertura" and a.get("fecha") == fecha,
+        lambda a: a.get("sede_id") == sede_id and a.get("tipo") == "apertura" and a.get("fecha") in formatos,
+    ):
+        for apertura in aperturas:
+            if cumple(apertura):
+                return apertura
+    return None
+
+
+async def calcular_periodo(
+    sede_id: str,
+    fecha_inicio: str,
+    fecha_fin: str,
+    detalle: bool = True,
+    movimientos: bool = True
+) -> Dict[str, Dict]:
+    """
+    Calcula cada día del rango con un número fijo de consultas.
+
+    Returns:
+        {fecha: {"resumen": ..., "ventas": [...], "egresos": [...],
+                 "movimientos_efectivo": {...}}}
+        Cada valor es igual al de calcular_resumen_dia, obtener_ventas_dia,
+        obtener_egresos_dia y obtener_movimientos_efectivo_dia para ese día.
+        Con detalle=False solo se calcula "resumen" (sin filas de pagos).
+        Con movimientos=False se omite "movimientos_efectivo" (para periodos
+        largos está libro_efectivo, paginado y calculado en la base).
+    """
+    return (await calcular_periodo_sedes([sede_id], fecha_inicio, fecha_fin, detalle, movimientos))[sede_id]
+
+
+async def calcular_periodo_sedes(
+    sede_ids: List[str],
+    fecha_inicio: str,
+    fecha_fin: str,
+    detalle: bool = False,
+    movimientos: bool = True
+) -> Dict[str, Dict[str, Dict]]:
+    """
+    calcular_periodo() de varias sedes a la vez: las mismas consultas,
+    con sede_id $in y agrupadas por (sede, día), así el número de
+    consultas no crece con las sedes ni con los días.
+
+    Returns:
+        {sede_id: {fecha: dia}} con el formato de calcular_periodo().
+    """
+    sede_ids  = list(dict.fromkeys(sede_ids))
+    filtro    = _filtro_sedes(sede_ids)
+    fechas    = fechas_rango(fecha_inicio, fecha_fin)
+    mapa      = _fechas_query_rango(fechas)
+    inicio_dt = datetime.strptime(fechas[0], "%Y-%m-%d")
+    fin_dt    = datetime.strptime(fechas[-1], "%Y-%m-%d").replace(hour=23, minute=59, second=59, microsecond=999999)
+
+    consultas = [
+        lambda: locales.find({"sede_id": filtro}).to_list(None),
+        lambda: cash_closures.find({"$or": [
+            {"apertura_id": {"$in": [f"AP-{f}-{s}" for s in sede_ids for f in fechas]}},
+            {"sede_id": filtro, "tipo": "apertura", "fecha": {"$in": list(mapa)}},
+        ]}).to_list(None),
+        lambda: cash_expenses.find({
+            "sede_id": filtro,
+            "fecha"  : {"$in": list(mapa)},
+        }).sort("creado_en", 1).to_list(None),
+        lambda: cash_incomes.find({
+            "sede_id": filtro,
+            "fecha": {"$in": list(mapa)},
+            "eliminado": {"$ne": True}
+        }).sort("creado_en", 1).to_list(None),
+        lambda: sales.find({
+            "sede_id"        : filtro,
+            "fecha_pago"     : {"$gte": inicio_dt, "$lte": fin_dt},
+            "historial_pagos": {"$exists": False},
+            "desglose_pagos" : {"$exists": True}
+        }).to_list(None),
+        lambda: _totales_pagos_rango(appointments, sede_ids, inicio_dt, fin_dt, es_cita=True),
+        lambda: _totales_pagos_rango(sales, sede_ids, inicio_dt, fin_dt, es_cita=False),
+    ]
+    if detalle:
+        consultas += [
+            lambda: _filas_pagos_rango(appointments, sede_ids, inicio_dt, fin_dt, es_cita=True),
+            lambda: _filas_pagos_rango(sales, sede_ids, inicio_dt, fin_dt, es_cita=False),
+        ]
+
+    resultados = await _reunir(*consultas)
+    sedes, aperturas, gastos, manuales, ventas_migradas, totales_citas, totales_sales = resultados[:7]
+    filas_citas, filas_sales = resultados[7:] if detalle else ([], [])
+
+    # ── Repartir por sede y día ──────────────────────────────
+    por_sede: Dict[str, Dict[str, Dict[str, list]]] = {
+        s: {
+            f: {
+                "migrado": [], "gastos": [], "manuales": [], "ventas_migradas": [],
+                "totales_citas": [], "totales_sales": [], "filas_citas": [], "filas_sales": [],
+            }
+            for f in fechas
+        }
+        for s in sede_ids
+    }
+
+    def _dia(sede_id: Any, fecha: Optional[str]) -> Optional[Dict[str, list]]:
+        return por_sede.get(sede_id, {}).get(fecha) if fecha else None
+
+    for doc in gastos:
+        fecha = mapa.get(doc.get("fecha")) if isinstance(doc.get("fecha"), str) else None
+        datos = _dia(doc.get("sede_id"), fecha)
+        if datos is None:
+            continue
+        if doc.get("origen") == "migracion":
+            datos["migrado"].append(doc)
+        elif doc.get("eliminado") is not True:
+            datos["gastos"].append(doc)
+
+    for doc in manuales:
+        fecha = mapa.get(doc.get("fecha")) if isinstance(doc.get("fecha"), str) else None
+        datos = _dia(doc.get("sede_id"), fecha)
+        if datos is not None:
+            datos["manuales"].append(doc)
+
+    for venta in ventas_migradas:
+        datos = _dia(venta.get("sede_id"), venta["fecha_pago"].strftime("%Y-%m-%d"))
+        if datos is not None:
+            datos["ventas_migradas"].append(venta)
+
+    for clave, items in (("totales_citas", totales_citas), ("totales_sales", totales_sales)):
+        for item in items:
+            datos = _dia(item["_id"].get("sede"), item["_id"].get("dia"))
+            if datos is not None:
+                datos[clave].append(item)
+
+    for clave, filas in (("filas_citas", filas_citas), ("filas_sales", filas_sales)):
+        for fila in filas:
+            datos = _dia(fila.get("sede_id"), fila["historial_pagos"]["fecha"].strftime("%Y-%m-%d"))
+            if datos is not None:
+                datos[clave].append(fila)
+
+    sede_por_id: Dict[str, Dict] = {}
+    for sede in sedes:
+        sede_por_id.setdefault(sede.get("sede_id"), sede)
+    aperturas_por_sede: Dict[str, List[Dict]] = {s: [] for s in sede_ids}
+    for apertura in aperturas:
+        # apertura_id = "AP-YYYY-MM-DD-SEDE"; puede coincidir por id o por sede_id
+        for s in {apertura.get("sede_id"), str(apertura.get("apertura_id") or "")[14:]}:
+            if s in aperturas_por_sede:
+                aperturas_por_sede[s].append(apertura)
+
+    return {
+        s: _armar_periodo(s, sede_por_id.get(s), aperturas_por_sede[s], fechas, por_sede[s], detalle, movimientos)
+        for s in sede_ids
+    }
+
+
+def _armar_periodo(
+    sede_id: str,
+    sede: Optional[Dict],
+    aperturas: List[Dict],
+    fechas: List[str],
+    por_dia: Dict[str, Dict[str, list]],
+    detalle: bool,
+    movimientos: bool
+) -> Dict[str, Dict]:
+    # ── Armar cada día con los mismos helpers que las funciones por día ──
+    periodo: Dict[str, Dict] = {}
+    for fecha in fechas:
+        datos    = por_dia[fecha]
+        apertura = _elegir_apertura(aperturas, sede_id, fecha)
+        saldo_inicial = apertura.get("efectivo_inicial", 0) if apertura else 0
+        migrado  = bool(datos["migrado"])
+        manuales_dia = datos["manuales"]
+
+        if migrado:
+            por_categoria = {"INGRESO": [], "EGRESO": [], "EFECTIVO": []}
+            for doc in datos["migrado"]:
+                if doc.get("categoria") in por_categoria:
+                    por_categoria[doc["categoria"]].append(doc)
+
+            efectivo_citas         = 0
+            efectivo_sales         = _resumen_efectivo_migrado(por_categoria["INGRESO"])["total"]
+            ingresos_discriminados = _metodos_migrado(por_categoria["INGRESO"])
+            egresos_resumen        = _resumen_egresos_migrado(por_categoria["EGRESO"])
+        else:
+            efectivo_citas = sum(t["total"] for t in datos["totales_citas"] if t["_id"].get("metodo") == "efectivo")
+            efectivo_sales = sum(t["total"] for t in datos["totales_sales"] if t["_id"].get("metodo") == "efectivo")
+            efectivo_sales += sum(
+                v["desglose_pagos"]["efectivo"] for v in datos["ventas_migradas"]
+                if isinstance(v.get("desglose_pagos"), dict) and _es_monto_positivo(v["desglose_pagos"].get("efectivo"))
+            )
+            total_abonos = sum(
+                t["total"] for t in datos["totales_citas"] + datos["totales_sales"]
+                if t["_id"].get("tipo") == "abono_inicial"
+            )
+            ingresos_discriminados = _armar_metodos_sistema(
+                [(t["_id"].get("metodo"), t["total"]) for t in datos["totales_citas"]],
+                [(t["_id"].get("metodo"), t["total"]) for t in datos["totales_sales"]],
+                datos["ventas_migradas"],
+                total_abonos,
+            )
+            egresos_resumen = _resumen_egresos_sistema(datos["gastos"])
+
+        dia = {
+            "resumen": _armar_resumen_dia(
+                sede_id, fecha, sede, apertura, migrado,
+                efectivo_citas, efectivo_sales, ingresos_discriminados, egresos_resumen,
+                _ingresos_manuales_metodos(manuales_dia),
+            )
+        }
+
+        if detalle:
+            if migrado:
+                ventas = _formatear_ventas_migrado(por_categoria["INGRESO"], fecha)
+                dia["egresos"] = _formatear_egresos_migrado(por_categoria["EGRESO"], fecha)
+                if movimientos:
+                    dia["movimientos_efectivo"] = _movimientos_migrado(
+                        saldo_inicial, por_categoria["EFECTIVO"], manuales_dia, fecha
+                    )
+            else:
+                ventas = _formatear_ventas_sistema(datos["filas_citas"], datos["filas_sales"], datos["ventas_migradas"])
+                dia["egresos"] = _formatear_egresos_sistema(datos["gastos"])
+                if movimientos:
+                    dia["movimientos_efectivo"] = _movimientos_sistema(
+                        saldo_inicial,
+                        [f for f in datos["filas_citas"] if f["historial_pagos"].get("metodo") == "efectivo"],
+                        [f for f in datos["filas_sales"] if f["historial_pagos"].get("metodo") == "efectivo"],
+                        [
+                            v for v in datos["ventas_migradas"]
+                            if isinstance(v.get("desglose_pagos"), dict) and _es_monto_positivo(v["desglose_pagos"].get("efectivo"))
+                        ],
+                        manuales_dia, datos["gastos"], fecha,
+                    )
+            ventas.extend(_formatear_ingresos_manuales_para_flujo(manuales_dia, fecha))
+            ventas.sort(key=lambda item: item.get("fecha") or datetime.min)
+            dia["ventas"] = ventas
+
+        periodo[fecha] = dia
+
+    return periodo
+
+
+# ============================================================
+# VERIFICACIÓN DE PARIDAD Y BENCHMARK
+# ============================================================
+
+async def _periodo_dia_a_dia(sede_id: str, fechas: List[str]) -> Dict[str, Dict]:
+    """El cálculo anterior: las cuatro funciones por día, en serie."""
+    periodo = {}
+    for fecha in fechas:
+        periodo[fecha] = {
+            "resumen"             : await calcular_resumen_dia(sede_id, fecha),
+            "ventas"              : await obtener_ventas_dia(sede_id, fecha),
+            "egresos"             : await obtener_egresos_dia(sede_id, fecha),
+            "movimientos_efectivo": await obtener_movimientos_efectivo_dia(sede_id, fecha),
+        }
+    return periodo
+
+
+def diferencias(esperado: Any, obtenido: Any, ruta: str = "") -> List[str]:
+    """Diferencias entre dos resultados (montos con tolerancia de redondeo)."""
+    if isinstance(esperado, bool) or isinstance(obtenido, bool):
+        return [] if esperado == obtenido else [f"{ruta}: {esperado!r} != {obtenido!r}"]
+    if isinstance(esperado, (int, float)) and isinstance(obtenido, (int, float)):
+        return [] if math.isclose(esperado, obtenido, rel_tol=1e-9, abs_tol=1e-6) else [f"{ruta}: {esperado!r} != {obtenido!r}"]
+    if isinstance(esperado, dict) and isinstance(obtenido, dict):
+        salida = []
+        for clave in sorted(set(esperado) | set(obtenido), key=str):
+            if clave not in esperado or clave not in obtenido:
+                salida.append(f"{ruta}.{clave}: falta en {'esperado' if clave not in esperado else 'obtenido'}")
+            else:
+                salida += diferencias(esperado[clave], obtenido[clave], f"{ruta}.{clave}")
+        return salida
+    if isinstance(esperado, list) and isinstance(obtenido, list):
+        if len(esperado) != len(obtenido):
+            return [f"{ruta}: {len(esperado)} elementos != {len(obtenido)}"]
+        salida = []
+        for i, (a, b) in enumerate(zip(esperado, obtenido)):
+            salida += diferencias(a, b, f"{ruta}[{i}]")
+        return salida
+    return [] if esperado == obtenido else [f"{ruta}: {esperado!r} != {obtenido!r}"]
+
+
+async def verificar_paridad(sede_id: str, fecha_inicio: str, fecha_fin: str) -> List[str]:
+    """Compara calcular_periodo con las funciones por día. Lista vacía = idénticos."""
+    fechas   = fechas_rango(fecha_inicio, fecha_fin)
+    esperado = await _periodo_dia_a_dia(sede_id, fechas)
+    obtenido = await calcular_periodo(sede_id, fecha_inicio, fecha_fin)
+    return diferencias(esperado, obtenido)
+
+
+async def benchmark_periodo(sede_id: str, fecha_fin: str, dias: tuple = (1, 31, 365)) -> List[Dict]:
+    resultados = []
+    fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d")
+    for n in dias:
+        inicio = (fin_dt - timedelta(days=n - 1)).strftime("%Y-%m-%d")
+        fechas = fechas_rango(inicio, fecha_fin)
+
+        t0 = time.perf_counter()
+        await _periodo_dia_a_dia(sede_id, fechas)
+        t_dia_a_dia = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        await calcular_periodo(sede_id, inicio, fecha_fin)
+        t_periodo = time.perf_counter() - t0
+
+        resultados.append({
+            "dias": n,
+            "dia_a_dia_s": round(t_dia_a_dia, 3),
+            "periodo_s": round(t_periodo, 3),
+            "aceleracion": round(t_dia_a_dia / t_periodo, 1) if t_periodo else None,
+        })
+    return resultados
+
+
+async def _dia_en_serie(sede_id: str, fecha: str) -> Dict[str, Any]:
+    """Las cuatro funciones por separado (sin contexto compartido)."""
+    return {
+        "resumen"             : await calcular_resumen_dia(sede_id, fecha),
+        "ventas"              : await obtener_ventas_dia(sede_id, fecha),
+        "egresos"             : await obtener_egresos_dia(sede_id, fecha),
+        "movimientos_efectivo": await obtener_movimientos_efectivo_dia(sede_id, fecha),
+    }
+
+
+async def benchmark_dia(sede_id: str, fecha: str, repeticiones: int = 5) -> List[Dict]:
+    """
+    Latencia de un día: consultas en serie (límite 1, cada función pide sus
+    propias entradas, como antes) contra consultas concurrentes con el
+    contexto compartido. Se reporta la mediana en milisegundos.
+    """
+    async def _medir(corutina_fn, limite: int) -> tuple:
+        token = _limite_consultas.set(limite)
+        try:
+            tiempos, resultado = [], None
+            for _ in range(repeticiones):
+                t0 = time.perf_counter()
+                resultado = await corutina_fn()
+                tiempos.append(time.perf_counter() - t0)
+        finally:
+            _limite_consultas.reset(token)
+        tiempos.sort()
+        return round(tiempos[len(tiempos) // 2] * 1000, 1), resultado
+
+    casos = [
+        ("resumen", lambda: calcular_resumen_dia(sede_id, fecha), lambda: calcular_resumen_dia(sede_id, fecha)),
+        ("dia_completo", lambda: _dia_en_serie(sede_id, fecha), lambda: calcular_dia_completo(sede_id, fecha)),
+    ]
+    filas = []
+    for nombre, en_serie, concurrente in casos:
+        serie_ms, esperado = await _medir(en_serie, 1)
+        conc_ms, obtenido = await _medir(concurrente, CONSULTAS_CONCURRENTES)
+        filas.append({
+            "caso": nombre,
+            "serie_ms": serie_ms,
+            "concurrente_ms": conc_ms,
+            "aceleracion": round(serie_ms / conc_ms, 1) if conc_ms else None,
+            "identicos": not diferencias(esperado, obtenido),
+        })
+    return filas
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) == 4 and args[0] == "--paridad":
+        difs = asyncio.run(verificar_paridad(args[1], args[2], args[3]))
+        print("✅ Idénticos" if not difs else "\n".join(difs[:200]))
+        sys.exit(1 if difs else 0)
+    elif len(args) == 3 and args[0] == "--bench":
+        for fila in asyncio.run(benchmark_periodo(args[1], args[2])):
+            print(fila)
+    elif len(args) == 3 and args[0] == "--bench-dia":
+        for fila in asyncio.run(benchmark_dia(args[1], args[2])):
+            print(fila)
+    else:
+        print("Uso:\n"
+              "  python -m app.cash.accounting_logic --paridad SEDE_ID INICIO FIN\n"
+              "  python -m app.cash.accounting_logic --bench SEDE_ID FECHA_FIN\n"
+              "  python -m app.cash.accounting_logic --bench-dia SEDE_ID FECHA")
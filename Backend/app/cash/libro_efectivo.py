@@ -0,0 +1,408 @@
+# ============================================================
+# libro_efectivo.py - Movimientos en efectivo con saldo corrido en MongoDB
+# Ubicación: app/cash/libro_efectivo.py
+#
+# Mismos movimientos que obtener_movimientos_efectivo_dia(), pero para
+# un periodo y calculados en la base:
+#
+# - Una sola agregación sobre appointments con $unionWith a sales,
+#   cash_ingresos y cash_expenses arma el libro (pagos en efectivo de
+#   citas y ventas, ventas migradas, ingresos manuales, egresos en
+#   efectivo y, en días migrados, los movimientos EFECTIVO migrados).
+# - El orden es por fecha y, en empates, por origen y documento; la
+#   clave "k" lo resume en un string para paginar por keyset.
+# - El saldo corrido lo calcula $setWindowFields sobre cada página, a
+#   partir del saldo con que terminó la anterior (viaja en el cursor),
+#   así una página no recorre las anteriores.
+#
+# La API nunca tiene el periodo completo en memoria: cada página trae
+# como máximo `limite` movimientos.
+# ============================================================
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.database.mongo import collection_citas as appointments
+from .accounting_logic import (
+    _buscar_apertura,
+    _fechas_query_rango,
+    cash_expenses,
+    fechas_rango,
+)
+
+LIMITE_PAGINA = 500
+
+# Orden de los orígenes en empates de fecha (el mismo en que el cálculo
+# por día los agrega antes de ordenar)
+ORDEN_EFECTIVO_MIGRADO = 0
+ORDEN_CITA = 1
+ORDEN_VENTA = 2
+ORDEN_VENTA_MIGRADA = 3
+ORDEN_INGRESO_MANUAL = 4
+ORDEN_EGRESO = 5
+
+# Movimientos sin fecha: primero, como datetime.min en el cálculo por día
+_FECHA_NULA = datetime(1970, 1, 1)
+
+
+# ============================================================
+# EXPRESIONES
+# ============================================================
+
+def _texto(expr: Any) -> Dict:
+    return {"$toString": {"$ifNull": [expr, ""]}}
+
+
+def _numero(expr: Any) -> Dict:
+    return {"$convert": {"input": expr, "to": "double", "onError": 0, "onNull": 0}}
+
+
+def _es_efectivo(metodo: Dict) -> Dict:
+    # Igual que _normalizar_metodo(...) == "efectivo"
+    return {"$eq": [{"$trim": {"input": {"$toLower": metodo}}}, "efectivo"]}
+
+
+def _fecha_desde_texto(expr: Any, formatos: Tuple[str, ...], si_no: Any) -> Any:
+    """Primer formato que parsee `expr`; si ninguno, `si_no`."""
+    resultado = si_no
+    for formato in reversed(formatos):
+        resultado = {"$dateFromString": {
+            "dateString": expr, "format": formato, "onError": resultado, "onNull": resultado,
+        }}
+    return resultado
+
+
+_FORMATOS_HORA = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+# Día del documento (fecha guardada como YYYY-MM-DD o DD-MM-YYYY)
+_DIA_DOCUMENTO = _fecha_desde_texto("$fecha", ("%Y-%m-%d", "%d-%m-%Y"), None)
+
+
+def _valor(expr: Any) -> Any:
+    # En $project un número o string suelto no es un valor: 0 excluye el campo
+    return {"$literal": expr} if isinstance(expr, (int, float, str)) and not str(expr).startswith("$") else expr
+
+
+def _movimiento(fecha: Any, orden: int, idx: Any, tipo: Any, descripcion: Any,
+                comprobante: Any, ingreso: Any, egreso: Any) -> Dict:
+    return {"$project": {
+        "_id"        : 0,
+        "fecha"      : fecha,
+        "orden"      : {"$literal": orden},
+        "ref"        : {"$toString": "$_id"},
+        "idx"        : _valor(idx),
+        "tipo"       : _valor(tipo),
+        "descripcion": descripcion,
+        "comprobante": comprobante,
+        "ingreso"    : _valor(ingreso),
+        "egreso"     : _valor(egreso),
+    }}
+
+
+# ============================================================
+# RAMAS DEL LIBRO
+# ============================================================
+
+def _rama_pagos(sede_id: str, inicio: datetime, fin: datetime, dias_migrados: List[str], es_cita: bool) -> List[Dict]:
+    match: Dict[str, Any] = {
+        "sede_id": sede_id,
+        "historial_pagos": {"$exists": True, "$ne": []},
+        "historial_pagos.fecha": {"$gte": inicio, "$lte": fin},
+    }
+    if es_cita:
+        match["$or"] = [
+            {"estado_factura": {"$exists": False}},
+            {"estado_factura": {"$ne": "facturado"}}
+        ]
+    despues: Dict[str, Any] = {
+        "historial_pagos.metodo": "efectivo",
+        "historial_pagos.fecha": {"$gte": inicio, "$lte": fin},
+    }
+    if dias_migrados:
+        despues["$expr"] = {"$not": [{"$in": [
+            {"$dateToString": {"format": "%Y-%m-%d", "date": "$historial_pagos.fecha"}}, dias_migrados
+        ]}]}
+
+    if es_cita:
+        descripcion = {"$concat": [_texto("$cliente_nombre"), " - cita"]}
+    else:
+        descripcion = {"$concat": [
+            _texto("$nombre_cliente"), " - ", _texto({"$ifNull": ["$tipo_origen", "venta"]})
+        ]}
+
+    return [
+        {"$match": match},
+        {"$unwind": {"path": "$historial_pagos", "includeArrayIndex": "idx"}},
+        {"$match": despues},
+        _movimiento(
+            "$historial_pagos.fecha", ORDEN_CITA if es_cita else ORDEN_VENTA, "$idx", "INGRESO",
+            descripcion, {"$ifNull": ["$numero_comprobante", ""]},
+            _numero("$historial_pagos.monto"), 0,
+        ),
+    ]
+
+
+def _rama_ventas_migradas(sede_id: str, inicio: datetime, fin: datetime, dias_migrados: List[str]) -> List[Dict]:
+    match: Dict[str, Any] = {
+        "sede_id"        : sede_id,
+        "fecha_pago"     : {"$gte": inicio, "$lte": fin},
+        "historial_pagos": {"$exists": False},
+        "desglose_pagos.efectivo": {"$exists": True, "$gt": 0}
+    }
+    if dias_migrados:
+        match["$expr"] = {"$not": [{"$in": [
+            {"$dateToString": {"format": "%Y-%m-%d", "date": "$fecha_pago"}}, dias_migrados
+        ]}]}
+    return [
+        {"$match": match},
+        _movimiento(
+            "$fecha_pago", ORDEN_VENTA_MIGRADA, 0, "INGRESO",
+            {"$concat": [_texto("$nombre_cliente"), " - venta migrada"]},
+            {"$ifNull": ["$numero_comprobante", ""]},
+            _numero("$desglose_pagos.efectivo"), 0,
+        ),
+    ]
+
+
+def _rama_ingresos_manuales(sede_id: str, fechas_guardadas: List[str]) -> List[Dict]:
+    # Fecha como _fecha_para_manual: creado_en, luego fecha, luego el día
+    fecha = {"$cond": [
+        {"$eq": [{"$type": "$creado_en"}, "date"]},
+        "$creado_en",
+        _fecha_desde_texto(
+            {"$trim": {"input": _texto("$creado_en")}}, _FORMATOS_HORA,
+            _fecha_desde_texto({"$trim": {"input": _texto("$fecha")}}, _FORMATOS_HORA, _DIA_DOCUMENTO),
+        ),
+    ]}
+    return [
+        {"$match": {
+            "sede_id": sede_id,
+            "fecha": {"$in": fechas_guardadas},
+            "eliminado": {"$ne": True},
+        }},
+        {"$match": {"$expr": {"$and": [
+            _es_efectivo(_texto("$metodo_pago")),
+            {"$gt": [_numero("$monto"), 0]},
+        ]}}},
+        _movimiento(
+            fecha, ORDEN_INGRESO_MANUAL, 0, "INGRESO",
+            {"$trim": {
+                "input": {"$concat": ["Ingreso manual - ", _texto("$motivo")]},
+                "chars": " -",
+            }},
+            {"$ifNull": ["$comprobante_numero", ""]},
+            _numero("$monto"), 0,
+        ),
+    ]
+
+
+def _rama_egresos(sede_id: str, fechas_guardadas: List[str]) -> List[Dict]:
+    # metodo_pago ausente cuenta como efectivo (e.get("metodo_pago", "efectivo"))
+    metodo = {"$cond": [
+        {"$eq": [{"$type": "$metodo_pago"}, "missing"]}, "efectivo", _texto("$metodo_pago")
+    ]}
+    return [
+        {"$match": {
+            "sede_id": sede_id,
+            "fecha"  : {"$in": fechas_guardadas},
+            "origen" : {"$ne": "migracion"},
+            "eliminado": {"$ne": True}
+        }},
+        {"$match": {"$expr": _es_efectivo(metodo)}},
+        _movimiento(
+            "$creado_en", ORDEN_EGRESO, 0, "EGRESO",
+            {"$concat": [_texto("$concepto"), " - ", _texto("$descripcion")]},
+            {"$ifNull": ["$comprobante_numero", ""]},
+            0, _numero("$monto"),
+        ),
+    ]
+
+
+def _rama_efectivo_migrado(sede_id: str, fechas_guardadas: List[str]) -> List[Dict]:
+    es_ingreso = {"$eq": [{"$trim": {"input": _texto({"$ifNull": ["$flujo", "+"]})}}, "+"]}
+    # Fecha como _extraer_fecha_migrado: _raw.fecha (con hora), fecha, el día
+    fecha = _fecha_desde_texto(
+        {"$trim": {"input": _texto("$_raw.fecha")}}, _FORMATOS_HORA,
+        _fecha_desde_texto({"$trim": {"input": _texto("$fecha")}}, _FORMATOS_HORA, _DIA_DOCUMENTO),
+    )
+    monto = _numero("$monto")
+    return [
+        {"$match": {
+            "sede_id"  : sede_id,
+            "fecha"    : {"$in": fechas_guardadas},
+            "categoria": "EFECTIVO",
+            "origen"   : "migracion"
+        }},
+        _movimiento(
+            fecha, ORDEN_EFECTIVO_MIGRADO, 0,
+            {"$cond": [es_ingreso, "INGRESO", "EGRESO"]},
+            {"$trim": {
+                "input": {"$concat": [_texto("$tipo"), " - ", _texto("$notas")]},
+                "chars": " -",
+            }},
+            {"$ifNull": ["$nro_comprobante", ""]},
+            {"$cond": [es_ingreso, monto, 0]},
+            {"$cond": [es_ingreso, 0, monto]},
+        ),
+    ]
+
+
+# ============================================================
+# LIBRO COMPLETO
+# ============================================================
+
+async def _preparar_libro(sede_id: str, fecha_inicio: str, fecha_fin: str) -> Tuple[List[Dict], float]:
+    """Pipeline base del libro (sin orden ni saldo) y saldo inicial del periodo."""
+    fechas = fechas_rango(fecha_inicio, fecha_fin)
+    mapa   = _fechas_query_rango(fechas)
+    inicio = datetime.strptime(fechas[0], "%Y-%m-%d")
+    fin    = datetime.strptime(fechas[-1], "%Y-%m-%d").replace(hour=23, minute=59, second=59, microsecond=999999)
+
+    guardadas_migradas = await cash_expenses.distinct("fecha", {
+        "sede_id": sede_id,
+        "fecha"  : {"$in": list(mapa)},
+        "origen" : "migracion",
+    })
+    dias_migrados = sorted({mapa[f] for f in guardadas_migradas if f in mapa})
+    guardadas_sistema = [g for g, dia in mapa.items() if dia not in dias_migrados]
+    guardadas_migrado = [g for g, dia in mapa.items() if dia in dias_migrados]
+
+    pipeline = _rama_pagos(sede_id, inicio, fin, dias_migrados, es_cita=True) + [
+        {"$unionWith": {"coll": "sales", "pipeline": _rama_pagos(sede_id, inicio, fin, dias_migrados, es_cita=False)}},
+        {"$unionWith": {"coll": "sales", "pipeline": _rama_ventas_migradas(sede_id, inicio, fin, dias_migrados)}},
+        {"$unionWith": {"coll": "cash_ingresos", "pipeline": _rama_ingresos_manuales(sede_id, list(mapa))}},
+        {"$unionWith": {"coll": "cash_expenses", "pipeline": _rama_egresos(sede_id, guardadas_sistema)}},
+    ]
+    if guardadas_migrado:
+        pipeline.append(
+            {"$unionWith": {"coll": "cash_expenses", "pipeline": _rama_efectivo_migrado(sede_id, guardadas_migrado)}}
+        )
+    pipeline.append({"$set": {"k": {"$concat": [
+        {"$dateToString": {
+            "format": "%Y-%m-%dT%H:%M:%S.%LZ",
+            "date": {"$cond": [{"$eq": [{"$type": "$fecha"}, "date"]}, "$fecha", _FECHA_NULA]},
+        }},
+        "|", {"$toString": "$orden"}, "|", "$ref",
+    ]}}})
+
+    apertura = await _buscar_apertura(sede_id, fechas[0])
+    saldo_inicial = apertura.get("efectivo_inicial", 0) if apertura else 0
+    return pipeline, saldo_inicial
+
+
+def _codificar_cursor(k: str, idx: int, saldo: float) -> str:
+    datos = json.dumps({"k": k, "i": idx, "s": saldo}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(datos.encode()).decode()
+
+
+def _decodificar_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return {"k": str(datos["k"]), "i": int(datos["i"]), "s": float(datos["s"])}
+    except Exception as exc:
+        raise ValueError("Cursor de movimientos inválido") from exc
+
+
+async def pagina_movimientos_efectivo(
+    sede_id: str,
+    fecha_inicio: str,
+    fecha_fin: str,
+    cursor: Optional[str] = None,
+    limite: int = LIMITE_PAGINA
+) -> Dict[str, Any]:
+    """
+    Una página del libro de efectivo del periodo, ya ordenada y con saldo.
+
+    Returns:
+        {"saldo_inicial", "movimientos", "saldo_final", "siguiente"}
+        saldo_inicial/saldo_final son los de la página; "siguiente" es el
+        cursor de la próxima página o None si es la última.
+    """
+    pipeline, saldo_base = await _preparar_libro(sede_id, fecha_inicio, fecha_fin)
+    if cursor:
+        posicion = _decodificar_cursor(cursor)
+        saldo_base = posicion["s"]
+        pipeline.append({"$match": {"$or": [
+            {"k": {"$gt": posicion["k"]}},
+            {"k": posicion["k"], "idx": {"$gt": posicion["i"]}},
+        ]}})
+
+    pipeline += [
+        {"$sort": {"k": 1, "idx": 1}},
+        {"$limit": limite + 1},
+        {"$setWindowFields": {
+            "sortBy": {"k": 1, "idx": 1},
+            "output": {"saldo": {
+                "$sum": {"$subtract": ["$ingreso", "$egreso"]},
+                "window": {"documents": ["unbounded", "current"]},
+            }},
+        }},
+        {"$set": {"saldo": {"$add": ["$saldo", saldo_base]}}},
+    ]
+
+    filas = await appointments.aggregate(pipeline, allowDiskUse=True).to_list(limite + 1)
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+
+    movimientos = [
+        {
+            "fecha"      : f.get("fecha"),
+            "tipo"       : f["tipo"],
+            "descripcion": f["descripcion"],
+            "comprobante": f["comprobante"],
+            "ingreso"    : f["ingreso"],
+            "egreso"     : f["egreso"],
+            "saldo"      : f["saldo"],
+        }
+        for f in filas
+    ]
+    saldo_final = movimientos[-1]["saldo"] if movimientos else saldo_base
+    siguiente = None
+    if hay_mas:
+        siguiente = _codificar_cursor(filas[-1]["k"], int(filas[-1]["idx"]), saldo_final)
+
+    return {
+        "saldo_inicial": saldo_base,
+        "movimientos"  : movimientos,
+        "saldo_final"  : saldo_final,
+        "siguiente"    : siguiente,
+    }
+
+
+async def iterar_movimientos_efectivo(
+    sede_id: str,
+    fecha_inicio: str,
+    fecha_fin: str,
+    limite: int = LIMITE_PAGINA
+) -> AsyncIterator[Dict]:
+    """Recorre el libro completo página a página (para hojas de Excel)."""
+    cursor = None
+    while True:
+        pagina = await pagina_movimientos_efectivo(sede_id, fecha_inicio, fecha_fin, cursor, limite)
+        for movimiento in pagina["movimientos"]:
+            yield movimiento
+        cursor = pagina["siguiente"]
+        if not cursor:
+            return
+
+
+async def totales_movimientos_efectivo(sede_id: str, fecha_inicio: str, fecha_fin: str) -> Dict[str, Any]:
+    """Saldo inicial, totales y saldo final del libro, sin traer los movimientos."""
+    pipeline, saldo_inicial = await _preparar_libro(sede_id, fecha_inicio, fecha_fin)
+    pipeline.append({"$group": {
+        "_id"     : None,
+        "ingresos": {"$sum": "$ingreso"},
+        "egresos" : {"$sum": "$egreso"},
+        "cantidad": {"$sum": 1},
+    }})
+    totales = await appointments.aggregate(pipeline, allowDiskUse=True).to_list(1)
+    t = totales[0] if totales else {"ingresos": 0, "egresos": 0, "cantidad": 0}
+    return {
+        "saldo_inicial" : saldo_inicial,
+        "total_ingresos": t["ingresos"],
+        "total_egresos" : t["egresos"],
+        "movimientos"   : t["cantidad"],
+        "saldo_final"   : saldo_inicial + t["ingresos"] - t["egresos"],
+    }
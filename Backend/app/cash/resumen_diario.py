@@ -0,0 +1,343 @@
+# ============================================================
+# resumen_diario.py - Resumen de caja materializado por sede/día
+# Ubicación: app/cash/resumen_diario.py
+#
+# Colección cash_daily_summary, un documento por (sede_id, fecha):
+#   {_id: "SEDE|YYYY-MM-DD", sede_id, fecha, resumen, version,
+#    sucio, calculado_en, invalidado_en, deriva}
+#
+# - Cada escritura que afecta la caja (pagos de citas y ventas,
+#   facturación, egresos, ingresos, apertura) llama a
+#   invalidar_resumen_dia() con las fechas afectadas: se marca el
+#   documento como sucio (version += 1) y se programa un recálculo
+#   en segundo plano con un pequeño debounce.
+# - El recálculo es del día completo con calcular_resumen_dia(), no
+#   deltas con $inc: un pago editado o una cita facturada cambia
+#   totales de forma no aditiva y los deltas acumulan deriva.
+# - El resultado solo se guarda si version no cambió mientras se
+#   calculaba; si cambió, el documento queda sucio y el siguiente
+#   recálculo lo corrige.
+# - obtener_resumen_dia() lee un solo documento. Si falta o está
+#   sucio se recalcula en la misma petición. Los últimos DIAS_ABIERTOS
+#   días (y los futuros) además vencen a los RESUMEN_MAX_EDAD_SEGUNDOS,
+#   red de seguridad para escrituras sin gancho; los días anteriores
+#   solo se recalculan por invalidación (sucio/version).
+# - obtener_resumenes_rango() lee varias sedes y días con una consulta y
+#   calcula juntos (calcular_periodo_sedes) solo los que no estén vigentes.
+# - verificar_resumen_dia() recalcula desde los datos crudos, compara
+#   con lo materializado y registra la deriva encontrada.
+#
+# Uso por consola:
+#   python -m app.cash.resumen_diario --rebuild INICIO FIN [SEDE_ID]
+#   python -m app.cash.resumen_diario --verificar SEDE_ID INICIO FIN
+# ============================================================
+
+import asyncio
+import logging
+import os
+import sys
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.database.mongo import collection_locales as locales, db
+from .accounting_logic import (
+    calcular_periodo,
+    calcular_periodo_sedes,
+    calcular_resumen_dia,
+    diferencias,
+    fechas_rango,
+)
+
+logger = logging.getLogger(__name__)
+
+collection_resumen_diario = db["cash_daily_summary"]
+
+RESUMEN_MAX_EDAD_SEGUNDOS = int(os.getenv("CASH_RESUMEN_MAX_EDAD", "600"))
+# Días recientes (incluido hoy) a los que se aplica RESUMEN_MAX_EDAD_SEGUNDOS
+DIAS_ABIERTOS = int(os.getenv("CASH_RESUMEN_DIAS_ABIERTOS", "2"))
+DEBOUNCE_SEGUNDOS = 1.0
+
+
+def _doc_id(sede_id: str, fecha: str) -> str:
+    return f"{sede_id}|{fecha}"
+
+
+def fecha_dia(valor: Any) -> Optional[str]:
+    """YYYY-MM-DD de un datetime o de un string YYYY-MM-DD / DD-MM-YYYY."""
+    if isinstance(valor, datetime):
+        return valor.strftime("%Y-%m-%d")
+    if isinstance(valor, str) and valor.strip():
+        texto = valor.strip()[:10]
+        for fmt in ("%Y-%m-%d", "%d-%m-%Y"):
+            try:
+                return datetime.strptime(texto, fmt).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+    return None
+
+
+# ============================================================
+# INVALIDACIÓN (llamada desde los endpoints que escriben)
+# ============================================================
+
+_recalculos: Dict[str, asyncio.Task] = {}
+
+
+async def invalidar_resumen_dia(sede_id: Optional[str], *fechas: Any) -> None:
+    """
+    Marca como sucios los resúmenes de la sede en esas fechas y programa
+    su recálculo. Nunca lanza: la escritura que la llama ya se guardó, y
+    un resumen que no se pudo marcar se corrige por edad o con --rebuild.
+    """
+    if not sede_id:
+        return
+    dias = {d for d in (fecha_dia(f) for f in fechas) if d}
+    for fecha in dias:
+        try:
+            await collection_resumen_diario.update_one(
+                {"_id": _doc_id(sede_id, fecha)},
+                {
+                    "$set": {"sede_id": sede_id, "fecha": fecha, "sucio": True, "invalidado_en": datetime.utcnow()},
+                    "$inc": {"version": 1},
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo invalidar el resumen {sede_id} {fecha}: {e}")
+            continue
+        _programar_recalculo(sede_id, fecha)
+
+
+async def invalidar_por_pagos(sede_id: Optional[str], historial_pagos: Optional[Iterable[Dict]], *otras_fechas: Any) -> None:
+    """Invalida los días de cada pago del historial (y fechas extra, p. ej. fecha_pago)."""
+    fechas = [p.get("fecha") for p in (historial_pagos or []) if isinstance(p, dict)]
+    await invalidar_resumen_dia(sede_id, *fechas, *otras_fechas)
+
+
+def _programar_recalculo(sede_id: str, fecha: str) -> None:
+    """Un recálculo pendiente por día y proceso; las invalidaciones seguidas se agrupan."""
+    clave = _doc_id(sede_id, fecha)
+    tarea = _recalculos.get(clave)
+    if tarea is not None and not tarea.done():
+        return
+    try:
+        _recalculos[clave] = asyncio.get_running_loop().create_task(_recalculo_diferido(sede_id, fecha))
+    except RuntimeError:
+        # Sin loop (scripts): el siguiente obtener_resumen_dia lo recalcula
+        pass
+
+
+async def _recalculo_diferido(sede_id: str, fecha: str) -> None:
+    try:
+        await asyncio.sleep(DEBOUNCE_SEGUNDOS)
+        await recalcular_resumen_dia(sede_id, fecha)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error recalculando resumen {sede_id} {fecha}: {e}")
+    finally:
+        _recalculos.pop(_doc_id(sede_id, fecha), None)
+
+
+async def detener_recalculos() -> None:
+    for tarea in list(_recalculos.values()):
+        tarea.cancel()
+    await asyncio.gather(*_recalculos.values(), return_exceptions=True)
+    _recalculos.clear()
+
+
+# ============================================================
+# RECÁLCULO Y LECTURA
+# ============================================================
+
+async def _guardar(
+    sede_id: str,
+    fecha: str,
+    resumen: Dict,
+    version: Optional[int],
+    extra: Optional[Dict] = None,
+    quitar: Iterable[str] = (),
+) -> bool:
+    """
+    Guarda el resumen si nadie invalidó el día mientras se calculaba.
+    version=None significa que el documento no existía al empezar.
+    `quitar`: campos a eliminar del documento existente.
+    """
+    campos = {"resumen": resumen, "sucio": False, "calculado_en": datetime.utcnow(), **(extra or {})}
+    if version is None:
+        try:
+            await collection_resumen_diario.insert_one({
+                "_id": _doc_id(sede_id, fecha), "sede_id": sede_id, "fecha": fecha, "version": 0, **campos
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+    cambios: Dict[str, Any] = {"$set": campos}
+    if quitar:
+        cambios["$unset"] = {c: "" for c in quitar}
+    resultado = await collection_resumen_diario.update_one(
+        {"_id": _doc_id(sede_id, fecha), "version": version}, cambios
+    )
+    return resultado.matched_count == 1
+
+
+async def recalcular_resumen_dia(sede_id: str, fecha: str, doc: Optional[Dict] = None) -> Dict:
+    if doc is None:
+        doc = await collection_resumen_diario.find_one({"_id": _doc_id(sede_id, fecha)}, {"version": 1})
+    version = doc.get("version", 0) if doc else None
+    resumen = await calcular_resumen_dia(sede_id, fecha)
+    await _guardar(sede_id, fecha, dict(resumen), version)
+    return resumen
+
+
+def _desde_abiertos() -> str:
+    return (date.today() - timedelta(days=DIAS_ABIERTOS - 1)).strftime("%Y-%m-%d")
+
+
+def _vigente(doc: Optional[Dict], desde_abiertos: str) -> bool:
+    if not doc or doc.get("sucio") or doc.get("resumen") is None:
+        return False
+    calculado_en = doc.get("calculado_en")
+    if not calculado_en:
+        return False
+    if doc.get("fecha", "") < desde_abiertos:
+        return True
+    return datetime.utcnow() - calculado_en <= timedelta(seconds=RESUMEN_MAX_EDAD_SEGUNDOS)
+
+
+async def obtener_resumen_dia(sede_id: str, fecha: str) -> Dict:
+    """Mismo resultado que calcular_resumen_dia(), leído de cash_daily_summary."""
+    doc = await collection_resumen_diario.find_one({"_id": _doc_id(sede_id, fecha)})
+    if _vigente(doc, _desde_abiertos()):
+        return doc["resumen"]
+    return await recalcular_resumen_dia(sede_id, fecha, doc)
+
+
+async def obtener_resumenes_rango(
+    sede_ids: List[str], fecha_inicio: str, fecha_fin: str
+) -> Dict[str, Dict[str, Dict]]:
+    """
+    {sede_id: {fecha: resumen}} de varias sedes en el rango, con el mismo
+    resultado que obtener_resumen_dia() por cada par. Los documentos se
+    leen con una sola consulta; los días faltantes, sucios o viejos se
+    calculan todos juntos con calcular_periodo_sedes() y se guardan.
+    """
+    fechas = fechas_rango(fecha_inicio, fecha_fin)
+    vigentes: Dict[str, Dict[str, Dict]] = {s: {} for s in sede_ids}
+    versiones: Dict[str, int] = {}
+    desde_abiertos = _desde_abiertos()
+
+    async for doc in collection_resumen_diario.find(
+        {"sede_id": {"$in": list(vigentes)}, "fecha": {"$gte": fechas[0], "$lte": fechas[-1]}},
+        {"sede_id": 1, "fecha": 1, "resumen": 1, "sucio": 1, "calculado_en": 1, "version": 1},
+    ):
+        if doc.get("sede_id") not in vigentes:
+            continue
+        if _vigente(doc, desde_abiertos):
+            vigentes[doc["sede_id"]][doc["fecha"]] = doc["resumen"]
+        else:
+            versiones[doc["_id"]] = doc.get("version", 0)
+
+    faltantes = [(s, f) for s in vigentes for f in fechas if f not in vigentes[s]]
+    if faltantes:
+        fechas_faltantes = sorted({f for _, f in faltantes})
+        periodo = await calcular_periodo_sedes(
+            sorted({s for s, _ in faltantes}), fechas_faltantes[0], fechas_faltantes[-1], detalle=False
+        )
+        semaforo = asyncio.Semaphore(16)
+
+        async def _guardar_uno(sede_id: str, fecha: str, resumen: Dict) -> None:
+            async with semaforo:
+                await _guardar(sede_id, fecha, dict(resumen), versiones.get(_doc_id(sede_id, fecha)))
+
+        for sede_id, fecha in faltantes:
+            vigentes[sede_id][fecha] = periodo[sede_id][fecha]["resumen"]
+        await asyncio.gather(*(_guardar_uno(s, f, vigentes[s][f]) for s, f in faltantes))
+        logger.info(f"Resúmenes de caja calculados en bloque: {len(faltantes)} sede-día(s)")
+
+    return {s: {f: vigentes[s][f] for f in fechas} for s in vigentes}
+
+
+async def verificar_resumen_dia(sede_id: str, fecha: str) -> Dict[str, Any]:
+    """
+    Modo verificación: recalcula desde appointments/sales/caja y compara con
+    el documento materializado. La deriva se registra en el documento y en
+    el log, y el resumen se reemplaza por el recalculado.
+
+    Returns:
+        {"resumen": dict recalculado, "deriva": [diferencias]}
+    """
+    doc = await collection_resumen_diario.find_one({"_id": _doc_id(sede_id, fecha)})
+    resumen = await calcular_resumen_dia(sede_id, fecha)
+
+    deriva: List[str] = []
+    if doc and doc.get("resumen") is not None and not doc.get("sucio"):
+        deriva = diferencias(resumen, doc["resumen"])
+    if deriva:
+        logger.warning(f"⚠️ Deriva en resumen de caja {sede_id} {fecha}: {len(deriva)} diferencia(s)")
+
+    extra = {"verificado_en": datetime.utcnow()}
+    if deriva:
+        extra["deriva"] = deriva[:50]
+    await _guardar(
+        sede_id, fecha, dict(resumen), doc.get("version", 0) if doc else None, extra,
+        quitar=() if deriva else ("deriva",),
+    )
+    return {"resumen": resumen, "deriva": deriva}
+
+
+# ============================================================
+# RECONSTRUCCIÓN POR RANGO
+# ============================================================
+
+async def reconstruir_resumenes(fecha_inicio: str, fecha_fin: str, sede_id: Optional[str] = None) -> Dict[str, int]:
+    """Recalcula y guarda los resúmenes del rango (una sede o todas)."""
+    sedes = [sede_id] if sede_id else [s for s in await locales.distinct("sede_id") if s]
+    fechas = fechas_rango(fecha_inicio, fecha_fin)
+    conteo = {"sedes": 0, "dias": 0, "omitidos": 0}
+
+    for sede in sedes:
+        ids = [_doc_id(sede, f) for f in fechas]
+        versiones = {
+            d["_id"]: d.get("version", 0)
+            for d in await collection_resumen_diario.find({"_id": {"$in": ids}}, {"version": 1}).to_list(None)
+        }
+        periodo = await calcular_periodo(sede, fechas[0], fechas[-1], detalle=False)
+        for fecha, dia in periodo.items():
+            if await _guardar(sede, fecha, dia["resumen"], versiones.get(_doc_id(sede, fecha))):
+                conteo["dias"] += 1
+            else:
+                # Invalidado durante la reconstrucción: lo toma el recálculo normal
+                conteo["omitidos"] += 1
+        conteo["sedes"] += 1
+        logger.info(f"✅ Resúmenes de caja reconstruidos: {sede} {fechas[0]} → {fechas[-1]}")
+
+    return conteo
+
+
+async def verificar_rango(sede_id: str, fecha_inicio: str, fecha_fin: str) -> Dict[str, List[str]]:
+    """{fecha: deriva} solo de los días con diferencias."""
+    salida = {}
+    for fecha in fechas_rango(fecha_inicio, fecha_fin):
+        deriva = (await verificar_resumen_dia(sede_id, fecha))["deriva"]
+        if deriva:
+            salida[fecha] = deriva
+    return salida
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) in (3, 4) and args[0] == "--rebuild":
+        print(asyncio.run(reconstruir_resumenes(args[1], args[2], args[3] if len(args) == 4 else None)))
+    elif len(args) == 4 and args[0] == "--verificar":
+        con_deriva = asyncio.run(verificar_rango(args[1], args[2], args[3]))
+        for fecha, deriva in con_deriva.items():
+            print(f"⚠️ {fecha}:\n  " + "\n  ".join(deriva[:20]))
+        print("✅ Sin deriva" if not con_deriva else f"{len(con_deriva)} día(s) con deriva")
+        sys.exit(1 if con_deriva else 0)
+    else:
+        print("Uso:\n"
+              "  python -m app.cash.resumen_diario --rebuild INICIO FIN [SEDE_ID]\n"
+              "  python -m app.cash.resumen_diario --verificar SEDE_ID INICIO FIN")
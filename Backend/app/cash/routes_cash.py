@@ -7,18 +7,28 @@ from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import StreamingResponse
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
+import asyncio
 import logging
 
 # Importar lógica contable separada
 from .accounting_logic import (
-    calcular_resumen_dia,
     obtener_ventas_dia,        # ← NUEVO
     obtener_egresos_dia,          # ← NUEVO
-    obtener_movimientos_efectivo_dia  # ← NUEVO
+    obtener_movimientos_efectivo_dia,  # ← NUEVO
+    calcular_periodo,
+    contexto_dia
 )
+from .libro_efectivo import (
+    pagina_movimientos_efectivo, iterar_movimientos_efectivo, totales_movimientos_efectivo
+)
+from .resumen_diario import (
+    obtener_resumen_dia, obtener_resumenes_rango, verificar_resumen_dia, invalidar_resumen_dia
+)
+from .scheduler import estado_scheduler, obtener_ejecuciones
 
 # Importar generador de Excel
-from .excel_generator import generar_reporte_excel_caja_completo, generar_nombre_archivo_excel
+from .excel_generator import escribir_reporte_caja, generar_nombre_archivo_excel
+from app.utils.excel_stream import stream_xlsx, MEDIA_TYPE_XLSX
 
 # Importar modelos y utilidades
 from .models_cash import (
@@ -94,10 +104,15 @@ def _campos_auditoria(current_user: dict, motivo: Optional[str] = None) -> dict:
 async def calcular_efectivo_dia_endpoint(
     sede_id: str = Query(..., description="ID de la sede"),
     fecha: Optional[str] = Query(None, description="Fecha (YYYY-MM-DD), default: hoy"),
+    verificar: bool = Query(False, description="Recalcular desde los datos crudos y reportar deriva"),
     current_user: dict = Depends(get_current_user)
 ):
     """
     Calcula el efectivo del día con criterio contable correcto.
+
+    Lee el resumen materializado en cash_daily_summary. Con verificar=true
+    lo recalcula desde appointments/sales/caja y agrega "deriva" con las
+    diferencias encontradas.
     
     ✅ CRITERIO CONTABLE:
     - Solo suma pagos con metodo == "efectivo" del historial_pagos
@@ -131,8 +146,12 @@ async def calcular_efectivo_dia_endpoint(
 
     fecha = normalizar_fecha(fecha)
     
-    # Usar lógica contable separada
-    resumen = await calcular_resumen_dia(sede_id, fecha)
+    if verificar:
+        verificacion = await verificar_resumen_dia(sede_id, fecha)
+        resumen = verificacion["resumen"]
+        resumen["deriva"] = verificacion["deriva"]
+    else:
+        resumen = await obtener_resumen_dia(sede_id, fecha)
     
     # Verificar si hay cierre
     cierre = await cash_closures.find_one({
@@ -228,6 +247,8 @@ async def registrar_egreso(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error al registrar el egreso"
         )
+
+    await invalidar_resumen_dia(egreso.sede_id, fecha)
     
     return EgresoResponse(
         egreso_id=egreso_doc["egreso_id"],
@@ -309,6 +330,7 @@ async def editar_egreso(
             "$push": {"historial_ediciones": snapshot_anterior}  # audit trail
         }
     )
+    await invalidar_resumen_dia(egreso["sede_id"], egreso["fecha"], campos_a_actualizar.get("fecha"))
 
     egreso_actualizado = await cash_expenses.find_one({"egreso_id": egreso_id})
 
@@ -363,6 +385,8 @@ async def registrar_ingreso(
             detail="Error al registrar el ingreso"
         )
 
+    await invalidar_resumen_dia(ingreso.sede_id, fecha)
+
     return IngresoResponse(
         ingreso_id=ingreso_doc["ingreso_id"],
         sede_id=ingreso_doc["sede_id"],
@@ -430,6 +454,7 @@ async def editar_ingreso(
             "$push": {"historial_ediciones": snapshot_anterior}
         }
     )
+    await invalidar_resumen_dia(ingreso["sede_id"], ingreso["fecha"], campos_a_actualizar.get("fecha"))
 
     return {
         "ok": True,
@@ -526,6 +551,7 @@ async def eliminar_ingreso(
             "actualizado_en": datetime.now(),
         }}
     )
+    await invalidar_resumen_dia(ingreso["sede_id"], ingreso["fecha"])
 
     return {
         "ok": True,
@@ -648,6 +674,8 @@ async def apertura_caja(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error al registrar la apertura de caja"
         )
+
+    await invalidar_resumen_dia(apertura.sede_id, apertura.fecha)
     
     return {
         "ok": True,
@@ -683,8 +711,8 @@ async def cerrar_caja(
             detail=f"Ya existe un cierre de caja para {cierre.sede_id} el {cierre.fecha}"
         )
     
-    # Usar lógica contable refactorizada
-    resumen = await calcular_resumen_dia(cierre.sede_id, cierre.fecha)
+    # Resumen materializado (recalculado si está sucio o vencido)
+    resumen = await obtener_resumen_dia(cierre.sede_id, cierre.fecha)
     
     diferencia = calcular_diferencia(resumen["efectivo_esperado"], cierre.efectivo_contado)
     es_aceptable, mensaje_validacion = validar_diferencia_aceptable(diferencia)
@@ -870,6 +898,7 @@ async def eliminar_egreso(
             "actualizado_en": datetime.now(),
         }}
     )
+    await invalidar_resumen_dia(egreso["sede_id"], egreso["fecha"])
 
     return {
         "ok": True,
@@ -982,23 +1011,23 @@ async def _build_period_report_data(
     resumenes: List[Dict[str, Any]] = []
     ventas: List[Dict[str, Any]] = []
     egresos: List[Dict[str, Any]] = []
-    movimientos: List[Dict[str, Any]] = []
 
-    saldo_inicial = 0.0
+    # Todo el rango con consultas agrupadas por fecha (ver calcular_periodo).
+    # El libro de efectivo con saldo corrido lo calcula la base
+    # (libro_efectivo); aquí solo se piden sus totales y el Excel recorre
+    # los movimientos por páginas.
+    periodo, libro = await asyncio.gather(
+        calcular_periodo(sede_id, fechas[0], fechas[-1], movimientos=False),
+        totales_movimientos_efectivo(sede_id, fechas[0], fechas[-1]),
+    )
 
-    for index, fecha_actual in enumerate(fechas):
-        resumen_dia = await calcular_resumen_dia(sede_id, fecha_actual)
+    for fecha_actual in fechas:
+        dia = periodo[fecha_actual]
+        resumen_dia = dia["resumen"]
         resumenes.append(resumen_dia)
 
-        ventas.extend(await obtener_ventas_dia(sede_id, fecha_actual))
-        egresos.extend(await obtener_egresos_dia(sede_id, fecha_actual))
-
-        movimientos_dia = await obtener_movimientos_efectivo_dia(sede_id, fecha_actual)
-        if index == 0:
-            saldo_inicial = float(
-                movimientos_dia.get("saldo_inicial", resumen_dia.get("efectivo_inicial", 0)) or 0
-            )
-        movimientos.extend(movimientos_dia.get("movimientos", []))
+        ventas.extend(dia["ventas"])
+        egresos.extend(dia["egresos"])
 
     resumen_ref = resumenes[0]
 
@@ -1090,16 +1119,9 @@ async def _build_period_report_data(
         for categoria in ["compras_internas", "gastos_operativos", "retiros_caja", "otros"]
     )
 
-    movimientos = _sort_items_by_fecha(movimientos)
-    saldo_corrido = float(saldo_inicial)
-    for movimiento in movimientos:
-        ingreso = float(movimiento.get("ingreso", 0) or 0)
-        egreso = float(movimiento.get("egreso", 0) or 0)
-        saldo_corrido += ingreso - egreso
-        movimiento["saldo"] = saldo_corrido
-
-    if movimientos:
-        resumen_total["efectivo_esperado"] = saldo_corrido
+    saldo_inicial = float(libro["saldo_inicial"])
+    if libro["movimientos"]:
+        resumen_total["efectivo_esperado"] = float(libro["saldo_final"])
     else:
         resumen_total["efectivo_esperado"] = (
             resumen_total["efectivo_inicial"]
@@ -1113,7 +1135,7 @@ async def _build_period_report_data(
         "egresos": _sort_items_by_fecha(egresos),
         "movimientos_efectivo": {
             "saldo_inicial": saldo_inicial,
-            "movimientos": movimientos,
+            "movimientos": iterar_movimientos_efectivo(sede_id, fechas[0], fechas[-1]),
             "saldo_final": resumen_total["efectivo_esperado"],
         },
         "fecha_inicio": fechas[0],
@@ -1168,17 +1190,17 @@ async def descargar_reporte_excel(
     else:
         _parse_date_yyyy_mm_dd(fecha, "fecha")
 
-        # 1. Obtener resumen del día
-        resumen = await calcular_resumen_dia(sede_id, fecha)
-        
-        # 3. Obtener todas las ventas del día (todos los métodos) desde SALES
-        ventas = await obtener_ventas_dia(sede_id, fecha)
-        
-        # 4. Obtener todos los egresos del día
-        egresos = await obtener_egresos_dia(sede_id, fecha)
-        
-        # 5. Obtener movimientos en efectivo con saldo corrido
-        movimientos_efectivo = await obtener_movimientos_efectivo_dia(sede_id, fecha)
+        # Apertura, flag de migración e ingresos manuales se consultan una vez
+        contexto = await contexto_dia(sede_id, fecha)
+
+        # 1. Resumen del día, 3. ventas (todos los métodos), 4. egresos y
+        # 5. movimientos en efectivo con saldo corrido, en paralelo
+        resumen, ventas, egresos, movimientos_efectivo = await asyncio.gather(
+            obtener_resumen_dia(sede_id, fecha),
+            obtener_ventas_dia(sede_id, fecha, contexto),
+            obtener_egresos_dia(sede_id, fecha, contexto),
+            obtener_movimientos_efectivo_dia(sede_id, fecha, contexto),
+        )
         fecha_para_nombre = fecha
         periodo_inicio = fecha
         periodo_fin = fecha
@@ -1205,24 +1227,261 @@ async def descargar_reporte_excel(
     # 6. Agregar quien genera el reporte
     resumen["generado_por"] = current_user.get("email")
     
-    # 7. Generar Excel con 4 hojas
-    excel_file = generar_reporte_excel_caja_completo(
-        resumen=resumen,
-        sede_info=sede_info,
-        facturas=ventas,  # ← Ahora son ventas de sales, no facturas de invoices
-        egresos=egresos,
-        movimientos_efectivo=movimientos_efectivo
-    )
-    
-    # 8. Nombre del archivo
+    # 7. Nombre del archivo
     nombre_sede = sede.get("nombre", sede_id).replace(" ", "_")
     filename = generar_nombre_archivo_excel(nombre_sede, fecha_para_nombre)
     
-    # 9. Retornar como descarga
+    # 8. Generar el Excel en un hilo (write-only) y enviarlo por bloques
     return StreamingResponse(
-        excel_file,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        stream_xlsx(
+            escribir_reporte_caja,
+            resumen,
+            sede_info,
+            ventas,  # ← Ahora son ventas de sales, no facturas de invoices
+            egresos,
+            movimientos_efectivo,
+        ),
+        media_type=MEDIA_TYPE_XLSX,
         headers={
             "Content-Disposition": f"attachment; filename={filename}"
         }
     )
+
+
+# ============================================================
+# 11. SCHEDULER DE CIERRES AUTOMÁTICOS: ESTADO E HISTORIAL
+# ============================================================
+
+@router.get("/scheduler/estado")
+async def ver_estado_scheduler(current_user: dict = Depends(get_current_user)):
+    """Líder actual del scheduler y próximos disparos de los jobs."""
+    _validar_rol_admin(current_user)
+    return convertir_mongo_a_json(await estado_scheduler())
+
+
+@router.get("/scheduler/ejecuciones")
+async def listar_ejecuciones_scheduler(
+    sede_id: Optional[str] = Query(None),
+    fecha_inicio: Optional[str] = Query(None),
+    fecha_fin: Optional[str] = Query(None),
+    estado: Optional[str] = Query(None, description="ejecutando | completado | omitido | fallido"),
+    limite: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user)
+):
+    """Historial de cierres automáticos (incluye recuperados y fallidos)."""
+    _validar_rol_admin(current_user)
+    ejecuciones = await obtener_ejecuciones(
+        sede_id=sede_id,
+        fecha_inicio=normalizar_fecha(fecha_inicio) if fecha_inicio else None,
+        fecha_fin=normalizar_fecha(fecha_fin) if fecha_fin else None,
+        estado=estado,
+        limite=limite,
+    )
+    return {"total": len(ejecuciones), "ejecuciones": convertir_mongo_a_json(ejecuciones)}
+
+
+# ============================================================
+# 12. REPORTE CONSOLIDADO POR FRANQUICIA
+# Todas las sedes de la franquicia en una sola pasada: los resúmenes
+# diarios se leen de cash_daily_summary para todas las sedes a la vez
+# y los que falten se calculan en bloque (ver obtener_resumenes_rango).
+# ============================================================
+
+def _monto(valor: Any) -> float:
+    return float(valor or 0)
+
+
+def _total_egresos(egresos: Dict[str, Any]) -> float:
+    # Igual que el reporte de periodo: suma de categorías (el resumen
+    # del flujo normal no trae "total", solo el migrado)
+    return sum(
+        _monto(egresos.get(categoria, {}).get("total"))
+        for categoria in ["compras_internas", "gastos_operativos", "retiros_caja", "otros"]
+    )
+
+
+def _totales_vacios() -> Dict[str, float]:
+    return {
+        "ingresos": 0.0,
+        "ingresos_efectivo": 0.0,
+        "ingresos_otros_metodos": 0.0,
+        "egresos": 0.0,
+        "neto": 0.0,
+        "diferencias_acumuladas": 0.0,
+    }
+
+
+async def _build_consolidated_report_data(
+    sedes: List[Dict[str, Any]],
+    fecha_inicio: str,
+    fecha_fin: str,
+    incluir_dias: bool
+) -> Dict[str, Any]:
+    sede_ids = [s["sede_id"] for s in sedes]
+
+    resumenes, cierres = await asyncio.gather(
+        obtener_resumenes_rango(sede_ids, fecha_inicio, fecha_fin),
+        cash_closures.aggregate([
+            {"$match": {
+                "sede_id": {"$in": sede_ids},
+                "fecha": {"$gte": fecha_inicio, "$lte": fecha_fin},
+                "tipo": "cierre"
+            }},
+            {"$group": {
+                "_id": "$sede_id",
+                "cierres": {"$sum": 1},
+                "diferencias": {"$sum": {"$ifNull": ["$diferencia", 0]}}
+            }}
+        ]).to_list(None),
+    )
+    cierres_por_sede = {c["_id"]: c for c in cierres}
+
+    filas: List[Dict[str, Any]] = []
+    por_moneda: Dict[str, Dict[str, Any]] = {}
+
+    for sede in sedes:
+        sede_id = sede["sede_id"]
+        dias = resumenes.get(sede_id, {})
+        totales = _totales_vacios()
+        moneda = sede.get("moneda", "COP")
+        por_dia = []
+
+        for fecha, resumen in dias.items():
+            moneda = resumen.get("moneda", moneda)
+            ingresos = _monto(resumen.get("total_vendido"))
+            egresos = _total_egresos(resumen.get("egresos", {}))
+            totales["ingresos"] += ingresos
+            totales["ingresos_efectivo"] += _monto(resumen.get("ingresos_efectivo", {}).get("total"))
+            totales["ingresos_otros_metodos"] += _monto(resumen.get("ingresos_otros_metodos", {}).get("total"))
+            totales["egresos"] += egresos
+            if incluir_dias:
+                por_dia.append({
+                    "fecha": fecha,
+                    "ingresos": ingresos,
+                    "egresos": egresos,
+                    "neto": ingresos - egresos,
+                    "efectivo_esperado": _monto(resumen.get("efectivo_esperado")),
+                })
+
+        cierre = cierres_por_sede.get(sede_id, {})
+        totales["neto"] = totales["ingresos"] - totales["egresos"]
+        totales["diferencias_acumuladas"] = _monto(cierre.get("diferencias"))
+
+        fila = {
+            "sede_id": sede_id,
+            "sede_nombre": sede.get("nombre"),
+            "moneda": moneda,
+            "cierres": cierre.get("cierres", 0),
+            "totales": totales,
+        }
+        if incluir_dias:
+            fila["por_dia"] = por_dia
+        filas.append(fila)
+
+        acumulado = por_moneda.setdefault(moneda, {"sedes": 0, **_totales_vacios()})
+        acumulado["sedes"] += 1
+        for clave, valor in totales.items():
+            acumulado[clave] += valor
+
+    return {"sedes": filas, "totales_por_moneda": por_moneda}
+
+
+@router.get("/reporte-consolidado")
+async def reporte_consolidado_franquicia(
+    franquicia_id: str = Query(...),
+    fecha_inicio: str = Query(...),
+    fecha_fin: str = Query(...),
+    incluir_dias: bool = Query(False, description="Incluir el desglose diario de cada sede"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Reporte de caja de todas las sedes de una franquicia para un periodo:
+    una fila por sede y totales por moneda (no se suman monedas distintas).
+    """
+    rol = current_user.get("rol")
+    if rol not in ["admin_sede", "admin_franquicia", "super_admin"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo administradores pueden ver el reporte consolidado de caja."
+        )
+
+    if rol == "admin_franquicia":
+        franquicia_usuario = current_user.get("franquicia_id")
+    elif rol == "admin_sede":
+        sede_usuario = await locales.find_one(
+            {"sede_id": current_user.get("sede_id")}, {"_id": 0, "franquicia_id": 1}
+        )
+        franquicia_usuario = sede_usuario.get("franquicia_id") if sede_usuario else None
+    if rol != "super_admin" and (not franquicia_usuario or franquicia_usuario != franquicia_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tienes acceso a las sedes de esta franquicia"
+        )
+
+    inicio_dt = _parse_date(fecha_inicio, "fecha_inicio")
+    fin_dt = _parse_date(fecha_fin, "fecha_fin")
+    if inicio_dt > fin_dt:
+        inicio_dt, fin_dt = fin_dt, inicio_dt
+    inicio, fin = inicio_dt.strftime("%Y-%m-%d"), fin_dt.strftime("%Y-%m-%d")
+
+    sedes = await locales.find(
+        {"franquicia_id": franquicia_id},
+        {"_id": 0, "sede_id": 1, "nombre": 1, "moneda": 1}
+    ).sort("nombre", 1).to_list(None)
+    sedes = [s for s in sedes if s.get("sede_id")]
+    if not sedes:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"La franquicia {franquicia_id} no tiene sedes"
+        )
+
+    reporte = await _build_consolidated_report_data(sedes, inicio, fin, incluir_dias)
+
+    return {
+        "franquicia_id": franquicia_id,
+        "periodo": {
+            "inicio": inicio,
+            "fin": fin,
+            "dias": (fin_dt - inicio_dt).days + 1
+        },
+        **reporte,
+        "generado_por": current_user.get("email"),
+    }
+
+
+# ============================================================
+# 13. LIBRO DE EFECTIVO PAGINADO (SALDO CORRIDO EN LA BASE)
+# ============================================================
+
+@router.get("/movimientos-efectivo")
+async def listar_movimientos_efectivo(
+    sede_id: str = Query(...),
+    fecha_inicio: str = Query(...),
+    fecha_fin: str = Query(...),
+    cursor: Optional[str] = Query(None, description="Valor 'siguiente' de la página anterior"),
+    limite: int = Query(500, ge=1, le=2000),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Movimientos en efectivo del periodo con saldo corrido, por páginas.
+    El saldo viaja en el cursor, así cada página continúa el de la anterior.
+    """
+    inicio_dt = _parse_date(fecha_inicio, "fecha_inicio")
+    fin_dt = _parse_date(fecha_fin, "fecha_fin")
+    if inicio_dt > fin_dt:
+        inicio_dt, fin_dt = fin_dt, inicio_dt
+    inicio, fin = inicio_dt.strftime("%Y-%m-%d"), fin_dt.strftime("%Y-%m-%d")
+
+    try:
+        pagina = await pagina_movimientos_efectivo(sede_id, inicio, fin, cursor, limite)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(exc)
+        ) from exc
+
+    return {
+        "sede_id": sede_id,
+        "periodo": {"inicio": inicio, "fin": fin},
+        **convertir_mongo_a_json(pagina),
+    }
@@ -2,241 +2,555 @@
 # scheduler.py - Scheduler para cierre automático de caja
 # Ubicación: app/cash/scheduler.py
 # ============================================================
+#
+# Cada proceso (worker de uvicorn / réplica) arranca su scheduler, pero
+# solo el líder (lease en scheduler_leases, ver utils/leader_lease.py)
+# dispara los jobs. Además cada cierre se reclama en scheduler_runs con
+# _id "cierre_auto|SEDE|FECHA": aunque dos procesos se crean líderes a
+# la vez, el insert del reclamo deja pasar a uno solo.
+#
+# - Un job por zona horaria a las 23:59 locales; las sedes de esa zona
+#   se leen al dispararse y se cierran en paralelo (hasta CONCURRENCIA).
+#   Es un job de una sola vez con la fecha a cerrar como argumento (la de
+#   su hora programada, no la del reloj al correr: con misfire_grace_time
+#   puede correr pasada la medianoche); al dispararse programa el del día
+#   siguiente.
+# - Al ganar el liderazgo y cada hora se recuperan los cierres de los
+#   últimos DIAS_RECUPERACION días que no se hicieron (proceso caído,
+#   cambio de líder a las 23:59, fallos).
+# - scheduler_runs queda como historial: estado, líder, duración, error.
+#
+# Configuración por entorno:
+#   SCHEDULER_CONCURRENCIA      (default: 4)  sedes cerrándose a la vez
+#   SCHEDULER_DIAS_RECUPERACION (default: 3)  días hacia atrás a recuperar
+# ============================================================
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime
+from apscheduler.triggers.date import DateTrigger
+from datetime import datetime, timedelta, time as hora
+from typing import Any, Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import os
+import time
 import pytz
 import logging
 
 from app.database.mongo import collection_locales as locales, db
-from .accounting_logic import calcular_resumen_dia
+from app.utils.leader_lease import (
+    INSTANCIA_ID, LEASE_SEGUNDOS, es_lider, iniciar_eleccion, detener_eleccion, lider_actual,
+)
+from .resumen_diario import obtener_resumen_dia
 
 logger = logging.getLogger(__name__)
 
 cash_closures = db["cash_closures"]
+scheduler_runs = db["scheduler_runs"]
+
+LIDERAZGO = "cash_scheduler"
+JOB_CIERRE = "cierre_auto"
+
+CONCURRENCIA = int(os.getenv("SCHEDULER_CONCURRENCIA", "4"))
+DIAS_RECUPERACION = int(os.getenv("SCHEDULER_DIAS_RECUPERACION", "3"))
+MAX_INTENTOS = 3
+# Un reclamo "ejecutando" más viejo que esto se da por perdido
+LEASE_EJECUCION_SEGUNDOS = 600
+
+# Estados de scheduler_runs
+EJECUTANDO = "ejecutando"
+COMPLETADO = "completado"
+OMITIDO = "omitido"       # ya existía un cierre (manual) para ese día
+FALLIDO = "fallido"
 
 # ============================================================
 # INSTANCIA DEL SCHEDULER
 # ============================================================
 
-scheduler = AsyncIOScheduler()
+scheduler = AsyncIOScheduler(job_defaults={"coalesce": True, "misfire_grace_time": 300})
 
 # ============================================================
 # FUNCIÓN DE CIERRE AUTOMÁTICO
 # ============================================================
 
-async def ejecutar_cierre_automatico_sede(sede_id: str, sede_nombre: str):
+async def ejecutar_cierre_automatico_sede(
+    sede_id: str,
+    sede_nombre: str,
+    fecha: Optional[str] = None,
+    recuperado: bool = False,
+) -> str:
     """
     Ejecuta el cierre automático para una sede específica.
-    
+
     CRITERIO:
-    - Se ejecuta a las 23:59 hora local de la sede
+    - Se ejecuta a las 23:59 hora local de la sede (o al recuperar un
+      día pasado, con `fecha` y `recuperado=True`)
     - Solo si NO existe ya un cierre para ese día
     - Registra el cierre con efectivo_contado = efectivo_esperado (estimado)
-    
+
     Args:
         sede_id: ID de la sede
         sede_nombre: Nombre de la sede (para logs)
+        fecha: Día a cerrar (YYYY-MM-DD); por defecto hoy en la zona de la sede
+        recuperado: True si es un cierre atrasado
+
+    Returns:
+        COMPLETADO u OMITIDO. Los errores se propagan para que quien
+        llama los registre.
+    """
+    # Obtener fecha actual en zona horaria de la sede
+    sede = await locales.find_one({"sede_id": sede_id}, {"zona_horaria": 1})
+    if not sede:
+        raise ValueError(f"Sede {sede_id} no encontrada para cierre automático")
+
+    zona_horaria = sede.get("zona_horaria", "UTC")
+    tz = pytz.timezone(zona_horaria)
+    ahora = datetime.now(tz)
+    fecha = fecha or ahora.strftime("%Y-%m-%d")
+
+    # Verificar si ya existe un cierre para ese día
+    cierre_existente = await cash_closures.find_one({
+        "sede_id": sede_id,
+        "fecha": fecha,
+        "tipo": "cierre"
+    }, {"_id": 1})
+
+    if cierre_existente:
+        logger.info(f"Cierre automático OMITIDO: Ya existe cierre para {sede_nombre} ({sede_id}) el {fecha}")
+        return OMITIDO
+
+    # Calcular resumen del día
+    resumen = await obtener_resumen_dia(sede_id, fecha)
+
+    if recuperado:
+        observaciones = f"Cierre automático recuperado el {ahora.strftime('%Y-%m-%d %H:%M:%S')} ({zona_horaria})"
+    else:
+        observaciones = f"Cierre automático ejecutado a las {ahora.strftime('%H:%M:%S')} ({zona_horaria})"
+
+    # Crear documento de cierre automático
+    cierre_doc = {
+        "cierre_id": f"CC-AUTO-{fecha}-{sede_id}-{int(ahora.timestamp())}",
+        "tipo": "cierre",
+        "sede_id": sede_id,
+        "sede_nombre": sede_nombre,
+        "fecha": fecha,
+        "moneda": resumen["moneda"],
+
+        # Efectivo
+        "efectivo_inicial": resumen["efectivo_inicial"],
+        "total_ingresos": resumen["total_vendido"],
+        "total_ingresos_efectivo": resumen["ingresos_efectivo"]["total"],
+        "total_egresos": resumen["egresos"]["total"],
+        "efectivo_esperado": resumen["efectivo_esperado"],
+        "efectivo_contado": resumen["efectivo_esperado"],  # Estimado automático
+        "diferencia": 0,  # Asumimos que es correcto
+
+        # Desglose
+        "ingresos_detalle": resumen["ingresos_efectivo"],
+        "egresos_detalle": resumen["egresos"],
+
+        # Estado
+        "estado": "cerrado_automatico",
+        "diferencia_aceptable": True,
+        "mensaje_validacion": "Cierre automático - efectivo estimado",
+
+        # Observaciones
+        "observaciones": observaciones,
+
+        # Auditoría
+        "cerrado_por": "sistema_automatico",
+        "cerrado_por_nombre": "Sistema Automático",
+        "cerrado_por_rol": "sistema",
+        "creado_en": ahora,
+        "aprobado_por": None,
+        "aprobado_en": None,
+
+        # Metadata adicional
+        "es_automatico": True,
+        "es_recuperado": recuperado,
+        "requiere_revision": True  # El admin debe revisar después
+    }
+
+    # Insertar cierre
+    await cash_closures.insert_one(cierre_doc)
+    logger.info(f"✅ Cierre automático EXITOSO: {sede_nombre} ({sede_id}) el {fecha} - Efectivo: {resumen['efectivo_esperado']}")
+    return COMPLETADO
+
+# ============================================================
+# EJECUCIONES: RECLAMO EXACTLY-ONCE E HISTORIAL
+# ============================================================
+
+def _run_id(sede_id: str, fecha: str) -> str:
+    return f"{JOB_CIERRE}|{sede_id}|{fecha}"
+
+
+async def _reclamar_ejecucion(sede_id: str, fecha: str, recuperado: bool) -> Optional[str]:
     """
-    
+    Reclama el cierre (sede, fecha) para este proceso. Devuelve el id del
+    registro o None si otro ya lo hizo, lo está haciendo o agotó intentos.
+    """
+    ahora = datetime.utcnow()
+    run_id = _run_id(sede_id, fecha)
+    lease_hasta = ahora + timedelta(seconds=LEASE_EJECUCION_SEGUNDOS)
     try:
-        # Obtener fecha actual en zona horaria de la sede
-        sede = await locales.find_one({"sede_id": sede_id})
-        if not sede:
-            logger.error(f"Sede {sede_id} no encontrada para cierre automático")
-            return
-        
-        zona_horaria = sede.get("zona_horaria", "UTC")
-        tz = pytz.timezone(zona_horaria)
-        ahora = datetime.now(tz)
-        fecha = ahora.strftime("%Y-%m-%d")
-        
-        # Verificar si ya existe un cierre para hoy
-        cierre_existente = await cash_closures.find_one({
+        await scheduler_runs.insert_one({
+            "_id": run_id,
+            "job": JOB_CIERRE,
             "sede_id": sede_id,
             "fecha": fecha,
-            "tipo": "cierre"
+            "estado": EJECUTANDO,
+            "intentos": 1,
+            "recuperado": recuperado,
+            "instancia": INSTANCIA_ID,
+            "iniciado_en": ahora,
+            "lease_hasta": lease_hasta,
         })
-        
-        if cierre_existente:
-            logger.info(f"Cierre automático OMITIDO: Ya existe cierre para {sede_nombre} ({sede_id}) el {fecha}")
-            return
-        
-        # Calcular resumen del día
-        resumen = await calcular_resumen_dia(sede_id, fecha)
-        
-        # Crear documento de cierre automático
-        cierre_doc = {
-            "cierre_id": f"CC-AUTO-{fecha}-{sede_id}-{int(ahora.timestamp())}",
-            "tipo": "cierre",
-            "sede_id": sede_id,
-            "sede_nombre": sede_nombre,
-            "fecha": fecha,
-            "moneda": resumen["moneda"],
-            
-            # Efectivo
-            "efectivo_inicial": resumen["efectivo_inicial"],
-            "total_ingresos": resumen["total_vendido"],
-            "total_ingresos_efectivo": resumen["ingresos_efectivo"]["total"],
-            "total_egresos": resumen["egresos"]["total"],
-            "efectivo_esperado": resumen["efectivo_esperado"],
-            "efectivo_contado": resumen["efectivo_esperado"],  # Estimado automático
-            "diferencia": 0,  # Asumimos que es correcto
-            
-            # Desglose
-            "ingresos_detalle": resumen["ingresos_efectivo"],
-            "egresos_detalle": resumen["egresos"],
-            
-            # Estado
-            "estado": "cerrado_automatico",
-            "diferencia_aceptable": True,
-            "mensaje_validacion": "Cierre automático - efectivo estimado",
-            
-            # Observaciones
-            "observaciones": f"Cierre automático ejecutado a las {ahora.strftime('%H:%M:%S')} ({zona_horaria})",
-            
-            # Auditoría
-            "cerrado_por": "sistema_automatico",
-            "cerrado_por_nombre": "Sistema Automático",
-            "cerrado_por_rol": "sistema",
-            "creado_en": ahora,
-            "aprobado_por": None,
-            "aprobado_en": None,
-            
-            # Metadata adicional
-            "es_automatico": True,
-            "requiere_revision": True  # El admin debe revisar después
-        }
-        
-        # Insertar cierre
-        resultado = await cash_closures.insert_one(cierre_doc)
-        
-        if resultado.inserted_id:
-            logger.info(f"✅ Cierre automático EXITOSO: {sede_nombre} ({sede_id}) el {fecha} - Efectivo: {resumen['efectivo_esperado']}")
-        else:
-            logger.error(f"❌ Cierre automático FALLIDO: {sede_nombre} ({sede_id}) el {fecha}")
-            
+        return run_id
+    except DuplicateKeyError:
+        pass
+
+    # Ya existe: solo se retoma si falló o si quien lo tenía murió
+    previo = await scheduler_runs.find_one_and_update(
+        {
+            "_id": run_id,
+            "$or": [
+                {"estado": FALLIDO, "intentos": {"$lt": MAX_INTENTOS}},
+                {"estado": EJECUTANDO, "lease_hasta": {"$lte": ahora}},
+            ],
+        },
+        {
+            "$set": {
+                "estado": EJECUTANDO,
+                "recuperado": recuperado,
+                "instancia": INSTANCIA_ID,
+                "iniciado_en": ahora,
+                "lease_hasta": lease_hasta,
+            },
+            "$inc": {"intentos": 1},
+            "$unset": {"error": "", "finalizado_en": "", "duracion_ms": ""},
+        },
+    )
+    return run_id if previo else None
+
+
+async def _finalizar_ejecucion(run_id: str, estado: str, duracion_ms: int, error: Optional[str] = None) -> None:
+    cambios: Dict[str, Any] = {
+        "estado": estado,
+        "finalizado_en": datetime.utcnow(),
+        "duracion_ms": duracion_ms,
+    }
+    if error:
+        cambios["error"] = error[:500]
+    await scheduler_runs.update_one(
+        {"_id": run_id, "instancia": INSTANCIA_ID},
+        {"$set": cambios, "$unset": {"lease_hasta": ""}},
+    )
+
+
+async def correr_cierre(sede: dict, fecha: Optional[str] = None, recuperado: bool = False) -> Optional[str]:
+    """
+    Reclama, ejecuta y registra el cierre automático de una sede.
+    Devuelve el estado final o None si no le tocaba a este proceso.
+    """
+    sede_id = sede.get("sede_id")
+    sede_nombre = sede.get("nombre")
+    if fecha is None:
+        tz = pytz.timezone(sede.get("zona_horaria", "UTC"))
+        fecha = datetime.now(tz).strftime("%Y-%m-%d")
+
+    run_id = await _reclamar_ejecucion(sede_id, fecha, recuperado)
+    if run_id is None:
+        logger.info(f"Cierre automático de {sede_nombre} ({sede_id}) el {fecha} ya reclamado")
+        return None
+
+    inicio = time.monotonic()
+    try:
+        estado = await ejecutar_cierre_automatico_sede(sede_id, sede_nombre, fecha, recuperado)
+        error = None
+    except Exception as e:
+        logger.error(f"❌ ERROR en cierre automático de {sede_nombre} ({sede_id}) el {fecha}: {str(e)}", exc_info=True)
+        estado, error = FALLIDO, str(e)
+
+    try:
+        await _finalizar_ejecucion(run_id, estado, int((time.monotonic() - inicio) * 1000), error)
+    except Exception as e:
+        logger.error(f"❌ Error registrando ejecución {run_id}: {str(e)}")
+    return estado
+
+
+async def _correr_en_paralelo(trabajos: List[tuple]) -> List[Optional[str]]:
+    """Corre correr_cierre(*args) para cada tupla, hasta CONCURRENCIA a la vez."""
+    semaforo = asyncio.Semaphore(CONCURRENCIA)
+
+    async def uno(args: tuple) -> Optional[str]:
+        async with semaforo:
+            return await correr_cierre(*args)
+
+    return await asyncio.gather(*(uno(args) for args in trabajos))
+
+# ============================================================
+# JOBS
+# ============================================================
+
+_PROYECCION_SEDE = {"_id": 0, "sede_id": 1, "nombre": 1, "zona_horaria": 1}
+
+
+async def _sedes_activas() -> List[dict]:
+    return await locales.find({"activa": True}, _PROYECCION_SEDE).to_list(None)
+
+
+def _proximo_cierre(zona_horaria: str) -> datetime:
+    """Las próximas 23:59 locales de la zona (hoy si aún no pasaron)."""
+    tz = pytz.timezone(zona_horaria)
+    ahora = datetime.now(tz)
+    dia = ahora.date()
+    cuando = tz.localize(datetime.combine(dia, hora(23, 59)))
+    if cuando <= ahora:
+        cuando = tz.localize(datetime.combine(dia + timedelta(days=1), hora(23, 59)))
+    return cuando
+
+
+def _programar_cierre_zona(zona_horaria: str) -> None:
+    """Programa el job de cierre de la zona para sus próximas 23:59, con esa fecha como argumento."""
+    cuando = _proximo_cierre(zona_horaria)
+    scheduler.add_job(
+        cierres_zona_horaria,
+        trigger=DateTrigger(run_date=cuando),
+        args=[zona_horaria, cuando.strftime("%Y-%m-%d")],
+        id=f"{JOB_CIERRE}_{zona_horaria}",
+        name=f"Cierre automático {zona_horaria} {cuando:%Y-%m-%d}",
+        replace_existing=True
+    )
+
+
+async def cierres_zona_horaria(zona_horaria: str, fecha: str) -> None:
+    """
+    Job de las 23:59 de una zona: cierra sus sedes activas el día `fecha`
+    (el de la hora programada) si este proceso es líder.
+    """
+    # Todos los procesos programan el siguiente, sean o no líderes
+    try:
+        _programar_cierre_zona(zona_horaria)
+    except Exception as e:
+        logger.error(f"❌ Error programando el siguiente cierre de {zona_horaria}: {str(e)}")
+    if not es_lider(LIDERAZGO):
+        return
+    sedes = [s for s in await _sedes_activas() if s.get("zona_horaria", "UTC") == zona_horaria]
+    if not sedes:
+        return
+    estados = await _correr_en_paralelo([(s, fecha) for s in sedes])
+    logger.info(
+        f"🕛 Cierres automáticos {zona_horaria} {fecha}: {len(sedes)} sedes, "
+        f"{estados.count(COMPLETADO)} cerradas, {estados.count(FALLIDO)} fallidas"
+    )
+
+
+async def recuperar_cierres_pendientes(dias: int = DIAS_RECUPERACION) -> int:
+    """
+    Cierra los días de los últimos `dias` que quedaron sin cierre
+    (automático o manual), incluido hoy si en la sede ya pasaron las 23:59.
+
+    Solo se recuperan días desde la primera ejecución registrada: en
+    una instalación nueva no se generan cierres hacia atrás.
+    Devuelve cuántos cierres se crearon.
+    """
+    if not es_lider(LIDERAZGO):
+        return 0
+
+    primera = await scheduler_runs.find_one({"job": JOB_CIERRE}, {"fecha": 1}, sort=[("fecha", 1)])
+    if not primera:
+        return 0
+    desde = primera["fecha"]
+
+    candidatos: List[tuple] = []
+    for sede in await _sedes_activas():
+        try:
+            ahora = datetime.now(pytz.timezone(sede.get("zona_horaria", "UTC")))
+        except pytz.UnknownTimeZoneError:
+            continue
+        inicio = 0 if (ahora.hour, ahora.minute) >= (23, 59) else 1
+        for d in range(inicio, dias + 1):
+            fecha = (ahora - timedelta(days=d)).strftime("%Y-%m-%d")
+            if fecha >= desde:
+                candidatos.append((sede, fecha))
+    if not candidatos:
+        return 0
+
+    # Descartar en bloque los días ya cerrados o ya resueltos
+    sede_ids = list({s["sede_id"] for s, _ in candidatos})
+    fechas = list({f for _, f in candidatos})
+    cerrados = {
+        (c["sede_id"], c["fecha"])
+        async for c in cash_closures.find(
+            {"sede_id": {"$in": sede_ids}, "fecha": {"$in": fechas}, "tipo": "cierre"},
+            {"_id": 0, "sede_id": 1, "fecha": 1},
+        )
+    }
+    resueltos = {
+        r["_id"]
+        async for r in scheduler_runs.find(
+            {
+                "_id": {"$in": [_run_id(s["sede_id"], f) for s, f in candidatos]},
+                "$or": [{"estado": {"$in": [COMPLETADO, OMITIDO]}}, {"intentos": {"$gte": MAX_INTENTOS}}],
+            },
+            {"_id": 1},
+        )
+    }
+    pendientes = [
+        (sede, fecha, True)
+        for sede, fecha in candidatos
+        if (sede["sede_id"], fecha) not in cerrados and _run_id(sede["sede_id"], fecha) not in resueltos
+    ]
+    if not pendientes:
+        return 0
+
+    logger.info(f"🔁 Recuperando {len(pendientes)} cierres automáticos pendientes")
+    estados = await _correr_en_paralelo(pendientes)
+    return estados.count(COMPLETADO)
+
+
+async def _recuperar_en_segundo_plano() -> None:
+    try:
+        await recuperar_cierres_pendientes()
     except Exception as e:
-        logger.error(f"❌ ERROR en cierre automático de {sede_nombre} ({sede_id}): {str(e)}", exc_info=True)
+        logger.error(f"❌ Error recuperando cierres pendientes: {str(e)}", exc_info=True)
 
 # ============================================================
-# REGISTRAR TAREAS PARA TODAS LAS SEDES
+# REGISTRAR TAREAS
 # ============================================================
 
 async def registrar_cierres_automaticos():
     """
-    Registra tareas de cierre automático para todas las sedes activas.
-    
-    Se ejecuta al iniciar la aplicación.
-    Crea un job para cada sede a las 23:59 de su zona horaria.
+    Registra un job de cierre a las 23:59 por cada zona horaria con sedes
+    activas. Se ejecuta al iniciar y cada hora, para tomar zonas nuevas y
+    reponer un job que se perdió (p. ej. descartado por misfire); las
+    sedes de cada zona se leen al dispararse el job.
     """
-    
     try:
-        # Obtener todas las sedes activas
-        sedes = await locales.find({"activa": True}).to_list(None)
-        
-        logger.info(f"📋 Registrando cierres automáticos para {len(sedes)} sedes...")
-        
-        for sede in sedes:
-            sede_id = sede.get("sede_id")
-            sede_nombre = sede.get("nombre")
-            zona_horaria = sede.get("zona_horaria", "UTC")
-            
+        sedes = await _sedes_activas()
+        zonas = {s.get("zona_horaria", "UTC") for s in sedes}
+
+        for zona_horaria in zonas:
+            job_id = f"{JOB_CIERRE}_{zona_horaria}"
+            if scheduler.get_job(job_id):
+                continue
             try:
-                # Crear timezone
-                tz = pytz.timezone(zona_horaria)
-                
-                # Registrar job para las 23:59 en la zona horaria de la sede
-                scheduler.add_job(
-                    ejecutar_cierre_automatico_sede,
-                    trigger=CronTrigger(hour=23, minute=59, timezone=tz),
-                    args=[sede_id, sede_nombre],
-                    id=f"cierre_auto_{sede_id}",
-                    name=f"Cierre automático {sede_nombre}",
-                    replace_existing=True
-                )
-                
-                logger.info(f"✅ Job registrado: {sede_nombre} ({sede_id}) a las 23:59 {zona_horaria}")
-                
+                _programar_cierre_zona(zona_horaria)
+                logger.info(f"✅ Job registrado: cierres a las 23:59 {zona_horaria}")
             except Exception as e:
-                logger.error(f"❌ Error registrando job para {sede_nombre} ({sede_id}): {str(e)}")
-                continue
-        
-        logger.info(f"✅ Cierres automáticos configurados para {len(sedes)} sedes")
-        
+                logger.error(f"❌ Error registrando job para la zona {zona_horaria}: {str(e)}")
+
+        logger.info(f"✅ Cierres automáticos configurados para {len(sedes)} sedes en {len(zonas)} zonas horarias")
+
     except Exception as e:
         logger.error(f"❌ Error registrando cierres automáticos: {str(e)}", exc_info=True)
 
+
+async def _mantenimiento_horario() -> None:
+    await registrar_cierres_automaticos()
+    await _recuperar_en_segundo_plano()
+
 # ============================================================
 # INICIAR Y DETENER SCHEDULER
 # ============================================================
 
 async def iniciar_scheduler():
     """
-    Inicia el scheduler y registra las tareas de cierre automático.
-    Llamar desde main.py al iniciar la app.
+    Inicia el scheduler, registra las tareas de cierre automático y
+    empieza a competir por el liderazgo. Llamar desde el lifespan.
     """
     try:
         if not scheduler.running:
             # Registrar tareas
             await registrar_cierres_automaticos()
-            
+            scheduler.add_job(
+                _mantenimiento_horario,
+                trigger=CronTrigger(minute=17),
+                id="cierre_auto_mantenimiento",
+                name="Registrar zonas y recuperar cierres",
+                replace_existing=True
+            )
+
             # Iniciar scheduler
             scheduler.start()
-            logger.info("✅ Scheduler de cierres automáticos INICIADO")
+            await iniciar_eleccion(LIDERAZGO, al_ganar=_recuperar_en_segundo_plano)
+            logger.info(f"✅ Scheduler de cierres automáticos INICIADO ({INSTANCIA_ID})")
         else:
             logger.warning("⚠️ Scheduler ya estaba iniciado")
-            
+
     except Exception as e:
         logger.error(f"❌ Error iniciando scheduler: {str(e)}", exc_info=True)
 
-def detener_scheduler():
+async def detener_scheduler():
     """
-    Detiene el scheduler.
-    Llamar al cerrar la aplicación.
+    Detiene el scheduler y libera el liderazgo para que otro proceso lo
+    tome sin esperar a que venza. Llamar al cerrar la aplicación.
     """
     try:
         if scheduler.running:
-            scheduler.shutdown()
-            logger.info("✅ Scheduler de cierres automáticos DETENIDO")
+            scheduler.shutdown(wait=False)
+        await detener_eleccion(LIDERAZGO)
+        logger.info("✅ Scheduler de cierres automáticos DETENIDO")
     except Exception as e:
         logger.error(f"❌ Error deteniendo scheduler: {str(e)}", exc_info=True)
 
 # ============================================================
-# FUNCIÓN PARA EJECUTAR MANUALMENTE (DEBUGGING)
+# CONSULTA DE ESTADO E HISTORIAL
 # ============================================================
 
-async def ejecutar_cierre_manual_todas_sedes():
-    """
-    Ejecuta el cierre automático para TODAS las sedes AHORA.
-    Útil para testing o ejecución manual.
-    """
-    sedes = await locales.find({"activa": True}).to_list(None)
-    
-    for sede in sedes:
-        sede_id = sede.get("sede_id")
-        sede_nombre = sede.get("nombre")
-        await ejecutar_cierre_automatico_sede(sede_id, sede_nombre)
+async def estado_scheduler() -> dict:
+    """Líder actual, si este proceso lo es y próximos disparos de los jobs."""
+    lider = await lider_actual(LIDERAZGO)
+    vigente = bool(lider and lider.get("expira_en") and lider["expira_en"] > datetime.utcnow())
+    return {
+        "instancia": INSTANCIA_ID,
+        "es_lider": es_lider(LIDERAZGO),
+        "lider": lider.get("dueno") if vigente else None,
+        "lider_expira_en": lider.get("expira_en") if vigente else None,
+        "lease_segundos": LEASE_SEGUNDOS,
+        "jobs": [
+            {
+                "id": job.id,
+                "nombre": job.name,
+                "proxima_ejecucion": job.next_run_time,
+            }
+            for job in scheduler.get_jobs()
+        ] if scheduler.running else [],
+    }
 
-# ============================================================
-# INTEGRACIÓN CON MAIN.PY
-# ============================================================
 
-"""
-# En app/main.py:
+async def obtener_ejecuciones(
+    sede_id: Optional[str] = None,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    estado: Optional[str] = None,
+    limite: int = 100,
+) -> List[dict]:
+    """Historial de ejecuciones de cierres automáticos, más recientes primero."""
+    filtro: Dict[str, Any] = {"job": JOB_CIERRE}
+    if sede_id:
+        filtro["sede_id"] = sede_id
+    if fecha_inicio or fecha_fin:
+        filtro["fecha"] = {}
+        if fecha_inicio:
+            filtro["fecha"]["$gte"] = fecha_inicio
+        if fecha_fin:
+            filtro["fecha"]["$lte"] = fecha_fin
+    if estado:
+        filtro["estado"] = estado
 
-from fastapi import FastAPI
-from contextlib import asynccontextmanager
-from app.cash.scheduler import iniciar_scheduler, detener_scheduler
+    cursor = scheduler_runs.find(filtro).sort("fecha", -1).limit(limite)
+    return [{"id": r.pop("_id"), **r} async for r in cursor]
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup
-    await iniciar_scheduler()
-    yield
-    # Shutdown
-    detener_scheduler()
+# ============================================================
+# FUNCIÓN PARA EJECUTAR MANUALMENTE (DEBUGGING)
+# ============================================================
 
-app = FastAPI(lifespan=lifespan)
-"""
+async def ejecutar_cierre_manual_todas_sedes():
+    """
+    Ejecuta el cierre automático para TODAS las sedes AHORA.
+    Útil para testing o ejecución manual. No requiere ser líder: el
+    reclamo en scheduler_runs evita duplicar un cierre ya hecho.
+    """
+    sedes = await _sedes_activas()
+    return await _correr_en_paralelo([(s,) for s in sedes])
@@ -0,0 +1,578 @@
+# ============================================================
+# busqueda.py - Claves de búsqueda de clientes
+# Ubicación: app/clients_service/busqueda.py
+#
+# Cada cliente guarda sus claves normalizadas al crearse o editarse:
+#
+#   busqueda {
+#     v,          versión de la normalización (VERSION_CLAVES)
+#     tokens,     nombre sin tildes, en minúsculas, por palabra
+#     prefijos,   prefijos de cada token (MIN_PREFIJO..MAX_PREFIJO letras)
+#     telefono,   solo dígitos, formato nacional (sin indicativo de país)
+#     cedula,     solo dígitos
+#     digitos     [telefono, cedula] para buscar ambos con un índice
+#   }
+#   telefono_e164    teléfono canónico (+573001234567); sin indicativo
+#                    se asume el del país de la sede del cliente
+#   cedula_digitos   documento solo con dígitos
+#
+# Los campos canónicos están indexados por franquicia: la validación de
+# duplicados y las búsquedas de un número completo (MIN_DIGITOS_EXACTO
+# o más dígitos) son una igualdad sobre el índice, sin re-normalizar a
+# cada candidato. Si el número completo no coincide con ningún cliente
+# se busca como prefijo.
+#
+# Las búsquedas son consultas por índice sobre esas claves
+# ((franquicia_id, busqueda.prefijos, nombre) y
+# (franquicia_id, busqueda.digitos)) y traen a lo sumo TOP_K candidatos;
+# el ranking fuzzy (rapidfuzz, en routes_clientes) corre solo sobre ellos.
+#
+# - nombre: todos los tokens del término deben ser prefijo de alguna
+#   palabra del nombre ("luisa bust" → "Luisa Bustamante"). Si hay
+#   menos de 3 resultados se relaja a cualquier token por sus primeras
+#   3 letras, para tolerar errores de tipeo.
+# - teléfono / cédula: prefijo de dígitos (se escribe desde el inicio).
+#   El término también se prueba sin indicativo de país.
+# - mixto (cliente_id, nombre con números): prefijo de cliente_id o
+#   de los tokens del nombre.
+#
+# Backfill: al arrancar la API (lifespan) se reconstruyen en segundo
+# plano las claves de los clientes que no las tienen y se registra
+# VERSION_CLAVES en schema_meta. Mientras este proceso no lo confirme,
+# las búsquedas también traen, por el camino anterior ($regex), los
+# clientes que aún no tienen `busqueda`.
+#
+# Uso por consola (backfill de claves y campos canónicos):
+#   python -m app.clients_service.busqueda --rebuild
+#   MONGODB_BENCH_URI=... python -m app.clients_service.busqueda --bench [CLIENTES]
+# ============================================================
+
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+import time
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from app.database.mongo import db, collection_clients
+from app.database.indexes import SCHEMA_META_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+VERSION_CLAVES = 2
+MIN_PREFIJO = 2
+MAX_PREFIJO = 12
+MIN_DIGITOS = 4
+# Desde aquí el término se busca primero como teléfono/documento exacto
+MIN_DIGITOS_EXACTO = 7
+# Candidatos que llegan al ranking fuzzy
+TOP_K = 200
+
+LOTE_CLIENTES = 1000
+
+# Registro en schema_meta de la versión de claves aplicada a todos los clientes
+META_CLAVES_ID = "clients_busqueda"
+# True cuando este proceso sabe que ningún cliente quedó sin claves
+_claves_al_dia = False
+_tarea_backfill: Optional[asyncio.Task] = None
+
+# Indicativos de país que se quitan al normalizar teléfonos
+# (57=Colombia, 1=USA, 52=México, 34=España, 56=Chile, ...)
+INDICATIVOS = ["57", "1", "52", "34", "56", "51", "593", "591", "595", "598"]
+
+# Indicativo según el país de la sede (Local.pais), para teléfonos escritos sin él
+INDICATIVO_POR_PAIS = {
+    "colombia": "57", "estados unidos": "1", "usa": "1", "mexico": "52", "espana": "34",
+    "chile": "56", "peru": "51", "ecuador": "593", "bolivia": "591", "paraguay": "595",
+    "uruguay": "598",
+}
+INDICATIVO_DEFECTO = "57"
+
+
+# ============================================================
+# NORMALIZACIÓN
+# ============================================================
+
+def solo_digitos(texto: Any) -> str:
+    """Extrae solo los dígitos de un string."""
+    return re.sub(r"\D", "", str(texto or ""))
+
+
+def telefono_nacional(tel: Any) -> str:
+    """
+    Teléfono en dígitos sin indicativo de país.
+    +573001234567 → 3001234567
+    57 300 123 4567 → 3001234567
+    """
+    digitos = solo_digitos(tel)
+    for prefijo in INDICATIVOS:
+        if digitos.startswith(prefijo) and len(digitos) > len(prefijo) + 6:
+            sin_prefijo = digitos[len(prefijo):]
+            # Solo quitar el prefijo si lo que queda parece un número local válido (7-10 dígitos)
+            if 7 <= len(sin_prefijo) <= 10:
+                return sin_prefijo
+    return digitos
+
+
+def indicativo_pais(pais: Any) -> str:
+    return INDICATIVO_POR_PAIS.get(normalizar_texto(pais).strip(), INDICATIVO_DEFECTO)
+
+
+def telefono_e164(tel: Any, pais: Any = None) -> Optional[str]:
+    """
+    Teléfono canónico E.164, o None si no tiene dígitos suficientes.
+    +57 300 123 4567 → +573001234567
+    0057 300 123 4567 → +573001234567
+    300 123 4567 (sede en Colombia) → +573001234567
+    """
+    return _e164(tel, indicativo_pais(pais))
+
+
+def _e164(tel: Any, propio: str) -> Optional[str]:
+    """telefono_e164() con el indicativo por defecto ya resuelto."""
+    texto = str(tel or "").strip()
+    digitos = solo_digitos(texto)
+    if len(digitos) < 7:
+        return None
+    if texto.startswith("+"):
+        internacional = digitos
+    elif digitos.startswith("00"):
+        internacional = digitos[2:]
+    elif digitos.startswith(propio) and 7 <= len(digitos) - len(propio) <= 10:
+        internacional = digitos
+    elif len(digitos) <= 10:
+        internacional = propio + digitos
+    else:
+        # Más largo que un número nacional: ya trae indicativo
+        internacional = digitos
+    return "+" + internacional if 7 <= len(internacional) <= 15 else None
+
+
+def normalizar_texto(texto: Any) -> str:
+    """Minúsculas y sin tildes: 'José Peña' → 'jose pena'."""
+    descompuesto = unicodedata.normalize("NFKD", str(texto or "").lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def tokens_nombre(texto: Any) -> List[str]:
+    return re.findall(r"[a-z0-9]+", normalizar_texto(texto))
+
+
+def _prefijos(tokens: List[str]) -> List[str]:
+    prefijos = set()
+    for token in tokens:
+        if len(token) < MIN_PREFIJO:
+            prefijos.add(token)
+            continue
+        for largo in range(MIN_PREFIJO, min(len(token), MAX_PREFIJO) + 1):
+            prefijos.add(token[:largo])
+    return sorted(prefijos)
+
+
+def claves_busqueda(cliente: Dict[str, Any]) -> Dict[str, Any]:
+    """Valor del campo `busqueda` para un documento de cliente."""
+    tokens = tokens_nombre(cliente.get("nombre"))
+    telefono = telefono_nacional(cliente.get("telefono"))
+    cedula = solo_digitos(cliente.get("cedula"))
+    return {
+        "v": VERSION_CLAVES,
+        "tokens": tokens,
+        "prefijos": _prefijos(tokens),
+        "telefono": telefono,
+        "cedula": cedula,
+        "digitos": sorted({d for d in (telefono, cedula) if d}),
+    }
+
+
+def claves_cliente(cliente: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Campos derivados que se guardan en cada escritura del cliente:
+    `busqueda`, `telefono_e164` y `cedula_digitos`.
+    """
+    return {
+        "busqueda": claves_busqueda(cliente),
+        "telefono_e164": telefono_e164(cliente.get("telefono"), cliente.get("pais")),
+        "cedula_digitos": solo_digitos(cliente.get("cedula")) or None,
+    }
+
+
+# ============================================================
+# CONSULTAS
+# ============================================================
+
+def _tokens_termino(termino: str) -> List[str]:
+    tokens = tokens_nombre(termino)
+    largos = [t for t in tokens if len(t) >= MIN_PREFIJO]
+    return [t[:MAX_PREFIJO] for t in (largos or tokens)]
+
+
+def _claves_digitos(termino: str) -> List[str]:
+    """Dígitos del término, tal cual y sin indicativo de país."""
+    digitos = solo_digitos(termino)
+    if len(digitos) < MIN_DIGITOS:
+        return []
+    claves = {digitos, telefono_nacional(digitos)}
+    # "+57 315": el indicativo es explícito aunque el número esté incompleto
+    if termino.strip().startswith("+"):
+        for prefijo in INDICATIVOS:
+            if digitos.startswith(prefijo) and len(digitos) > len(prefijo):
+                claves.add(digitos[len(prefijo):])
+                break
+    return sorted(claves)
+
+
+def _prefijo_regex(valor: str) -> re.Pattern:
+    # Anclado y sensible a mayúsculas: MongoDB lo resuelve como rango del índice
+    return re.compile("^" + re.escape(valor))
+
+
+async def _consultar(coleccion, query: Dict, projection: Optional[Dict], limite: int, ordenar: bool = True) -> List[dict]:
+    cursor = coleccion.find(query, projection or None)
+    if ordenar:
+        cursor = cursor.sort("nombre", 1)
+    return await cursor.limit(limite).to_list(limite)
+
+
+def _query_sin_claves(termino: str, tipo: str) -> Optional[Dict[str, Any]]:
+    """La consulta anterior ($regex sin anclar), para clientes aún sin claves."""
+    if tipo == "nombre":
+        tokens = [re.escape(t) for t in termino.split() if len(t) >= MIN_PREFIJO]
+        if not tokens:
+            return None
+        condiciones = [{"nombre": {"$regex": t, "$options": "i"}} for t in tokens]
+    else:
+        condiciones = [{"cliente_id": {"$regex": re.escape(termino.strip()), "$options": "i"}}]
+        digitos = solo_digitos(termino)
+        if len(digitos) >= MIN_DIGITOS:
+            condiciones += [{"telefono": {"$regex": digitos}}, {"cedula": {"$regex": digitos}}]
+    return {"busqueda": {"$exists": False}, "$or": condiciones}
+
+
+async def buscar_candidatos(
+    query_base: Dict[str, Any],
+    termino: str,
+    tipo: str,
+    projection: Optional[Dict[str, int]] = None,
+    limite: int = TOP_K,
+    coleccion=None,
+) -> List[dict]:
+    """
+    Hasta `limite` clientes candidatos para el término, por índice.
+    `tipo` es el de _tipo_busqueda(): nombre | telefono_o_cedula | mixto.
+    `coleccion` es la de clientes de la app salvo que se indique (benchmark);
+    el respaldo para clientes sin claves solo aplica a la de la app.
+    """
+    if projection:
+        projection = {**projection, "busqueda": 1}
+    respaldo = coleccion is None and not _claves_al_dia
+    if coleccion is None:
+        coleccion = collection_clients
+
+    candidatos = await _candidatos_por_claves(coleccion, query_base, termino, tipo, projection, limite)
+
+    if respaldo and len(candidatos) < limite:
+        # Backfill pendiente: sumar los clientes que todavía no tienen claves
+        query = _query_sin_claves(termino, tipo)
+        if query:
+            vistos = {c["_id"] for c in candidatos}
+            pendientes = await _consultar(coleccion, {**query_base, **query}, projection, limite, ordenar=False)
+            candidatos += [c for c in pendientes if c["_id"] not in vistos][: limite - len(candidatos)]
+    return candidatos
+
+
+async def _buscar_numero_exacto(
+    coleccion,
+    query_base: Dict[str, Any],
+    termino: str,
+    projection: Optional[Dict[str, int]],
+    limite: int,
+) -> List[dict]:
+    """
+    Clientes cuyo telefono_e164 o cedula_digitos es exactamente el término.
+    Sin el país de la sede, el teléfono sin indicativo se prueba con cada
+    indicativo conocido.
+    """
+    digitos = solo_digitos(termino)
+    if len(digitos) < MIN_DIGITOS_EXACTO:
+        return []
+    telefonos = sorted({t for t in (_e164(termino, ind) for ind in INDICATIVOS) if t})
+    condiciones = [{**query_base, "cedula_digitos": digitos}]
+    if telefonos:
+        condiciones.append({**query_base, "telefono_e164": {"$in": telefonos}})
+    return await _consultar(coleccion, {"$or": condiciones}, projection, limite, ordenar=False)
+
+
+async def _candidatos_por_claves(
+    coleccion,
+    query_base: Dict[str, Any],
+    termino: str,
+    tipo: str,
+    projection: Optional[Dict[str, int]],
+    limite: int,
+) -> List[dict]:
+    if tipo == "telefono_o_cedula":
+        claves = _claves_digitos(termino)
+        if not claves:
+            return []
+        exactos = await _buscar_numero_exacto(coleccion, query_base, termino, projection, limite)
+        if exactos:
+            return exactos
+        return await _consultar(
+            coleccion, {**query_base, "busqueda.digitos": {"$in": [_prefijo_regex(c) for c in claves]}},
+            projection, limite, ordenar=False,
+        )
+
+    tokens = _tokens_termino(termino)
+
+    if tipo == "mixto":
+        condiciones = [{"cliente_id": _prefijo_regex(termino.strip().upper())}]
+        if tokens:
+            condiciones.append({"busqueda.prefijos": {"$all": tokens}})
+        return await _consultar(coleccion, {**query_base, "$or": condiciones}, projection, limite, ordenar=False)
+
+    # nombre
+    if not tokens:
+        return await _consultar(coleccion, query_base, projection, limite)
+
+    candidatos = await _consultar(
+        coleccion, {**query_base, "busqueda.prefijos": {"$all": tokens}}, projection, limite
+    )
+    if len(candidatos) < 3:
+        # Tolerar errores de tipeo: cualquier token por sus primeras letras
+        vistos = {c["_id"] for c in candidatos}
+        relajados = await _consultar(
+            coleccion, {**query_base, "busqueda.prefijos": {"$in": sorted({t[:3] for t in tokens})}},
+            projection, limite,
+        )
+        candidatos += [c for c in relajados if c["_id"] not in vistos][: limite - len(candidatos)]
+    return candidatos
+
+
+def filtrar_por_digitos(candidatos: List[dict], termino: str) -> List[dict]:
+    """
+    Candidatos cuyo teléfono o cédula empiezan por los dígitos del término,
+    primero los de teléfono. Usa las claves guardadas, sin re-normalizar
+    (salvo clientes que el backfill aún no alcanzó).
+    """
+    claves = _claves_digitos(termino)
+    por_telefono, por_cedula = [], []
+    for cliente in candidatos:
+        guardadas = cliente.get("busqueda") or claves_busqueda(cliente)
+        if any((guardadas.get("telefono") or "").startswith(c) for c in claves):
+            por_telefono.append(cliente)
+        elif any((guardadas.get("cedula") or "").startswith(c) for c in claves):
+            por_cedula.append(cliente)
+    return por_telefono + por_cedula
+
+
+# ============================================================
+# BACKFILL
+# ============================================================
+
+async def reconstruir_claves(lote: int = LOTE_CLIENTES) -> Dict[str, int]:
+    """
+    Calcula `busqueda` y los campos canónicos de los clientes sin claves
+    o con una versión anterior.
+    """
+    conteo = {"actualizados": 0}
+    pendientes: List[UpdateOne] = []
+    cursor = collection_clients.find(
+        {"busqueda.v": {"$ne": VERSION_CLAVES}}, {"nombre": 1, "telefono": 1, "cedula": 1, "pais": 1}
+    )
+    async for cliente in cursor:
+        pendientes.append(UpdateOne({"_id": cliente["_id"]}, {"$set": claves_cliente(cliente)}))
+        if len(pendientes) >= lote:
+            await collection_clients.bulk_write(pendientes, ordered=False)
+            conteo["actualizados"] += len(pendientes)
+            pendientes = []
+    if pendientes:
+        await collection_clients.bulk_write(pendientes, ordered=False)
+        conteo["actualizados"] += len(pendientes)
+
+    global _claves_al_dia
+    await db[SCHEMA_META_COLLECTION].update_one(
+        {"_id": META_CLAVES_ID},
+        {"$set": {"version": VERSION_CLAVES, "aplicado_en": datetime.utcnow()}},
+        upsert=True,
+    )
+    _claves_al_dia = True
+    logger.info(f"✅ Claves y campos canónicos de clientes reconstruidos: {conteo}")
+    return conteo
+
+
+async def asegurar_claves() -> Dict[str, int]:
+    """Reconstruye las claves solo si schema_meta no registra VERSION_CLAVES."""
+    global _claves_al_dia
+    registro = await db[SCHEMA_META_COLLECTION].find_one({"_id": META_CLAVES_ID})
+    if registro and registro.get("version", 0) >= VERSION_CLAVES:
+        _claves_al_dia = True
+        return {"actualizados": 0}
+    return await reconstruir_claves()
+
+
+async def _backfill_en_segundo_plano() -> None:
+    try:
+        await asegurar_claves()
+    except Exception as e:
+        logger.error(f"❌ Error en el backfill de claves de clientes: {e}", exc_info=True)
+
+
+async def iniciar_backfill_claves() -> None:
+    """Lanza asegurar_claves() sin bloquear el arranque. Llamar desde el lifespan."""
+    global _tarea_backfill
+    if _tarea_backfill is None or _tarea_backfill.done():
+        _tarea_backfill = asyncio.create_task(_backfill_en_segundo_plano())
+
+
+async def detener_backfill_claves() -> None:
+    if _tarea_backfill and not _tarea_backfill.done():
+        _tarea_backfill.cancel()
+        try:
+            await _tarea_backfill
+        except asyncio.CancelledError:
+            pass
+
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+
+async def _buscar_anterior(coleccion, query_base: Dict, termino: str, tipo: str, projection: Dict) -> List[dict]:
+    """La búsqueda anterior: $regex sin anclar, hasta 5000 candidatos y fuzzy sobre todos."""
+    from app.clients_service.routes_clientes import _aplicar_fuzzy_nombres
+
+    if tipo == "nombre":
+        tokens = [re.escape(t) for t in termino.split() if len(t) >= 2]
+        query = {**query_base, "$or": [{"nombre": {"$regex": t, "$options": "i"}} for t in tokens]} if tokens else query_base
+    else:
+        digitos = solo_digitos(termino)
+        query = {**query_base, "$or": [
+            {"telefono": {"$regex": digitos, "$options": "i"}},
+            {"cedula": {"$regex": digitos, "$options": "i"}},
+            {"cliente_id": {"$regex": re.escape(termino), "$options": "i"}},
+        ]}
+    candidatos = await coleccion.find(query, projection).limit(5000).to_list(5000)
+    if len(candidatos) < 3 and tipo == "nombre":
+        candidatos = await coleccion.find(query_base, projection).limit(5000).to_list(5000)
+
+    if tipo == "nombre":
+        return _aplicar_fuzzy_nombres(candidatos, termino)
+    termino_norm = telefono_nacional(termino)
+    return [
+        c for c in candidatos
+        if termino_norm in telefono_nacional(c.get("telefono"))
+        or termino_norm in solo_digitos(c.get("cedula"))
+    ]
+
+
+async def benchmark_busqueda(clientes, n_clientes: int = 200_000, franquicia_id: str = "FR-BENCH") -> Dict[str, Any]:
+    """
+    Siembra una franquicia de n_clientes en `clientes` (vacía, de una base
+    de pruebas) y mide la latencia (mediana y p95, en ms) de la búsqueda
+    anterior y la nueva para términos de nombre (parciales, con tildes,
+    con errores) y de teléfono/cédula. Al terminar elimina la colección.
+    """
+
+    nombres = ["Luisa", "María", "José", "Ana", "Andrés", "Camila", "Juan", "Valentina", "Sofía", "Carlos",
+               "Daniela", "Felipe", "Laura", "Santiago", "Paula", "Mateo", "Natalia", "Sebastián"]
+    apellidos = ["Bustamante", "Gómez", "Rodríguez", "Peña", "Martínez", "López", "García", "Hernández",
+                 "Ramírez", "Torres", "Castaño", "Muñoz", "Ortiz", "Restrepo", "Zuluaga", "Álvarez"]
+    terminos = ["luisa bust", "maria", "jose pena", "Andrés Martínez", "cami", "valentina zuluaga",
+                "sebastian castano", "luisa bustamnte", "3001", "3104567", "+57 315", "1020"]
+
+    if await clientes.find_one({}, {"_id": 1}):
+        raise ValueError(f"La colección {clientes.name} debe estar vacía para el benchmark")
+
+    from app.clients_service.routes_clientes import _aplicar_fuzzy_nombres
+
+    random.seed(42)
+    try:
+        await clientes.create_index([("franquicia_id", 1), ("nombre", 1)])
+        await clientes.create_index([("franquicia_id", 1), ("busqueda.prefijos", 1), ("nombre", 1)])
+        await clientes.create_index([("franquicia_id", 1), ("busqueda.digitos", 1)])
+
+        lote = []
+        for i in range(n_clientes):
+            doc = {
+                "cliente_id": f"CL-{i:06d}",
+                "nombre": f"{random.choice(nombres)} {random.choice(nombres)} {random.choice(apellidos)} {random.choice(apellidos)}",
+                "telefono": f"+57 3{random.randint(0, 2)}{random.randint(0, 9)} {random.randint(1000000, 9999999)}",
+                "cedula": str(random.randint(10_000_000, 1_099_999_999)),
+                "franquicia_id": franquicia_id,
+            }
+            doc["busqueda"] = claves_busqueda(doc)
+            lote.append(doc)
+            if len(lote) >= 10_000:
+                await clientes.insert_many(lote, ordered=False)
+                lote = []
+        if lote:
+            await clientes.insert_many(lote, ordered=False)
+
+        query_base = {"franquicia_id": franquicia_id}
+        projection = {"_id": 1, "cliente_id": 1, "nombre": 1, "telefono": 1, "cedula": 1}
+
+        async def _nueva(termino: str, tipo: str) -> List[dict]:
+            candidatos = await buscar_candidatos(query_base, termino, tipo, projection, coleccion=clientes)
+            if tipo == "nombre":
+                return _aplicar_fuzzy_nombres(candidatos, termino)
+            return filtrar_por_digitos(candidatos, termino)
+
+        def _resumen(tiempos: List[float]) -> Dict[str, float]:
+            tiempos = sorted(tiempos)
+            return {"p50_ms": round(tiempos[len(tiempos) // 2] * 1000, 1),
+                    "p95_ms": round(tiempos[int(len(tiempos) * 0.95) - 1] * 1000, 1)}
+
+        medidas: Dict[str, List[float]] = {"anterior": [], "nueva": []}
+        por_termino = []
+        for termino in terminos:
+            tipo = "telefono_o_cedula" if not re.search(r"[a-zA-Záéíóúñ]", termino) else "nombre"
+            fila = {"termino": termino}
+            for nombre, buscar in (
+                ("anterior", lambda: _buscar_anterior(clientes, query_base, termino, tipo, projection)),
+                ("nueva", lambda: _nueva(termino, tipo)),
+            ):
+                tiempos = []
+                for _ in range(5):
+                    t0 = time.perf_counter()
+                    resultado = await buscar()
+                    tiempos.append(time.perf_counter() - t0)
+                medidas[nombre] += tiempos
+                fila[f"{nombre}_ms"] = round(min(tiempos) * 1000, 1)
+                fila[f"{nombre}_top"] = (resultado[0].get("nombre") if resultado else None)
+            por_termino.append(fila)
+
+        return {
+            "clientes": n_clientes,
+            "anterior": _resumen(medidas["anterior"]),
+            "nueva": _resumen(medidas["nueva"]),
+            "terminos": por_termino,
+        }
+    finally:
+        await clientes.drop()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args == ["--rebuild"]:
+        print(asyncio.run(reconstruir_claves()))
+    elif args and args[0] == "--bench":
+        # El benchmark siembra y elimina la colección: nunca en la base de la app
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        bench_uri = os.getenv("MONGODB_BENCH_URI")
+        if not bench_uri:
+            sys.exit("Defina MONGODB_BENCH_URI con una base de pruebas (no la de la app)")
+        bench_db = AsyncIOMotorClient(bench_uri)[os.getenv("MONGODB_BENCH_NAME", "bench_busqueda")]
+        print(asyncio.run(benchmark_busqueda(
+            bench_db[collection_clients.name], int(args[1]) if len(args) > 1 else 200_000
+        )))
+    else:
+        print("Uso:\n"
+              "  python -m app.clients_service.busqueda --rebuild\n"
+              "  MONGODB_BENCH_URI=... python -m app.clients_service.busqueda --bench [CLIENTES]")
@@ -7,6 +7,7 @@ from app.database.mongo import collection_clients, collection_citas, collection_
 from app.auth.routes import get_current_user
 from app.scheduling.submodules.quotes.controllers import ( generar_pdf_ficha, 
     crear_html_correo_ficha, enviar_correo_con_pdf)
+from app.utils.cpu_pool import PoolSaturado, metricas as metricas_pool
 
 router = APIRouter()
 
@@ -150,6 +151,8 @@ async def generar_pdf_especifico(
     except HTTPException as he:
         print(f"❌ HTTP Exception: {he.detail}")
         raise he
+    except PoolSaturado as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"❌ Error generando PDF: {e}")
         import traceback
@@ -355,4 +358,14 @@ async def reenviar_pdf_correo(
         raise
     except Exception as e:
         print(f"❌ Error reenviando PDF: {e}")
-        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+
+
+# ============================================
+# 📊 Métricas del pool de procesos de PDFs
+# ============================================
+@router.get("/pool/metricas", response_model=dict)
+async def metricas_pool_pdf(current_user: dict = Depends(get_current_user)):
+    if current_user["rol"] not in ["super_admin", "admin_franquicia"]:
+        raise HTTPException(status_code=403, detail="No autorizado")
+    return {"success": True, "pool": metricas_pool()}
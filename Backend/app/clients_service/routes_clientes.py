@@ -6,6 +6,15 @@ from app.database.mongo import (
 )
 from app.auth.routes import get_current_user
 from app.id_generator.generator import generar_id
+from app.scheduling.submodules.fichas.imagenes import miniaturas
+from app.analytics.visitas_clientes import obtener_visitas
+from app.clients_service.busqueda import (
+    buscar_candidatos,
+    claves_cliente,
+    filtrar_por_digitos,
+    solo_digitos,
+    telefono_e164,
+)
 from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 from typing import List, Optional
@@ -22,6 +31,7 @@ router = APIRouter()
 
 def cliente_to_dict(c: dict) -> dict:
     c["_id"] = str(c["_id"])
+    c.pop("busqueda", None)
     if "cliente_id" not in c or not c["cliente_id"]:
         c["cliente_id"] = str(c["_id"])
     return c
@@ -35,7 +45,9 @@ def cita_to_dict(c: dict) -> dict:
 async def verificar_duplicado_cliente(
     correo: Optional[str] = None,
     telefono: Optional[str] = None,
-    exclude_id: Optional[str] = None
+    exclude_id: Optional[str] = None,
+    franquicia_id: Optional[str] = None,
+    pais: Optional[str] = None
 ):
     if not correo and not telefono:
         return None
@@ -44,7 +56,12 @@ async def verificar_duplicado_cliente(
     if correo:
         query["$or"].append({"correo": correo})
     if telefono:
-        query["$or"].append({"telefono": telefono})
+        # Teléfono canónico dentro de la franquicia: igualdad sobre el índice
+        e164 = telefono_e164(telefono, pais)
+        if e164:
+            query["$or"].append({"franquicia_id": franquicia_id, "telefono_e164": e164})
+        else:
+            query["$or"].append({"telefono": telefono})
 
     if exclude_id:
         try:
@@ -69,17 +86,12 @@ async def _get_franquicia_id_de_sede(sede_id: str) -> Optional[str]:
 # ✅ HELPERS DE BÚSQUEDA INTELIGENTE
 # ============================================================
  
-def _solo_digitos(texto: str) -> str:
-    """Extrae solo los dígitos de un string. Útil para normalizar teléfonos y cédulas."""
-    return re.sub(r"\D", "", texto)
- 
- 
 def _tipo_busqueda(termino: str) -> str:
     """
     Clasifica el tipo de búsqueda según el contenido del término.
     Retorna: 'nombre' | 'telefono' | 'cedula_o_id' | 'mixto'
     """
-    digitos = _solo_digitos(termino)
+    digitos = solo_digitos(termino)
     tiene_letras = bool(re.search(r"[a-zA-ZáéíóúÁÉÍÓÚñÑüÜ]", termino))
     tiene_digitos = bool(digitos)
  
@@ -94,24 +106,6 @@ def _tipo_busqueda(termino: str) -> str:
     return "nombre"
  
  
-def _normalizar_telefono(tel: str) -> str:
-    """
-    Normaliza teléfono: quita +, espacios, guiones, prefijos de país comunes.
-    +573001234567 → 3001234567
-    57 300 123 4567 → 3001234567
-    """
-    digitos = _solo_digitos(tel)
-    # Quitar prefijos de país comunes (57=Colombia, 1=USA, 52=México, 34=España, 56=Chile)
-    for prefijo in ["57", "1", "52", "34", "56", "51", "593", "591", "595", "598"]:
-        if digitos.startswith(prefijo) and len(digitos) > len(prefijo) + 6:
-            sin_prefijo = digitos[len(prefijo):]
-            # Solo quitar el prefijo si lo que queda parece un número local válido (7-10 dígitos)
-            if 7 <= len(sin_prefijo) <= 10:
-                digitos = sin_prefijo
-                break
-    return digitos
- 
- 
 def _score_nombre(termino: str, nombre: str) -> int:
     """
     Score en 3 capas:
@@ -179,39 +173,6 @@ def _aplicar_fuzzy_nombres(clientes: List[dict], termino: str) -> List[dict]:
     return [c for _, c in scored]
  
  
-def _aplicar_filtro_telefono(clientes: List[dict], termino: str) -> List[dict]:
-    """
-    Filtra clientes por teléfono normalizando ambos lados.
-    Busca si el número normalizado del término está contenido en el teléfono normalizado
-    o viceversa. Así '3001234567' encuentra '+57 300 123 4567'.
-    """
-    termino_norm = _normalizar_telefono(termino)
-    if len(termino_norm) < 4:
-        return []
- 
-    resultado = []
-    for cliente in clientes:
-        tel = cliente.get("telefono") or ""
-        tel_norm = _normalizar_telefono(tel)
-        # Match si uno contiene al otro (maneja prefijos y sufijos)
-        if termino_norm in tel_norm or tel_norm in termino_norm:
-            resultado.append(cliente)
-    return resultado
- 
- 
-def _aplicar_filtro_cedula(clientes: List[dict], termino: str) -> List[dict]:
-    """Filtra clientes por cédula normalizando dígitos."""
-    termino_norm = _solo_digitos(termino)
-    if len(termino_norm) < 4:
-        return []
-    resultado = []
-    for cliente in clientes:
-        cedula = _solo_digitos(cliente.get("cedula") or "")
-        if termino_norm in cedula or cedula in termino_norm:
-            resultado.append(cliente)
-    return resultado
- 
- 
 async def _get_query_base(rol: str, current_user: dict) -> dict:
     """Construye el filtro base de franquicia/sede según el rol."""
     query_base = {}
@@ -227,96 +188,18 @@ async def _get_query_base(rol: str, current_user: dict) -> dict:
     return query_base
  
  
-async def _buscar_candidatos(
-    query_base: dict,
-    termino: str,
-    tipo: str,
-    projection: dict,
-    max_candidatos: int = 5000
-) -> List[dict]:
-    """
-    Estrategia de pre-filtro en MongoDB según el tipo de búsqueda.
-    Siempre garantiza que los candidatos relevantes estén incluidos.
-    """
-    if tipo == "nombre":
-        # Pre-filtro: nombres que contengan AL MENOS UNO de los tokens
-        tokens = [re.escape(t) for t in termino.split() if len(t) >= 2]
-        if tokens:
-            query = {
-                **query_base,
-                "$or": [
-                    {"nombre": {"$regex": t, "$options": "i"}}
-                    for t in tokens
-                ]
-            }
-        else:
-            query = query_base
- 
-    elif tipo == "telefono_o_cedula":
-        # Buscar por teléfono Y por cédula simultáneamente
-        digitos = _solo_digitos(termino)
-        if not digitos:
-            return []
-        # Regex que busca los dígitos en cualquier posición del campo
-        regex_digitos = {"$regex": digitos, "$options": "i"}
-        query = {
-            **query_base,
-            "$or": [
-                {"telefono": regex_digitos},
-                {"cedula": regex_digitos},
-                {"cliente_id": {"$regex": re.escape(termino), "$options": "i"}},
-            ]
-        }
- 
-    else:  # mixto (cliente_id tipo "CLI-001")
-        query = {
-            **query_base,
-            "$or": [
-                {"cliente_id": {"$regex": re.escape(termino), "$options": "i"}},
-                {"nombre": {"$regex": re.escape(termino), "$options": "i"}},
-            ]
-        }
- 
-    candidatos = await (
-        collection_clients
-        .find(query, projection)
-        .limit(max_candidatos)
-        .to_list(max_candidatos)
-    )
- 
-    # Fallback: si no hay resultados, ampliar sin restricción de campo
-    if len(candidatos) < 3 and tipo == "nombre":
-        candidatos = await (
-            collection_clients
-            .find(query_base, projection)
-            .limit(max_candidatos)
-            .to_list(max_candidatos)
-        )
- 
-    return candidatos
- 
- 
 def _puntuar_y_ordenar(candidatos: List[dict], termino: str, tipo: str) -> List[dict]:
     """
     Aplica el algoritmo de scoring adecuado según el tipo de búsqueda
-    y retorna la lista ordenada por relevancia.
+    sobre los candidatos de buscar_candidatos() (a lo sumo TOP_K) y
+    retorna la lista ordenada por relevancia.
     """
     if tipo == "nombre":
         return _aplicar_fuzzy_nombres(candidatos, termino)
  
     elif tipo == "telefono_o_cedula":
-        # Para teléfonos y cédulas: match exacto por contenido, sin fuzzy
-        por_tel = _aplicar_filtro_telefono(candidatos, termino)
-        por_ced = _aplicar_filtro_cedula(candidatos, termino)
-        # Combinar sin duplicados, teléfono primero
-        ids_vistos = set()
-        resultado = []
-        for c in por_tel + por_ced:
-            cid = str(c.get("_id", ""))
-            if cid not in ids_vistos:
-                ids_vistos.add(cid)
-                resultado.append(c)
-        return resultado
+        # Para teléfonos y cédulas: prefijo de dígitos, sin fuzzy, teléfono primero
+        return filtrar_por_digitos(candidatos, termino)
  
     else:  # mixto
         # Para cliente_id u otros mixtos: devolver como vienen (ya filtrados por MongoDB)
@@ -364,6 +247,7 @@ async def crear_cliente(
         data["franquicia_id"] = franquicia_id  # ⭐ Heredado de la sede
         data["pais"] = sede_info.get("pais", "")
         data["notas_historial"] = []
+        data.update(claves_cliente(data))
 
         # Limpiar campo obsoleto si venía en el payload
         data.pop("es_global", None)
@@ -379,6 +263,7 @@ async def crear_cliente(
                 data["cliente_id"] = await generar_id("cliente", sede_objetivo)
 
         data["_id"] = str(result.inserted_id)  # ← LÍNEA 2: convertir para el return
+        data.pop("busqueda", None)
         return {"success": True, "cliente": data}
 
     except HTTPException:
@@ -406,17 +291,16 @@ async def listar_clientes(
         filtro_limpio = filtro.strip() if filtro else None
  
         if not filtro_limpio:
-            clientes = await collection_clients.find(query_base).limit(limite).to_list(None)
+            clientes = await collection_clients.find(query_base, {"busqueda": 0}).limit(limite).to_list(None)
             return [cliente_to_dict(c) for c in clientes]
  
         tipo = _tipo_busqueda(filtro_limpio)
  
-        candidatos = await _buscar_candidatos(
+        candidatos = await buscar_candidatos(
             query_base=query_base,
             termino=filtro_limpio,
             tipo=tipo,
-            projection={},        # proyección completa para este endpoint
-            max_candidatos=5000
+            projection=None,      # proyección completa para este endpoint
         )
  
         resultado = _puntuar_y_ordenar(candidatos, filtro_limpio, tipo)
@@ -441,10 +325,11 @@ async def listar_todos(
 ):
     """
     Búsqueda inteligente de clientes con lazy loading.
-    - Nombres: fuzzy con token_set_ratio + partial_ratio, umbral dinámico
-    - Teléfonos: normaliza prefijos de país (+57, 57, etc.)
-    - Cédulas: normaliza dígitos, búsqueda por contención
-    - IDs: regex exacto
+    - Nombres: prefijos indexados (busqueda.prefijos) y fuzzy con
+      token_set_ratio + partial_ratio sobre los primeros TOP_K, umbral dinámico
+    - Teléfonos: prefijo de dígitos sin indicativo de país (+57, 57, etc.)
+    - Cédulas: prefijo de dígitos
+    - IDs: prefijo de cliente_id
     """
     try:
         rol = current_user.get("rol")
@@ -494,12 +379,11 @@ async def listar_todos(
         tipo = _tipo_busqueda(filtro_limpio)
         logger.info(f"[BUSQUEDA] filtro='{filtro_limpio}' tipo='{tipo}'")
  
-        candidatos = await _buscar_candidatos(
+        candidatos = await buscar_candidatos(
             query_base=query_base,
             termino=filtro_limpio,
             tipo=tipo,
             projection=projection,
-            max_candidatos=5000
         )
         logger.info(f"[BUSQUEDA] candidatos MongoDB: {len(candidatos)}")
  
@@ -618,7 +502,16 @@ async def obtener_cliente(
                 # Fallback: verificar por sede directa
                 raise HTTPException(status_code=403, detail="No autorizado")
 
-        return cliente_to_dict(cliente)
+        cliente = cliente_to_dict(cliente)
+
+        # Visitas y gasto desde client_visit_stats (todas las sedes)
+        stats = (await obtener_visitas([cliente["cliente_id"]])).get(cliente["cliente_id"])
+        cliente["estadisticas"] = {
+            campo: stats.get(campo)
+            for campo in ("primera_cita", "ultima_cita", "visitas", "compras", "gasto", "ultima_compra")
+        } if stats else None
+
+        return cliente
 
     except HTTPException:
         raise
@@ -668,7 +561,9 @@ async def editar_cliente(
         existing = await verificar_duplicado_cliente(
             correo=data_update.correo,
             telefono=data_update.telefono,
-            exclude_id=str(cliente["_id"])
+            exclude_id=str(cliente["_id"]),
+            franquicia_id=cliente.get("franquicia_id"),
+            pais=cliente.get("pais")
         )
 
         if existing:
@@ -680,6 +575,7 @@ async def editar_cliente(
         update_data["fecha_modificacion"] = datetime.now()
         update_data.pop("cliente_id", None)
         update_data.pop("es_global", None)  # Nunca permitir setear campo obsoleto
+        update_data.update(claves_cliente({**cliente, **update_data}))
 
         await collection_clients.update_one(
             {"_id": cliente["_id"]},
@@ -825,6 +721,7 @@ async def obtener_fichas_cliente(
                 "sede": sede_nombre,
                 "estilista": estilista_nombre,
                 "sede_estilista": sede_estilista_nombre,
+                "miniaturas": miniaturas(ficha),
             })
 
         return resultado_final
@@ -847,7 +744,7 @@ async def get_clientes_mi_sede(
     if not sede_usuario:
         raise HTTPException(400, "El usuario autenticado no tiene una sede asignada")
 
-    clientes_cursor = collection_clients.find({"sede_id": sede_usuario}, {"_id": 0})
+    clientes_cursor = collection_clients.find({"sede_id": sede_usuario}, {"_id": 0, "busqueda": 0})
     return await clientes_cursor.to_list(length=None)
 
 # ─── ENDPOINT PUT ────────────────────────────────────────────────
@@ -27,13 +27,52 @@ from app.cash.routes_cash import router as cash_router
 from app.giftcards.routes_giftcards import router as giftcards_router
 from app.scheduling.submodules.fichas.routes_fichas import router as routes_fichas_router
 from app.admin.routes_franquicias import router as admin_franquicias_router
-# from app.database.indexes import create_indexes
+from app.database.indexes import create_indexes
+from app.utils.email_queue import iniciar_workers_correo, detener_workers_correo
+from app.utils.job_queue import iniciar_workers_trabajos, detener_workers_trabajos
+from app.utils.cpu_pool import detener_pool
+from app.cash.resumen_diario import detener_recalculos
+from app.analytics.scheduler_hechos import iniciar_rollup, detener_rollup
+from app.clients_service.busqueda import iniciar_backfill_claves, detener_backfill_claves
+from app.database.migraciones import lanzar_migracion, detener_migraciones
+from app.scheduling.submodules.quotes.slot_claims import (
+    MIGRACION_BACKFILL as MIGRACION_SLOT_CLAIMS,
+    VERSION_BACKFILL as VERSION_SLOT_CLAIMS,
+    backfill_citas_futuras,
+)
+from app.analytics.visitas_clientes import MIGRACION_VISITAS, VERSION_VISITAS, reconstruir_visitas
 from app.database.mongo import db  
-# from app.database.indexes import create_indexes  
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup
+    try:
+        await create_indexes(db)
+    except Exception as e:
+        print(f"⚠️ No se pudieron aplicar los índices: {e}")
+    await iniciar_scheduler()
+    await iniciar_rollup()
+    await iniciar_workers_correo()
+    await iniciar_workers_trabajos()
+    await iniciar_backfill_claves()
+    lanzar_migracion(MIGRACION_SLOT_CLAIMS, VERSION_SLOT_CLAIMS, backfill_citas_futuras)
+    lanzar_migracion(MIGRACION_VISITAS, VERSION_VISITAS, reconstruir_visitas)
+    yield
+    # Shutdown
+    await detener_backfill_claves()
+    await detener_migraciones()
+    await detener_workers_trabajos()
+    await detener_recalculos()
+    detener_pool()
+    await detener_workers_correo()
+    await detener_scheduler()
+    await detener_rollup()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -57,21 +96,6 @@ async def read_root():
 async def health():
     return {"status": "healthy"}
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup
-    await iniciar_scheduler()
-    yield
-    # Shutdown
-    detener_scheduler()
-
-
-
-# @app.on_event("startup")
-# async def startup_event():
-#     await create_indexes(db)
-#     print("ÍNDICES CREADOS EN MONGODB")
-
 # Incluir todos los routers
 app.include_router(auth_router, prefix="/auth", tags=["Authentication"])
 app.include_router(reporte_router, prefix="/api/reporte", tags=["Reporte"])
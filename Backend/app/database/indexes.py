@@ -1,36 +1,385 @@
-# from motor.motor_asyncio import AsyncIOMotorDatabase
-# from auth import logger
-
-# async def create_indexes(db: AsyncIOMotorDatabase):
-#     # === CITAS ===
-#     await db.citas.create_index(
-#         [("estilista_id", 1), ("fecha_hora_inicio", 1)],
-#         name="citas_estilista_fecha"
-#     )
-#     await db.citas.create_index([("cliente_id", 1)], name="citas_cliente")
-
-#     # === HORARIOS ===
-#     await db.horarios.create_index(
-#         [("estilista_id", 1), ("dia_semana", 1)],
-#         name="horarios_estilista_dia",
-#         unique=True
-#     )
-
-#     # === BLOQUEOS ===
-#     await db.bloqueos.create_index(
-#         [("estilista_id", 1), ("es_recurrente", 1)],
-#         name="bloqueos_recurrente"
-#     )
-#     await db.bloqueos.create_index(
-#         [("estilista_id", 1), ("fecha_inicio", 1)],
-#         name="bloqueos_fecha"
-#     )
-
-#     # === SERVICIOS ===
-#     await db.servicios.create_index(
-#         [("sede_id", 1), ("nombre", 1)],
-#         name="servicios_sede_nombre",
-#         unique=True
-#     )
-
-#     logger.info("Todos los índices creados correctamente")
+# ============================================================
+# indexes.py - Manifiesto declarativo de índices de MongoDB
+# Ubicación: app/database/indexes.py
+#
+# - INDEX_MANIFEST describe TODOS los índices por colección.
+# - create_indexes() los aplica de forma idempotente (se llama
+#   desde el lifespan de FastAPI en cada arranque).
+# - verificar_indices() ejecuta explain() sobre un catálogo de
+#   consultas representativas y falla si alguna hace COLLSCAN.
+#
+# Uso por consola:
+#   python -m app.database.indexes            → aplicar manifiesto
+#   python -m app.database.indexes --check    → aplicar + verificar planes
+#
+# ⚠️ Al agregar/cambiar un índice, subir INDEX_MANIFEST_VERSION.
+# ============================================================
+
+import asyncio
+import logging
+import re
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEX_MANIFEST_VERSION = 14
+
+# Colección donde se registra la versión aplicada del manifiesto
+SCHEMA_META_COLLECTION = "schema_meta"
+SCHEMA_META_ID = "indexes"
+
+# ============================================================
+# MANIFIESTO
+# Cada entrada: {"keys": [(campo, dirección), ...], "name": str, **opciones}
+# Los nombres son estables: cambiar un índice = nuevo nombre.
+# ============================================================
+
+INDEX_MANIFEST: Dict[str, List[Dict[str, Any]]] = {
+    # === CITAS ===
+    # routes_quotes.obtener_citas, disponibilidad, accounting_logic, churn
+    "appointments": [
+        {"keys": [("sede_id", 1), ("fecha", 1)], "name": "appointments_sede_fecha"},
+        {"keys": [("profesional_id", 1), ("fecha", 1), ("hora_inicio", 1)], "name": "appointments_profesional_fecha_hora"},
+        {"keys": [("cliente_id", 1), ("fecha", -1)], "name": "appointments_cliente_fecha"},
+        {"keys": [("sede_id", 1), ("historial_pagos.fecha", 1)], "name": "appointments_sede_fecha_pago"},
+        {"keys": [("cita_id", 1)], "name": "appointments_cita_id", "sparse": True},
+        # analytics/hechos_diarios.invalidar_hechos_servicio (edición de servicios)
+        {"keys": [("servicios.servicio_id", 1)], "name": "appointments_servicio"},
+    ],
+
+    # === HORARIOS ===
+    "stylist_schedules": [
+        {"keys": [("profesional_id", 1)], "name": "horarios_profesional"},
+        {"keys": [("sede_id", 1)], "name": "horarios_sede"},
+    ],
+
+    # === BLOQUEOS ===
+    "block": [
+        {"keys": [("profesional_id", 1), ("fecha", 1), ("hora_inicio", 1)], "name": "block_profesional_fecha_hora"},
+        {"keys": [("sede_id", 1), ("fecha", 1)], "name": "block_sede_fecha"},
+        {"keys": [("serie_id", 1)], "name": "block_serie", "sparse": True},
+    ],
+
+    # === PRE-RESERVAS ===
+    "pre_bookings": [
+        {"keys": [("profesional_id", 1), ("sede_id", 1), ("fecha", 1), ("hora_inicio", 1)], "name": "pre_bookings_slot"},
+        {"keys": [("sede_id", 1), ("fecha", 1)], "name": "pre_bookings_sede_fecha"},
+        # Expiración por TTL: reemplaza el delete_many en cada lectura
+        {"keys": [("expira_en", 1)], "name": "pre_bookings_ttl", "expireAfterSeconds": 0},
+    ],
+
+    # === RESERVA ATÓMICA DE HORARIO ===
+    # quotes/slot_claims: _id único por profesional|fecha|HH:MM
+    "slot_claims": [
+        {"keys": [("ref_tipo", 1), ("ref_id", 1)], "name": "slot_claims_ref"},
+        {"keys": [("profesional_id", 1), ("fecha", 1)], "name": "slot_claims_profesional_fecha"},
+        {"keys": [("expira_en", 1)], "name": "slot_claims_ttl", "expireAfterSeconds": 0},
+    ],
+
+    # === COLA DE CORREOS ===
+    # utils/email_queue: toma de trabajos y lotes por destinatario
+    "email_jobs": [
+        {"keys": [("estado", 1), ("proximo_intento", 1)], "name": "email_jobs_estado_proximo"},
+        {"keys": [("destinatario", 1), ("estado", 1), ("proximo_intento", 1)], "name": "email_jobs_destinatario"},
+        # encolar_correo(clave=...): un solo correo por clave de idempotencia
+        {"keys": [("clave", 1)], "name": "email_jobs_clave", "unique": True,
+         "partialFilterExpression": {"clave": {"$type": "string"}}},
+        # Los enviados se purgan a los 30 días
+        {"keys": [("enviado_en", 1)], "name": "email_jobs_ttl_enviados", "expireAfterSeconds": 30 * 86400},
+    ],
+
+    # === TRABAJOS EN SEGUNDO PLANO ===
+    # utils/job_queue (PDF de fichas al finalizar)
+    "background_jobs": [
+        {"keys": [("tipo", 1), ("estado", 1), ("proximo_intento", 1)], "name": "background_jobs_tipo_estado"},
+        {"keys": [("finalizado_en", 1)], "name": "background_jobs_ttl", "expireAfterSeconds": 7 * 86400},
+    ],
+
+    # === VENTAS ===
+    "sales": [
+        {"keys": [("sede_id", 1), ("fecha_pago", 1)], "name": "sales_sede_fecha_pago"},
+        {"keys": [("sede_id", 1), ("historial_pagos.fecha", 1)], "name": "sales_sede_historial_fecha"},
+        {"keys": [("cliente_id", 1)], "name": "sales_cliente"},
+        {"keys": [("identificador", 1)], "name": "sales_identificador", "sparse": True},
+    ],
+
+    # === CLIENTES ===
+    # routes_clientes (búsqueda/listado por franquicia o sede), churn
+    "clients": [
+        {"keys": [("cliente_id", 1)], "name": "clients_cliente_id", "unique": True, "sparse": True},
+        {"keys": [("franquicia_id", 1), ("nombre", 1)], "name": "clients_franquicia_nombre"},
+        {"keys": [("sede_id", 1), ("nombre", 1)], "name": "clients_sede_nombre"},
+        {"keys": [("telefono", 1)], "name": "clients_telefono", "sparse": True},
+        {"keys": [("cedula", 1)], "name": "clients_cedula", "sparse": True},
+        {"keys": [("correo", 1)], "name": "clients_correo", "sparse": True},
+        # clients_service/busqueda: prefijos del nombre ordenados por nombre y
+        # prefijo de dígitos (teléfono nacional, cédula) dentro de la franquicia
+        {"keys": [("franquicia_id", 1), ("busqueda.prefijos", 1), ("nombre", 1)], "name": "clients_franquicia_busqueda_prefijos"},
+        {"keys": [("franquicia_id", 1), ("busqueda.digitos", 1)], "name": "clients_franquicia_busqueda_digitos"},
+        # Teléfono E.164 y documento canónicos. No son únicos: hay duplicados
+        # históricos; el duplicado se valida al escribir con una igualdad aquí
+        {"keys": [("franquicia_id", 1), ("telefono_e164", 1)], "name": "clients_franquicia_telefono_e164"},
+        {"keys": [("franquicia_id", 1), ("cedula_digitos", 1)], "name": "clients_franquicia_cedula_digitos"},
+    ],
+
+    # === CAJA ===
+    "cash_expenses": [
+        {"keys": [("sede_id", 1), ("fecha", 1), ("origen", 1)], "name": "cash_expenses_sede_fecha_origen"},
+        {"keys": [("egreso_id", 1)], "name": "cash_expenses_egreso_id", "sparse": True},
+    ],
+    "cash_ingresos": [
+        {"keys": [("sede_id", 1), ("fecha", 1)], "name": "cash_ingresos_sede_fecha"},
+        {"keys": [("ingreso_id", 1)], "name": "cash_ingresos_ingreso_id", "sparse": True},
+    ],
+    "cash_closures": [
+        {"keys": [("sede_id", 1), ("fecha", 1), ("tipo", 1)], "name": "cash_closures_sede_fecha_tipo"},
+        {"keys": [("apertura_id", 1)], "name": "cash_closures_apertura_id", "sparse": True},
+        {"keys": [("cierre_id", 1)], "name": "cash_closures_cierre_id", "sparse": True},
+    ],
+    # resumen_diario: _id = "SEDE|YYYY-MM-DD"; este índice es para lecturas por rango
+    "cash_daily_summary": [
+        {"keys": [("sede_id", 1), ("fecha", 1)], "name": "cash_daily_summary_sede_fecha"},
+    ],
+    # scheduler: _id = "JOB|SEDE|YYYY-MM-DD"; historial de ejecuciones
+    "scheduler_runs": [
+        {"keys": [("job", 1), ("fecha", -1)], "name": "scheduler_runs_job_fecha"},
+        {"keys": [("sede_id", 1), ("fecha", -1)], "name": "scheduler_runs_sede_fecha"},
+    ],
+
+    # === HECHOS DE ANALYTICS ===
+    # analytics/hechos_diarios: _id = "SEDE|YYYY-MM-DD|..."; lecturas por rango
+    "analytics_daily_facts": [
+        {"keys": [("sede_id", 1), ("fecha", 1)], "name": "analytics_daily_facts_sede_fecha"},
+    ],
+    "analytics_daily_sales": [
+        {"keys": [("sede_id", 1), ("fecha", 1)], "name": "analytics_daily_sales_sede_fecha"},
+    ],
+    "analytics_daily_status": [
+        {"keys": [("sede_id", 1), ("fecha", 1)], "name": "analytics_daily_status_sede_fecha"},
+        # El rollup solo recorre los días sucios
+        {"keys": [("sucio", 1)], "name": "analytics_daily_status_sucio",
+         "partialFilterExpression": {"sucio": True}},
+    ],
+    # _id = "PROF|SERVICIO_ID"; se rellena antes de cada agregación de hechos,
+    # las tasas de pares que ya no aparecen vencen solas
+    "analytics_commission_rates": [
+        {"keys": [("actualizado_en", 1)], "name": "analytics_commission_rates_ttl", "expireAfterSeconds": 30 * 86400},
+    ],
+    # analytics/visitas_clientes: _id = "CLIENTE|SEDE" ("*" = todas)
+    "client_visit_stats": [
+        # Churn: rango sobre ultima_cita ya ordenado por cliente
+        {"keys": [("sede_id", 1), ("ultima_cita", 1), ("cliente_id", 1)], "name": "client_visit_stats_sede_ultima"},
+        {"keys": [("cliente_id", 1)], "name": "client_visit_stats_cliente"},
+    ],
+
+    # === FICHAS ===
+    "fichas": [
+        {"keys": [("cliente_id", 1), ("fecha_ficha", -1)], "name": "fichas_cliente_fecha"},
+        {"keys": [("datos_especificos.cita_id", 1)], "name": "fichas_cita_id", "sparse": True},
+    ],
+
+    # === CATÁLOGOS ===
+    "services": [
+        {"keys": [("servicio_id", 1)], "name": "services_servicio_id"},
+    ],
+    "stylist": [
+        {"keys": [("profesional_id", 1)], "name": "stylist_profesional_id"},
+        {"keys": [("email", 1)], "name": "stylist_email", "sparse": True},
+        {"keys": [("sede_id", 1)], "name": "stylist_sede"},
+    ],
+    "branch": [
+        {"keys": [("sede_id", 1)], "name": "branch_sede_id"},
+        {"keys": [("franquicia_id", 1)], "name": "branch_franquicia"},
+    ],
+}
+
+# ============================================================
+# CATÁLOGO DE CONSULTAS REPRESENTATIVAS (modo check)
+# (colección, filtro, sort) — reflejan los filtros reales de:
+# routes_quotes.obtener_citas, accounting_logic, routes_churn,
+# routes_clientes.
+# ============================================================
+
+QUERY_CATALOGUE: List[Tuple[str, Dict[str, Any], Optional[List[Tuple[str, int]]]]] = [
+    # routes_quotes.obtener_citas
+    ("appointments", {"sede_id": "SD-00000", "fecha": {"$gte": "2025-01-01", "$lte": "2025-03-31"}}, [("fecha", 1)]),
+    ("appointments", {"sede_id": "SD-00000", "profesional_id": "ES-00000", "fecha": "2025-01-01"}, None),
+    # routes_quotes.disponibilidad / pre-reservar
+    ("appointments", {"profesional_id": "ES-00000", "sede_id": "SD-00000", "fecha": "2025-01-01", "hora_inicio": "10:00"}, None),
+    ("pre_bookings", {"sede_id": "SD-00000", "fecha": "2025-01-01", "expira_en": {"$gt": datetime(2025, 1, 1)}}, None),
+    ("block", {"profesional_id": "ES-00000", "fecha": "2025-01-01"}, None),
+    ("stylist_schedules", {"profesional_id": "ES-00000"}, None),
+    # accounting_logic
+    ("appointments", {"sede_id": "SD-00000", "historial_pagos": {"$exists": True, "$ne": []}}, None),
+    ("sales", {"sede_id": "SD-00000", "historial_pagos": {"$exists": True, "$ne": []}}, None),
+    ("sales", {"sede_id": "SD-00000", "fecha_pago": {"$gte": datetime(2025, 1, 1), "$lte": datetime(2025, 1, 1, 23, 59, 59)}}, None),
+    ("cash_expenses", {"sede_id": "SD-00000", "fecha": {"$in": ["2025-01-01", "01-01-2025"]}, "origen": "migracion"}, None),
+    ("cash_expenses", {"sede_id": "SD-00000", "fecha": {"$in": ["2025-01-01", "01-01-2025"]}, "origen": {"$ne": "migracion"}}, [("creado_en", 1)]),
+    ("cash_ingresos", {"sede_id": "SD-00000", "fecha": {"$in": ["2025-01-01", "01-01-2025"]}}, None),
+    ("cash_closures", {"apertura_id": "AP-2025-01-01-SD-00000"}, None),
+    ("cash_closures", {"sede_id": "SD-00000", "fecha": "2025-01-01", "tipo": "apertura"}, None),
+    # resumen_diario
+    ("cash_daily_summary", {"sede_id": "SD-00000", "fecha": {"$gte": "2025-01-01", "$lte": "2025-01-31"}}, None),
+    # cash/scheduler (recuperación e historial)
+    ("scheduler_runs", {"job": "cierre_auto"}, [("fecha", 1)]),
+    ("scheduler_runs", {"sede_id": "SD-00000", "fecha": {"$gte": "2025-01-01", "$lte": "2025-01-31"}}, [("fecha", -1)]),
+    # analytics/hechos_diarios
+    ("analytics_daily_facts", {"sede_id": {"$in": ["SD-00000"]}, "fecha": {"$gte": "2025-01-01", "$lte": "2025-01-31"}}, [("fecha", 1)]),
+    ("analytics_daily_sales", {"sede_id": {"$in": ["SD-00000"]}, "fecha": {"$gte": "2025-01-01", "$lte": "2025-01-31"}}, None),
+    ("analytics_daily_status", {"sede_id": {"$in": ["SD-00000"]}, "fecha": {"$gte": "2025-01-01", "$lte": "2025-01-31"}}, None),
+    ("analytics_daily_status", {"sucio": True}, None),
+    # analytics/hechos_diarios: invalidación por edición de estilista / servicio
+    ("appointments", {"profesional_id": "ES-00000"}, None),
+    ("appointments", {"servicios.servicio_id": "SV-00000"}, None),
+    # analytics/visitas_clientes
+    ("client_visit_stats", {"sede_id": "*", "ultima_cita": {"$lte": "2025-01-01"}}, [("ultima_cita", 1), ("cliente_id", 1)]),
+    ("client_visit_stats", {"cliente_id": {"$in": ["CL-00000"]}}, None),
+    ("appointments", {"cliente_id": {"$in": ["CL-00000"]}, "estado": {"$ne": "cancelada"}}, None),
+    ("sales", {"cliente_id": {"$in": ["CL-00000"]}, "estado_factura": {"$ne": "cancelado"}}, None),
+    # routes_churn
+    ("appointments", {"cliente_id": {"$in": ["CL-00000"]}, "estado": {"$ne": "cancelada"}}, [("fecha", -1)]),
+    ("appointments", {"sede_id": "SD-00000", "estado": {"$ne": "cancelada"}, "fecha": {"$gte": "2025-01-01", "$lte": "2025-03-31"}}, None),
+    # routes_clientes
+    ("clients", {"cliente_id": "CL-00000"}, None),
+    ("clients", {"franquicia_id": "FR-00000"}, [("nombre", 1)]),
+    ("clients", {"sede_id": "SD-00000"}, [("nombre", 1)]),
+    # clients_service/busqueda
+    ("clients", {"franquicia_id": "FR-00000", "busqueda.prefijos": {"$all": ["luisa", "bust"]}}, [("nombre", 1)]),
+    ("clients", {"franquicia_id": "FR-00000", "busqueda.digitos": {"$in": [re.compile("^3001")]}}, None),
+    ("clients", {"$or": [
+        {"franquicia_id": "FR-00000", "cedula_digitos": "3001234567"},
+        {"franquicia_id": "FR-00000", "telefono_e164": {"$in": ["+13001234567", "+573001234567"]}},
+    ]}, None),
+    ("appointments", {"cliente_id": "CL-00000"}, [("fecha", -1)]),
+    ("fichas", {"cliente_id": "CL-00000"}, [("fecha_ficha", -1)]),
+]
+
+
+# ============================================================
+# APLICAR MANIFIESTO
+# ============================================================
+
+async def create_indexes(db: AsyncIOMotorDatabase, forzar: bool = False) -> Dict[str, List[str]]:
+    """
+    Aplica INDEX_MANIFEST de forma idempotente.
+
+    Si la versión registrada en schema_meta ya es la actual, no hace nada
+    (salvo forzar=True). Un índice que entra en conflicto con uno existente
+    (mismo key pattern con otro nombre/opciones) se registra y se omite:
+    el arranque de la API nunca se bloquea por un índice.
+
+    Returns:
+        {"creados": [...], "omitidos": [...]}
+    """
+    meta = db[SCHEMA_META_COLLECTION]
+    resultado: Dict[str, List[str]] = {"creados": [], "omitidos": []}
+
+    if not forzar:
+        registro = await meta.find_one({"_id": SCHEMA_META_ID})
+        if registro and registro.get("version", 0) >= INDEX_MANIFEST_VERSION:
+            logger.info(f"Índices al día (manifiesto v{INDEX_MANIFEST_VERSION})")
+            return resultado
+
+    for coleccion, indices in INDEX_MANIFEST.items():
+        for spec in indices:
+            opciones = {k: v for k, v in spec.items() if k != "keys"}
+            try:
+                await db[coleccion].create_index(spec["keys"], **opciones)
+                resultado["creados"].append(f"{coleccion}.{spec['name']}")
+            except OperationFailure as e:
+                logger.warning(f"⚠️ Índice {coleccion}.{spec['name']} omitido: {e}")
+                resultado["omitidos"].append(f"{coleccion}.{spec['name']}")
+
+    await meta.update_one(
+        {"_id": SCHEMA_META_ID},
+        {"$set": {
+            "version": INDEX_MANIFEST_VERSION,
+            "aplicado_en": datetime.utcnow(),
+            "omitidos": resultado["omitidos"],
+        }},
+        upsert=True
+    )
+
+    logger.info(
+        f"✅ Manifiesto de índices v{INDEX_MANIFEST_VERSION} aplicado: "
+        f"{len(resultado['creados'])} creados, {len(resultado['omitidos'])} omitidos"
+    )
+    return resultado
+
+
+# ============================================================
+# MODO CHECK: explain() sobre el catálogo
+# ============================================================
+
+def _etapas_plan(plan: Dict[str, Any]) -> List[str]:
+    """Recorre un winningPlan y devuelve todas sus etapas."""
+    etapas = [plan.get("stage", "")]
+    if "inputStage" in plan:
+        etapas.extend(_etapas_plan(plan["inputStage"]))
+    for sub in plan.get("inputStages", []):
+        etapas.extend(_etapas_plan(sub))
+    # MongoDB 7+ (SBE) anida el plan clásico en queryPlan
+    if "queryPlan" in plan:
+        etapas.extend(_etapas_plan(plan["queryPlan"]))
+    return etapas
+
+
+async def verificar_indices(db: AsyncIOMotorDatabase) -> List[Dict[str, Any]]:
+    """
+    Ejecuta explain() sobre cada consulta de QUERY_CATALOGUE.
+
+    Returns:
+        Lista de consultas que caen en COLLSCAN (vacía si todo usa índices).
+
+    Raises:
+        RuntimeError si alguna consulta hace COLLSCAN.
+    """
+    fallidas: List[Dict[str, Any]] = []
+
+    for coleccion, filtro, sort in QUERY_CATALOGUE:
+        cursor = db[coleccion].find(filtro)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        etapas = _etapas_plan(plan)
+
+        if "COLLSCAN" in etapas:
+            fallidas.append({"coleccion": coleccion, "filtro": filtro, "sort": sort, "etapas": etapas})
+            logger.error(f"❌ COLLSCAN en {coleccion}: {filtro}")
+
+    if fallidas:
+        raise RuntimeError(
+            f"{len(fallidas)} consulta(s) del catálogo hacen COLLSCAN: "
+            + "; ".join(f"{f['coleccion']} {list(f['filtro'].keys())}" for f in fallidas)
+        )
+
+    logger.info(f"✅ {len(QUERY_CATALOGUE)} consultas del catálogo usan índices")
+    return fallidas
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+async def _main(check: bool) -> int:
+    from app.database.mongo import db
+
+    await create_indexes(db, forzar=True)
+    if check:
+        try:
+            await verificar_indices(db)
+        except RuntimeError as e:
+            print(str(e))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(check="--check" in sys.argv)))
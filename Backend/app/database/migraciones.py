@@ -0,0 +1,74 @@
+# ============================================================
+# migraciones.py - Backfills que corren una vez al arrancar
+# Ubicación: app/database/migraciones.py
+#
+# Cada migración se registra en schema_meta con _id = clave y la versión
+# aplicada. El lifespan de FastAPI lanza en segundo plano las que no
+# estén registradas en su versión actual (el arranque no espera); si una
+# falla, no se registra y se reintenta en el siguiente arranque.
+#
+# Las migraciones deben ser idempotentes: con varios procesos arrancando
+# a la vez, más de uno puede ejecutarla antes de que quede registrada.
+# ============================================================
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional, Set
+
+from app.database.indexes import SCHEMA_META_COLLECTION
+from app.database.mongo import db
+
+logger = logging.getLogger(__name__)
+
+_tareas: Set[asyncio.Task] = set()
+
+
+async def migracion_aplicada(clave: str, version: int) -> bool:
+    registro = await db[SCHEMA_META_COLLECTION].find_one({"_id": clave}, {"version": 1})
+    return bool(registro) and registro.get("version", 0) >= version
+
+
+async def registrar_migracion(clave: str, version: int, resultado: Any = None) -> None:
+    await db[SCHEMA_META_COLLECTION].update_one(
+        {"_id": clave},
+        {"$set": {"version": version, "resultado": resultado, "aplicado_en": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+async def ejecutar_migracion(clave: str, version: int, funcion: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+    """Ejecuta `funcion` y la registra, salvo que ya esté aplicada (devuelve None)."""
+    if await migracion_aplicada(clave, version):
+        return None
+    logger.info(f"Migración {clave} v{version}: iniciando")
+    resultado = await funcion()
+    await registrar_migracion(clave, version, resultado)
+    logger.info(f"✅ Migración {clave} v{version}: {resultado}")
+    return resultado
+
+
+async def _en_segundo_plano(clave: str, version: int, funcion: Callable[[], Awaitable[Any]]) -> None:
+    try:
+        await ejecutar_migracion(clave, version, funcion)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error en la migración {clave} v{version}: {e}", exc_info=True)
+
+
+def lanzar_migracion(clave: str, version: int, funcion: Callable[[], Awaitable[Any]]) -> None:
+    """Programa la migración sin bloquear el arranque. Llamar desde el lifespan."""
+    tarea = asyncio.create_task(_en_segundo_plano(clave, version, funcion))
+    _tareas.add(tarea)
+    tarea.add_done_callback(_tareas.discard)
+
+
+async def detener_migraciones() -> None:
+    for tarea in list(_tareas):
+        tarea.cancel()
+    for tarea in list(_tareas):
+        try:
+            await tarea
+        except asyncio.CancelledError:
+            pass
@@ -28,6 +28,7 @@ from app.database.mongo import (
     collection_invoices,
 )
 from app.auth.routes import get_current_user
+from app.cash.resumen_diario import invalidar_resumen_dia
 from app.utils.timezone import today, today_str
 
 router = APIRouter()
@@ -207,6 +208,7 @@ async def _registrar_venta_y_factura(
     }
 
     await collection_sales.insert_one(venta)
+    await invalidar_resumen_dia(sede_id, fecha_actual)
 
     await collection_invoices.insert_one({
         **venta,
@@ -8,6 +8,9 @@ import random
 from app.auth.routes import get_current_user
 from app.utils.timezone import today_str, today
 from app.bills.routes import obtener_porcentaje_comision_producto
+from app.cash.resumen_diario import invalidar_por_pagos
+from app.analytics.hechos_diarios import invalidar_hechos
+from app.analytics.visitas_clientes import actualizar_visitas_cliente
 from app.database.mongo import (
     collection_products,
     collection_clients,
@@ -473,6 +476,10 @@ async def crear_venta_directa(venta: VentaDirecta, current_user: dict = Depends(
                 detail=f"Error reservando giftcard, venta revertida: {str(e)}"
             )
 
+    await invalidar_por_pagos(venta.sede_id, historial_pagos, venta_doc["fecha_pago"])
+    await invalidar_hechos(venta.sede_id, venta_doc["fecha_pago"])
+    await actualizar_visitas_cliente(cliente_id)
+
     # ─── Registrar comisión del estilista si aplica ──────────────────
     comision_id_generado = None
     if aplica_comision and items_con_comision and total_comision_productos > 0:
@@ -670,6 +677,8 @@ async def registrar_pago_venta(
             "ultima_actualizacion": today(sede).replace(tzinfo=None)
         }}
     )
+    await invalidar_por_pagos(venta.get("sede_id"), historial_actual[-1:])
+    await invalidar_hechos(venta.get("sede_id"), venta.get("fecha_pago"))
 
     respuesta = {
         "success": True,
@@ -751,6 +760,8 @@ async def eliminar_producto_de_venta(
             "ultima_actualizacion": today(sede).replace(tzinfo=None)
         }}
     )
+    await invalidar_hechos(venta.get("sede_id"), venta.get("fecha_pago"))
+    await actualizar_visitas_cliente(venta.get("cliente_id"))
 
     return {
         "success": True,
@@ -908,6 +919,9 @@ async def eliminar_todos_productos_de_venta(
             "ultima_actualizacion": today(sede).replace(tzinfo=None)
         }}
     )
+    await invalidar_por_pagos(venta.get("sede_id"), venta.get("historial_pagos"), venta.get("fecha_pago"))
+    await invalidar_hechos(venta.get("sede_id"), venta.get("fecha_pago"))
+    await actualizar_visitas_cliente(venta.get("cliente_id"))
 
     return {
         "success": True,
@@ -126,6 +126,10 @@ class FichaCreate(BaseModel):
     
     fotos_antes: Optional[List[str]] = []
     fotos_despues: Optional[List[str]] = []
+
+    # Keys S3 de fotos ya subidas con /fichas/fotos/url-subida
+    fotos_antes_keys: Optional[List[str]] = []
+    fotos_despues_keys: Optional[List[str]] = []
     
     autorizacion_publicacion: bool = False
     comentario_interno: Optional[str] = None
@@ -134,6 +138,15 @@ class FichaCreate(BaseModel):
         arbitrary_types_allowed = True
 
 
+class SolicitudSubidaFoto(BaseModel):
+    cliente_id: str
+    sede_id: str
+    tipo_ficha: str = "general"
+    lado: str = Field(..., pattern="^(antes|despues)$")
+    content_type: str = "image/jpeg"
+    nombre_archivo: Optional[str] = None
+
+
 class ProductoItem(BaseModel):
     producto_id: str
     nombre: str
@@ -1,16 +1,31 @@
 # controllers.py
 from datetime import datetime
+from typing import Optional
 from bson import ObjectId
-from app.database.mongo import collection_citas, collection_clients
+from app.database.mongo import collection_citas, collection_clients, collection_card, collection_locales
 from app.scheduling.submodules.quotes.controllers import (
     generar_pdf_ficha,
     crear_html_correo_ficha,
     enviar_correo_con_pdf
 )
+from app.scheduling.submodules.fichas.imagenes import completar_derivados
+from app.utils.email_queue import ENVIADO, estado_correo
+from app.utils.job_queue import registrar_handler
+from app.utils.timezone import today
 
-async def generar_y_enviar_pdf_ficha(ficha: dict, cita_id: str) -> dict:
+JOB_PDF_FICHA = "pdf_ficha"
+JOB_DERIVADOS_FICHA = "derivados_ficha"
+
+async def generar_y_enviar_pdf_ficha(ficha: dict, cita_id: str, clave_correo: Optional[str] = None) -> dict:
+    """
+    Genera el PDF de la ficha y encola el correo al cliente.
+
+    pdf_enviado solo es True si el correo ya salió; mientras esté en cola su
+    estado se consulta con email_job_id (app/utils/email_queue.py).
+    """
     cliente_email = None
     pdf_generado = False
+    email_job_id = None
 
     try:
         try:
@@ -43,12 +58,13 @@ async def generar_y_enviar_pdf_ficha(ficha: dict, cita_id: str) -> dict:
                 fecha=datetime.now().strftime("%d/%m/%Y %H:%M")
             )
 
-            await enviar_correo_con_pdf(
+            email_job_id = await enviar_correo_con_pdf(
                 destinatario=cliente_email,
                 asunto="Comprobante de Servicio",
                 mensaje_html=html,
                 pdf_bytes=pdf_bytes,
-                nombre_archivo="comprobante_servicio.pdf"
+                nombre_archivo="comprobante_servicio.pdf",
+                clave=clave_correo
             )
 
     except Exception as e:
@@ -56,6 +72,49 @@ async def generar_y_enviar_pdf_ficha(ficha: dict, cita_id: str) -> dict:
 
     return {
         "pdf_generado": pdf_generado,
-        "pdf_enviado": bool(cliente_email) and pdf_generado,
+        "pdf_enviado": await estado_correo(email_job_id) == ENVIADO,
+        "email_job_id": email_job_id,
         "cliente_email": cliente_email
-    }
\ No newline at end of file
+    }
+
+
+async def procesar_job_pdf_ficha(payload: dict) -> dict:
+    """
+    Handler del trabajo en segundo plano de finalizar_servicio_con_pdf:
+    genera el PDF de la ficha, encola el correo y deja el resultado en la cita.
+
+    El correo se encola con el id del trabajo como clave: si el trabajo se
+    reintenta después de encolarlo, no sale un segundo correo.
+    """
+    cita_id = payload["cita_id"]
+    ficha = await collection_card.find_one({"_id": ObjectId(payload["ficha_id"])})
+    if not ficha:
+        raise ValueError(f"Ficha {payload['ficha_id']} no encontrada")
+
+    pdf_result = await generar_y_enviar_pdf_ficha(ficha, cita_id, clave_correo=f"{JOB_PDF_FICHA}:{payload['job_id']}")
+    if not pdf_result["pdf_generado"]:
+        # Dejar que la cola reintente
+        raise RuntimeError("No se pudo generar el PDF de la ficha")
+
+    sede = await collection_locales.find_one({"sede_id": payload.get("sede_id")}) or {}
+    await collection_citas.update_one(
+        {"_id": ObjectId(cita_id)},
+        {"$set": {
+            "pdf_generado":         pdf_result["pdf_generado"],
+            "pdf_fecha_generacion": today(sede).replace(tzinfo=None),
+            "pdf_email_job_id":     pdf_result["email_job_id"]
+        }}
+    )
+    # El correo no se guarda en el resultado del trabajo (lo lee el endpoint de estado)
+    return {k: v for k, v in pdf_result.items() if k != "cliente_email"}
+
+
+registrar_handler(JOB_PDF_FICHA, procesar_job_pdf_ficha)
+
+
+async def procesar_job_derivados_ficha(payload: dict) -> dict:
+    """Derivados de las fotos subidas con URL prefirmada."""
+    return await completar_derivados(payload["ficha_id"])
+
+
+registrar_handler(JOB_DERIVADOS_FICHA, procesar_job_derivados_ficha)
@@ -0,0 +1,307 @@
+"""
+Derivados de las fotos de fichas, generados una sola vez al subirlas.
+
+Por cada foto se guardan en S3 tres objetos:
+    original  → el archivo tal como llegó (HEIC, PNG, JPG...)
+    pdf       → JPEG normalizado (EXIF, RGB) de máx. 1200 px, listo para el PDF
+    thumb     → JPEG de máx. 320 px para el historial de fichas
+
+La ficha guarda las tres URLs en fotos.variantes.{antes|despues}; las listas
+fotos.antes / fotos.despues apuntan al derivado "pdf" (visible en navegador).
+
+Las fotos subidas directo al bucket con URL prefirmada quedan con "pdf" y
+"thumb" en None hasta que completar_derivados() (trabajo en segundo plano)
+las procesa; mientras tanto se usa el original.
+
+Backfill de fichas existentes (solo las que no tienen variantes):
+    python -m app.scheduling.submodules.fichas.imagenes --backfill [limite]
+Las fotos que el backfill no pudo procesar quedan pendientes y la ficha se
+encola para completar_derivados(), que las reintenta.
+"""
+import asyncio
+import sys
+import uuid
+from io import BytesIO
+from typing import BinaryIO, Dict, List, Optional
+
+from PIL import Image as PILImage, ImageOps
+
+from app.utils.almacenamiento import (
+    subir_bytes, subir_stream, descargar_objeto, key_de_url,
+)
+from app.utils.cpu_pool import ejecutar as ejecutar_cpu
+
+PDF_MAX_PX = 1200
+PDF_CALIDAD = 75
+THUMB_MAX_PX = 320
+THUMB_CALIDAD = 70
+
+
+class ImagenNoSoportada(ValueError):
+    """PIL y pillow_heif no pudieron abrir el archivo."""
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# PROCESAMIENTO (CPU, corre en el pool de procesos)
+# ─────────────────────────────────────────────────────────────────────────────
+def _abrir(contenido: bytes) -> PILImage.Image:
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+    except ImportError:
+        pass
+
+    try:
+        img = PILImage.open(BytesIO(contenido))
+        img.load()
+    except Exception as e_pil:
+        # Fallback HEIF manual (Samsung msf1/mif1)
+        try:
+            import pillow_heif
+            heif_file = pillow_heif.read_heif(contenido)
+            img = PILImage.frombytes(heif_file.mode, heif_file.size, heif_file.data, "raw")
+        except Exception as e_heif:
+            raise ImagenNoSoportada(f"{e_pil} / {e_heif}")
+
+    try:
+        img = ImageOps.exif_transpose(img)
+    except Exception:
+        pass
+
+    if img.mode in ("RGBA", "LA", "P"):
+        fondo = PILImage.new("RGB", img.size, (255, 255, 255))
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        fondo.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
+        return fondo
+    return img.convert("RGB")
+
+
+def _jpeg(img: PILImage.Image, max_px: int, calidad: int) -> bytes:
+    w, h = img.size
+    if max(w, h) > max_px:
+        ratio = max_px / max(w, h)
+        img = img.resize((int(w * ratio), int(h * ratio)), PILImage.LANCZOS)
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=calidad, optimize=True)
+    return out.getvalue()
+
+
+def generar_derivados(contenido: bytes) -> Dict[str, bytes]:
+    """{"pdf": jpeg 1200px, "thumb": jpeg 320px}. Lanza ImagenNoSoportada."""
+    img = _abrir(contenido)
+    return {
+        "pdf": _jpeg(img, PDF_MAX_PX, PDF_CALIDAD),
+        "thumb": _jpeg(img, THUMB_MAX_PX, THUMB_CALIDAD),
+    }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SUBIDA
+# ─────────────────────────────────────────────────────────────────────────────
+def nueva_key(folder_path: str, extension: str) -> str:
+    return f"{folder_path}/{uuid.uuid4()}.{extension}"
+
+
+def _key_base(key_original: str) -> str:
+    return key_original.rsplit(".", 1)[0]
+
+
+async def subir_derivados(contenido: bytes, key_original: str) -> Dict[str, str]:
+    """Genera los derivados en el pool de procesos y los sube junto al original."""
+    derivados = await ejecutar_cpu(generar_derivados, contenido)
+    base_key = _key_base(key_original)
+    pdf_url, thumb_url = await asyncio.gather(
+        subir_bytes(f"{base_key}_{PDF_MAX_PX}.jpg", derivados["pdf"], "image/jpeg"),
+        subir_bytes(f"{base_key}_thumb.jpg", derivados["thumb"], "image/jpeg"),
+    )
+    return {"pdf": pdf_url, "thumb": thumb_url}
+
+
+async def subir_foto_con_derivados(
+    contenido: bytes,
+    folder_path: str,
+    extension: str = "jpg",
+    content_type: Optional[str] = None,
+    original_url: Optional[str] = None,
+    archivo: Optional[BinaryIO] = None,
+) -> Dict[str, str]:
+    """
+    Sube el original y sus derivados. Los derivados se generan primero, así
+    un archivo que no es imagen se rechaza (ImagenNoSoportada) sin subir nada.
+
+    - archivo: stream del original (UploadFile.file); se sube por partes.
+    - original_url (backfill): el original ya está en S3 y no se vuelve a subir.
+
+    Returns:
+        {"original": url, "pdf": url, "thumb": url}
+    """
+    derivados = await ejecutar_cpu(generar_derivados, contenido)
+    key_original = nueva_key(folder_path, extension) if original_url is None else None
+    base_key = _key_base(key_original) if key_original else f"{folder_path}/{uuid.uuid4()}"
+
+    subidas = [
+        subir_bytes(f"{base_key}_{PDF_MAX_PX}.jpg", derivados["pdf"], "image/jpeg"),
+        subir_bytes(f"{base_key}_thumb.jpg", derivados["thumb"], "image/jpeg"),
+    ]
+    if original_url is None:
+        tipo = content_type or "application/octet-stream"
+        subidas.append(
+            subir_stream(archivo, key_original, tipo) if archivo is not None
+            else subir_bytes(key_original, contenido, tipo)
+        )
+    urls = await asyncio.gather(*subidas)
+
+    return {"original": original_url or urls[2], "pdf": urls[0], "thumb": urls[1]}
+
+
+def urls_para_pdf(ficha: dict, lado: str) -> List[str]:
+    """URLs a usar en el PDF: derivado 'pdf' si existe, si no la foto guardada."""
+    fotos = ficha.get("fotos", {}) or {}
+    variantes = (fotos.get("variantes") or {}).get(lado) or []
+    if variantes:
+        # Una subida directa queda sin "pdf" hasta que corre su trabajo de derivados
+        return [v.get("pdf") or v.get("original") for v in variantes]
+    return fotos.get(lado, []) or []
+
+
+def miniaturas(ficha: dict) -> Dict[str, List[str]]:
+    """Thumbnails por lado; sin variantes se devuelve la foto guardada."""
+    fotos = ficha.get("fotos", {}) or {}
+    variantes = fotos.get("variantes") or {}
+    return {
+        lado: [v.get("thumb") or v.get("original") for v in variantes[lado]] if variantes.get(lado) else (fotos.get(lado, []) or [])
+        for lado in ("antes", "despues")
+    }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SUBIDAS DIRECTAS (URL prefirmada): derivados en segundo plano
+# ─────────────────────────────────────────────────────────────────────────────
+def variante_pendiente(url: str) -> Dict[str, Optional[str]]:
+    """Entrada de fotos.variantes para una foto subida directo al bucket."""
+    return {"original": url, "pdf": None, "thumb": None}
+
+
+async def completar_derivados(ficha_id: str) -> Dict[str, int]:
+    """
+    Genera los derivados que falten en la ficha (fotos subidas con URL
+    prefirmada). Un lado que se editó mientras tanto no se sobrescribe.
+    Errores de descarga se propagan para que la cola reintente.
+    """
+    from bson import ObjectId
+    from app.database.mongo import collection_card
+
+    resumen = {"fotos": 0, "errores": 0}
+    ficha = await collection_card.find_one({"_id": ObjectId(ficha_id)}, {"fotos": 1})
+    if not ficha:
+        return resumen
+
+    variantes = (ficha.get("fotos") or {}).get("variantes") or {}
+    for lado in ("antes", "despues"):
+        actuales = variantes.get(lado) or []
+        if not any(v.get("pdf") is None and not v.get("error") for v in actuales):
+            continue
+
+        nuevas = []
+        for v in actuales:
+            if v.get("pdf") or v.get("error"):
+                nuevas.append(v)
+                continue
+            key = key_de_url(v["original"])
+            try:
+                contenido = await descargar_objeto(key)
+                v = {k: x for k, x in v.items() if k != "ultimo_error"}
+                nuevas.append({**v, **await subir_derivados(contenido, key)})
+                resumen["fotos"] += 1
+            except ImagenNoSoportada as e:
+                print(f"⚠️ {v['original']}: {e}")
+                nuevas.append({**v, "error": "formato no soportado"})
+                resumen["errores"] += 1
+
+        await collection_card.update_one(
+            {"_id": ficha["_id"], f"fotos.variantes.{lado}": actuales},
+            {"$set": {
+                f"fotos.variantes.{lado}": nuevas,
+                f"fotos.{lado}": [n.get("pdf") or n["original"] for n in nuevas],
+            }}
+        )
+
+    return resumen
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# BACKFILL
+# ─────────────────────────────────────────────────────────────────────────────
+def _carpeta_de_url(url: str) -> str:
+    """Carpeta S3 de una URL pública (los derivados quedan junto al original)."""
+    key = key_de_url(url)
+    return key.rsplit("/", 1)[0] if "/" in key else "fichas/derivados"
+
+
+async def backfill_fichas(limite: Optional[int] = None) -> Dict[str, int]:
+    """
+    Genera derivados para las fichas con fotos y sin fotos.variantes.
+    La URL existente se conserva como "original".
+    """
+    from app.database.mongo import collection_card
+    from app.scheduling.submodules.quotes.controllers import descargar_imagen
+    from app.scheduling.submodules.fichas.controllers import JOB_DERIVADOS_FICHA
+    from app.utils.job_queue import encolar_trabajo
+
+    resumen = {"fichas": 0, "fotos": 0, "errores": 0, "reintentos": 0}
+    filtro = {
+        "fotos.variantes": {"$exists": False},
+        "$or": [{"fotos.antes.0": {"$exists": True}}, {"fotos.despues.0": {"$exists": True}}],
+    }
+    cursor = collection_card.find(filtro, {"fotos": 1})
+    if limite:
+        cursor = cursor.limit(limite)
+
+    async for ficha in cursor:
+        fotos = ficha.get("fotos", {}) or {}
+        variantes: Dict[str, list] = {"antes": [], "despues": []}
+        pendientes = False
+        for lado in ("antes", "despues"):
+            for url in fotos.get(lado, []) or []:
+                buf = await descargar_imagen(url)
+                if not buf:
+                    resumen["errores"] += 1
+                    variantes[lado].append({**variante_pendiente(url), "ultimo_error": "descarga fallida"})
+                    pendientes = True
+                    continue
+                folder = _carpeta_de_url(url)
+                try:
+                    variantes[lado].append(
+                        await subir_foto_con_derivados(buf.getvalue(), folder, original_url=url)
+                    )
+                    resumen["fotos"] += 1
+                except ImagenNoSoportada as e:
+                    # No se reintenta: el mismo archivo volvería a fallar
+                    print(f"⚠️ {url}: {e}")
+                    resumen["errores"] += 1
+                    variantes[lado].append({**variante_pendiente(url), "error": "formato no soportado"})
+                except Exception as e:
+                    print(f"⚠️ {url}: {e}")
+                    resumen["errores"] += 1
+                    variantes[lado].append({**variante_pendiente(url), "ultimo_error": str(e)})
+                    pendientes = True
+
+        await collection_card.update_one(
+            {"_id": ficha["_id"]},
+            {"$set": {"fotos.variantes": variantes}}
+        )
+        if pendientes:
+            await encolar_trabajo(JOB_DERIVADOS_FICHA, {"ficha_id": str(ficha["_id"])})
+            resumen["reintentos"] += 1
+        resumen["fichas"] += 1
+
+    return resumen
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args and args[0] == "--backfill":
+        print(asyncio.run(backfill_fichas(int(args[1]) if len(args) > 1 else None)))
+    else:
+        print(__doc__)
@@ -1,17 +1,23 @@
 
 from fastapi import APIRouter, HTTPException, Depends, Query, UploadFile, File, Form
 from datetime import datetime, time, timedelta
-from app.scheduling.models import FichaCreate, ServicioEnFicha
+from app.scheduling.models import FichaCreate, ServicioEnFicha, SolicitudSubidaFoto
 from app.scheduling.submodules.quotes.controllers import generar_pdf_ficha, crear_html_correo_ficha, enviar_correo_con_pdf
-from app.scheduling.submodules.fichas.controllers import generar_y_enviar_pdf_ficha
+from app.scheduling.submodules.fichas.controllers import generar_y_enviar_pdf_ficha, JOB_DERIVADOS_FICHA
+import asyncio
 import traceback
-from typing import Optional, List
+from typing import Dict, Optional, List
 from bson import ObjectId
 import json
 import os
-import boto3
-import uuid
 from app.auth.routes import get_current_user
+from app.scheduling.submodules.fichas.imagenes import (
+    subir_foto_con_derivados, ImagenNoSoportada, nueva_key, variante_pendiente
+)
+from app.utils.almacenamiento import (
+    MAX_FOTO_BYTES, borrar_objetos, metadatos_objeto, url_publica, url_subida_directa
+)
+from app.utils.job_queue import encolar_trabajo
 
 from app.database.mongo import (
     collection_citas,
@@ -33,125 +39,116 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
 AWS_REGION = os.getenv("AWS_REGION")
 
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION", "us-west-2")
-)
-
+async def upload_to_s3(file: UploadFile, folder_path: str) -> dict:
+    """
+    Sube la foto original y sus derivados (JPEG 1200px para PDF y thumbnail).
+    Ver app/scheduling/submodules/fichas/imagenes.py.
 
-def upload_to_s3(file: UploadFile, folder_path: str) -> str:
+    Returns:
+        {"original": url, "pdf": url, "thumb": url}
+    """
     try:
-        file_content   = file.file.read()
-        file_extension = file.filename.split('.')[-1].lower() if file.filename else "jpg"
+        file_content   = await file.read()
+        file_extension = file.filename.split('.')[-1].lower() if file.filename and "." in file.filename else "jpg"
 
         print(f"📷 Subiendo: {file.filename} | {len(file_content)} bytes | {file.content_type}")
 
-        # ── Convertir a JPEG si no lo es ya ──────────────────────────────────
-        if file_extension not in ("jpg", "jpeg"):
-            try:
-                from PIL import Image as PILImage, ImageOps
-                from io import BytesIO as _BytesIO
-
-                # Intento 1: PIL normal (funciona con PNG, WEBP, y HEIC de iPhone)
-                try:
-                    img = PILImage.open(_BytesIO(file_content))
-                    img.load()
-                    print(f"  ✅ PIL abrió OK: modo={img.mode} tamaño={img.size}")
-
-                except Exception as e_pil:
-                    # Intento 2: fallback HEIF manual (Samsung msf1/mif1)
-                    print(f"  ⚠️ PIL falló ({e_pil}), intentando HEIF fallback...")
-                    try:
-                        import pillow_heif
-                        heif_file = pillow_heif.read_heif(file_content)
-                        img = PILImage.frombytes(
-                            heif_file.mode,
-                            heif_file.size,
-                            heif_file.data,
-                            "raw",
-                        )
-                        print(f"  ✅ HEIF fallback OK: modo={img.mode} tamaño={img.size}")
-                    except Exception as e_heif:
-                        print(f"  ❌ HEIF fallback también falló: {e_heif}")
-                        raise HTTPException(
-                            status_code=400,
-                            detail="Formato de imagen no soportado. Usa JPG, PNG o cambia la configuración de cámara del celular."
-                        )
-
-                # Corregir rotación EXIF (iPhone y Samsung)
-                try:
-                    img = ImageOps.exif_transpose(img)
-                except Exception:
-                    pass
-
-                # Fondo blanco si tiene transparencia
-                if img.mode in ("RGBA", "LA", "P"):
-                    fondo = PILImage.new("RGB", img.size, (255, 255, 255))
-                    if img.mode == "P":
-                        img = img.convert("RGBA")
-                    fondo.paste(img, mask=img.split()[-1] if img.mode == "RGBA" else None)
-                    img = fondo
-                else:
-                    img = img.convert("RGB")
-
-                # Redimensionar si es muy grande (fotos iPhone/Samsung son 4000+ px)
-                w, h = img.size
-                if max(w, h) > 2000:
-                    ratio = 2000 / max(w, h)
-                    img   = img.resize((int(w * ratio), int(h * ratio)), PILImage.LANCZOS)
-
-                out = _BytesIO()
-                img.save(out, format="JPEG", quality=85, optimize=True)
-                file_content   = out.getvalue()
-                file_extension = "jpg"
-                print(f"  ✅ Convertido a JPEG exitosamente ({len(file_content)} bytes)")
-
-            except HTTPException:
-                raise  # Re-lanzar el 400 sin envolver
-            except Exception as e:
-                print(f"  ❌ Error inesperado en conversión: {e}")
-                raise HTTPException(status_code=500, detail=f"Error procesando imagen: {str(e)}")
-
-        # ── Subir a S3 ───────────────────────────────────────────────────────
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        s3_key          = f"{folder_path}/{unique_filename}"
-
-        s3_client.put_object(
-            Bucket=os.getenv("AWS_BUCKET_NAME"),
-            Key=s3_key,
-            Body=file_content,
-            ContentType="image/jpeg",
+        variantes = await subir_foto_con_derivados(
+            file_content,
+            folder_path,
+            extension=file_extension,
+            content_type=file.content_type,
+            archivo=file.file,
+        )
+        print(f"  ☁️ Subido a S3: {variantes['pdf']}")
+        return variantes
+
+    except ImagenNoSoportada as e:
+        print(f"  ❌ Formato no soportado: {e}")
+        # Nunca sube basura a S3
+        raise HTTPException(
+            status_code=400,
+            detail="Formato de imagen no soportado. Usa JPG, PNG o cambia la configuración de cámara del celular."
         )
-
-        base_url = os.getenv("AWS_PUBLIC_BASE_URL")
-        if not base_url:
-            raise RuntimeError("AWS_PUBLIC_BASE_URL no está configurado")
-
-        url_final = f"{base_url}/{s3_key}"
-        print(f"  ☁️ Subido a S3: {url_final}")
-        return url_final
-
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-### Resumen de la lógica
-'''
-Foto entra
-    │
-    ├── ¿Ya es JPG/JPEG? → Sube directo ✅
-    │
-    └── ¿Otro formato (HEIC/HEIF/PNG/WEBP)?
-            │
-            ├── Intento 1: PILImage.open() → funciona con iPhone, PNG, WEBP
-            │
-            ├── Intento 2: pillow_heif.read_heif() → cubre Samsung msf1/mif1
-            │
-            └── ¿Ambos fallan? → HTTP 400 (nunca sube basura a S3)'''
+def carpeta_fotos(company_id: str, cliente_id: str, tipo_ficha: str, lado: str) -> str:
+    return f"companies/{company_id}/clients/{cliente_id}/fichas/{tipo_ficha}/{lado}"
+
+
+async def subir_fotos(fotos: Optional[List[UploadFile]], folder_path: str) -> list:
+    """Sube las fotos de un lado en paralelo (el límite lo pone app.utils.almacenamiento)."""
+    if not fotos:
+        return []
+    return list(await asyncio.gather(*(upload_to_s3(foto, folder_path) for foto in fotos)))
+
+
+async def descartar_subidas(keys: List[str]) -> None:
+    """Borra del bucket las subidas directas que ninguna ficha usa."""
+    if not keys:
+        return
+    urls = [url_publica(key) for key in keys]
+    try:
+        usadas = set()
+        async for ficha in collection_card.find(
+            {"$or": [{f"fotos.variantes.{lado}.original": {"$in": urls}} for lado in ("antes", "despues")]},
+            {"fotos.variantes": 1}
+        ):
+            for lado in (ficha.get("fotos", {}).get("variantes") or {}).values():
+                usadas.update(v.get("original") for v in lado or [])
+        huerfanas = [key for key, url in zip(keys, urls) if url not in usadas]
+        await borrar_objetos(huerfanas)
+        print(f"🗑️ Subidas directas descartadas: {len(huerfanas)}")
+    except Exception as e:
+        # La limpieza no debe tapar el error de validación
+        print(f"⚠️ No se pudieron borrar las subidas {keys}: {e}")
+
+
+async def registrar_subidas_directas(
+    keys_por_lado: Dict[str, Optional[List[str]]], company_id: str, cliente_id: str
+) -> Dict[str, list]:
+    """
+    Valida las keys subidas con URL prefirmada (carpeta del cliente, objeto
+    existente, imagen dentro del tamaño permitido) y devuelve por lado sus
+    variantes pendientes de derivados. Si alguna no es válida, borra las de
+    la carpeta del cliente que quedarían huérfanas y responde 400.
+    """
+    keys = [key for lado in keys_por_lado.values() for key in lado or []]
+    if not keys:
+        return {lado: [] for lado in keys_por_lado}
+    prefijo = f"companies/{company_id}/clients/{cliente_id}/fichas/"
+    propias = [k for k in keys if isinstance(k, str) and k.startswith(prefijo) and ".." not in k]
+
+    error = None
+    if len(propias) < len(keys):
+        ajena = next(k for k in keys if k not in propias)
+        error = f"La foto {ajena} no pertenece a este cliente"
+    else:
+        metadatos = await asyncio.gather(*(metadatos_objeto(key) for key in keys))
+        for key, meta in zip(keys, metadatos):
+            if meta is None:
+                error = f"La foto {key} no se encuentra en el bucket"
+                break
+            if meta["tamano"] > MAX_FOTO_BYTES or not (meta["content_type"] or "").startswith("image/"):
+                error = f"La foto {key} no es una imagen o supera el tamaño permitido"
+                break
+
+    if error:
+        await descartar_subidas(propias)
+        raise HTTPException(status_code=400, detail=error)
+    return {
+        lado: [variante_pendiente(url_publica(key)) for key in lado_keys or []]
+        for lado, lado_keys in keys_por_lado.items()
+    }
+
+
+def tiene_pendientes(variantes: dict) -> bool:
+    return any(v.get("pdf") is None for lado in variantes.values() for v in lado or [])
+
 
 # =============================================================
 # 🔹 OBTENER FICHAS POR CLIENTE (con filtros inteligentes)
@@ -332,6 +329,44 @@ def parse_ficha(data: str = Form(...)):
         print("Error parseando JSON de ficha:", e)
         raise HTTPException(422, "Formato inválido en 'data'. Debe ser JSON válido.")   
 
+# ============================================================
+# 📤 URL PREFIRMADA PARA SUBIR FOTOS DIRECTO AL BUCKET
+# ============================================================
+@router.post("/fichas/fotos/url-subida", response_model=dict)
+async def url_subida_foto(
+    data: SolicitudSubidaFoto,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Devuelve un formulario prefirmado para hacer POST de la foto directo a
+    S3, sin pasar los bytes por la API (máximo `tamano_maximo` bytes). La
+    `key` devuelta se envía luego en fotos_antes_keys / fotos_despues_keys
+    al crear o editar la ficha; los derivados (PDF, thumbnail) se generan
+    en segundo plano.
+    """
+    if current_user.get("rol") not in ["estilista", "admin_sede", "super_admin"]:
+        raise HTTPException(403, "No autorizado")
+
+    if not data.content_type.startswith("image/"):
+        raise HTTPException(400, "Solo se permiten imágenes")
+
+    cliente = await collection_clients.find_one({"cliente_id": data.cliente_id}, {"_id": 1})
+    if not cliente:
+        raise HTTPException(404, "Cliente no encontrado")
+
+    sede = await collection_locales.find_one({"sede_id": data.sede_id})
+    if not sede:
+        raise HTTPException(404, "Sede no encontrada")
+
+    extension = (data.nombre_archivo or "").rsplit(".", 1)[-1].lower() if data.nombre_archivo and "." in data.nombre_archivo \
+        else data.content_type.split("/", 1)[-1].lower()
+    if not extension.isalnum() or len(extension) > 5:
+        extension = "jpg"
+
+    folder_path = carpeta_fotos(sede.get("company_id", "default"), data.cliente_id, data.tipo_ficha, data.lado)
+    return url_subida_directa(nueva_key(folder_path, extension), data.content_type)
+
+
 # ============================================================
 # 📌 Crear ficha 
 # ============================================================
@@ -410,23 +445,21 @@ async def crear_ficha(
     # ------------------------------
     # SUBIR FOTOS
     # ------------------------------
-    urls_antes = []
-    if fotos_antes:
-        for foto in fotos_antes:
-            url = upload_to_s3(
-                foto,
-                f"companies/{sede.get('company_id','default')}/clients/{data.cliente_id}/fichas/{data.tipo_ficha}/antes"
-            )
-            urls_antes.append(url)
-
-    urls_despues = []
-    if fotos_despues:
-        for foto in fotos_despues:
-            url = upload_to_s3(
-                foto,
-                f"companies/{sede.get('company_id','default')}/clients/{data.cliente_id}/fichas/{data.tipo_ficha}/despues"
-            )
-            urls_despues.append(url)
+    company_id = sede.get('company_id', 'default')
+    # Fotos ya subidas con URL prefirmada: se validan antes de subir las
+    # del formulario para no dejar archivos huérfanos si alguna falla
+    directas = await registrar_subidas_directas(
+        {"antes": data.fotos_antes_keys, "despues": data.fotos_despues_keys}, company_id, data.cliente_id
+    )
+    variantes_antes, variantes_despues = await asyncio.gather(
+        subir_fotos(fotos_antes,   carpeta_fotos(company_id, data.cliente_id, data.tipo_ficha, "antes")),
+        subir_fotos(fotos_despues, carpeta_fotos(company_id, data.cliente_id, data.tipo_ficha, "despues")),
+    )
+    variantes_antes   += directas["antes"]
+    variantes_despues += directas["despues"]
+
+    urls_antes   = [v["pdf"] or v["original"] for v in variantes_antes]
+    urls_despues = [v["pdf"] or v["original"] for v in variantes_despues]
 
     # ------------------------------
     # FIX RESPUESTAS
@@ -476,7 +509,8 @@ async def crear_ficha(
             "antes": urls_antes,
             "despues": urls_despues,
             "antes_urls": data.fotos_antes,
-            "despues_urls": data.fotos_despues
+            "despues_urls": data.fotos_despues,
+            "variantes": {"antes": variantes_antes, "despues": variantes_despues}
         },
 
         "autorizacion_publicacion": data.autorizacion_publicacion,
@@ -492,6 +526,9 @@ async def crear_ficha(
 
     await collection_card.insert_one(ficha)
 
+    if tiene_pendientes(ficha["fotos"]["variantes"]):
+        await encolar_trabajo(JOB_DERIVADOS_FICHA, {"ficha_id": str(ficha["_id"])}, current_user.get("email"))
+
     ficha["_id"] = str(ficha["_id"])
 
     return {
@@ -516,6 +553,8 @@ async def editar_ficha(
     Edita una ficha técnica existente.
 
     ⭐ FOTOS:
+    - Archivos (fotos_antes / fotos_despues) o keys ya subidas con URL
+      prefirmada (fotos_antes_keys / fotos_despues_keys en 'data')
     - Si envías fotos_antes  → reemplaza SOLO las fotos de antes
     - Si envías fotos_despues → reemplaza SOLO las fotos de despues
     - Si no envías fotos     → las fotos no se tocan
@@ -615,7 +654,10 @@ async def editar_ficha(
     # FOTOS — siempre reemplazan, nunca acumulan
     # Solo se toca el lado (antes/despues) que se envía
     # ------------------------------
-    if fotos_antes or fotos_despues:
+    keys_antes   = cambios.get("fotos_antes_keys") or []
+    keys_despues = cambios.get("fotos_despues_keys") or []
+
+    if fotos_antes or fotos_despues or keys_antes or keys_despues:
         sede       = await collection_locales.find_one({"sede_id": ficha.get("sede_id")})
         company_id = sede.get("company_id", "default") if sede else "default"
         cliente_id = ficha.get("cliente_id")
@@ -625,32 +667,36 @@ async def editar_ficha(
             "antes": [], "despues": [], "antes_urls": [], "despues_urls": []
         })
 
-        nuevas_antes   = fotos_actuales.get("antes", [])   # default: mantener las actuales
-        nuevas_despues = fotos_actuales.get("despues", []) # default: mantener las actuales
+        nuevas    = {
+            "antes":   fotos_actuales.get("antes", []),    # default: mantener las actuales
+            "despues": fotos_actuales.get("despues", []),  # default: mantener las actuales
+        }
+        variantes = dict(fotos_actuales.get("variantes") or {})
 
-        if fotos_antes:
-            nuevas_antes = []  # ← reemplaza, no suma
-            for foto in fotos_antes:
-                url = upload_to_s3(
-                    foto,
-                    f"companies/{company_id}/clients/{cliente_id}/fichas/{tipo_ficha}/antes"
-                )
-                nuevas_antes.append(url)
-
-        if fotos_despues:
-            nuevas_despues = []  # ← reemplaza, no suma
-            for foto in fotos_despues:
-                url = upload_to_s3(
-                    foto,
-                    f"companies/{company_id}/clients/{cliente_id}/fichas/{tipo_ficha}/despues"
-                )
-                nuevas_despues.append(url)
+        # Las subidas directas se validan antes de subir las del formulario
+        directas = await registrar_subidas_directas(
+            {"antes": keys_antes, "despues": keys_despues}, company_id, cliente_id
+        )
+        subidas = await asyncio.gather(
+            subir_fotos(fotos_antes,   carpeta_fotos(company_id, cliente_id, tipo_ficha, "antes")),
+            subir_fotos(fotos_despues, carpeta_fotos(company_id, cliente_id, tipo_ficha, "despues")),
+        )
+        for lado, archivos, keys, subidas_lado in (
+            ("antes",   fotos_antes,   keys_antes,   subidas[0]),
+            ("despues", fotos_despues, keys_despues, subidas[1]),
+        ):
+            if not (archivos or keys):
+                continue
+            # ← reemplaza, no suma
+            variantes[lado] = subidas_lado + directas[lado]
+            nuevas[lado]    = [v["pdf"] or v["original"] for v in variantes[lado]]
 
         update_doc["fotos"] = {
-            "antes":       nuevas_antes,
-            "despues":     nuevas_despues,
+            "antes":       nuevas["antes"],
+            "despues":     nuevas["despues"],
             "antes_urls":  fotos_actuales.get("antes_urls", []),
-            "despues_urls": fotos_actuales.get("despues_urls", [])
+            "despues_urls": fotos_actuales.get("despues_urls", []),
+            "variantes":   variantes
         }
 
     # ------------------------------
@@ -670,13 +716,16 @@ async def editar_ficha(
         {"$set": update_doc}
     )
 
+    if "fotos" in update_doc and tiene_pendientes(update_doc["fotos"]["variantes"]):
+        await encolar_trabajo(JOB_DERIVADOS_FICHA, {"ficha_id": ficha_id}, current_user.get("email"))
+
     # Leer la ficha ya actualizada (con las fotos nuevas)
     ficha_actualizada = await collection_card.find_one({"_id": ObjectId(ficha_id)})
 
     # ------------------------------
     # REENVIAR PDF (opcional)
     # ------------------------------
-    pdf_result = {"pdf_generado": False, "pdf_enviado": False, "cliente_email": None}
+    pdf_result = {"pdf_generado": False, "pdf_enviado": False, "email_job_id": None, "cliente_email": None}
 
     reenviar_pdf = cambios.get("reenviar_pdf", False)
     if reenviar_pdf:
@@ -698,7 +747,7 @@ async def editar_ficha(
                         {"$set": {
                             "pdf_generado":        True,
                             "pdf_fecha_generacion": datetime.now(),
-                            "pdf_enviado":          pdf_result["pdf_enviado"]
+                            "pdf_email_job_id":     pdf_result["email_job_id"]
                         }}
                     )
                 except Exception:
@@ -710,7 +759,7 @@ async def editar_ficha(
         "success": True,
         "message": "Ficha actualizada exitosamente",
         "ficha":   ficha_actualizada,
-        **pdf_result  # pdf_generado, pdf_enviado, cliente_email
+        **pdf_result  # pdf_generado, pdf_enviado, email_job_id, cliente_email
     }
 
 # ============================================================
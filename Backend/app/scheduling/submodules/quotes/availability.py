@@ -0,0 +1,384 @@
+"""
+Motor de disponibilidad de agenda.
+
+Carga en pocas consultas masivas (una por colección) todo lo que afecta
+la agenda de una sede en un rango de fechas:
+
+- horarios (stylist_schedules): ventanas laborales por día de semana
+- bloqueos (block): intervalos no disponibles por fecha
+- citas (appointments) no canceladas, con su hora_fin real
+- pre-reservas (pre_bookings) vigentes
+- festivos de la sede (campo festivos de branch): días sin agenda
+
+y calcula, por profesional y por día, los intervalos libres y los
+slots reservables para una duración de servicio dada.
+
+calcular_capacidad() da los minutos laborables de un período largo
+(ocupación en analytics) sin recorrer los días: semanas completas más
+el resto por día de semana, menos festivos y bloqueos.
+
+Los intervalos se manejan en minutos desde medianoche: [inicio, fin).
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.database.mongo import (
+    collection_citas,
+    collection_horarios,
+    collection_block,
+    collection_pre_bookings,
+    collection_locales,
+)
+
+Intervalo = Tuple[int, int]
+
+ESTADOS_NO_OCUPAN = ["cancelada", "cancelado", "no_asistio", "no asistio"]
+MAX_DIAS_RANGO = 31
+PASO_DEFAULT = 15
+
+
+# ============================================================
+# HELPERS DE INTERVALOS
+# ============================================================
+def hhmm_a_minutos(valor) -> Optional[int]:
+    """'HH:MM' (o 'HH:MM:SS') → minutos desde medianoche. None si no parsea."""
+    if not valor:
+        return None
+    try:
+        partes = str(valor).strip().split(":")
+        return int(partes[0]) * 60 + int(partes[1])
+    except (ValueError, IndexError):
+        return None
+
+
+def minutos_a_hhmm(minutos: int) -> str:
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+
+def fusionar_intervalos(intervalos: List[Intervalo]) -> List[Intervalo]:
+    """Ordena y une intervalos solapados o contiguos."""
+    resultado: List[Intervalo] = []
+    for inicio, fin in sorted(i for i in intervalos if i[1] > i[0]):
+        if resultado and inicio <= resultado[-1][1]:
+            if fin > resultado[-1][1]:
+                resultado[-1] = (resultado[-1][0], fin)
+        else:
+            resultado.append((inicio, fin))
+    return resultado
+
+
+def restar_intervalos(base: List[Intervalo], ocupados: List[Intervalo]) -> List[Intervalo]:
+    """base − ocupados. Ambas listas se asumen fusionadas (ordenadas, sin solape)."""
+    libres: List[Intervalo] = []
+    j = 0
+    for inicio, fin in base:
+        cursor = inicio
+        while j < len(ocupados) and ocupados[j][1] <= cursor:
+            j += 1
+        k = j
+        while k < len(ocupados) and ocupados[k][0] < fin:
+            o_ini, o_fin = ocupados[k]
+            if o_ini > cursor:
+                libres.append((cursor, o_ini))
+            cursor = max(cursor, o_fin)
+            if cursor >= fin:
+                break
+            k += 1
+        if cursor < fin:
+            libres.append((cursor, fin))
+    return libres
+
+
+def generar_slots(libres: List[Intervalo], duracion: int, paso: int) -> List[str]:
+    """Horas de inicio (HH:MM) donde cabe un servicio de `duracion` minutos."""
+    slots: List[str] = []
+    for inicio, fin in libres:
+        # Alinear el primer slot a la grilla del paso
+        t = inicio if inicio % paso == 0 else inicio + (paso - inicio % paso)
+        while t + duracion <= fin:
+            slots.append(minutos_a_hhmm(t))
+            t += paso
+    return slots
+
+
+def rango_fechas(fecha_inicio: str, fecha_fin: str) -> List[str]:
+    """Lista de fechas YYYY-MM-DD entre ambos extremos (inclusive)."""
+    ini = datetime.strptime(fecha_inicio, "%Y-%m-%d").date()
+    fin = datetime.strptime(fecha_fin, "%Y-%m-%d").date()
+    if fin < ini:
+        raise ValueError("fecha_fin no puede ser menor a fecha")
+    dias = (fin - ini).days + 1
+    if dias > MAX_DIAS_RANGO:
+        raise ValueError(f"El rango máximo es de {MAX_DIAS_RANGO} días")
+    return [(ini + timedelta(days=i)).isoformat() for i in range(dias)]
+
+
+def ventanas_laborales(horario: dict) -> Dict[int, List[Intervalo]]:
+    """
+    Disponibilidad del horario indexada por isoweekday (1=lunes..7=domingo).
+    Días inactivos o mal formados se omiten.
+    """
+    ventanas: Dict[int, List[Intervalo]] = {}
+    for d in horario.get("disponibilidad", []) or []:
+        if d.get("activo", True) is not True:
+            continue
+        try:
+            dia = int(d.get("dia_semana", 0))
+        except (TypeError, ValueError):
+            continue
+        ini = hhmm_a_minutos(d.get("hora_inicio"))
+        fin = hhmm_a_minutos(d.get("hora_fin"))
+        if ini is None or fin is None or fin <= ini:
+            continue
+        ventanas.setdefault(dia, []).append((ini, fin))
+    return {dia: fusionar_intervalos(v) for dia, v in ventanas.items()}
+
+
+async def cargar_festivos(sede_ids: Iterable[str], fecha_inicio: str, fecha_fin: str) -> Dict[str, Set[str]]:
+    """{sede_id: {YYYY-MM-DD}} con los festivos de cada sede dentro del rango."""
+    ids = [s for s in set(sede_ids) if s]
+    if not ids:
+        return {}
+    festivos: Dict[str, Set[str]] = {}
+    async for sede in collection_locales.find(
+        {"sede_id": {"$in": ids}, "festivos.0": {"$exists": True}},
+        {"sede_id": 1, "festivos": 1}
+    ):
+        fechas = {str(f)[:10] for f in sede.get("festivos") or []}
+        festivos[sede["sede_id"]] = {f for f in fechas if fecha_inicio <= f <= fecha_fin}
+    return festivos
+
+
+# ============================================================
+# CARGA MASIVA
+# ============================================================
+async def cargar_agenda(
+    sede_id: str,
+    fechas: List[str],
+    profesional_id: Optional[str] = None,
+    duracion_pre_reserva: int = PASO_DEFAULT,
+) -> Dict[str, dict]:
+    """
+    Lee horarios, bloqueos, citas, pre-reservas y festivos del rango en
+    5 consultas y devuelve por profesional:
+        {"horario": {isoweekday: [(ini, fin)]},
+         "ocupado": {fecha: [(ini, fin)]},   # ya fusionado
+         "festivos": {fecha}}
+    """
+    filtro_horarios = {"sede_id": sede_id}
+    if profesional_id:
+        filtro_horarios["profesional_id"] = profesional_id
+
+    horarios = await collection_horarios.find(
+        filtro_horarios,
+        {"profesional_id": 1, "disponibilidad": 1}
+    ).to_list(None)
+
+    agenda: Dict[str, dict] = {}
+    for h in horarios:
+        pid = h.get("profesional_id")
+        if pid:
+            agenda[pid] = {"horario": ventanas_laborales(h), "ocupado": {}}
+
+    if not agenda:
+        return agenda
+
+    festivos = (await cargar_festivos([sede_id], fechas[0], fechas[-1])).get(sede_id, set())
+    for datos in agenda.values():
+        datos["festivos"] = festivos
+
+    profesionales = list(agenda.keys())
+    rango = {"$gte": fechas[0], "$lte": fechas[-1]}
+
+    # Las citas y bloqueos del profesional ocupan su tiempo aunque sean
+    # de otra sede, por eso se filtra por profesional y no por sede.
+    bloqueos = await collection_block.find(
+        {"profesional_id": {"$in": profesionales}, "fecha": rango},
+        {"profesional_id": 1, "fecha": 1, "hora_inicio": 1, "hora_fin": 1}
+    ).to_list(None)
+
+    citas = await collection_citas.find(
+        {
+            "profesional_id": {"$in": profesionales},
+            "fecha": rango,
+            "estado": {"$nin": ESTADOS_NO_OCUPAN},
+        },
+        {"profesional_id": 1, "fecha": 1, "hora_inicio": 1, "hora_fin": 1}
+    ).to_list(None)
+
+    pre_reservas = await collection_pre_bookings.find(
+        {
+            "profesional_id": {"$in": profesionales},
+            "fecha": rango,
+            "expira_en": {"$gt": datetime.utcnow()},
+        },
+        {"profesional_id": 1, "fecha": 1, "hora_inicio": 1}
+    ).to_list(None)
+
+    def _agregar(pid, fecha, ini, fin):
+        if pid not in agenda or ini is None:
+            return
+        if fin is None or fin <= ini:
+            fin = ini + duracion_pre_reserva
+        agenda[pid]["ocupado"].setdefault(str(fecha)[:10], []).append((ini, fin))
+
+    for b in bloqueos:
+        _agregar(b.get("profesional_id"), b.get("fecha"),
+                 hhmm_a_minutos(b.get("hora_inicio")), hhmm_a_minutos(b.get("hora_fin")))
+
+    for c in citas:
+        _agregar(c.get("profesional_id"), c.get("fecha"),
+                 hhmm_a_minutos(c.get("hora_inicio")), hhmm_a_minutos(c.get("hora_fin")))
+
+    # La pre-reserva no sabe qué servicio se va a agendar: ocupa el slot
+    # de la duración consultada a partir de su hora_inicio.
+    for p in pre_reservas:
+        _agregar(p.get("profesional_id"), p.get("fecha"),
+                 hhmm_a_minutos(p.get("hora_inicio")), None)
+
+    for datos in agenda.values():
+        datos["ocupado"] = {f: fusionar_intervalos(v) for f, v in datos["ocupado"].items()}
+
+    return agenda
+
+
+# ============================================================
+# CÁLCULO DE DISPONIBILIDAD
+# ============================================================
+async def calcular_disponibilidad(
+    sede_id: str,
+    fecha_inicio: str,
+    fecha_fin: Optional[str] = None,
+    duracion_minutos: int = 30,
+    profesional_id: Optional[str] = None,
+    paso_minutos: int = PASO_DEFAULT,
+    ahora_local: Optional[datetime] = None,
+) -> Dict[str, Dict[str, dict]]:
+    """
+    Disponibilidad por profesional y fecha:
+        {profesional_id: {fecha: {"libres": [{"inicio", "fin"}], "slots": ["HH:MM", ...]}}}
+
+    Si se pasa ahora_local (hora actual en la zona de la sede), los slots
+    del día de hoy anteriores a esa hora se descartan.
+    """
+    fechas = rango_fechas(fecha_inicio, fecha_fin or fecha_inicio)
+    agenda = await cargar_agenda(
+        sede_id, fechas, profesional_id, duracion_pre_reserva=duracion_minutos
+    )
+
+    hoy = ahora_local.strftime("%Y-%m-%d") if ahora_local else None
+    minuto_actual = ahora_local.hour * 60 + ahora_local.minute if ahora_local else 0
+
+    resultado: Dict[str, Dict[str, dict]] = {}
+    for pid, datos in agenda.items():
+        por_fecha: Dict[str, dict] = {}
+        for fecha in fechas:
+            dia_semana = datetime.strptime(fecha, "%Y-%m-%d").isoweekday()
+            base = datos["horario"].get(dia_semana, [])
+            if fecha in datos["festivos"] or (hoy and fecha < hoy):
+                base = []
+            elif fecha == hoy:
+                base = restar_intervalos(base, [(0, minuto_actual)])
+
+            libres = restar_intervalos(base, datos["ocupado"].get(fecha, []))
+            por_fecha[fecha] = {
+                "libres": [
+                    {"inicio": minutos_a_hhmm(i), "fin": minutos_a_hhmm(f)}
+                    for i, f in libres
+                ],
+                "slots": generar_slots(libres, duracion_minutos, paso_minutos),
+            }
+        resultado[pid] = por_fecha
+
+    return resultado
+
+
+# ============================================================
+# CAPACIDAD (minutos laborables de un período)
+# ============================================================
+def minutos_por_dia_semana(ventanas: Dict[int, List[Intervalo]]) -> Dict[int, int]:
+    """{isoweekday: minutos laborables} a partir de ventanas_laborales()."""
+    return {dia: sum(fin - ini for ini, fin in v) for dia, v in ventanas.items()}
+
+
+def contar_dias_semana(desde: date, hasta: date) -> Dict[int, int]:
+    """Cuántas veces cae cada isoweekday en [desde, hasta], sin recorrer los días."""
+    dias = (hasta - desde).days + 1
+    if dias <= 0:
+        return {}
+    semanas, resto = divmod(dias, 7)
+    primero = desde.isoweekday()
+    # Los `resto` días sobrantes son los que siguen a `desde` en la semana
+    return {dia: semanas + (1 if (dia - primero) % 7 < resto else 0) for dia in range(1, 8)}
+
+
+def capacidad_periodo(ventanas: Dict[int, List[Intervalo]], desde: date, hasta: date) -> int:
+    """Minutos laborables del horario en [desde, hasta] sin festivos ni bloqueos."""
+    por_dia = minutos_por_dia_semana(ventanas)
+    return sum(n * por_dia.get(dia, 0) for dia, n in contar_dias_semana(desde, hasta).items())
+
+
+async def calcular_capacidad(
+    profesional_ids: Iterable[str],
+    desde: date,
+    hasta: date,
+) -> Dict[str, int]:
+    """
+    Minutos laborables de cada profesional en [desde, hasta]:
+    capacidad_periodo() de su horario, menos los festivos de la sede del
+    horario y la parte de sus bloqueos que cae dentro del horario.
+
+    Tres consultas; el costo depende de los profesionales y los bloqueos
+    del rango, no de la cantidad de días. Los profesionales sin horario
+    no aparecen en el resultado.
+    """
+    ids = [p for p in set(profesional_ids) if p]
+    if not ids or hasta < desde:
+        return {}
+    fecha_inicio, fecha_fin = desde.isoformat(), hasta.isoformat()
+
+    horarios = {
+        h["profesional_id"]: h
+        for h in await collection_horarios.find(
+            {"profesional_id": {"$in": ids}},
+            {"profesional_id": 1, "sede_id": 1, "disponibilidad": 1}
+        ).to_list(None)
+    }
+    if not horarios:
+        return {}
+
+    festivos = await cargar_festivos(
+        (h.get("sede_id") for h in horarios.values()), fecha_inicio, fecha_fin
+    )
+    bloqueos = await collection_block.find(
+        {"profesional_id": {"$in": list(horarios)}, "fecha": {"$gte": fecha_inicio, "$lte": fecha_fin}},
+        {"profesional_id": 1, "fecha": 1, "hora_inicio": 1, "hora_fin": 1}
+    ).to_list(None)
+
+    bloqueado: Dict[str, Dict[str, List[Intervalo]]] = {}
+    for b in bloqueos:
+        ini, fin = hhmm_a_minutos(b.get("hora_inicio")), hhmm_a_minutos(b.get("hora_fin"))
+        if ini is None or fin is None or fin <= ini:
+            continue
+        bloqueado.setdefault(b["profesional_id"], {}).setdefault(str(b.get("fecha"))[:10], []).append((ini, fin))
+
+    capacidad: Dict[str, int] = {}
+    for pid, horario in horarios.items():
+        ventanas = ventanas_laborales(horario)
+        por_dia = minutos_por_dia_semana(ventanas)
+        dias_festivos = festivos.get(horario.get("sede_id"), set())
+
+        total = capacidad_periodo(ventanas, desde, hasta)
+        for fecha in dias_festivos:
+            total -= por_dia.get(date.fromisoformat(fecha).isoweekday(), 0)
+
+        for fecha, intervalos in bloqueado.get(pid, {}).items():
+            if fecha in dias_festivos:
+                continue
+            base = ventanas.get(date.fromisoformat(fecha).isoweekday(), [])
+            libres = restar_intervalos(base, fusionar_intervalos(intervalos))
+            total -= sum(f - i for i, f in base) - sum(f - i for i, f in libres)
+
+        capacidad[pid] = max(0, total)
+
+    return capacidad
@@ -1,10 +1,7 @@
 import asyncio
 import httpx
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
 from datetime import datetime
+from typing import Optional
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import (SimpleDocTemplate, Paragraph, Spacer,
                                  Table, TableStyle, Image,
@@ -14,16 +11,12 @@ from PIL import Image as PILImage
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from reportlab.lib import colors
 from reportlab.lib.units import cm
-import smtplib
-import ssl
 from io import BytesIO
-import os
 import base64
 
-EMAIL_SENDER     = os.getenv("EMAIL_REMITENTE")
-EMAIL_PASSWORD   = os.getenv("EMAIL_CONTRASENA")
-SMTP_SERVER      = "smtp.gmail.com"
-SMTP_PORT        = 465
+from app.utils.email_queue import encolar_correo
+from app.utils.cpu_pool import ejecutar as ejecutar_cpu, PoolSaturado
+
 LOGO_URL         = "https://s3.us-east-1.amazonaws.com/rf.images/companies/default/clients/RF+PNG.png"
 LOGO_ALTERNATIVO = "https://rizosfelicesdata.s3.us-east-2.amazonaws.com/logo+rosado+letra+blanca.png"
 
@@ -194,24 +187,67 @@ def comprimir_imagen_para_pdf(buf: BytesIO, max_px: int = 1200, quality: int = 7
         import traceback; traceback.print_exc()
         return None
 
+async def comprimir_imagen_async(buf: BytesIO, max_px: int = 1200, quality: int = 75) -> BytesIO | None:
+    """comprimir_imagen_para_pdf ejecutada en el pool de procesos."""
+    buf.seek(0)
+    out = await ejecutar_cpu(_comprimir_bytes, buf.getvalue(), max_px, quality)
+    return BytesIO(out) if out else None
+
+
+def _comprimir_bytes(data: bytes, max_px: int, quality: int) -> bytes | None:
+    out = comprimir_imagen_para_pdf(BytesIO(data), max_px=max_px, quality=quality)
+    return out.getvalue() if out else None
+
 # ─────────────────────────────────────────────────────────────────────────────
 # GENERADOR PRINCIPAL
 # ─────────────────────────────────────────────────────────────────────────────
 async def generar_pdf_ficha(ficha_data: dict, cita_data: dict) -> bytes:
+    """
+    Descarga las imágenes en el event loop (I/O) y delega la compresión
+    PIL y el layout reportlab al pool de procesos (CPU).
+    """
+    # Import diferido: este módulo también se carga en los procesos del pool
+    from app.scheduling.submodules.fichas.imagenes import urls_para_pdf
 
     # ── PRE-CARGA PARALELA ───────────────────────────────────────────────────
-    fotos_antes   = ficha_data.get("fotos", {}).get("antes",   []) or []
-    fotos_despues = ficha_data.get("fotos", {}).get("despues", []) or []
+    # Con derivados (fotos.variantes) se descarga el JPEG de 1200 px ya listo
+    fotos_antes   = urls_para_pdf(ficha_data, "antes")
+    fotos_despues = urls_para_pdf(ficha_data, "despues")
+    variantes     = ficha_data.get("fotos", {}).get("variantes") or {}
 
     urls_map: dict[str, str] = {"logo": LOGO_URL}
-    for i, u in enumerate(fotos_antes[:4]):   urls_map[f"antes_{i}"]   = u
-    for i, u in enumerate(fotos_despues[:4]): urls_map[f"despues_{i}"] = u
+    listas: list[str] = []
+    for prefix, urls in (("antes", fotos_antes), ("despues", fotos_despues)):
+        derivados = variantes.get(prefix) or []
+        for i, u in enumerate(urls[:4]):
+            urls_map[f"{prefix}_{i}"] = u
+            if i < len(derivados) and derivados[i].get("pdf"):
+                listas.append(f"{prefix}_{i}")
 
     print(f"🌐 Descargando {len(urls_map)} imágenes en paralelo…")
     keys = list(urls_map.keys())
     bufs = await descargar_imagenes_paralelo(list(urls_map.values()))
-    imgs: dict[str, BytesIO | None] = dict(zip(keys, bufs))
-    print(f"✅ {sum(1 for v in imgs.values() if v)}/{len(imgs)} descargadas")
+    imgs_bytes: dict[str, bytes | None] = {k: (b.getvalue() if b else None) for k, b in zip(keys, bufs)}
+    print(f"✅ {sum(1 for v in imgs_bytes.values() if v)}/{len(imgs_bytes)} descargadas")
+
+    try:
+        return await ejecutar_cpu(render_pdf_ficha, ficha_data, cita_data, imgs_bytes, listas)
+    except PoolSaturado:
+        raise
+    except Exception as e:
+        print(f"❌ Error renderizando PDF en el pool: {e}")
+        return await generar_pdf_simple_fallback(ficha_data, cita_data)
+
+
+def render_pdf_ficha(ficha_data: dict, cita_data: dict, imgs_bytes: dict, listas: list | None = None) -> bytes:
+    """
+    Parte CPU-bound de generar_pdf_ficha. Corre en el pool de procesos.
+    `listas`: claves de imgs_bytes que ya son derivados JPEG (no se recomprimen).
+    """
+    fotos_antes   = [k for k in imgs_bytes if k.startswith("antes_")]
+    fotos_despues = [k for k in imgs_bytes if k.startswith("despues_")]
+    listas = set(listas or [])
+    imgs: dict[str, BytesIO | None] = {k: (BytesIO(v) if v else None) for k, v in imgs_bytes.items()}
 
     # ── DOCUMENTO ────────────────────────────────────────────────────────────
     buf  = BytesIO()
@@ -471,8 +507,9 @@ async def generar_pdf_ficha(ficha_data: dict, cita_data: dict) -> bytes:
                     if j < len(urls):
                         b = imgs.get(f"{prefix}_{j}")
                         if b:
-                            print(f"    🖼️ Comprimiendo foto {prefix}_{j}...")
-                            b = comprimir_imagen_para_pdf(b, max_px=1200, quality=75)
+                            if f"{prefix}_{j}" not in listas:
+                                print(f"    🖼️ Comprimiendo foto {prefix}_{j}...")
+                                b = comprimir_imagen_para_pdf(b, max_px=1200, quality=75)
                             if b:
                                 img_el = Image(b, width=8*cm, height=8*cm, kind="proportional")
                                 img_el.hAlign = "CENTER"
@@ -534,13 +571,17 @@ async def generar_pdf_ficha(ficha_data: dict, cita_data: dict) -> bytes:
     except Exception as e:
         print(f"❌ Error construyendo PDF: {e}")
         import traceback; traceback.print_exc()
-        return await generar_pdf_simple_fallback(ficha_data, cita_data)
+        return render_pdf_simple(ficha_data, cita_data)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
 # FALLBACK
 # ─────────────────────────────────────────────────────────────────────────────
 async def generar_pdf_simple_fallback(ficha_data: dict, cita_data: dict) -> bytes:
+    return await ejecutar_cpu(render_pdf_simple, ficha_data, cita_data)
+
+
+def render_pdf_simple(ficha_data: dict, cita_data: dict) -> bytes:
     buf   = BytesIO()
     doc   = SimpleDocTemplate(buf, pagesize=A4)
     story = []
@@ -613,26 +654,26 @@ async def enviar_correo_con_pdf(
     asunto: str,
     mensaje_html: str,
     pdf_bytes: bytes,
-    nombre_archivo: str = "comprobante_servicio.pdf"
-) -> bool:
+    nombre_archivo: str = "comprobante_servicio.pdf",
+    clave: Optional[str] = None
+) -> Optional[str]:
+    """
+    Encola el correo con el PDF adjunto (app/utils/email_queue.py).
+    Retorna el id del trabajo de correo (None si no se pudo encolar); el
+    envío y los reintentos son en segundo plano. Con `clave`, una segunda
+    llamada con la misma clave no encola otro correo.
+    """
     try:
-        msg = MIMEMultipart()
-        msg["Subject"] = asunto
-        msg["From"]    = EMAIL_SENDER
-        msg["To"]      = destinatario
-        msg.attach(MIMEText(mensaje_html, "html", "utf-8"))
-        part = MIMEBase("application", "pdf")
-        part.set_payload(pdf_bytes)
-        encoders.encode_base64(part)
-        part.add_header("Content-Disposition",
-                        f'attachment; filename="{nombre_archivo}"')
-        msg.attach(part)
-        ctx = ssl.create_default_context()
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, context=ctx) as server:
-            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            server.send_message(msg)
-        print(f"✅ Correo enviado a {destinatario}")
-        return True
+        job_id = await encolar_correo(
+            destinatario,
+            asunto,
+            mensaje_html,
+            adjuntos=[{"nombre": nombre_archivo, "contenido": pdf_bytes, "mime": "application/pdf"}],
+            origen="comprobante_pdf",
+            clave=clave,
+        )
+        print(f"✅ Correo encolado para {destinatario} ({job_id})")
+        return job_id
     except Exception as e:
-        print(f"❌ Error enviando email: {e}")
-        return False
\ No newline at end of file
+        print(f"❌ Error encolando email: {e}")
+        return None
\ No newline at end of file
@@ -2,8 +2,6 @@ from fastapi import APIRouter, HTTPException, Depends, Query, UploadFile, File,
 from datetime import datetime, time, timedelta
 import traceback
 from typing import Optional, List
-from email.message import EmailMessage
-import smtplib, ssl, os
 from bson import ObjectId
 import uuid
 import boto3
@@ -11,7 +9,8 @@ import json
 from dotenv import load_dotenv
 load_dotenv()
 
-from app.scheduling.submodules.fichas.controllers import generar_y_enviar_pdf_ficha
+from app.scheduling.submodules.fichas.controllers import JOB_PDF_FICHA
+from app.utils.job_queue import encolar_trabajo, obtener_trabajo
 from app.bills.routes import obtener_porcentaje_comision_producto
 from app.scheduling.models import Cita, ProductoItem, PagoRequest, ServicioEnCita, ServicioEnFicha
 from app.database.mongo import (
@@ -29,38 +28,35 @@ from app.database.mongo import (
     collection_pre_bookings
 )
 from app.cash.utils_cash import fecha_a_datetime
+from app.cash.resumen_diario import invalidar_por_pagos
+from app.analytics.hechos_diarios import invalidar_hechos
+from app.analytics.visitas_clientes import actualizar_visitas_cliente
+from app.scheduling.submodules.quotes.availability import calcular_disponibilidad, PASO_DEFAULT
+from app.scheduling.submodules.quotes.slot_claims import (
+    reclamar_slot,
+    liberar_slot,
+    SlotOcupado,
+    REF_CITA,
+    REF_PRE_RESERVA,
+    ESTADOS_LIBERAN,
+)
 from app.auth.routes import get_current_user
 from app.utils.timezone import today_str, today
+from app.utils.email_queue import ENVIADO, encolar_correo, estado_correo
 
 
 router = APIRouter()
 
 
 # -----------------------
-# EMAIL (config desde env)
+# EMAIL (cola en segundo plano, ver app/utils/email_queue.py)
 # -----------------------
-EMAIL_SENDER = os.getenv("EMAIL_REMITENTE")
-EMAIL_PASSWORD = os.getenv("EMAIL_CONTRASENA")
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 465
-
-def enviar_correo(destinatario: str, asunto: str, mensaje: str):
-    """Envía correo HTML (SSL)."""
+async def enviar_correo(destinatario: str, asunto: str, mensaje: str):
+    """Encola un correo HTML; lo envían los workers de la cola."""
     try:
-        msg = EmailMessage()
-        msg["Subject"] = asunto
-        msg["From"] = EMAIL_SENDER
-        msg["To"] = destinatario
-        msg.set_content(mensaje, subtype="html")
-
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, context=context) as server:
-            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            server.send_message(msg)
-
-        print(f"📧 Correo enviado a {destinatario}")
+        await encolar_correo(destinatario, asunto, mensaje, origen="citas")
     except Exception as e:
-        print("Error enviando email:", e)
+        print("Error encolando email:", e)
 
 # -----------------------
 # HELPERS
@@ -88,6 +84,26 @@ async def resolve_cita_by_id(cita_id: str) -> Optional[dict]:
     except Exception:
         return None
 
+def detalle_slot_ocupado(error: SlotOcupado) -> str:
+    """Mensaje para el 409 según quién tiene tomado el horario."""
+    claim = error.claim
+    if claim.get("ref_tipo") == REF_PRE_RESERVA:
+        expira_en = claim.get("expira_en")
+        minutos_restantes = max(0, round((expira_en - datetime.utcnow()).total_seconds() / 60)) if expira_en else "?"
+        return (
+            f"Horario en negociación por {claim.get('reservado_por') or 'otro usuario'}. "
+            f"Libera en ~{minutos_restantes} min."
+        )
+    if claim:
+        return f"El profesional ya tiene una cita en ese horario ({claim.get('hora')})"
+    return str(error)
+
+async def descartar_pre_reservas(pre_reserva_ids: List[str]) -> None:
+    """Elimina las pre-reservas cuyas celdas fueron tomadas por una cita."""
+    oids = [ObjectId(p) for p in pre_reserva_ids if ObjectId.is_valid(p)]
+    if oids:
+        await collection_pre_bookings.delete_many({"_id": {"$in": oids}})
+
 # ============================================================
 # ENDPOINT PRE-RESERVAS
 # ============================================================
@@ -131,15 +147,6 @@ async def pre_reservar_slot(
     except ValueError:
         raise HTTPException(status_code=400, detail="Formato de fecha u hora inválido. Usa YYYY-MM-DD y HH:MM")
 
-    # Limpiar pre-reservas expiradas de este slot antes de verificar
-    await collection_pre_bookings.delete_many({
-        "profesional_id": datos.profesional_id,
-        "sede_id": datos.sede_id,
-        "fecha": datos.fecha,
-        "hora_inicio": datos.hora_inicio,
-        "expira_en": {"$lt": datetime.utcnow()}
-    })
-
     # Verificar cita confirmada
     conflicto_cita = await collection_citas.find_one({
         "profesional_id": datos.profesional_id,
@@ -151,12 +158,14 @@ async def pre_reservar_slot(
     if conflicto_cita:
         raise HTTPException(status_code=409, detail="Este horario ya tiene una cita confirmada")
 
-    # Verificar pre-reserva activa (ya limpiamos las expiradas arriba)
+    # Verificar pre-reserva activa. Las vencidas las borra el índice TTL
+    # (expira_en); las que aún no barrió se excluyen en la consulta.
     pre_reserva_activa = await collection_pre_bookings.find_one({
         "profesional_id": datos.profesional_id,
         "sede_id": datos.sede_id,
         "fecha": datos.fecha,
         "hora_inicio": datos.hora_inicio,
+        "expira_en": {"$gt": datetime.utcnow()}
     })
     if pre_reserva_activa:
         reservado_por = pre_reserva_activa.get("reservado_por", "otro usuario")
@@ -168,7 +177,23 @@ async def pre_reservar_slot(
         )
 
     ahora = datetime.utcnow()
+    pre_reserva_oid = ObjectId()
+
+    # Reserva atómica de la celda: si dos usuarios pasan las verificaciones
+    # anteriores a la vez, solo uno logra insertar el claim.
+    try:
+        await reclamar_slot(
+            datos.profesional_id, datos.fecha, datos.hora_inicio, None,
+            REF_PRE_RESERVA, str(pre_reserva_oid),
+            sede_id=datos.sede_id,
+            reservado_por=current_user.get("email"),
+            expira_en=ahora + timedelta(minutes=duracion)
+        )
+    except SlotOcupado as e:
+        raise HTTPException(status_code=409, detail=detalle_slot_ocupado(e))
+
     resultado = await collection_pre_bookings.insert_one({
+        "_id": pre_reserva_oid,
         "sede_id": datos.sede_id,
         "profesional_id": datos.profesional_id,
         "fecha": datos.fecha,
@@ -215,6 +240,7 @@ async def liberar_pre_reserva(
         raise HTTPException(status_code=403, detail="Solo puedes liberar tus propias pre-reservas")
 
     await collection_pre_bookings.delete_one({"_id": oid})
+    await liberar_slot(REF_PRE_RESERVA, pre_reserva_id)
     return {"success": True, "message": "Pre-reserva liberada correctamente"}
 
 
@@ -223,21 +249,29 @@ async def obtener_disponibilidad(
     sede_id: str,
     fecha: str,
     profesional_id: Optional[str] = None,
+    fecha_fin: Optional[str] = Query(None, description="Fin del rango (YYYY-MM-DD), máx. 31 días"),
+    duracion_minutos: Optional[int] = Query(None, ge=5, le=600, description="Duración del servicio; si se envía, se calculan slots libres"),
+    paso_minutos: int = Query(PASO_DEFAULT, ge=5, le=120, description="Granularidad de los slots"),
     current_user: dict = Depends(get_current_user)
 ):
-    # Limpiar globalmente las pre-reservas expiradas de esa sede/fecha antes de responder
-    await collection_pre_bookings.delete_many({
-        "sede_id": sede_id,
-        "fecha": fecha,
-        "expira_en": {"$lt": datetime.utcnow()}
-    })
+    """
+    Sin duracion_minutos: devuelve los slots ocupados de la fecha (comportamiento original).
+    Con duracion_minutos: además devuelve `disponibilidad` por profesional y fecha
+    (intervalos libres y horas de inicio reservables) para todo el rango
+    fecha..fecha_fin, cruzando horarios, bloqueos, citas y pre-reservas.
+    """
+    if fecha_fin and not duracion_minutos:
+        raise HTTPException(status_code=400, detail="fecha_fin requiere duracion_minutos")
+
+    ahora = datetime.utcnow()
 
     filtro_citas = {
         "sede_id": sede_id,
         "fecha": fecha,
         "estado": {"$nin": ["cancelada", "cancelado"]}
     }
-    filtro_pre = {"sede_id": sede_id, "fecha": fecha}
+    # Solo lectura: las pre-reservas vencidas las elimina el índice TTL
+    filtro_pre = {"sede_id": sede_id, "fecha": fecha, "expira_en": {"$gt": ahora}}
 
     if profesional_id:
         filtro_citas["profesional_id"] = profesional_id
@@ -253,8 +287,6 @@ async def obtener_disponibilidad(
         {"hora_inicio": 1, "profesional_id": 1, "expira_en": 1, "reservado_por": 1, "duracion_minutos": 1}
     ).to_list(None)
 
-    ahora = datetime.utcnow()
-
     slots_ocupados = [
         {
             "hora": c["hora_inicio"],
@@ -275,7 +307,26 @@ async def obtener_disponibilidad(
         for p in pre_reservas
     ]
 
-    return {"success": True, "slots_ocupados": slots_ocupados}
+    respuesta = {"success": True, "slots_ocupados": slots_ocupados}
+
+    if duracion_minutos:
+        sede = await collection_locales.find_one({"sede_id": sede_id}, {"zona_horaria": 1}) or {}
+        try:
+            respuesta["disponibilidad"] = await calcular_disponibilidad(
+                sede_id=sede_id,
+                fecha_inicio=fecha,
+                fecha_fin=fecha_fin,
+                duracion_minutos=duracion_minutos,
+                profesional_id=profesional_id,
+                paso_minutos=paso_minutos,
+                ahora_local=today(sede).replace(tzinfo=None),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        respuesta["duracion_minutos"] = duracion_minutos
+        respuesta["paso_minutos"] = paso_minutos
+
+    return respuesta
 
 # ============================================================
 # ENDPOINT OBTENER CITAS (con cálculos en tiempo real) con fecha
@@ -667,9 +718,32 @@ async def crear_cita(
         "ultima_actualizacion": today(sede).replace(tzinfo=None),
     }
 
+    # === reserva atómica del horario del profesional ===
+    cita_oid = ObjectId()
+    try:
+        reclamo = await reclamar_slot(
+            cita.profesional_id, fecha_str, cita.hora_inicio, cita.hora_fin,
+            REF_CITA, str(cita_oid),
+            sede_id=cita.sede_id,
+            reservado_por=current_user.get("email")
+        )
+    except SlotOcupado as e:
+        raise HTTPException(status_code=409, detail=detalle_slot_ocupado(e))
+
     # Guardar en BD
-    result = await collection_citas.insert_one(data)
+    data["_id"] = cita_oid
+    try:
+        result = await collection_citas.insert_one(data)
+    except Exception:
+        await liberar_slot(REF_CITA, str(cita_oid))
+        raise
     cita_id = str(result.inserted_id)
+    await descartar_pre_reservas(reclamo["reemplazadas"])
+
+    async def _revertir_cita():
+        # Liberar el horario antes de borrar: los reclamos de la cita no vencen solos
+        await liberar_slot(REF_CITA, cita_id)
+        await collection_citas.delete_one({"_id": result.inserted_id})
 
     # === construir email HTML mejorado ===
     estilo = """
@@ -1198,12 +1272,12 @@ async def crear_cita(
     cliente_email = cliente.get("email") or cliente.get("correo")
     if cliente_email:
         try:
-            enviar_correo(
+            await enviar_correo(
                 cliente_email, 
                 asunto_limpio,
                 mensaje_html
             )
-            print(f"📧 Email enviado a cliente: {cliente_email}")
+            print(f"📧 Email encolado para cliente: {cliente_email}")
         except Exception as e:
             print(f"⚠️ Error enviando email al cliente: {e}")
 
@@ -1213,8 +1287,8 @@ async def crear_cita(
         if prof_email:
             # Modificar ligeramente el email para el profesional
             prof_subject = f"📅 Nueva cita asignada - {fecha_str} {cita.hora_inicio} - {cliente.get('nombre')}"
-            enviar_correo(prof_email, prof_subject, mensaje_html)
-            print(f"📧 Email enviado a profesional: {prof_email}")
+            await enviar_correo(prof_email, prof_subject, mensaje_html)
+            print(f"📧 Email encolado para profesional: {prof_email}")
     except Exception as e:
         print(f"⚠️ Error enviando email al profesional: {e}")
 
@@ -1223,7 +1297,7 @@ async def crear_cita(
         admin_sede_email = sede.get("email_contacto")
         if admin_sede_email and admin_sede_email != current_user.get("email"):
             admin_subject = f"📋 Nueva cita registrada - {fecha_str} - {cliente.get('nombre')}"
-            enviar_correo(admin_sede_email, admin_subject, mensaje_html)
+            await enviar_correo(admin_sede_email, admin_subject, mensaje_html)
     except Exception as e:
         print(f"⚠️ Error enviando email a admin sede: {e}")
 
@@ -1244,7 +1318,7 @@ async def crear_cita(
             gc_doc = await collection_giftcards.find_one({"codigo": codigo_upper})
 
             if not gc_doc:
-                await collection_citas.delete_one({"_id": result.inserted_id})
+                await _revertir_cita()
                 raise HTTPException(
                     status_code=404,
                     detail=f"Giftcard '{codigo_upper}' no encontrada"
@@ -1252,7 +1326,7 @@ async def crear_cita(
 
             estado_gc = _estado_giftcard(gc_doc)
             if estado_gc in ["cancelada", "vencida", "usada"]:
-                await collection_citas.delete_one({"_id": result.inserted_id})
+                await _revertir_cita()
                 raise HTTPException(
                     status_code=400,
                     detail=f"Giftcard no válida: estado '{estado_gc}'"
@@ -1261,7 +1335,7 @@ async def crear_cita(
             saldo_gc = round(float(gc_doc.get("saldo_disponible", 0)), 2)
 
             if saldo_gc <= 0:
-                await collection_citas.delete_one({"_id": result.inserted_id})
+                await _revertir_cita()
                 raise HTTPException(
                     status_code=400,
                     detail="La giftcard no tiene saldo disponible"
@@ -1333,15 +1407,19 @@ async def crear_cita(
 
         except HTTPException:
             # Re-lanzar los errores que generamos arriba
-            # (la cita ya fue eliminada dentro de cada if antes del raise)
+            # (la cita ya fue revertida dentro de cada if antes del raise)
             raise
         except Exception as e:
-            await collection_citas.delete_one({"_id": result.inserted_id})
+            await _revertir_cita()
             raise HTTPException(
                 status_code=500,
                 detail=f"Error reservando giftcard: {str(e)}"
             )
 
+    await invalidar_por_pagos(cita.sede_id, historial_pagos)
+    await invalidar_hechos(cita.sede_id, fecha_str)
+    await actualizar_visitas_cliente(cita.cliente_id)
+
     return {
         "success": True, 
         "message": "Cita creada exitosamente", 
@@ -1754,6 +1832,25 @@ async def editar_cita(
     # ====================================
     cambios["ultima_actualizacion"] = today_str(sede)
 
+    # ====================================
+    # Reservar el nuevo horario (atómico)
+    # ====================================
+    estado_final = cambios.get("estado", cita_actual.get("estado"))
+    reclamo = None
+    if (
+        estado_final not in ESTADOS_LIBERAN
+        and any(campo in cambios for campo in {"fecha", "hora_inicio", "hora_fin", "profesional_id", "servicios", "estado"})
+    ):
+        try:
+            reclamo = await reclamar_slot(
+                profesional_id_final, fecha_final, hora_inicio_final, hora_fin_final,
+                REF_CITA, str(cita_object_id),
+                sede_id=cita_actual.get("sede_id"),
+                reservado_por=current_user.get("email")
+            )
+        except SlotOcupado as e:
+            raise HTTPException(status_code=409, detail=detalle_slot_ocupado(e))
+
     # ====================================
     # Ejecutar actualización
     # ====================================
@@ -1763,8 +1860,21 @@ async def editar_cita(
     )
 
     if result.matched_count == 0:
+        if reclamo:
+            await liberar_slot(REF_CITA, str(cita_object_id))
         raise HTTPException(status_code=404, detail="Cita no encontrada")
 
+    # Los hechos de analytics del día anterior y del nuevo quedan desactualizados
+    await invalidar_hechos(cita_actual.get("sede_id"), cita_actual.get("fecha"), cambios.get("fecha"))
+    await actualizar_visitas_cliente(cita_actual.get("cliente_id"))
+
+    # Soltar las celdas del horario anterior (o todas si quedó cancelada)
+    if reclamo:
+        await liberar_slot(REF_CITA, str(cita_object_id), conservar=reclamo["claims"])
+        await descartar_pre_reservas(reclamo["reemplazadas"])
+    elif estado_final in ESTADOS_LIBERAN:
+        await liberar_slot(REF_CITA, str(cita_object_id))
+
     # Obtener cita actualizada
     cita_actualizada = await collection_citas.find_one({"_id": cita_object_id})
     normalize_cita_doc(cita_actualizada)
@@ -1792,6 +1902,9 @@ async def cancelar_cita(cita_id: str, current_user: dict = Depends(get_current_u
         "fecha_cancelacion": today_str(sede),
         "cancelada_por": current_user.get("email")
     }})
+    await liberar_slot(REF_CITA, str(cita["_id"]))
+    await invalidar_hechos(cita.get("sede_id"), cita.get("fecha"))
+    await actualizar_visitas_cliente(cita.get("cliente_id"))
 
     # ═══════════════════════════════════════════════
     # ⭐ INTEGRACIÓN GIFTCARD - Liberar saldo reservado
@@ -1851,11 +1964,25 @@ async def confirmar_cita(cita_id: str, current_user: dict = Depends(get_current_
     if not sede:
         raise HTTPException(status_code=404, detail="Sede no encontrada")
 
+    # Re-confirmar una cita cancelada vuelve a ocupar su horario
+    if cita.get("estado") in ESTADOS_LIBERAN:
+        try:
+            await reclamar_slot(
+                cita.get("profesional_id"), str(cita.get("fecha"))[:10],
+                cita.get("hora_inicio"), cita.get("hora_fin"),
+                REF_CITA, str(cita["_id"]),
+                sede_id=cita.get("sede_id"),
+                reservado_por=current_user.get("email")
+            )
+        except SlotOcupado as e:
+            raise HTTPException(status_code=409, detail=detalle_slot_ocupado(e))
+
     await collection_citas.update_one({"_id": ObjectId(cita["_id"])}, {"$set": {
         "estado": "confirmada",
         "confirmada_por": current_user.get("email"),
         "fecha_confirmacion": today_str(sede)
     }})
+    await invalidar_hechos(cita.get("sede_id"), cita.get("fecha"))
 
     return {"success": True, "mensaje": "Cita confirmada", "cita_id": cita_id}
 
@@ -2007,6 +2134,7 @@ async def registrar_pago(
         {"_id": ObjectId(cita_id)},
         {"$set": update_set, "$push": {"historial_pagos": nuevo_pago}}
     )
+    await invalidar_por_pagos(cita.get("sede_id"), [nuevo_pago])
 
     respuesta = {
         "success": True,
@@ -2079,6 +2207,7 @@ async def completar_cita(cita_id: str, current_user: dict = Depends(get_current_
         "completada_por": current_user.get("email"),
         "fecha_completada": today(sede).replace(tzinfo=None)
     }})
+    await invalidar_hechos(cita.get("sede_id"), cita.get("fecha"))
 
     return {"success": True, "mensaje": "Cita completada", "cita_id": cita_id}
 
@@ -2100,6 +2229,8 @@ async def no_asistio(cita_id: str, current_user: dict = Depends(get_current_user
         "marcada_no_asistio_por": current_user.get("email"),
         "fecha_no_asistio": today(sede).replace(tzinfo=None)
     }})
+    await liberar_slot(REF_CITA, str(cita["_id"]))
+    await invalidar_hechos(cita.get("sede_id"), cita.get("fecha"))
 
     return {"success": True, "mensaje": "Marcada como no asistió", "cita_id": cita_id}
 
@@ -2531,6 +2662,7 @@ async def agregar_productos_a_cita(
             }
         }
     )
+    await invalidar_hechos(cita.get("sede_id"), cita.get("fecha"))
 
     # Obtener cita actualizada
     cita_actualizada = await collection_citas.find_one({"_id": ObjectId(cita_id)})
@@ -2636,6 +2768,7 @@ async def eliminar_producto_de_cita(
             }
         }
     )
+    await invalidar_hechos(cita.get("sede_id"), cita.get("fecha"))
 
     # Obtener cita actualizada
     cita_actualizada = await collection_citas.find_one({"_id": ObjectId(cita_id)})
@@ -2717,6 +2850,7 @@ async def eliminar_todos_productos_de_cita(
             }
         }
     )
+    await invalidar_hechos(cita.get("sede_id"), cita.get("fecha"))
 
     # Obtener cita actualizada
     cita_actualizada = await collection_citas.find_one({"_id": ObjectId(cita_id)})
@@ -2766,29 +2900,66 @@ async def finalizar_servicio_con_pdf(
             "finalizado_por":     current_user.get("email")
         }}
     )
+    await invalidar_hechos(cita.get("sede_id"), cita.get("fecha"))
     await collection_card.update_one(
         {"_id": ficha["_id"]},
         {"$set": {"estado": "finalizado"}}
     )
 
-    # Leer ficha actualizada y generar PDF — UNA SOLA LÍNEA en vez de 60
-    ficha_actualizada = await collection_card.find_one({"_id": ficha["_id"]})
-    pdf_result = await generar_y_enviar_pdf_ficha(ficha_actualizada, cita_id)
-
-    # Guardar resultado del PDF en la cita
+    # PDF + correo en segundo plano: la respuesta no espera el render
+    job_id = await encolar_trabajo(
+        JOB_PDF_FICHA,
+        {"cita_id": cita_id, "ficha_id": str(ficha["_id"]), "sede_id": cita.get("sede_id")},
+        creado_por=current_user.get("email")
+    )
     await collection_citas.update_one(
         {"_id": ObjectId(cita_id)},
-        {"$set": {
-            "pdf_generado":         pdf_result["pdf_generado"],
-            "pdf_fecha_generacion": today(sede).replace(tzinfo=None),
-            "pdf_enviado":          pdf_result["pdf_enviado"]
-        }}
+        {"$set": {"pdf_job_id": job_id, "pdf_generado": False, "pdf_email_job_id": None}}
     )
 
     return {
         "success": True,
-        "message": "Servicio finalizado correctamente",
+        "message": "Servicio finalizado correctamente. El comprobante se está generando.",
         "cita_id": cita_id,
         "estado":  "finalizado",
-        **pdf_result  # contiene: pdf_generado, pdf_enviado, cliente_email
+        "job_id":  job_id,
+        "pdf_estado": "pendiente"
+    }
+
+
+@router.get("/citas/finalizar/jobs/{job_id}", response_model=dict)
+async def estado_finalizacion_pdf(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Estado del trabajo de PDF lanzado por finalizar_servicio_con_pdf.
+    pdf_enviado se lee del trabajo de correo: True solo cuando ya salió.
+    """
+    if current_user["rol"] not in ["super_admin", "admin_sede", "estilista"]:
+        raise HTTPException(status_code=403, detail="No tienes permisos para consultar este trabajo")
+
+    job = await obtener_trabajo(job_id)
+    if not job or job.get("tipo") != JOB_PDF_FICHA:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    payload = job.get("payload") or {}
+    if current_user["rol"] != "super_admin":
+        sedes_autorizadas = set([current_user.get("sede_id")] + current_user.get("sedes_permitidas", []))
+        if payload.get("sede_id") not in sedes_autorizadas:
+            # Igual que un trabajo inexistente: no revelar trabajos de otras sedes
+            raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    resultado = job.get("resultado") or {}
+    estado_email = await estado_correo(resultado.get("email_job_id"))
+    return {
+        "success": True,
+        "job_id": job_id,
+        "cita_id": payload.get("cita_id"),
+        "pdf_estado": job.get("estado"),
+        "intentos": job.get("intentos", 0),
+        "pdf_generado": resultado.get("pdf_generado", False),
+        "pdf_enviado": estado_email == ENVIADO,
+        "email_estado": estado_email,
+        "error": job.get("error")
     }
@@ -0,0 +1,284 @@
+"""
+Reserva atómica de horario por profesional.
+
+Cada cita o pre-reserva "reclama" las celdas de SLOT_MINUTOS que ocupa
+insertando un documento por celda en `slot_claims`, con
+_id = "<profesional_id>|<fecha>|<HH:MM>". La unicidad del _id la garantiza
+MongoDB, así que dos reservas que se pisan no pueden insertar la misma
+celda: una gana y la otra recibe DuplicateKeyError, sin locks globales ni
+serializar a todos los escritores.
+
+- Las celdas se insertan en orden ascendente y con ordered=True: dos
+  reservas que se pisan compiten por la primera celda común, así que
+  entre reservas que se solapan siempre gana exactamente una.
+- Si la reserva falla a mitad, se eliminan las celdas que sí alcanzó a
+  insertar (rollback compensatorio).
+- Las celdas de pre-reservas llevan expira_en: el índice TTL las barre y,
+  mientras tanto, una celda vencida se considera libre y se reemplaza.
+- Una cita puede tomar las celdas de una pre-reserva del mismo usuario
+  (el flujo normal: pre-reservar → crear cita).
+- Las citas futuras que existían antes de slot_claims reciben sus celdas
+  con backfill_citas_futuras(), que el arranque de la API ejecuta una
+  vez (registrado en schema_meta).
+
+Uso por consola:
+    python -m app.scheduling.submodules.quotes.slot_claims --backfill [YYYY-MM-DD]
+    python -m app.scheduling.submodules.quotes.slot_claims --bench [N]
+"""
+import asyncio
+import logging
+import sys
+import uuid
+from datetime import date, datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from app.database.mongo import collection_citas, db
+
+logger = logging.getLogger(__name__)
+
+collection_slot_claims = db["slot_claims"]
+
+SLOT_MINUTOS = 5
+REF_CITA = "cita"
+REF_PRE_RESERVA = "pre_reserva"
+ESTADOS_LIBERAN = {"cancelada", "cancelado", "no_asistio"}
+MAX_INTENTOS = 3
+# Migración de arranque (schema_meta) que crea las celdas de citas previas
+MIGRACION_BACKFILL = "slot_claims_citas"
+VERSION_BACKFILL = 1
+DUPLICATE_KEY = 11000
+
+
+class SlotOcupado(Exception):
+    """El horario ya está tomado. `claim` es la celda que bloqueó la reserva."""
+
+    def __init__(self, mensaje: str, claim: Optional[dict] = None):
+        super().__init__(mensaje)
+        self.claim = claim or {}
+
+
+def _a_minutos(hhmm: str) -> int:
+    h, m = str(hhmm).split(":")[:2]
+    return int(h) * 60 + int(m)
+
+
+def celdas(profesional_id: str, fecha: str, hora_inicio: str, hora_fin: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    (_id, HH:MM) de cada celda que cubre [hora_inicio, hora_fin).
+    Sin hora_fin (o hora_fin <= hora_inicio) se reclama una sola celda.
+    """
+    inicio = _a_minutos(hora_inicio)
+    fin = _a_minutos(hora_fin) if hora_fin else inicio
+    primera = inicio - inicio % SLOT_MINUTOS
+    ultima = max(fin, inicio + 1)
+    resultado = []
+    t = primera
+    while t < ultima:
+        hora = f"{t // 60:02d}:{t % 60:02d}"
+        resultado.append((f"{profesional_id}|{fecha}|{hora}", hora))
+        t += SLOT_MINUTOS
+    return resultado
+
+
+def _liberable(claim: dict, ref_tipo: str, reservado_por: Optional[str], ahora: datetime) -> bool:
+    expira_en = claim.get("expira_en")
+    if expira_en and expira_en <= ahora:
+        return True
+    return (
+        ref_tipo == REF_CITA
+        and claim.get("ref_tipo") == REF_PRE_RESERVA
+        and reservado_por is not None
+        and claim.get("reservado_por") == reservado_por
+    )
+
+
+async def reclamar_slot(
+    profesional_id: str,
+    fecha: str,
+    hora_inicio: str,
+    hora_fin: Optional[str],
+    ref_tipo: str,
+    ref_id: str,
+    sede_id: Optional[str] = None,
+    reservado_por: Optional[str] = None,
+    expira_en: Optional[datetime] = None,
+) -> Dict[str, list]:
+    """
+    Reclama atómicamente las celdas del intervalo para (ref_tipo, ref_id).
+    Las celdas que ya pertenecen a la misma referencia se conservan, lo que
+    permite re-reclamar al editar una cita.
+
+    Returns:
+        {"claims": [_id, ...], "reemplazadas": [ref_id de pre-reservas tomadas]}
+
+    Raises:
+        SlotOcupado si alguna celda pertenece a otra reserva vigente.
+    """
+    ahora = datetime.utcnow()
+    todas = sorted(celdas(profesional_id, fecha, hora_inicio, hora_fin))
+    pendientes = [
+        {
+            "_id": _id,
+            "profesional_id": profesional_id,
+            "sede_id": sede_id,
+            "fecha": fecha,
+            "hora": hora,
+            "ref_tipo": ref_tipo,
+            "ref_id": ref_id,
+            "reservado_por": reservado_por,
+            "creado_en": ahora,
+            **({"expira_en": expira_en} if expira_en else {}),
+        }
+        for _id, hora in todas
+    ]
+    insertadas: Set[str] = set()
+    reemplazadas: Set[str] = set()
+
+    for _ in range(MAX_INTENTOS):
+        if not pendientes:
+            break
+        try:
+            await collection_slot_claims.insert_many(pendientes, ordered=True)
+            insertadas.update(d["_id"] for d in pendientes)
+            pendientes = []
+            break
+        except BulkWriteError as e:
+            # ordered=True: se detiene en el primer error, las anteriores quedaron
+            errores = e.details.get("writeErrors", [])
+            indice = errores[0]["index"] if errores else 0
+            insertadas.update(d["_id"] for d in pendientes[:indice])
+            if not errores or errores[0].get("code") != DUPLICATE_KEY:
+                await _revertir(insertadas, ref_tipo, ref_id)
+                raise
+            pendientes = pendientes[indice:]
+
+        existentes = await collection_slot_claims.find(
+            {"_id": {"$in": [d["_id"] for d in pendientes]}}
+        ).to_list(None)
+        propias = {c["_id"] for c in existentes
+                   if c.get("ref_tipo") == ref_tipo and c.get("ref_id") == ref_id}
+        bloqueantes = [c for c in existentes
+                       if c["_id"] not in propias and not _liberable(c, ref_tipo, reservado_por, ahora)]
+        if bloqueantes:
+            await _revertir(insertadas, ref_tipo, ref_id)
+            raise SlotOcupado("El profesional ya tiene ese horario ocupado", bloqueantes[0])
+
+        for c in existentes:
+            if c["_id"] in propias:
+                continue
+            # Borrado condicionado al dueño actual: si otro lo tomó entretanto,
+            # el siguiente intento lo detecta como bloqueante.
+            await collection_slot_claims.delete_many({
+                "ref_tipo": c.get("ref_tipo"), "ref_id": c.get("ref_id")
+            })
+            if c.get("ref_tipo") == REF_PRE_RESERVA:
+                reemplazadas.add(c.get("ref_id"))
+
+        # Las celdas propias ya existían: no entran en `insertadas` para que
+        # un rollback no las borre.
+        pendientes = [d for d in pendientes if d["_id"] not in propias]
+    else:
+        if pendientes:
+            await _revertir(insertadas, ref_tipo, ref_id)
+            raise SlotOcupado("No se pudo reservar el horario, intenta de nuevo")
+
+    return {"claims": [i for i, _ in todas], "reemplazadas": sorted(reemplazadas)}
+
+
+async def _revertir(ids: Set[str], ref_tipo: str, ref_id: str) -> None:
+    if ids:
+        await collection_slot_claims.delete_many({
+            "_id": {"$in": list(ids)}, "ref_tipo": ref_tipo, "ref_id": ref_id
+        })
+
+
+async def liberar_slot(ref_tipo: str, ref_id: str, conservar: Optional[List[str]] = None) -> int:
+    """Elimina las celdas de una referencia (excepto las de `conservar`)."""
+    filtro = {"ref_tipo": ref_tipo, "ref_id": ref_id}
+    if conservar:
+        filtro["_id"] = {"$nin": list(conservar)}
+    resultado = await collection_slot_claims.delete_many(filtro)
+    return resultado.deleted_count
+
+
+# ============================================================
+# BACKFILL: celdas para citas existentes
+# ============================================================
+async def backfill_citas(desde: str) -> Dict[str, int]:
+    """
+    Crea las celdas de las citas vigentes con fecha >= desde. Los solapes
+    ya existentes en la base se reportan y se dejan como están.
+    """
+    resumen = {"citas": 0, "reclamadas": 0, "conflictos": 0}
+    cursor = collection_citas.find(
+        {"fecha": {"$gte": desde}, "estado": {"$nin": list(ESTADOS_LIBERAN)}},
+        {"profesional_id": 1, "sede_id": 1, "fecha": 1, "hora_inicio": 1, "hora_fin": 1, "creada_por": 1}
+    )
+    async for c in cursor:
+        resumen["citas"] += 1
+        if not (c.get("profesional_id") and c.get("fecha") and c.get("hora_inicio")):
+            continue
+        try:
+            await reclamar_slot(
+                c["profesional_id"], str(c["fecha"])[:10], c["hora_inicio"], c.get("hora_fin"),
+                REF_CITA, str(c["_id"]), sede_id=c.get("sede_id"),
+            )
+            resumen["reclamadas"] += 1
+        except SlotOcupado as e:
+            resumen["conflictos"] += 1
+            logger.warning(f"⚠️ Cita {c['_id']} se solapa con {e.claim.get('ref_tipo')} {e.claim.get('ref_id')}")
+    return resumen
+
+
+async def backfill_citas_futuras() -> Dict[str, int]:
+    """backfill_citas() desde hoy (migración de arranque)."""
+    return await backfill_citas(date.today().isoformat())
+
+
+# ============================================================
+# BENCHMARK DE CONCURRENCIA
+# ============================================================
+async def benchmark(n: int = 50) -> Dict[str, float]:
+    """
+    Lanza n reservas simultáneas (mismo profesional, horarios que se
+    solapan) y verifica que exactamente una gane.
+    """
+    profesional = f"BENCH-{uuid.uuid4().hex[:8]}"
+    fecha = "2099-01-01"
+
+    async def intento(i: int) -> bool:
+        # Todas se solapan con 10:00-10:30 aunque empiecen distinto
+        inicio = f"10:{(i % 3) * 5:02d}"
+        try:
+            await reclamar_slot(profesional, fecha, inicio, "10:30", REF_CITA, f"bench-{i}")
+            return True
+        except SlotOcupado:
+            return False
+
+    t0 = asyncio.get_running_loop().time()
+    resultados = await asyncio.gather(*(intento(i) for i in range(n)))
+    duracion = asyncio.get_running_loop().time() - t0
+
+    ganadoras = sum(resultados)
+    restantes = await collection_slot_claims.count_documents({"profesional_id": profesional})
+    ref_restantes = await collection_slot_claims.distinct("ref_id", {"profesional_id": profesional})
+    await collection_slot_claims.delete_many({"profesional_id": profesional})
+
+    assert ganadoras == 1, f"Se esperaba 1 reserva ganadora, hubo {ganadoras}"
+    assert len(ref_restantes) == 1, f"Quedaron celdas de {len(ref_restantes)} reservas: {ref_restantes}"
+
+    return {"intentos": n, "ganadoras": ganadoras, "celdas": restantes, "segundos": round(duracion, 3)}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    if args and args[0] == "--backfill":
+        desde = args[1] if len(args) > 1 else datetime.utcnow().strftime("%Y-%m-%d")
+        print(asyncio.run(backfill_citas(desde)))
+    elif args and args[0] == "--bench":
+        print(asyncio.run(benchmark(int(args[1]) if len(args) > 1 else 50)))
+    else:
+        print(__doc__)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends
 from app.scheduling.models import Servicio
 from app.database.mongo import collection_servicios
+from app.analytics.hechos_diarios import invalidar_hechos_servicio
 from app.auth.routes import get_current_user
 from typing import List
 from bson import ObjectId
@@ -90,14 +91,19 @@ async def editar_servicio(
 
     update_data = {k: v for k, v in servicio_data.dict().items() if v is not None}
 
-    result = await collection_servicios.update_one(
+    anterior = await collection_servicios.find_one_and_update(
         {"_id": ObjectId(servicio_id)},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection={"servicio_id": 1, "nombre": 1, "categoria": 1}
     )
 
-    if result.matched_count == 0:
+    if anterior is None:
         raise HTTPException(status_code=404, detail="Servicio no encontrado")
 
+    # Los hechos de analytics guardan la categoría y el nombre del servicio
+    if any(campo in update_data and update_data[campo] != anterior.get(campo) for campo in ("nombre", "categoria")):
+        await invalidar_hechos_servicio(anterior.get("servicio_id"))
+
     return {"msg": "Servicio actualizado correctamente"}
 
 
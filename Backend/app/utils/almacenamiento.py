@@ -0,0 +1,154 @@
+"""
+Subidas a S3 sin bloquear el event loop.
+
+- boto3 es bloqueante: todas las llamadas corren en hilos (asyncio.to_thread).
+- subir_stream() usa upload_fileobj: lee el archivo por partes y, por encima
+  de S3_MULTIPART_MB, hace multipart upload con partes en paralelo.
+- Un semáforo por proceso limita las subidas simultáneas (S3_MAX_SUBIDAS),
+  así una ficha con muchas fotos no agota hilos ni conexiones.
+- url_subida_directa() genera un formulario prefirmado (POST) para que el
+  cliente suba la foto directo al bucket sin pasar los bytes por la API;
+  la política limita el tamaño (content-length-range) y el Content-Type.
+
+Configuración por entorno:
+    AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY / AWS_REGION / AWS_BUCKET_NAME
+    AWS_PUBLIC_BASE_URL       base de las URLs públicas
+    S3_ENDPOINT_URL           S3 compatible local (MinIO, moto_server)
+    S3_MAX_SUBIDAS            (default: 8)
+    S3_MULTIPART_MB           (default: 8)
+    S3_URL_FIRMADA_SEGUNDOS   (default: 900)
+    S3_MAX_FOTO_MB            tamaño máximo de una subida directa (default: 15)
+
+Para probar en local:
+    moto_server -p 5000
+    S3_ENDPOINT_URL=http://localhost:5000 AWS_PUBLIC_BASE_URL=http://localhost:5000/<bucket>
+"""
+import asyncio
+import os
+from typing import Any, BinaryIO, Dict, List, Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+MAX_SUBIDAS = int(os.getenv("S3_MAX_SUBIDAS", "8"))
+MULTIPART_BYTES = int(os.getenv("S3_MULTIPART_MB", "8")) * 1024 * 1024
+URL_FIRMADA_SEGUNDOS = int(os.getenv("S3_URL_FIRMADA_SEGUNDOS", "900"))
+MAX_FOTO_BYTES = int(os.getenv("S3_MAX_FOTO_MB", "15")) * 1024 * 1024
+
+s3_client = boto3.client(
+    "s3",
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+    region_name=os.getenv("AWS_REGION", "us-west-2"),
+    endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+    # El pool de conexiones debe alcanzar para las subidas y sus partes
+    config=Config(max_pool_connections=MAX_SUBIDAS * 4),
+)
+
+_transfer_config = TransferConfig(
+    multipart_threshold=MULTIPART_BYTES,
+    multipart_chunksize=MULTIPART_BYTES,
+    max_concurrency=4,
+)
+
+_semaforo = asyncio.Semaphore(MAX_SUBIDAS)
+
+
+def bucket() -> str:
+    return os.getenv("AWS_BUCKET_NAME")
+
+
+def url_publica(s3_key: str) -> str:
+    base_url = os.getenv("AWS_PUBLIC_BASE_URL")
+    if not base_url:
+        raise RuntimeError("AWS_PUBLIC_BASE_URL no está configurado")
+    return f"{base_url}/{s3_key}"
+
+
+def key_de_url(url: str) -> str:
+    """Inverso de url_publica (para URLs con otra base se toma el path)."""
+    base_url = os.getenv("AWS_PUBLIC_BASE_URL", "")
+    if base_url and url.startswith(base_url):
+        return url[len(base_url):].lstrip("/")
+    return url.split("://", 1)[-1].split("/", 1)[-1]
+
+
+async def subir_stream(archivo: BinaryIO, s3_key: str, content_type: str) -> str:
+    """Sube un archivo abierto (p. ej. UploadFile.file) leyéndolo por partes."""
+    archivo.seek(0)
+    async with _semaforo:
+        await asyncio.to_thread(
+            s3_client.upload_fileobj,
+            archivo, bucket(), s3_key,
+            ExtraArgs={"ContentType": content_type},
+            Config=_transfer_config,
+        )
+    return url_publica(s3_key)
+
+
+async def subir_bytes(s3_key: str, contenido: bytes, content_type: str) -> str:
+    async with _semaforo:
+        await asyncio.to_thread(
+            s3_client.put_object,
+            Bucket=bucket(), Key=s3_key, Body=contenido, ContentType=content_type,
+        )
+    return url_publica(s3_key)
+
+
+async def descargar_objeto(s3_key: str) -> bytes:
+    def _leer() -> bytes:
+        return s3_client.get_object(Bucket=bucket(), Key=s3_key)["Body"].read()
+    return await asyncio.to_thread(_leer)
+
+
+async def metadatos_objeto(s3_key: str) -> Optional[Dict[str, Any]]:
+    """{"tamano", "content_type"} o None si el objeto no existe."""
+    try:
+        head = await asyncio.to_thread(s3_client.head_object, Bucket=bucket(), Key=s3_key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return {"tamano": head.get("ContentLength", 0), "content_type": head.get("ContentType")}
+
+
+async def borrar_objetos(s3_keys: List[str]) -> None:
+    """Borra esas keys del bucket (las que no existen se ignoran)."""
+    if not s3_keys:
+        return
+    await asyncio.to_thread(
+        s3_client.delete_objects,
+        Bucket=bucket(),
+        Delete={"Objects": [{"Key": k} for k in s3_keys], "Quiet": True},
+    )
+
+
+def url_subida_directa(
+    s3_key: str,
+    content_type: str,
+    tamano_maximo: int = MAX_FOTO_BYTES,
+    expira_segundos: int = URL_FIRMADA_SEGUNDOS,
+) -> Dict[str, Any]:
+    """
+    Formulario prefirmado para que el cliente haga POST (multipart) del
+    archivo al bucket: `campos` van primero y el archivo al final, en el
+    campo "file". S3 rechaza otro Content-Type o más de tamano_maximo bytes.
+    """
+    post = s3_client.generate_presigned_post(
+        bucket(),
+        s3_key,
+        Fields={"Content-Type": content_type},
+        Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, tamano_maximo]],
+        ExpiresIn=expira_segundos,
+    )
+    return {
+        "key": s3_key,
+        "upload_url": post["url"],
+        "metodo": "POST",
+        "campos": post["fields"],
+        "url": url_publica(s3_key),
+        "tamano_maximo": tamano_maximo,
+        "expira_en_segundos": expira_segundos,
+    }
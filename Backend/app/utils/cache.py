@@ -0,0 +1,275 @@
+"""
+Capa de caché compartida (TTL + LRU) con backend intercambiable.
+
+- MemoryTTLCache: en proceso, acotada por número de entradas (LRU) y TTL.
+- RedisCache: compartida entre workers de gunicorn; acepta cualquier
+  cliente compatible con redis.asyncio (get/set/delete/incr). Los
+  valores se guardan como JSON (jsonable_encoder, ObjectId → str): el
+  mismo formato que recibe el cliente HTTP.
+
+Ambas implementan get_or_compute() con single-flight: si varias
+peticiones piden la misma clave a la vez y no está en caché, solo una
+ejecuta el cálculo y las demás esperan su resultado.
+
+Selección por variables de entorno:
+    CACHE_BACKEND=memory|redis   (default: memory)
+    REDIS_URL=redis://host:6379/0
+    CACHE_MAX_ENTRIES=512
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_MAX_ENTRIES = 512
+
+
+def make_cache_key(prefix: str, **kwargs) -> str:
+    """Clave determinística: prefix_k1=v1_k2=v2 (ignora valores None)."""
+    params = "_".join(f"{k}={v}" for k, v in sorted(kwargs.items()) if v is not None)
+    return f"{prefix}_{params}"
+
+
+class CacheBackend(ABC):
+    """Interfaz común. Las subclases implementan _get/_set/_delete."""
+
+    def __init__(self, default_ttl: int = DEFAULT_TTL_SECONDS):
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.computations = 0
+        self.deduplicated = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @abstractmethod
+    async def _get(self, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    async def _set(self, key: str, value: Any, ttl: int) -> None:
+        ...
+
+    @abstractmethod
+    async def _delete(self, key: str) -> None:
+        ...
+
+    async def get(self, key: str) -> Any:
+        value = await self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        await self._set(key, value, ttl or self.default_ttl)
+
+    async def delete(self, key: str) -> None:
+        await self._delete(key)
+
+    async def _compute_and_store(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        ttl: Optional[int]
+    ) -> Any:
+        self.computations += 1
+        value = await factory()
+        if value is not None:
+            await self.set(key, value, ttl)
+        return value
+
+    async def get_or_compute(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        ttl: Optional[int] = None
+    ) -> Any:
+        """
+        Devuelve el valor cacheado o lo calcula con factory().
+        Single-flight dentro del proceso: un solo cálculo por clave a la vez.
+        Si factory() lanza excepción, no se cachea y se propaga a todos
+        los que esperaban.
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        pendiente = self._inflight.get(key)
+        if pendiente is not None:
+            self.deduplicated += 1
+            return await asyncio.shield(pendiente)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._compute_and_store(key, factory, ttl)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # Evitar "Future exception was never retrieved" si nadie esperaba
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "computations": self.computations,
+            "deduplicated": self.deduplicated,
+        }
+
+
+class MemoryTTLCache(CacheBackend):
+    """
+    Caché en proceso acotada: como máximo max_entries claves.
+    Al superar el límite se expulsa la menos usada recientemente (LRU);
+    las entradas vencidas se expulsan al leerlas o al insertar.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, default_ttl: int = DEFAULT_TTL_SECONDS):
+        super().__init__(default_ttl)
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+
+    async def _get(self, key: str) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expira, value = entry
+        if time.monotonic() >= expira:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def _set(self, key: str, value: Any, ttl: int) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        self._purge()
+
+    async def _delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def _purge(self) -> None:
+        ahora = time.monotonic()
+        vencidas = [k for k, (expira, _) in self._data.items() if expira <= ahora]
+        for k in vencidas:
+            del self._data[k]
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        data = super().stats()
+        data.update({
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+        })
+        return data
+
+
+class RedisCache(CacheBackend):
+    """
+    Caché compartida entre workers. La memoria la acota Redis
+    (maxmemory + allkeys-lru); cada clave lleva además su TTL.
+
+    Single-flight entre procesos: el primer worker que falla toma un
+    lock (SET NX PX) y calcula; los demás esperan a que aparezca el
+    valor hasta lock_timeout y, si no aparece, calculan ellos mismos.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        prefix: str = "cache:",
+        default_ttl: int = DEFAULT_TTL_SECONDS,
+        lock_timeout: float = 30.0,
+        poll_interval: float = 0.1
+    ):
+        super().__init__(default_ttl)
+        self.client = client
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+
+    def _k(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def _get(self, key: str) -> Any:
+        raw = await self.client.get(self._k(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def _set(self, key: str, value: Any, ttl: int) -> None:
+        raw = json.dumps(jsonable_encoder(value, custom_encoder={ObjectId: str}), separators=(",", ":"))
+        await self.client.set(self._k(key), raw, ex=ttl)
+
+    async def _delete(self, key: str) -> None:
+        await self.client.delete(self._k(key))
+
+    async def get(self, key: str) -> Any:
+        value = await super().get(key)
+        # Contadores compartidos entre workers (best-effort)
+        try:
+            await self.client.incr(f"{self.prefix}__stats:{'hits' if value is not None else 'misses'}")
+        except Exception:
+            pass
+        return value
+
+    async def _compute_and_store(self, key, factory, ttl):
+        lock_key = self._k(f"__lock:{key}")
+        adquirido = await self.client.set(lock_key, b"1", nx=True, px=int(self.lock_timeout * 1000))
+        if not adquirido:
+            limite = time.monotonic() + self.lock_timeout
+            while time.monotonic() < limite:
+                await asyncio.sleep(self.poll_interval)
+                value = await self._get(key)
+                if value is not None:
+                    self.deduplicated += 1
+                    return value
+        try:
+            return await super()._compute_and_store(key, factory, ttl)
+        finally:
+            if adquirido:
+                await self.client.delete(lock_key)
+
+    async def shared_stats(self) -> Dict[str, int]:
+        """Contadores acumulados de todos los workers."""
+        hits = await self.client.get(f"{self.prefix}__stats:hits")
+        misses = await self.client.get(f"{self.prefix}__stats:misses")
+        return {"hits": int(hits or 0), "misses": int(misses or 0)}
+
+
+def build_cache(prefix: str = "cache:", default_ttl: int = DEFAULT_TTL_SECONDS) -> CacheBackend:
+    """Construye el backend configurado por entorno (fallback a memoria)."""
+    backend = os.getenv("CACHE_BACKEND", "memory").lower()
+    max_entries = int(os.getenv("CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+
+    if backend == "redis":
+        try:
+            import redis.asyncio as redis_asyncio
+            client = redis_asyncio.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+            return RedisCache(client, prefix=prefix, default_ttl=default_ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo inicializar Redis para caché ({e}); usando memoria")
+
+    return MemoryTTLCache(max_entries=max_entries, default_ttl=default_ttl)
@@ -0,0 +1,140 @@
+"""
+Pool de procesos compartido para trabajo CPU-bound (PDF con reportlab,
+compresión de imágenes con PIL).
+
+Ejecutar ese trabajo en el event loop congela a todas las demás
+peticiones del worker; aquí corre en procesos aparte:
+
+- Cola acotada: como máximo CPU_POOL_WORKERS tareas ejecutándose y
+  CPU_POOL_COLA esperando. Si se supera, ejecutar() lanza PoolSaturado
+  de inmediato en lugar de acumular trabajo sin límite.
+- Timeout por tarea: el awaiting se corta con PoolTimeout. Si la tarea
+  aún no empezaba se cancela; si ya corría, el proceso hijo la termina
+  y su resultado se descarta. En ambos casos sigue contando en la cola
+  hasta que el futuro termina de verdad, así una ráfaga de timeouts no
+  deja pasar más trabajo del que los procesos pueden atender.
+- Métricas: metricas() devuelve contadores y tiempos.
+
+Las funciones enviadas deben ser de nivel de módulo y sus argumentos
+serializables con pickle (bytes, dicts, etc.).
+
+Configuración por entorno:
+    CPU_POOL_WORKERS (default: min(4, núcleos))
+    CPU_POOL_COLA    (default: 32)
+    CPU_POOL_TIMEOUT (segundos, default: 60)
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+NUM_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+MAX_COLA = int(os.getenv("CPU_POOL_COLA", "32"))
+TIMEOUT_SEGUNDOS = float(os.getenv("CPU_POOL_TIMEOUT", "60"))
+
+
+class PoolSaturado(Exception):
+    """La cola del pool está llena."""
+
+
+class PoolTimeout(Exception):
+    """La tarea superó su tiempo máximo."""
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_pendientes = 0
+_metricas: Dict[str, float] = {
+    "enviadas": 0,
+    "completadas": 0,
+    "fallidas": 0,
+    "timeouts": 0,
+    "rechazadas": 0,
+    "segundos_total": 0.0,
+    "segundos_max": 0.0,
+}
+
+
+def _obtener_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: los hijos no heredan los hilos/sockets del loop de la API
+        _executor = ProcessPoolExecutor(
+            max_workers=NUM_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logger.info(f"✅ Pool CPU iniciado con {NUM_WORKERS} proceso(s)")
+    return _executor
+
+
+async def ejecutar(func: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+    """
+    Ejecuta func(*args) en el pool de procesos.
+
+    Raises:
+        PoolSaturado si hay más de NUM_WORKERS + MAX_COLA tareas en curso.
+        PoolTimeout si la tarea no termina en `timeout` segundos.
+    """
+    global _pendientes
+    if _pendientes >= NUM_WORKERS + MAX_COLA:
+        _metricas["rechazadas"] += 1
+        raise PoolSaturado("El servidor está procesando demasiados documentos, intenta de nuevo")
+
+    loop = asyncio.get_running_loop()
+    futuro = _obtener_executor().submit(func, *args)
+    _pendientes += 1
+    futuro.add_done_callback(lambda _: _liberar_desde_hilo(loop))
+    _metricas["enviadas"] += 1
+    inicio = time.monotonic()
+    try:
+        try:
+            resultado = await asyncio.wait_for(asyncio.wrap_future(futuro), timeout=timeout or TIMEOUT_SEGUNDOS)
+        except asyncio.TimeoutError:
+            _metricas["timeouts"] += 1
+            raise PoolTimeout(f"{getattr(func, '__name__', func)} superó {timeout or TIMEOUT_SEGUNDOS}s")
+        except Exception:
+            _metricas["fallidas"] += 1
+            raise
+        _metricas["completadas"] += 1
+        return resultado
+    finally:
+        duracion = time.monotonic() - inicio
+        _metricas["segundos_total"] += duracion
+        _metricas["segundos_max"] = max(_metricas["segundos_max"], duracion)
+
+
+def _liberar() -> None:
+    global _pendientes
+    _pendientes -= 1
+
+
+def _liberar_desde_hilo(loop: asyncio.AbstractEventLoop) -> None:
+    """Callback del futuro (corre en un hilo del executor): descuenta en el loop."""
+    try:
+        loop.call_soon_threadsafe(_liberar)
+    except RuntimeError:
+        # Loop ya cerrado (apagado): el contador ya no importa
+        pass
+
+
+def metricas() -> Dict[str, Any]:
+    terminadas = _metricas["completadas"] + _metricas["fallidas"] + _metricas["timeouts"]
+    return {
+        "workers": NUM_WORKERS,
+        "max_cola": MAX_COLA,
+        "en_curso": _pendientes,
+        **{k: v for k, v in _metricas.items() if k not in ("segundos_total", "segundos_max")},
+        "segundos_promedio": round(_metricas["segundos_total"] / terminadas, 3) if terminadas else 0.0,
+        "segundos_max": round(_metricas["segundos_max"], 3),
+    }
+
+
+def detener_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,357 @@
+"""
+Cola de correos salientes persistida en MongoDB (colección email_jobs).
+
+Los handlers solo encolan (encolar_correo); el envío lo hacen workers en
+segundo plano que:
+
+- reutilizan una conexión SMTP autenticada entre mensajes (reconectan si
+  el servidor la cierra o queda inactiva más de SMTP_IDLE_SEGUNDOS),
+- agrupan los trabajos pendientes de un mismo destinatario y los envían
+  en la misma sesión,
+- reintentan con backoff exponencial hasta MAX_INTENTOS; luego el trabajo
+  queda en estado "fallido" para revisión.
+
+Un trabajo tomado por un worker que muere vuelve a estar disponible al
+vencer su lease (LEASE_SEGUNDOS). El lease se renueva antes de cada envío
+del lote, e intentos sube al tomar el trabajo (no solo al fallar): un
+trabajo que tumba al worker una y otra vez termina en "fallido".
+
+Configuración por entorno:
+    EMAIL_REMITENTE / EMAIL_CONTRASENA
+    SMTP_SERVER (smtp.gmail.com) / SMTP_PORT (465) / SMTP_SSL (true)
+    EMAIL_QUEUE_WORKERS (2)
+
+Para probar en local con un servidor de depuración:
+    python -m aiosmtpd -n -l localhost:1025
+    SMTP_SERVER=localhost SMTP_PORT=1025 SMTP_SSL=false
+"""
+import asyncio
+import logging
+import os
+import smtplib
+import ssl
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Any, Dict, List, Optional
+
+from bson import Binary, ObjectId
+from pymongo import ReturnDocument
+
+from app.database.mongo import db
+
+logger = logging.getLogger(__name__)
+
+collection_email_jobs = db["email_jobs"]
+
+EMAIL_SENDER = os.getenv("EMAIL_REMITENTE")
+EMAIL_PASSWORD = os.getenv("EMAIL_CONTRASENA")
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "true").lower() not in ("0", "false", "no")
+SMTP_IDLE_SEGUNDOS = 60
+
+NUM_WORKERS = int(os.getenv("EMAIL_QUEUE_WORKERS", "2"))
+MAX_INTENTOS = 5
+BACKOFF_BASE_SEGUNDOS = 30
+BACKOFF_MAX_SEGUNDOS = 3600
+LEASE_SEGUNDOS = 120
+LOTE_POR_DESTINATARIO = 10
+POLL_SEGUNDOS = 2.0
+
+PENDIENTE = "pendiente"
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+FALLIDO = "fallido"
+
+
+# ============================================================
+# ENCOLAR
+# ============================================================
+async def encolar_correo(
+    destinatario: str,
+    asunto: str,
+    html: str,
+    adjuntos: Optional[List[Dict[str, Any]]] = None,
+    origen: Optional[str] = None,
+    clave: Optional[str] = None,
+) -> str:
+    """
+    Registra un correo para envío en segundo plano y devuelve el id del trabajo.
+
+    adjuntos: [{"nombre": str, "contenido": bytes, "mime": "application/pdf"}]
+    clave: clave de idempotencia. Si ya hay un correo con esa clave no se
+    encola otro y se devuelve el id existente (p. ej. un trabajo de PDF que
+    se reintenta después de haber encolado su correo).
+    """
+    ahora = datetime.utcnow()
+    job = {
+        "destinatario": destinatario,
+        "asunto": asunto,
+        "html": html,
+        "adjuntos": [
+            {
+                "nombre": a["nombre"],
+                "contenido": Binary(a["contenido"]),
+                "mime": a.get("mime", "application/octet-stream"),
+            }
+            for a in (adjuntos or [])
+        ],
+        "origen": origen,
+        "estado": PENDIENTE,
+        "intentos": 0,
+        "proximo_intento": ahora,
+        "creado_en": ahora,
+    }
+    if clave is None:
+        resultado = await collection_email_jobs.insert_one(job)
+        _despertar_workers()
+        return str(resultado.inserted_id)
+
+    job["clave"] = clave
+    existente = await collection_email_jobs.find_one_and_update(
+        {"clave": clave},
+        {"$setOnInsert": job},
+        upsert=True,
+        projection={"_id": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    _despertar_workers()
+    return str(existente["_id"])
+
+
+async def estado_correo(job_id: Optional[str]) -> Optional[str]:
+    """Estado del trabajo de correo (pendiente/enviando/enviado/fallido) o None."""
+    if not job_id or not ObjectId.is_valid(job_id):
+        return None
+    job = await collection_email_jobs.find_one({"_id": ObjectId(job_id)}, {"estado": 1})
+    return job.get("estado") if job else None
+
+
+def construir_mensaje(job: dict) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = job["asunto"]
+    msg["From"] = EMAIL_SENDER
+    msg["To"] = job["destinatario"]
+    msg.set_content(job["html"], subtype="html")
+    for adjunto in job.get("adjuntos", []):
+        maintype, _, subtype = adjunto.get("mime", "application/octet-stream").partition("/")
+        msg.add_attachment(
+            bytes(adjunto["contenido"]),
+            maintype=maintype,
+            subtype=subtype or "octet-stream",
+            filename=adjunto["nombre"],
+        )
+    return msg
+
+
+# ============================================================
+# CONEXIÓN SMTP REUTILIZABLE
+# ============================================================
+class ConexionSMTP:
+    """
+    Una conexión SMTP autenticada por worker. smtplib es bloqueante, así
+    que todas las operaciones corren en un hilo (asyncio.to_thread).
+    """
+
+    def __init__(self):
+        self._server: Optional[smtplib.SMTP] = None
+        self._ultimo_uso = 0.0
+
+    def _conectar(self) -> smtplib.SMTP:
+        if SMTP_SSL:
+            server = smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, context=ssl.create_default_context(), timeout=30)
+        else:
+            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+        if EMAIL_SENDER and EMAIL_PASSWORD:
+            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
+        return server
+
+    def _enviar_sync(self, msg: EmailMessage) -> None:
+        ahora = time.monotonic()
+        if self._server is not None and ahora - self._ultimo_uso > SMTP_IDLE_SEGUNDOS:
+            self._cerrar_sync()
+        if self._server is None:
+            self._server = self._conectar()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # El servidor cerró la sesión: reconectar una vez
+            self._server = self._conectar()
+            self._server.send_message(msg)
+        self._ultimo_uso = time.monotonic()
+
+    def _cerrar_sync(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+    async def enviar(self, msg: EmailMessage) -> None:
+        await asyncio.to_thread(self._enviar_sync, msg)
+
+    async def cerrar(self) -> None:
+        await asyncio.to_thread(self._cerrar_sync)
+
+
+# ============================================================
+# WORKERS
+# ============================================================
+def _backoff(intentos: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_BASE_SEGUNDOS * (2 ** max(0, intentos - 1)), BACKOFF_MAX_SEGUNDOS))
+
+
+async def _tomar_trabajo(worker_id: str) -> Optional[dict]:
+    """Toma atómicamente el siguiente trabajo disponible (o con lease vencido)."""
+    ahora = datetime.utcnow()
+    return await collection_email_jobs.find_one_and_update(
+        {
+            "$or": [
+                {"estado": PENDIENTE, "proximo_intento": {"$lte": ahora}},
+                {"estado": ENVIANDO, "lease_hasta": {"$lte": ahora}},
+            ]
+        },
+        {"$set": {"estado": ENVIANDO, "worker": worker_id, "lease_hasta": ahora + timedelta(seconds=LEASE_SEGUNDOS)},
+         "$inc": {"intentos": 1}},
+        sort=[("proximo_intento", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _tomar_lote_destinatario(worker_id: str, destinatario: str, limite: int) -> List[dict]:
+    """Toma otros trabajos listos del mismo destinatario para la misma sesión SMTP."""
+    lote = []
+    for _ in range(limite):
+        ahora = datetime.utcnow()
+        job = await collection_email_jobs.find_one_and_update(
+            {"destinatario": destinatario, "estado": PENDIENTE, "proximo_intento": {"$lte": ahora}},
+            {"$set": {"estado": ENVIANDO, "worker": worker_id, "lease_hasta": ahora + timedelta(seconds=LEASE_SEGUNDOS)},
+             "$inc": {"intentos": 1}},
+            sort=[("proximo_intento", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if not job:
+            break
+        lote.append(job)
+    return lote
+
+
+async def _renovar_lease(job: dict, worker_id: str) -> bool:
+    """
+    Extiende el lease justo antes de enviar. False si el trabajo ya no es
+    de este worker (el lease venció mientras esperaba en el lote y otro
+    worker lo retomó): no se envía, para no duplicar el correo.
+    """
+    resultado = await collection_email_jobs.update_one(
+        {"_id": job["_id"], "estado": ENVIANDO, "worker": worker_id},
+        {"$set": {"lease_hasta": datetime.utcnow() + timedelta(seconds=LEASE_SEGUNDOS)}},
+    )
+    return resultado.matched_count == 1
+
+
+async def _procesar(job: dict, conexion: ConexionSMTP, worker_id: str) -> bool:
+    # intentos ya cuenta esta toma (_tomar_trabajo / _tomar_lote_destinatario)
+    intentos = job.get("intentos", 0)
+    if intentos > MAX_INTENTOS:
+        # Se tomó MAX_INTENTOS veces sin terminar (el worker murió enviándolo)
+        await collection_email_jobs.update_one(
+            {"_id": job["_id"], "worker": worker_id},
+            {"$set": {"estado": FALLIDO, "ultimo_error": "Lease vencido en todos los intentos"},
+             "$unset": {"lease_hasta": "", "worker": ""}}
+        )
+        logger.warning(f"⚠️ Correo a {job['destinatario']} descartado tras {MAX_INTENTOS} intentos sin completar")
+        return False
+
+    if not await _renovar_lease(job, worker_id):
+        return False
+
+    try:
+        await conexion.enviar(construir_mensaje(job))
+    except Exception as e:
+        agotado = intentos >= MAX_INTENTOS
+        await collection_email_jobs.update_one(
+            {"_id": job["_id"]},
+            {"$set": {
+                "estado": FALLIDO if agotado else PENDIENTE,
+                "ultimo_error": str(e)[:500],
+                "proximo_intento": datetime.utcnow() + _backoff(intentos),
+            }, "$unset": {"lease_hasta": "", "worker": ""}}
+        )
+        logger.warning(f"⚠️ Error enviando correo a {job['destinatario']} (intento {intentos}): {e}")
+        # Forzar reconexión en el siguiente envío
+        await conexion.cerrar()
+        return False
+
+    await collection_email_jobs.update_one(
+        {"_id": job["_id"]},
+        {"$set": {"estado": ENVIADO, "enviado_en": datetime.utcnow()},
+         "$unset": {"lease_hasta": "", "adjuntos": ""}}
+    )
+    logger.info(f"📧 Correo enviado a {job['destinatario']}")
+    return True
+
+
+_evento_nuevo: Optional[asyncio.Event] = None
+_tareas: List[asyncio.Task] = []
+
+
+def _despertar_workers() -> None:
+    if _evento_nuevo is not None:
+        _evento_nuevo.set()
+
+
+async def _worker(worker_id: str) -> None:
+    conexion = ConexionSMTP()
+    try:
+        while True:
+            try:
+                job = await _tomar_trabajo(worker_id)
+            except Exception as e:
+                logger.error(f"❌ Cola de correos: error leyendo trabajos: {e}")
+                job = None
+
+            if job is None:
+                _evento_nuevo.clear()
+                try:
+                    await asyncio.wait_for(_evento_nuevo.wait(), timeout=POLL_SEGUNDOS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            lote = [job] + await _tomar_lote_destinatario(worker_id, job["destinatario"], LOTE_POR_DESTINATARIO - 1)
+            for item in lote:
+                try:
+                    await _procesar(item, conexion, worker_id)
+                except Exception as e:
+                    # El lease vencerá y otro worker lo retomará
+                    logger.error(f"❌ Cola de correos: error procesando {item.get('_id')}: {e}")
+    finally:
+        await conexion.cerrar()
+
+
+async def iniciar_workers_correo(num_workers: int = NUM_WORKERS) -> None:
+    """Arranca los workers de la cola (se llama desde el lifespan)."""
+    global _evento_nuevo
+    if _tareas:
+        return
+    _evento_nuevo = asyncio.Event()
+    for i in range(num_workers):
+        _tareas.append(asyncio.create_task(_worker(f"{os.getpid()}-{i}")))
+    logger.info(f"✅ Cola de correos: {num_workers} worker(s) iniciados")
+
+
+async def detener_workers_correo() -> None:
+    for tarea in _tareas:
+        tarea.cancel()
+    await asyncio.gather(*_tareas, return_exceptions=True)
+    _tareas.clear()
+
+
+async def estado_cola() -> Dict[str, int]:
+    """Cantidad de trabajos por estado."""
+    conteo = await collection_email_jobs.aggregate([
+        {"$group": {"_id": "$estado", "total": {"$sum": 1}}}
+    ]).to_list(None)
+    return {c["_id"]: c["total"] for c in conteo}
@@ -0,0 +1,310 @@
+"""
+Escritura de reportes .xlsx en streaming.
+
+Los reportes grandes (caja por período, citas, comisiones) se
+construían como Workbook completo en memoria, celda por celda y con
+objetos Font/PatternFill/Border nuevos por celda, en el event loop.
+Aquí:
+
+- El libro es write-only: cada fila se serializa al archivo temporal
+  de su hoja en cuanto se agrega, y la memoria no crece con el número
+  de filas. Anchos, congelado y alturas se fijan antes de escribir.
+- Los estilos son NamedStyle registrados una sola vez por libro
+  (LibroStream.estilo) y las celdas solo guardan la referencia.
+- La construcción corre en un hilo aparte. Los cursores de motor se
+  consumen desde el hilo con LibroStream.iterar(), sin cargar la
+  consulta completa con to_list().
+- stream_xlsx() entrega el archivo por bloques a StreamingResponse
+  mientras el zip se escribe, con una cola acotada (si el cliente lee
+  lento, el hilo espera) y cancelación si el cliente se desconecta.
+
+El zip de un .xlsx solo puede escribirse cuando las hojas están
+cerradas, así que el primer byte sale al terminar de escribir las
+filas; lo que se acota es la memoria, no el tiempo al primer byte.
+
+Configuración por entorno:
+    EXCEL_STREAM_CONCURRENTES (default: 2)  reportes construyéndose a la vez
+    EXCEL_STREAM_BLOQUES      (default: 16) bloques de 64 KB en cola
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+from io import BytesIO
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, Sequence
+
+from openpyxl import Workbook
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import NamedStyle
+from openpyxl.utils import get_column_letter
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+REPORTES_CONCURRENTES = int(os.getenv("EXCEL_STREAM_CONCURRENTES", "2"))
+BLOQUES_EN_COLA = int(os.getenv("EXCEL_STREAM_BLOQUES", "16"))
+TAMANO_BLOQUE = 64 * 1024
+LOTE_ITERAR = 500
+
+_FIN = object()
+
+
+async def _siguiente_lote(iterador: Any) -> list:
+    # Un salto hilo → loop por lote y no por documento
+    lote = []
+    try:
+        while len(lote) < LOTE_ITERAR:
+            lote.append(await iterador.__anext__())
+    except StopAsyncIteration:
+        pass
+    return lote
+
+
+class ReporteCancelado(Exception):
+    """El cliente cerró la conexión; el hilo deja de escribir."""
+
+
+class HojaStream:
+    """Hoja write-only: las filas se agregan en orden, de arriba hacia abajo."""
+
+    def __init__(self, libro: "LibroStream", ws):
+        self.libro = libro
+        self.ws = ws
+        self.fila_actual = 1  # número de la próxima fila
+
+    def celda(self, valor: Any, estilo: Optional[str] = None) -> Cell:
+        c = WriteOnlyCell(self.ws, value=valor)
+        if estilo:
+            c.style = estilo
+        return c
+
+    def fila(self, *valores: Any, estilo: Optional[str] = None, alto: Optional[float] = None) -> int:
+        """
+        Agrega una fila. Los valores pueden ser celdas de celda() o valores
+        simples; a estos se les aplica `estilo` si se indica. None deja la
+        columna vacía. Devuelve el número de la fila escrita.
+        """
+        self.libro.verificar()
+        n = self.fila_actual
+        if alto is not None:
+            self.ws.row_dimensions[n].height = alto
+        if estilo:
+            valores = tuple(
+                v if isinstance(v, Cell) or v is None else self.celda(v, estilo)
+                for v in valores
+            )
+        self.ws.append(valores)
+        self.fila_actual += 1
+        return n
+
+    def combinada(self, valor: Any, ncols: int, estilo: Optional[str] = None, alto: Optional[float] = None) -> int:
+        """Fila con las columnas 1..ncols combinadas (títulos y notas)."""
+        n = self.fila_actual
+        self.ws.merged_cells.add(f"A{n}:{get_column_letter(ncols)}{n}")
+        return self.fila(self.celda(valor, estilo), alto=alto)
+
+    def vacia(self, alto: Optional[float] = None) -> int:
+        return self.fila(alto=alto)
+
+
+class LibroStream:
+    """Workbook write-only con estilos con nombre compartidos."""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None,
+                 cancelado: Optional[threading.Event] = None):
+        self.wb = Workbook(write_only=True)
+        self._loop = loop
+        self._cancelado = cancelado or threading.Event()
+        self._estilos: set = set()
+
+    def estilo(self, nombre: str, **atributos: Any) -> str:
+        """
+        Registra el NamedStyle la primera vez y devuelve su nombre.
+        Atributos: font, fill, border, alignment, number_format.
+        """
+        if nombre not in self._estilos:
+            self.wb.add_named_style(NamedStyle(name=nombre, **atributos))
+            self._estilos.add(nombre)
+        return nombre
+
+    def tiene_estilo(self, nombre: str) -> bool:
+        """Para estilos armados por combinación: evita crear Font/Fill si ya existe."""
+        return nombre in self._estilos
+
+    def hoja(self, titulo: str, anchos: Sequence[float] = (), congelar: Optional[str] = None,
+             cuadricula: bool = True) -> HojaStream:
+        ws = self.wb.create_sheet(titulo)
+        for i, ancho in enumerate(anchos, start=1):
+            ws.column_dimensions[get_column_letter(i)].width = ancho
+        if congelar:
+            ws.freeze_panes = congelar
+        ws.sheet_view.showGridLines = cuadricula
+        return HojaStream(self, ws)
+
+    def verificar(self) -> None:
+        if self._cancelado.is_set():
+            raise ReporteCancelado()
+
+    def iterar(self, fuente: Any) -> Iterator:
+        """
+        Recorre un iterable normal o uno asíncrono (cursor de motor) desde
+        el hilo del reporte; los documentos se piden al event loop en lotes
+        de LOTE_ITERAR y el cursor trae lotes de la base, sin to_list().
+        """
+        if not hasattr(fuente, "__aiter__"):
+            yield from fuente
+            return
+        if self._loop is None:
+            raise RuntimeError("iterar() de una fuente asíncrona requiere el loop del reporte")
+        iterador = fuente.__aiter__()
+        while True:
+            self.verificar()
+            lote = asyncio.run_coroutine_threadsafe(_siguiente_lote(iterador), self._loop).result()
+            yield from lote
+            if len(lote) < LOTE_ITERAR:
+                return
+
+    def guardar(self, destino: Any) -> None:
+        if not self.wb.worksheets:
+            self.wb.create_sheet()
+        self.wb.save(destino)
+
+    def descartar(self) -> None:
+        """Borra los temporales de las hojas de un libro que no se guardó."""
+        for ws in self.wb.worksheets:
+            writer = getattr(ws, "_writer", None)
+            if writer is None:
+                continue
+            for cerrar in (getattr(ws, "_rows", None), writer):
+                try:
+                    if cerrar is not None:
+                        cerrar.close()
+                except Exception:
+                    pass
+            if os.path.exists(writer.out):
+                writer.cleanup()
+
+
+class _SalidaCola:
+    """Archivo de solo escritura (no seekable) que pasa bloques al event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, cola: asyncio.Queue, cancelado: threading.Event):
+        self._loop = loop
+        self._cola = cola
+        self._cancelado = cancelado
+        self._buffer = bytearray()
+        self._descartada = False
+
+    def write(self, datos: bytes) -> int:
+        if self._descartada:
+            # Cancelado: lo que el zip escriba al liberarse se ignora
+            return len(datos)
+        self._buffer += datos
+        if len(self._buffer) >= TAMANO_BLOQUE:
+            self._enviar(bytes(self._buffer))
+            self._buffer.clear()
+        return len(datos)
+
+    def flush(self) -> None:
+        pass
+
+    def cerrar(self) -> None:
+        if self._buffer:
+            self._enviar(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _enviar(self, bloque: Any) -> None:
+        # Espera espacio en la cola (backpressure), atento a la cancelación
+        futuro = asyncio.run_coroutine_threadsafe(self._cola.put(bloque), self._loop)
+        while True:
+            try:
+                futuro.result(timeout=0.5)
+                return
+            except concurrent.futures.TimeoutError:
+                if self._cancelado.is_set():
+                    futuro.cancel()
+                    self._descartada = True
+                    raise ReporteCancelado()
+
+
+_semaforo: Optional[asyncio.Semaphore] = None
+
+
+def _obtener_semaforo() -> asyncio.Semaphore:
+    global _semaforo
+    if _semaforo is None:
+        _semaforo = asyncio.Semaphore(REPORTES_CONCURRENTES)
+    return _semaforo
+
+
+async def stream_xlsx(construir: Callable[..., None], *args: Any) -> AsyncIterator[bytes]:
+    """
+    Ejecuta construir(libro, *args) en un hilo y entrega el .xlsx por
+    bloques. Uso:
+
+        return StreamingResponse(stream_xlsx(escribir_reporte, datos),
+                                 media_type=MEDIA_TYPE_XLSX, headers=...)
+
+    Las validaciones (404, 422...) deben hacerse antes: cuando el primer
+    bloque sale ya se enviaron los headers y un error solo puede cortar
+    la descarga.
+    """
+    loop = asyncio.get_running_loop()
+    cola: asyncio.Queue = asyncio.Queue(maxsize=BLOQUES_EN_COLA)
+    cancelado = threading.Event()
+
+    async with _obtener_semaforo():
+        libro = LibroStream(loop, cancelado)
+        salida = _SalidaCola(loop, cola, cancelado)
+
+        def trabajo() -> None:
+            try:
+                construir(libro, *args)
+                libro.guardar(salida)
+                salida.cerrar()
+            except BaseException:
+                libro.descartar()
+                raise
+            finally:
+                if not cancelado.is_set():
+                    try:
+                        salida._enviar(_FIN)
+                    except ReporteCancelado:
+                        pass
+
+        tarea = asyncio.ensure_future(asyncio.to_thread(trabajo))
+        try:
+            while True:
+                bloque = await cola.get()
+                if bloque is _FIN:
+                    break
+                yield bloque
+            await tarea
+        except ReporteCancelado:
+            pass
+        except Exception as e:
+            logger.error(f"❌ Error generando reporte Excel: {e}")
+            raise
+        finally:
+            # Cliente desconectado o error: el hilo se detiene en la próxima fila
+            cancelado.set()
+            try:
+                await asyncio.shield(tarea)
+            except BaseException:
+                pass
+
+
+def construir_xlsx(construir: Callable[..., None], *args: Any) -> BytesIO:
+    """Versión síncrona (scripts, adjuntos): el .xlsx completo en un BytesIO."""
+    libro = LibroStream()
+    salida = BytesIO()
+    try:
+        construir(libro, *args)
+        libro.guardar(salida)
+    except BaseException:
+        libro.descartar()
+        raise
+    salida.seek(0)
+    return salida
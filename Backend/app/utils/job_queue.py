@@ -0,0 +1,174 @@
+"""
+Trabajos en segundo plano persistidos en MongoDB (colección background_jobs).
+
+Cada tipo de trabajo registra un handler async con registrar_handler();
+los endpoints llaman a encolar_trabajo() y responden de inmediato con el
+id. Workers del proceso toman los trabajos con un lease, ejecutan el
+handler y guardan su resultado, que se consulta con obtener_trabajo().
+
+- La concurrencia queda acotada por JOBS_WORKERS por proceso, para que
+  una ráfaga de trabajos pesados (PDFs al cierre del día) no acapare la CPU.
+- Un trabajo cuyo worker muere se retoma al vencer el lease.
+- Si el handler falla se reintenta con backoff hasta MAX_INTENTOS.
+
+El handler recibe el payload más "job_id" (el id del trabajo), para que
+sus efectos externos (p. ej. encolar un correo) sean idempotentes entre
+reintentos.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from app.database.mongo import db
+
+logger = logging.getLogger(__name__)
+
+collection_jobs = db["background_jobs"]
+
+NUM_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+MAX_INTENTOS = 3
+BACKOFF_BASE_SEGUNDOS = 15
+LEASE_SEGUNDOS = 300
+POLL_SEGUNDOS = 2.0
+
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+_handlers: Dict[str, Handler] = {}
+
+
+def registrar_handler(tipo: str, handler: Handler) -> None:
+    _handlers[tipo] = handler
+
+
+async def encolar_trabajo(tipo: str, payload: Dict[str, Any], creado_por: Optional[str] = None) -> str:
+    ahora = datetime.utcnow()
+    resultado = await collection_jobs.insert_one({
+        "tipo": tipo,
+        "payload": payload,
+        "estado": PENDIENTE,
+        "intentos": 0,
+        "proximo_intento": ahora,
+        "creado_en": ahora,
+        "creado_por": creado_por,
+        "resultado": None,
+    })
+    _despertar_workers()
+    return str(resultado.inserted_id)
+
+
+async def obtener_trabajo(job_id: str) -> Optional[dict]:
+    if not ObjectId.is_valid(job_id):
+        return None
+    job = await collection_jobs.find_one({"_id": ObjectId(job_id)})
+    if job:
+        job["_id"] = str(job["_id"])
+    return job
+
+
+async def _tomar_trabajo(worker_id: str) -> Optional[dict]:
+    ahora = datetime.utcnow()
+    return await collection_jobs.find_one_and_update(
+        {
+            "tipo": {"$in": list(_handlers.keys())},
+            "$or": [
+                {"estado": PENDIENTE, "proximo_intento": {"$lte": ahora}},
+                {"estado": PROCESANDO, "lease_hasta": {"$lte": ahora}},
+            ],
+        },
+        {"$set": {
+            "estado": PROCESANDO,
+            "worker": worker_id,
+            "iniciado_en": ahora,
+            "lease_hasta": ahora + timedelta(seconds=LEASE_SEGUNDOS),
+        }},
+        sort=[("proximo_intento", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _ejecutar(job: dict) -> None:
+    intentos = job.get("intentos", 0) + 1
+    try:
+        payload = {**(job.get("payload") or {}), "job_id": str(job["_id"])}
+        resultado = await _handlers[job["tipo"]](payload)
+    except Exception as e:
+        agotado = intentos >= MAX_INTENTOS
+        await collection_jobs.update_one(
+            {"_id": job["_id"]},
+            {"$set": {
+                "estado": FALLIDO if agotado else PENDIENTE,
+                "intentos": intentos,
+                "error": str(e)[:500],
+                "proximo_intento": datetime.utcnow() + timedelta(seconds=BACKOFF_BASE_SEGUNDOS * 2 ** (intentos - 1)),
+            }, "$unset": {"lease_hasta": "", "worker": ""}}
+        )
+        logger.warning(f"⚠️ Trabajo {job['tipo']} {job['_id']} falló (intento {intentos}): {e}")
+        return
+
+    await collection_jobs.update_one(
+        {"_id": job["_id"]},
+        {"$set": {
+            "estado": COMPLETADO,
+            "intentos": intentos,
+            "resultado": resultado,
+            "finalizado_en": datetime.utcnow(),
+        }, "$unset": {"lease_hasta": "", "error": ""}}
+    )
+
+
+_evento_nuevo: Optional[asyncio.Event] = None
+_tareas: List[asyncio.Task] = []
+
+
+def _despertar_workers() -> None:
+    if _evento_nuevo is not None:
+        _evento_nuevo.set()
+
+
+async def _worker(worker_id: str) -> None:
+    while True:
+        try:
+            job = await _tomar_trabajo(worker_id)
+        except Exception as e:
+            logger.error(f"❌ Trabajos: error leyendo la cola: {e}")
+            job = None
+
+        if job is None:
+            _evento_nuevo.clear()
+            try:
+                await asyncio.wait_for(_evento_nuevo.wait(), timeout=POLL_SEGUNDOS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            await _ejecutar(job)
+        except Exception as e:
+            logger.error(f"❌ Trabajos: error guardando resultado de {job.get('_id')}: {e}")
+
+
+async def iniciar_workers_trabajos(num_workers: int = NUM_WORKERS) -> None:
+    """Arranca los workers (se llama desde el lifespan)."""
+    global _evento_nuevo
+    if _tareas:
+        return
+    _evento_nuevo = asyncio.Event()
+    for i in range(num_workers):
+        _tareas.append(asyncio.create_task(_worker(f"{os.getpid()}-{i}")))
+    logger.info(f"✅ Trabajos en segundo plano: {num_workers} worker(s) iniciados")
+
+
+async def detener_workers_trabajos() -> None:
+    for tarea in _tareas:
+        tarea.cancel()
+    await asyncio.gather(*_tareas, return_exceptions=True)
+    _tareas.clear()
@@ -0,0 +1,131 @@
+"""
+Elección de líder entre procesos con un lease en MongoDB (colección
+scheduler_leases).
+
+Con varios workers de uvicorn o varias réplicas cada proceso arranca su
+propio scheduler; solo el que tiene el lease vigente debe disparar los
+jobs. El lease es un documento por nombre con el dueño y su vencimiento:
+
+- Un proceso lo toma si está libre, vencido o ya es suyo (upsert con
+  filtro; si otro lo tiene vigente el upsert choca con el _id y falla).
+- El líder lo renueva cada LEASE_SEGUNDOS / 3. Si el proceso muere, otro
+  lo toma al vencer, a más tardar en LEASE_SEGUNDOS.
+- es_lider() solo responde True mientras el lease local no haya vencido,
+  así un líder aislado de Mongo deja de disparar jobs antes de que otro
+  pueda tomar el lease.
+
+Configuración por entorno:
+    SCHEDULER_LEASE_SEGUNDOS (default: 30)
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.database.mongo import db
+
+logger = logging.getLogger(__name__)
+
+collection_leases = db["scheduler_leases"]
+
+LEASE_SEGUNDOS = int(os.getenv("SCHEDULER_LEASE_SEGUNDOS", "30"))
+RENOVAR_SEGUNDOS = LEASE_SEGUNDOS / 3
+# Margen para desfase de relojes entre procesos
+MARGEN_SEGUNDOS = 2
+
+INSTANCIA_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# nombre -> time.monotonic() hasta el que este proceso se considera líder
+_vigente_hasta: Dict[str, float] = {}
+_tareas: Dict[str, asyncio.Task] = {}
+
+
+def es_lider(nombre: str) -> bool:
+    return time.monotonic() < _vigente_hasta.get(nombre, 0)
+
+
+async def intentar_liderazgo(nombre: str) -> bool:
+    """Toma o renueva el lease. Devuelve True si este proceso es el líder."""
+    inicio = time.monotonic()
+    ahora = datetime.utcnow()
+    try:
+        await collection_leases.find_one_and_update(
+            {
+                "_id": nombre,
+                "$or": [{"dueno": INSTANCIA_ID}, {"expira_en": {"$lte": ahora}}],
+            },
+            {
+                "$set": {
+                    "dueno": INSTANCIA_ID,
+                    "expira_en": ahora + timedelta(seconds=LEASE_SEGUNDOS),
+                    "renovado_en": ahora,
+                },
+                "$setOnInsert": {"desde": ahora},
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Otro proceso tiene el lease vigente
+        _vigente_hasta.pop(nombre, None)
+        return False
+
+    _vigente_hasta[nombre] = inicio + LEASE_SEGUNDOS - MARGEN_SEGUNDOS
+    return True
+
+
+async def _mantener_liderazgo(nombre: str, al_ganar: Optional[Callable[[], Awaitable[None]]]) -> None:
+    era_lider = False
+    while True:
+        try:
+            lider = await intentar_liderazgo(nombre)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error renovando lease '{nombre}': {e}")
+            lider = es_lider(nombre)
+
+        if lider and not era_lider:
+            logger.info(f"👑 {INSTANCIA_ID} es líder de '{nombre}'")
+            if al_ganar is not None:
+                asyncio.create_task(al_ganar())
+        elif era_lider and not lider:
+            logger.warning(f"⚠️ {INSTANCIA_ID} perdió el liderazgo de '{nombre}'")
+        era_lider = lider
+
+        await asyncio.sleep(RENOVAR_SEGUNDOS)
+
+
+async def iniciar_eleccion(nombre: str, al_ganar: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+    """
+    Arranca la tarea que compite y renueva el lease `nombre`. `al_ganar`
+    se lanza cada vez que este proceso pasa a ser líder.
+    """
+    if nombre in _tareas:
+        return
+    _tareas[nombre] = asyncio.create_task(_mantener_liderazgo(nombre, al_ganar))
+
+
+async def detener_eleccion(nombre: str) -> None:
+    """Detiene la renovación y libera el lease para que otro lo tome ya."""
+    tarea = _tareas.pop(nombre, None)
+    if tarea is not None:
+        tarea.cancel()
+        await asyncio.gather(tarea, return_exceptions=True)
+    if _vigente_hasta.pop(nombre, None) is not None:
+        try:
+            await collection_leases.update_one(
+                {"_id": nombre, "dueno": INSTANCIA_ID},
+                {"$set": {"expira_en": datetime.utcnow()}},
+            )
+        except Exception as e:
+            logger.error(f"❌ Error liberando lease '{nombre}': {e}")
+
+
+async def lider_actual(nombre: str) -> Optional[dict]:
+    return await collection_leases.find_one({"_id": nombre})
@@ -0,0 +1,231 @@
+"""
+Fixtures compartidas de las pruebas.
+
+Las pruebas corren contra mongomock (base en memoria) con un adaptador
+async mínimo con la interfaz de motor que usa la app. Los módulos leen
+sus colecciones de variables globales, así que `conectar(modulo, ...)`
+reemplaza cada colección / base motor del módulo por la de prueba con
+el mismo nombre.
+
+Las pruebas que necesitan operadores de agregación que mongomock no
+implementa ($trim, $facet con $lookup, ...) llevan @pytest.mark.mongodb y
+solo corren contra un MongoDB real:
+
+    MONGODB_TEST_URI=mongodb://localhost:27017 pytest
+
+(se crea una base temporal por prueba y se elimina al terminar).
+"""
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+# app.database.mongo exige la URI al importarse; motor no conecta hasta la
+# primera operación y las pruebas reemplazan las colecciones antes de usarlas.
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase  # noqa: E402
+
+MONGODB_TEST_URI = os.getenv("MONGODB_TEST_URI")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "mongodb: requiere un MongoDB real (MONGODB_TEST_URI)")
+
+
+def pytest_collection_modifyitems(config, items):
+    if MONGODB_TEST_URI:
+        return
+    omitir = pytest.mark.skip(reason="requiere MONGODB_TEST_URI (mongomock no implementa la agregación)")
+    for item in items:
+        if "mongodb" in item.keywords:
+            item.add_marker(omitir)
+
+
+# ============================================================
+# ADAPTADOR ASYNC (interfaz de motor sobre pymongo / mongomock)
+# ============================================================
+class CursorPrueba:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def skip(self, n):
+        self._cursor = self._cursor.skip(n)
+        return self
+
+    def limit(self, n):
+        self._cursor = self._cursor.limit(n)
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(0)
+        docs = list(self._cursor)
+        return docs if length is None else docs[:length]
+
+    async def explain(self):
+        await asyncio.sleep(0)
+        return self._cursor.explain()
+
+    def __aiter__(self):
+        return self._iterar()
+
+    async def _iterar(self):
+        for doc in self._cursor:
+            await asyncio.sleep(0)
+            yield doc
+
+
+class ColeccionPrueba:
+    """
+    Cada operación cede el loop antes de ejecutarse, como una llamada real
+    a la base: las corrutinas concurrentes se intercalan entre consultas.
+    """
+
+    def __init__(self, coleccion):
+        self._coleccion = coleccion
+        self.name = coleccion.name
+
+    def find(self, *args, **kwargs):
+        return CursorPrueba(self._coleccion.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        if MONGODB_TEST_URI:
+            return CursorPrueba(self._coleccion.aggregate(pipeline, **kwargs))
+        # mongomock no acepta opciones como allowDiskUse
+        return CursorPrueba(self._coleccion.aggregate(pipeline))
+
+    def __getattr__(self, nombre):
+        metodo = getattr(self._coleccion, nombre)
+
+        async def llamar(*args, **kwargs):
+            await asyncio.sleep(0)
+            return metodo(*args, **kwargs)
+
+        return llamar
+
+
+class BasePrueba:
+    def __init__(self, base):
+        self._base = base
+        self.name = base.name
+
+    def __getitem__(self, nombre):
+        return ColeccionPrueba(self._base[nombre])
+
+    def __getattr__(self, nombre):
+        return self[nombre]
+
+    @property
+    def sincronica(self):
+        """La base pymongo / mongomock subyacente, para sembrar y revisar datos."""
+        return self._base
+
+
+# ============================================================
+# FIXTURES
+# ============================================================
+@pytest.fixture
+def bd():
+    if MONGODB_TEST_URI:
+        import pymongo
+
+        cliente = pymongo.MongoClient(MONGODB_TEST_URI)
+        nombre = f"pruebas_{uuid.uuid4().hex[:12]}"
+        yield BasePrueba(cliente[nombre])
+        cliente.drop_database(nombre)
+        cliente.close()
+    else:
+        import mongomock
+
+        yield BasePrueba(mongomock.MongoClient().pruebas)
+
+
+@pytest.fixture
+def conectar(bd, monkeypatch):
+    """Apunta las colecciones y bases motor de los módulos dados a `bd`."""
+
+    def _conectar(*modulos):
+        for modulo in modulos:
+            for nombre, valor in list(vars(modulo).items()):
+                if isinstance(valor, AsyncIOMotorCollection):
+                    monkeypatch.setattr(modulo, nombre, bd[valor.name])
+                elif isinstance(valor, AsyncIOMotorDatabase):
+                    monkeypatch.setattr(modulo, nombre, bd)
+
+    return _conectar
+
+
+# ============================================================
+# DATOS DE CAJA
+# ============================================================
+SEDES_CAJA = ["SD-1", "SD-11", "SD-2"]
+METODOS_CAJA = ["efectivo", "tarjeta_credito", "transferencia", "giftcard"]
+INICIO_CAJA = datetime(2025, 3, 1)
+
+
+@pytest.fixture
+def caja(bd, conectar):
+    """
+    Diez días (2025-03-01 a 2025-03-10) de citas, ventas, egresos,
+    ingresos manuales y aperturas en las sedes SEDES_CAJA.
+    """
+    import app.cash.accounting_logic as al
+
+    conectar(al)
+    base = bd.sincronica
+    azar = random.Random(1)
+
+    for sede in SEDES_CAJA:
+        base.branch.insert_one({
+            "sede_id": sede, "nombre": sede, "franquicia_id": "FR-1",
+            "moneda": "USD" if sede == "SD-2" else "COP",
+        })
+
+    for i in range(400):
+        sede = azar.choice(SEDES_CAJA)
+        dia = INICIO_CAJA + timedelta(days=azar.randint(0, 9), hours=azar.randint(8, 20))
+        pagos = [
+            {"fecha": dia, "monto": azar.randint(1, 9) * 1000, "metodo": azar.choice(METODOS_CAJA),
+             "tipo": azar.choice(["abono_inicial", "pago"])}
+            for _ in range(azar.randint(1, 2))
+        ]
+        if i % 2:
+            base.appointments.insert_one({
+                "sede_id": sede, "fecha": dia.strftime("%Y-%m-%d"), "historial_pagos": pagos,
+                "cliente_nombre": f"c{i}", "estado_factura": azar.choice(["facturado", "pendiente"]),
+            })
+        else:
+            base.sales.insert_one({"sede_id": sede, "fecha_pago": dia, "historial_pagos": pagos, "nombre_cliente": f"c{i}"})
+
+    for _ in range(30):
+        sede = azar.choice(SEDES_CAJA)
+        dia = INICIO_CAJA + timedelta(days=azar.randint(0, 9))
+        # Venta con desglose en lugar de historial (formato anterior)
+        base.sales.insert_one({"sede_id": sede, "fecha_pago": dia, "desglose_pagos": {"efectivo": 5000, "tarjeta": 2000}})
+        base.cash_expenses.insert_one({
+            "sede_id": sede, "fecha": dia.strftime("%Y-%m-%d"), "monto": 1000,
+            "metodo_pago": "efectivo", "tipo": "gasto", "creado_en": dia,
+        })
+        base.cash_ingresos.insert_one({
+            "sede_id": sede, "fecha": dia.strftime("%d-%m-%Y"), "monto": 700,
+            "metodo_pago": "efectivo", "creado_en": dia,
+        })
+
+    for sede in SEDES_CAJA:
+        for k in range(0, 10, 3):
+            fecha = (INICIO_CAJA + timedelta(days=k)).strftime("%Y-%m-%d")
+            base.cash_closures.insert_one({
+                "apertura_id": f"AP-{fecha}-{sede}", "sede_id": sede, "tipo": "apertura",
+                "fecha": fecha, "efectivo_inicial": 100 * k,
+            })
+    return base
@@ -0,0 +1,128 @@
+"""
+Claves de búsqueda de clientes: normalización, búsqueda por prefijo sobre
+las claves y respaldo ($regex) para clientes que el backfill no alcanzó.
+"""
+import asyncio
+
+import pytest
+
+import app.clients_service.busqueda as busqueda
+from app.database.indexes import SCHEMA_META_COLLECTION
+
+FRANQUICIA = {"franquicia_id": "FR-1"}
+PROYECCION = {"_id": 1, "cliente_id": 1, "nombre": 1, "telefono": 1, "cedula": 1}
+
+CLIENTES = [
+    {"cliente_id": "CL-000001", "nombre": "Luisa Bustamante", "telefono": "+57 300 1234567", "cedula": "1020304050"},
+    {"cliente_id": "CL-000002", "nombre": "José Peña Gómez", "telefono": "3109876543", "cedula": "79000111"},
+    {"cliente_id": "CL-000003", "nombre": "María Luisa Ortiz", "telefono": "315 555 0000", "cedula": "52333444"},
+    {"cliente_id": "CL-000004", "nombre": "Camila Restrepo", "telefono": "(1) 305-222-3333", "cedula": "1020999888", "pais": "Estados Unidos"},
+]
+
+
+@pytest.fixture
+def clientes(bd, conectar, monkeypatch):
+    conectar(busqueda)
+    monkeypatch.setattr(busqueda, "_claves_al_dia", False)
+    base = bd.sincronica
+    for cliente in CLIENTES:
+        base.clients.insert_one({**cliente, **FRANQUICIA, **busqueda.claves_cliente(cliente)})
+    # Otra franquicia con el mismo nombre: nunca debe aparecer
+    base.clients.insert_one({"cliente_id": "CL-999999", "nombre": "Luisa Bustamante", "franquicia_id": "FR-2",
+                             **busqueda.claves_cliente({"nombre": "Luisa Bustamante"})})
+    return base
+
+
+def _buscar(termino, tipo):
+    candidatos = asyncio.run(busqueda.buscar_candidatos(FRANQUICIA, termino, tipo, PROYECCION))
+    return [c["cliente_id"] for c in candidatos]
+
+
+def test_claves_normalizan_nombre_y_numeros():
+    claves = busqueda.claves_cliente({"nombre": "José  Peña", "telefono": "+57 (310) 987-6543", "cedula": "79.000.111"})
+    assert claves["busqueda"]["tokens"] == ["jose", "pena"]
+    assert {"jo", "jos", "jose", "pe", "pen", "pena"} == set(claves["busqueda"]["prefijos"])
+    assert claves["busqueda"]["telefono"] == "3109876543"
+    assert claves["busqueda"]["digitos"] == ["3109876543", "79000111"]
+    assert claves["telefono_e164"] == "+573109876543"
+    assert claves["cedula_digitos"] == "79000111"
+
+
+def test_telefono_sin_indicativo_usa_el_pais():
+    assert busqueda.telefono_e164("3052223333", "Estados Unidos") == "+13052223333"
+    assert busqueda.telefono_e164("3052223333") == "+573052223333"
+    assert busqueda.telefono_e164("123") is None
+
+
+@pytest.mark.parametrize("termino,esperados", [
+    ("luisa bust", ["CL-000001"]),
+    ("maria", ["CL-000003"]),
+    ("jose pena", ["CL-000002"]),
+    ("Peña", ["CL-000002"]),
+])
+def test_nombre_por_prefijos(clientes, termino, esperados):
+    assert _buscar(termino, "nombre")[: len(esperados)] == esperados
+    assert "CL-999999" not in _buscar(termino, "nombre")
+
+
+def test_nombre_con_error_de_tipeo_se_relaja(clientes):
+    # "bustamnte" no es prefijo de nada: se relaja a "lui" / "bus"
+    assert "CL-000001" in _buscar("luisa bustamnte", "nombre")
+
+
+@pytest.mark.parametrize("termino,esperado", [
+    ("3001", "CL-000001"),        # prefijo de teléfono
+    ("+57 315", "CL-000003"),     # indicativo explícito
+    ("79000111", "CL-000002"),    # cédula completa (índice exacto)
+    ("3001234567", "CL-000001"),  # teléfono completo (índice exacto)
+    ("1020999", "CL-000004"),     # prefijo de cédula
+])
+def test_numero_por_prefijo_o_exacto(clientes, termino, esperado):
+    candidatos = asyncio.run(busqueda.buscar_candidatos(FRANQUICIA, termino, "telefono_o_cedula", PROYECCION))
+    assert [c["cliente_id"] for c in busqueda.filtrar_por_digitos(candidatos, termino)][0] == esperado
+
+
+def test_respaldo_para_clientes_sin_claves(clientes, monkeypatch):
+    clientes.clients.insert_one({"cliente_id": "CL-000005", "nombre": "Luisa Sin Claves", "telefono": "3001112222", **FRANQUICIA})
+
+    assert "CL-000005" in _buscar("luisa", "nombre")
+    assert "CL-000005" in _buscar("30011", "telefono_o_cedula")
+
+    # Con el backfill confirmado ya no se consulta por $regex
+    monkeypatch.setattr(busqueda, "_claves_al_dia", True)
+    assert "CL-000005" not in _buscar("luisa", "nombre")
+
+
+def test_reconstruir_claves_y_registrar_version(clientes, monkeypatch):
+    clientes.clients.insert_one({"cliente_id": "CL-000005", "nombre": "Luisa Sin Claves", "telefono": "3001112222", **FRANQUICIA})
+    clientes.clients.update_one({"cliente_id": "CL-000002"}, {"$set": {"busqueda.v": busqueda.VERSION_CLAVES - 1}})
+
+    assert asyncio.run(busqueda.asegurar_claves()) == {"actualizados": 2}
+    assert busqueda._claves_al_dia is True
+    nuevo = clientes.clients.find_one({"cliente_id": "CL-000005"})
+    assert nuevo["busqueda"]["prefijos"][:2] == ["cl", "cla"]
+    assert nuevo["telefono_e164"] == "+573001112222"
+    registro = clientes[SCHEMA_META_COLLECTION].find_one({"_id": busqueda.META_CLAVES_ID})
+    assert registro["version"] == busqueda.VERSION_CLAVES
+
+    # Segundo arranque: schema_meta ya registra la versión
+    monkeypatch.setattr(busqueda, "_claves_al_dia", False)
+    assert asyncio.run(busqueda.asegurar_claves()) == {"actualizados": 0}
+    assert busqueda._claves_al_dia is True
+
+
+def test_benchmark_busqueda_en_coleccion_dada(bd, conectar, clientes):
+    resultado = asyncio.run(busqueda.benchmark_busqueda(bd["bench_clientes"], n_clientes=500))
+
+    assert resultado["clientes"] == 500
+    fila = next(f for f in resultado["terminos"] if f["termino"] == "luisa bust")
+    assert "Luisa" in fila["nueva_top"]
+    assert "bench_clientes" not in bd.sincronica.list_collection_names()
+    # La colección de la app no se toca
+    assert clientes.clients.count_documents({}) == len(CLIENTES) + 1
+
+
+def test_benchmark_busqueda_rechaza_coleccion_con_datos(bd, clientes):
+    with pytest.raises(ValueError):
+        asyncio.run(busqueda.benchmark_busqueda(bd["clients"], n_clientes=10))
+    assert clientes.clients.count_documents({}) == len(CLIENTES) + 1
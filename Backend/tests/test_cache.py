@@ -0,0 +1,70 @@
+"""
+Caché compartida: interfaz abstracta, single-flight y valores en Redis
+guardados como JSON (no pickle).
+"""
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.utils.cache import CacheBackend, MemoryTTLCache, RedisCache
+
+
+class RedisFalso:
+    """Lo mínimo de redis.asyncio que usa RedisCache."""
+
+    def __init__(self):
+        self.datos = {}
+
+    async def get(self, key):
+        return self.datos.get(key)
+
+    async def set(self, key, value, ex=None, nx=False, px=None):
+        if nx and key in self.datos:
+            return None
+        self.datos[key] = value
+        return True
+
+    async def delete(self, key):
+        self.datos.pop(key, None)
+
+    async def incr(self, key):
+        self.datos[key] = int(self.datos.get(key, 0)) + 1
+
+
+def test_backend_es_abstracto():
+    with pytest.raises(TypeError):
+        CacheBackend()
+
+
+def test_redis_guarda_json():
+    cliente = RedisFalso()
+    cache = RedisCache(cliente, prefix="t:")
+    oid = ObjectId()
+    valor = {"id": oid, "fecha": datetime(2025, 3, 1, 8, 30), "filas": [{"total": 1.5}]}
+
+    asyncio.run(cache.set("k", valor))
+
+    assert json.loads(cliente.datos["t:k"]) == {"id": str(oid), "fecha": "2025-03-01T08:30:00", "filas": [{"total": 1.5}]}
+    assert asyncio.run(cache.get("k")) == {"id": str(oid), "fecha": "2025-03-01T08:30:00", "filas": [{"total": 1.5}]}
+
+
+@pytest.mark.parametrize("fabrica", [lambda: MemoryTTLCache(), lambda: RedisCache(RedisFalso())])
+def test_get_or_compute_calcula_una_vez(fabrica):
+    cache = fabrica()
+    llamadas = []
+
+    async def calcular():
+        llamadas.append(1)
+        await asyncio.sleep(0.01)
+        return [{"cliente_id": "CL-1"}]
+
+    async def correr():
+        return await asyncio.gather(*(cache.get_or_compute("churn", calcular) for _ in range(5)))
+
+    assert asyncio.run(correr()) == [[{"cliente_id": "CL-1"}]] * 5
+    assert len(llamadas) == 1
+    assert asyncio.run(cache.get_or_compute("churn", calcular)) == [{"cliente_id": "CL-1"}]
+    assert len(llamadas) == 1
@@ -0,0 +1,99 @@
+"""
+_reunir: consultas concurrentes acotadas por operación, y el día completo
+con consultas concurrentes igual al cálculo en serie.
+"""
+import asyncio
+
+import pytest
+
+import app.cash.accounting_logic as al
+
+# Sedes que siembra la fixture `caja` (conftest.py)
+SEDES = ["SD-1", "SD-11", "SD-2"]
+
+
+class Contador:
+    """Consulta falsa que registra cuántas hay en curso a la vez."""
+
+    def __init__(self):
+        self.en_curso = 0
+        self.maximo = 0
+
+    async def consulta(self, valor):
+        self.en_curso += 1
+        self.maximo = max(self.maximo, self.en_curso)
+        await asyncio.sleep(0.001)
+        self.en_curso -= 1
+        return valor
+
+
+@pytest.mark.parametrize("limite", [1, 3, 6])
+def test_reunir_anidado_respeta_limite(limite):
+    contador = Contador()
+
+    async def compuesta(i):
+        # Un _reunir anidado comparte el semáforo de la operación
+        return sum(await al._reunir(*(lambda j=j: contador.consulta(i * 10 + j) for j in range(5))))
+
+    async def correr():
+        token = al._limite_consultas.set(limite)
+        try:
+            return await al._reunir(*(lambda i=i: compuesta(i) for i in range(5)), lambda: contador.consulta(-1))
+        finally:
+            al._limite_consultas.reset(token)
+
+    resultado = asyncio.run(correr())
+    assert resultado == [sum(i * 10 + j for j in range(5)) for i in range(5)] + [-1]
+    assert contador.maximo <= limite
+    if limite > 1:
+        assert contador.maximo > 1
+
+
+def test_reunir_crea_las_consultas_dentro_del_semaforo():
+    # motor lanza la consulta al crear el futuro: no debe haber más
+    # creadas sin terminar que el límite
+    contador = Contador()
+    pendientes = []
+
+    def fabrica(i):
+        pendientes.append(i)
+        assert len(pendientes) <= 2
+
+        async def consulta():
+            valor = await contador.consulta(i)
+            pendientes.remove(i)
+            return valor
+
+        return consulta()
+
+    async def correr():
+        token = al._limite_consultas.set(2)
+        try:
+            return await al._reunir(*(lambda i=i: fabrica(i) for i in range(8)))
+        finally:
+            al._limite_consultas.reset(token)
+
+    assert asyncio.run(correr()) == list(range(8))
+    assert al._semaforo_consultas.get() is None
+
+
+@pytest.mark.parametrize("sede", SEDES)
+def test_dia_completo_igual_a_en_serie(caja, sede):
+    async def correr():
+        difs = []
+        for fecha in ["2025-03-01", "2025-03-04", "2025-03-07", "2025-03-15"]:
+            token = al._limite_consultas.set(1)
+            try:
+                esperado = await al._dia_en_serie(sede, fecha)
+            finally:
+                al._limite_consultas.reset(token)
+            difs += al.diferencias(esperado, await al.calcular_dia_completo(sede, fecha), fecha)
+        return difs
+
+    assert asyncio.run(correr()) == []
+
+
+def test_benchmark_dia_reporta_resultados_identicos(caja):
+    filas = asyncio.run(al.benchmark_dia("SD-1", "2025-03-04", repeticiones=1))
+    assert [f["caso"] for f in filas] == ["resumen", "dia_completo"]
+    assert all(f["identicos"] for f in filas)
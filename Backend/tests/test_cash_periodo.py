@@ -0,0 +1,42 @@
+"""
+calcular_periodo / calcular_periodo_sedes deben dar exactamente lo mismo
+que las cuatro funciones por día (el cálculo anterior), día por día.
+"""
+import asyncio
+
+import pytest
+
+import app.cash.accounting_logic as al
+
+# Sedes que siembra la fixture `caja` (conftest.py)
+SEDES = ["SD-1", "SD-11", "SD-2"]
+
+
+@pytest.mark.parametrize("desde,hasta", [
+    ("2025-03-01", "2025-03-10"),
+    ("2025-03-04", "2025-03-04"),
+    ("2025-02-25", "2025-03-02"),   # días sin datos al inicio
+])
+@pytest.mark.parametrize("sede", SEDES)
+def test_periodo_igual_a_dia_a_dia(caja, sede, desde, hasta):
+    assert asyncio.run(al.verificar_paridad(sede, desde, hasta)) == []
+
+
+def test_periodo_varias_sedes_igual_a_una_por_una(caja):
+    async def correr():
+        varias = await al.calcular_periodo_sedes(SEDES, "2025-03-01", "2025-03-10", detalle=True)
+        una_por_una = {s: await al.calcular_periodo(s, "2025-03-01", "2025-03-10") for s in SEDES}
+        return varias, una_por_una
+
+    varias, una_por_una = asyncio.run(correr())
+    for sede in SEDES:
+        assert al.diferencias(una_por_una[sede], varias[sede]) == []
+    # El conjunto de datos no es trivial: hay ventas en todas las sedes
+    assert all(
+        sum(d["resumen"]["total_vendido"] for d in una_por_una[s].values()) > 0 for s in SEDES
+    )
+
+
+def test_benchmark_periodo_reporta_cada_rango(caja):
+    filas = asyncio.run(al.benchmark_periodo("SD-1", "2025-03-10", dias=(1, 10)))
+    assert [f["dias"] for f in filas] == [1, 10]
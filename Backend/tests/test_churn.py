@@ -0,0 +1,189 @@
+"""
+Churn sobre client_visit_stats: la reconstrucción inicial corre como
+migración de arranque y, mientras no esté registrada, el churn y las
+estadísticas se calculan desde appointments con el mismo resultado.
+"""
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import app.analytics.routes_churn as routes_churn
+import app.analytics.visitas_clientes as visitas_clientes
+import app.database.migraciones as migraciones
+from app.database.indexes import SCHEMA_META_COLLECTION
+
+SEDE = "SD-1"
+
+
+def _fecha(dias: int) -> str:
+    return (datetime.now() + timedelta(days=dias)).strftime("%Y-%m-%d")
+
+
+@pytest.fixture
+def citas(bd, conectar, monkeypatch):
+    """200 clientes con 1-4 citas entre hace un año y dentro de un mes, en dos sedes."""
+    conectar(routes_churn, visitas_clientes, migraciones)
+    monkeypatch.setattr(visitas_clientes, "_visitas_al_dia", False)
+    base = bd.sincronica
+    azar = random.Random(7)
+    for i in range(200):
+        cliente_id = f"CL-{i:04d}"
+        base.clients.insert_one({"cliente_id": cliente_id, "nombre": f"Cliente {i}", "sede_id": SEDE})
+        for _ in range(azar.randint(1, 4)):
+            base.appointments.insert_one({
+                "cliente_id": cliente_id,
+                "sede_id": azar.choice([SEDE, "SD-2"]),
+                "fecha": _fecha(azar.randint(-360, 30)),
+                "estado": azar.choice(["confirmada", "completada", "cancelada"]),
+            })
+        if i % 3 == 0:
+            base.sales.insert_one({
+                "cliente_id": cliente_id, "sede_id": SEDE, "moneda": "COP",
+                "desglose_pagos": {"total": 50_000}, "fecha_pago": datetime(2025, 3, 1),
+            })
+    # Cita de un cliente que no existe en clients
+    base.appointments.insert_one({"cliente_id": "CL-HUERFANO", "sede_id": SEDE, "fecha": _fecha(-200), "estado": "completada"})
+    return base
+
+
+def _churn(sedes):
+    async def correr():
+        return [fila async for fila in routes_churn.iterar_churn(sedes, sede_id=sedes[0] if sedes and len(sedes) == 1 else None)]
+    return asyncio.run(correr())
+
+
+@pytest.mark.parametrize("sedes", [[SEDE], [SEDE, "SD-2"], None])
+def test_churn_igual_antes_y_despues_de_la_reconstruccion(citas, sedes):
+    antes = _churn(sedes)
+    assert citas.client_visit_stats.count_documents({}) == 0
+    assert antes
+
+    resultado = asyncio.run(migraciones.ejecutar_migracion(
+        visitas_clientes.MIGRACION_VISITAS, visitas_clientes.VERSION_VISITAS, visitas_clientes.reconstruir_visitas
+    ))
+    assert resultado["clientes"] == 201
+    assert asyncio.run(visitas_clientes.visitas_al_dia()) is True
+
+    assert _churn(sedes) == antes
+
+
+def test_reconstruccion_inicial_se_registra_una_vez(citas):
+    llamadas = []
+
+    async def reconstruir():
+        llamadas.append(1)
+        return await visitas_clientes.reconstruir_visitas()
+
+    async def correr():
+        for _ in range(2):
+            await migraciones.ejecutar_migracion(
+                visitas_clientes.MIGRACION_VISITAS, visitas_clientes.VERSION_VISITAS, reconstruir
+            )
+
+    asyncio.run(correr())
+    assert len(llamadas) == 1
+    registro = citas[SCHEMA_META_COLLECTION].find_one({"_id": visitas_clientes.MIGRACION_VISITAS})
+    assert registro["version"] == visitas_clientes.VERSION_VISITAS
+
+
+def test_estadisticas_iguales_con_y_sin_proyeccion(citas):
+    ids = [f"CL-{i:04d}" for i in range(0, 200, 7)]
+    referencia = datetime.now()
+
+    async def leer():
+        return (
+            await visitas_clientes.obtener_visitas(ids),
+            await visitas_clientes.obtener_visitas(ids, SEDE),
+            await visitas_clientes.contar_inactivos(ids, referencia, 60),
+            await visitas_clientes.contar_inactivos(ids, referencia, 60, SEDE),
+        )
+
+    calculadas = asyncio.run(leer())
+    asyncio.run(visitas_clientes.reconstruir_visitas())
+    visitas_clientes._visitas_al_dia = True
+    proyectadas = asyncio.run(leer())
+
+    assert calculadas == proyectadas
+    assert calculadas[0]["CL-0000"]["compras"] == 1
+
+
+def test_actualizar_visitas_cliente_tras_nueva_cita(citas):
+    asyncio.run(visitas_clientes.reconstruir_visitas())
+    previa = citas.client_visit_stats.find_one({"_id": "CL-0001|*"})
+    citas.appointments.insert_one({"cliente_id": "CL-0001", "sede_id": SEDE, "fecha": _fecha(90), "estado": "confirmada"})
+
+    asyncio.run(visitas_clientes.actualizar_visitas_cliente("CL-0001"))
+
+    nueva = citas.client_visit_stats.find_one({"_id": "CL-0001|*"})
+    assert nueva["visitas"] == previa["visitas"] + 1
+    assert nueva["ultima_cita"] == _fecha(90)
+
+
+def test_benchmark_churn_en_colecciones_dadas(bd, conectar):
+    conectar(routes_churn, visitas_clientes)
+    # Una base vacía con los nombres de la app (los $lookup los usan)
+    colecciones = [bd["appointments"], bd["clients"], bd["sales"], bd["client_visit_stats"]]
+
+    resultado = asyncio.run(routes_churn.benchmark_churn(*colecciones, n_clientes=300))
+
+    assert resultado["identicos"] is True
+    assert resultado["en_churn"] > 0
+    assert bd.sincronica.list_collection_names() == []
+
+
+def test_benchmark_churn_rechaza_colecciones_con_datos(citas, bd):
+    with pytest.raises(ValueError):
+        asyncio.run(routes_churn.benchmark_churn(
+            bd["appointments"], bd["clients"], bd["sales"], bd["client_visit_stats"], n_clientes=10
+        ))
+    assert citas.appointments.count_documents({}) > 0
+
+
+def test_recalculo_lento_no_pisa_uno_mas_reciente(citas):
+    asyncio.run(visitas_clientes.reconstruir_visitas())
+    calcular = visitas_clientes._calcular_visitas
+
+    async def correr():
+        lento_calculando = asyncio.Event()
+        nueva_cita = asyncio.Event()
+
+        async def lento(ids):
+            versiones = await visitas_clientes._subir_versiones(ids)
+            docs = await calcular(ids)
+            lento_calculando.set()
+            await nueva_cita.wait()
+            return await visitas_clientes._guardar(ids, docs, versiones)
+
+        async def reciente():
+            await lento_calculando.wait()
+            await visitas_clientes.collection_citas.insert_one(
+                {"cliente_id": "CL-0001", "sede_id": "SD-3", "fecha": _fecha(90), "estado": "confirmada"}
+            )
+            await visitas_clientes.actualizar_visitas_cliente("CL-0001")
+            nueva_cita.set()
+
+        return await asyncio.gather(lento(["CL-0001"]), reciente())
+
+    omitidos, _ = asyncio.run(correr())
+
+    assert omitidos > 0
+    total = citas.client_visit_stats.find_one({"_id": "CL-0001|*"})
+    assert total["ultima_cita"] == _fecha(90)
+    assert total["version"] == 3
+    # El documento de la sede nueva no lo borra el recálculo lento
+    assert citas.client_visit_stats.find_one({"_id": "CL-0001|SD-3"})["visitas"] == 1
+    assert asyncio.run(visitas_clientes.obtener_visitas(["CL-0001"]))["CL-0001"] == {
+        k: v for k, v in total.items() if k not in ("actualizado_en", "version")
+    }
+
+
+def test_cliente_sin_actividad_no_deja_documento(citas):
+    asyncio.run(visitas_clientes.reconstruir_visitas())
+    citas.appointments.delete_many({"cliente_id": "CL-0002"})
+    citas.sales.delete_many({"cliente_id": "CL-0002"})
+
+    asyncio.run(visitas_clientes.actualizar_visitas_cliente("CL-0002"))
+
+    assert citas.client_visit_stats.count_documents({"cliente_id": "CL-0002"}) == 0
@@ -0,0 +1,104 @@
+"""
+Subidas directas de fotos de fichas: formulario prefirmado con límite de
+tamaño, validación de las keys y limpieza de las subidas huérfanas.
+"""
+import asyncio
+import base64
+import json
+
+import boto3
+import pytest
+from fastapi import HTTPException
+
+import app.scheduling.submodules.fichas.routes_fichas as routes_fichas
+import app.utils.almacenamiento as almacenamiento
+from app.scheduling.models import SolicitudSubidaFoto
+
+BASE = "https://bucket.test"
+CARPETA = "companies/CO-1/clients/CL-1/fichas/general"
+USUARIO = {"rol": "estilista"}
+
+
+@pytest.fixture
+def bucket(bd, conectar, monkeypatch):
+    """Bucket falso: key → metadatos; registra las keys borradas."""
+    conectar(routes_fichas)
+    monkeypatch.setenv("AWS_PUBLIC_BASE_URL", BASE)
+    monkeypatch.setenv("AWS_BUCKET_NAME", "bucket")
+    objetos = {
+        f"{CARPETA}/antes/a.jpg": {"tamano": 1000, "content_type": "image/jpeg"},
+        f"{CARPETA}/despues/b.jpg": {"tamano": 1000, "content_type": "image/jpeg"},
+        f"{CARPETA}/antes/usada.jpg": {"tamano": 1000, "content_type": "image/jpeg"},
+        f"{CARPETA}/antes/enorme.jpg": {"tamano": almacenamiento.MAX_FOTO_BYTES + 1, "content_type": "image/jpeg"},
+    }
+    borradas = []
+
+    async def metadatos(key):
+        return objetos.get(key)
+
+    async def borrar(keys):
+        borradas.extend(keys)
+
+    monkeypatch.setattr(routes_fichas, "metadatos_objeto", metadatos)
+    monkeypatch.setattr(routes_fichas, "borrar_objetos", borrar)
+    base = bd.sincronica
+    base.clients.insert_one({"cliente_id": "CL-1"})
+    base.branch.insert_one({"sede_id": "SD-1", "company_id": "CO-1"})
+    base.fichas.insert_one({"fotos": {"variantes": {"antes": [{"original": f"{BASE}/{CARPETA}/antes/usada.jpg"}]}}})
+    return borradas
+
+
+def _registrar(antes, despues=None):
+    return asyncio.run(routes_fichas.registrar_subidas_directas({"antes": antes, "despues": despues}, "CO-1", "CL-1"))
+
+
+def test_keys_validas_devuelven_variantes_por_lado(bucket):
+    directas = _registrar([f"{CARPETA}/antes/a.jpg"], [f"{CARPETA}/despues/b.jpg"])
+    assert directas["antes"][0]["original"] == f"{BASE}/{CARPETA}/antes/a.jpg"
+    assert directas["antes"][0]["pdf"] is None
+    assert len(directas["despues"]) == 1
+    assert bucket == []
+
+
+def test_key_inexistente_descarta_las_huerfanas(bucket):
+    with pytest.raises(HTTPException) as error:
+        _registrar([f"{CARPETA}/antes/a.jpg", f"{CARPETA}/antes/usada.jpg"], [f"{CARPETA}/despues/nada.jpg"])
+    assert error.value.status_code == 400
+    # La que ya usa otra ficha se conserva
+    assert sorted(bucket) == [f"{CARPETA}/antes/a.jpg", f"{CARPETA}/despues/nada.jpg"]
+
+
+def test_key_de_otro_cliente_no_se_borra(bucket):
+    ajena = "companies/CO-1/clients/CL-2/fichas/general/antes/x.jpg"
+    with pytest.raises(HTTPException) as error:
+        _registrar([f"{CARPETA}/antes/a.jpg", ajena])
+    assert error.value.status_code == 400
+    assert bucket == [f"{CARPETA}/antes/a.jpg"]
+
+
+def test_foto_demasiado_grande_se_rechaza(bucket):
+    with pytest.raises(HTTPException):
+        _registrar([f"{CARPETA}/antes/enorme.jpg"])
+    assert bucket == [f"{CARPETA}/antes/enorme.jpg"]
+
+
+def test_url_subida_exige_cliente_existente(bucket):
+    solicitud = SolicitudSubidaFoto(cliente_id="CL-9", sede_id="SD-1", lado="antes")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(routes_fichas.url_subida_foto(solicitud, USUARIO))
+    assert error.value.status_code == 404
+
+
+def test_url_subida_firma_limite_de_tamano(bucket, monkeypatch):
+    monkeypatch.setattr(almacenamiento, "s3_client", boto3.client(
+        "s3", aws_access_key_id="x", aws_secret_access_key="x", region_name="us-west-2"
+    ))
+    solicitud = SolicitudSubidaFoto(cliente_id="CL-1", sede_id="SD-1", lado="antes", nombre_archivo="foto.PNG")
+
+    respuesta = asyncio.run(routes_fichas.url_subida_foto(solicitud, USUARIO))
+
+    assert respuesta["metodo"] == "POST"
+    assert respuesta["key"].startswith(f"{CARPETA}/antes/") and respuesta["key"].endswith(".png")
+    politica = json.loads(base64.b64decode(respuesta["campos"]["policy"]))
+    assert ["content-length-range", 1, almacenamiento.MAX_FOTO_BYTES] in politica["conditions"]
+    assert {"Content-Type": "image/jpeg"} in politica["conditions"]
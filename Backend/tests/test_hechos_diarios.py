@@ -0,0 +1,146 @@
+"""
+Hechos diarios de analytics: invalidación por edición de estilistas,
+servicios y sedes, y paridad de /analytics/performance (que lee los
+hechos) con el cálculo original sobre las citas.
+
+La paridad usa el pipeline $facet de _hechos_citas_sede ($trim, $lookup...),
+que mongomock no implementa: corre solo con MONGODB_TEST_URI.
+"""
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import app.analytics.hechos_diarios as hd
+import app.scheduling.submodules.quotes.availability as disponibilidad
+
+SEDES = ["SD-1", "SD-2"]
+
+
+@pytest.fixture
+def hechos(bd, conectar):
+    """Un mes de citas de cinco estilistas en dos sedes, con estados y servicios variados."""
+    conectar(hd, disponibilidad)
+    base = bd.sincronica
+    azar = random.Random(3)
+
+    for sede in SEDES:
+        base.branch.insert_one({"sede_id": sede, "nombre": f"Sede {sede}", "franquicia_id": "FR-1"})
+    categorias = ["Corte", "Color", None]
+    for i in range(8):
+        base.services.insert_one({"servicio_id": f"S{i}", "nombre": f"serv{i}", "categoria": categorias[i % 3]})
+    for p in range(5):
+        base.stylist.insert_one({
+            "profesional_id": f"P{p}", "nombre": f"prof{p}", "sede_id": SEDES[p % 2],
+            "comisiones_por_categoria": {"Corte": 30} if p % 2 else {}, "comision": 20,
+        })
+        base.stylist_schedules.insert_one({
+            "profesional_id": f"P{p}",
+            "disponibilidad": [{"dia_semana": d, "hora_inicio": "08:00", "hora_fin": "17:00"} for d in range(1, 7)],
+        })
+
+    estados = ["confirmada", "completada", "cancelada", "pendiente", "no_asistio", "Completada"]
+    for _ in range(300):
+        dia = datetime(2025, 3, 1) + timedelta(days=azar.randint(0, 30))
+        hora = azar.randint(8, 15)
+        servicios = [
+            {"servicio_id": f"S{azar.randint(0, 8)}", "precio": azar.randint(1, 9) * 1000, "cantidad": azar.choice([1, 2, None])}
+            for _ in range(azar.randint(0, 3))
+        ]
+        base.appointments.insert_one({
+            "sede_id": azar.choice(SEDES),
+            "profesional_id": azar.choice([f"P{p}" for p in range(5)] + [None]),
+            "fecha": dia.strftime("%Y-%m-%d"),
+            "hora_inicio": f"{hora:02d}:00",
+            "hora_fin": f"{hora + 1:02d}:{azar.choice(['00', '30'])}",
+            "estado": azar.choice(estados),
+            "valor_total": azar.choice([0, sum(s["precio"] for s in servicios)]),
+            "servicios": servicios,
+            "moneda": "COP",
+            "cliente_id": f"C{azar.randint(0, 40)}",
+            "profesional_nombre": "x",
+        })
+    return base
+
+
+def _calculados(base, sede_id):
+    """Simula días ya calculados (limpios) para todo marzo."""
+    for dia in range(1, 32):
+        fecha = f"2025-03-{dia:02d}"
+        base.analytics_daily_status.insert_one({
+            "_id": f"{sede_id}|{fecha}", "sede_id": sede_id, "fecha": fecha, "version": 1, "sucio": False,
+        })
+
+
+def _sucios(base):
+    return {(d["sede_id"], d["fecha"]) for d in base.analytics_daily_status.find({"sucio": True})}
+
+
+def test_invalidar_hechos_marca_el_dia_y_sube_version(hechos):
+    asyncio.run(hd.invalidar_hechos("SD-1", datetime(2025, 3, 4, 15), "2025-03-05", None))
+    asyncio.run(hd.invalidar_hechos("SD-1", "2025-03-04"))
+    assert _sucios(hechos) == {("SD-1", "2025-03-04"), ("SD-1", "2025-03-05")}
+    assert hechos.analytics_daily_status.find_one({"_id": "SD-1|2025-03-04"})["version"] == 2
+
+
+def test_invalidar_profesional_ensucia_sus_dias(hechos):
+    for sede in SEDES:
+        _calculados(hechos, sede)
+    esperado = {(c["sede_id"], c["fecha"]) for c in hechos.appointments.find({"profesional_id": "P1"})}
+
+    total = asyncio.run(hd.invalidar_hechos_profesional("P1"))
+
+    assert total == len(esperado) > 0
+    assert _sucios(hechos) == esperado
+    assert asyncio.run(hd.invalidar_hechos_profesional(None)) == 0
+
+
+def test_invalidar_servicio_ensucia_dias_con_el_servicio(hechos):
+    for sede in SEDES:
+        _calculados(hechos, sede)
+    esperado = {(c["sede_id"], c["fecha"]) for c in hechos.appointments.find({"servicios.servicio_id": "S2"})}
+
+    asyncio.run(hd.invalidar_hechos_servicio("S2"))
+
+    assert _sucios(hechos) == esperado
+
+
+def test_invalidar_sede_ensucia_todos_sus_dias(hechos):
+    for sede in SEDES:
+        _calculados(hechos, sede)
+
+    assert asyncio.run(hd.invalidar_hechos_sede("SD-2")) == 31
+    assert {sede for sede, _ in _sucios(hechos)} == {"SD-2"}
+
+
+def test_nombre_sede_sale_de_locales(hechos):
+    assert asyncio.run(hd._nombre_sede("SD-1")) == "Sede SD-1"
+    assert asyncio.run(hd._nombre_sede("SD-9")) is None
+
+
+@pytest.fixture
+def performance(hechos, conectar):
+    # Import local: projection_analytics depende de la autenticación (jose)
+    import app.analytics.projection_analytics as projection_analytics
+
+    conectar(projection_analytics)
+    return hechos
+
+
+@pytest.mark.mongodb
+@pytest.mark.parametrize("sede", SEDES)
+def test_performance_con_hechos_igual_al_calculo_original(performance, sede):
+    assert asyncio.run(hd.verificar_paridad_hechos(sede, "2025-03-01", "2025-03-31")) == []
+
+
+@pytest.mark.mongodb
+def test_paridad_detecta_una_comision_mal_calculada(performance, monkeypatch):
+    original = hd._preparar_tasas_comision
+
+    async def tasas_erradas(sede_id, fechas):
+        await original(sede_id, fechas)
+        await hd.collection_tasas_comision.update_many({}, {"$set": {"pct": 99}})
+
+    monkeypatch.setattr(hd, "_preparar_tasas_comision", tasas_erradas)
+    assert asyncio.run(hd.verificar_paridad_hechos("SD-1", "2025-03-01", "2025-03-31"))
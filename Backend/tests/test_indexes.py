@@ -0,0 +1,73 @@
+"""
+Manifiesto de índices: create_indexes es idempotente y registra su versión;
+verificar_indices (explain) solo corre contra un MongoDB real.
+"""
+import asyncio
+
+import pytest
+
+from app.database.indexes import (
+    INDEX_MANIFEST,
+    INDEX_MANIFEST_VERSION,
+    QUERY_CATALOGUE,
+    SCHEMA_META_COLLECTION,
+    SCHEMA_META_ID,
+    _etapas_plan,
+    create_indexes,
+    verificar_indices,
+)
+
+
+def _total_indices():
+    return sum(len(indices) for indices in INDEX_MANIFEST.values())
+
+
+def test_nombres_unicos_por_coleccion():
+    for coleccion, indices in INDEX_MANIFEST.items():
+        nombres = [spec["name"] for spec in indices]
+        assert len(nombres) == len(set(nombres)), coleccion
+
+
+def test_catalogo_solo_usa_colecciones_del_manifiesto():
+    assert {coleccion for coleccion, _, _ in QUERY_CATALOGUE} <= set(INDEX_MANIFEST)
+
+
+def test_crea_indices_y_registra_version(bd):
+    resultado = asyncio.run(create_indexes(bd))
+
+    assert resultado["omitidos"] == []
+    assert len(resultado["creados"]) == _total_indices()
+    base = bd.sincronica
+    for coleccion, indices in INDEX_MANIFEST.items():
+        existentes = base[coleccion].index_information()
+        for spec in indices:
+            assert spec["name"] in existentes
+    registro = base[SCHEMA_META_COLLECTION].find_one({"_id": SCHEMA_META_ID})
+    assert registro["version"] == INDEX_MANIFEST_VERSION
+
+
+def test_segundo_arranque_no_toca_indices(bd):
+    asyncio.run(create_indexes(bd))
+    assert asyncio.run(create_indexes(bd)) == {"creados": [], "omitidos": []}
+    # forzar vuelve a aplicarlo sin errores (create_index es idempotente)
+    assert len(asyncio.run(create_indexes(bd, forzar=True))["creados"]) == _total_indices()
+
+
+def test_version_anterior_vuelve_a_aplicar(bd):
+    bd.sincronica[SCHEMA_META_COLLECTION].insert_one({"_id": SCHEMA_META_ID, "version": INDEX_MANIFEST_VERSION - 1})
+    assert len(asyncio.run(create_indexes(bd))["creados"]) == _total_indices()
+
+
+def test_etapas_plan_recorre_plan_anidado():
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]},
+    }
+    assert _etapas_plan(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+    assert _etapas_plan({"stage": "SORT", "queryPlan": {"stage": "IXSCAN"}}) == ["SORT", "IXSCAN"]
+
+
+@pytest.mark.mongodb
+def test_catalogo_sin_collscan(bd):
+    asyncio.run(create_indexes(bd))
+    assert asyncio.run(verificar_indices(bd)) == []
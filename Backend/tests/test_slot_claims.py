@@ -0,0 +1,118 @@
+"""
+slot_claims: entre reservas simultáneas que se solapan gana exactamente
+una, y el backfill de citas previas se registra una sola vez.
+"""
+import asyncio
+from datetime import date, timedelta
+
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import app.database.migraciones as migraciones
+import app.scheduling.submodules.quotes.slot_claims as sc
+from app.database.indexes import SCHEMA_META_COLLECTION
+
+
+@pytest.fixture
+def claims(bd, conectar, monkeypatch):
+    """
+    slot_claims con insert_many documento a documento, cediendo el loop
+    entre inserciones: así las reservas concurrentes se intercalan a mitad
+    de un lote, como en un servidor real.
+    """
+    conectar(sc, migraciones)
+    base = bd.sincronica
+    coleccion = bd["slot_claims"]
+
+    async def insert_many(docs, ordered=True):
+        errores = []
+        for i, doc in enumerate(docs):
+            await asyncio.sleep(0)
+            try:
+                base.slot_claims.insert_one(dict(doc))
+            except DuplicateKeyError:
+                errores.append({"index": i, "code": sc.DUPLICATE_KEY})
+                if ordered:
+                    break
+        if errores:
+            raise BulkWriteError({"writeErrors": errores})
+
+    monkeypatch.setattr(coleccion, "insert_many", insert_many, raising=False)
+    monkeypatch.setattr(sc, "collection_slot_claims", coleccion)
+    return base
+
+
+def test_celdas_cubren_el_intervalo():
+    assert [h for _, h in sc.celdas("P1", "2099-01-01", "10:02", "10:20")] == ["10:00", "10:05", "10:10", "10:15"]
+    assert sc.celdas("P1", "2099-01-01", "10:00") == [("P1|2099-01-01|10:00", "10:00")]
+
+
+@pytest.mark.parametrize("n", [2, 20])
+def test_reservas_simultaneas_una_sola_gana(claims, n):
+    async def intento(i):
+        try:
+            await sc.reclamar_slot("P1", "2099-01-01", f"10:{(i % 3) * 5:02d}", "10:30", sc.REF_CITA, f"c{i}")
+            return True
+        except sc.SlotOcupado:
+            return False
+
+    async def correr():
+        return await asyncio.gather(*(intento(i) for i in range(n)))
+
+    for _ in range(20):
+        claims.slot_claims.delete_many({})
+        assert sum(asyncio.run(correr())) == 1
+        # La perdedora no deja celdas sueltas
+        assert len(claims.slot_claims.distinct("ref_id")) == 1
+
+
+def test_reservas_sin_solape_ganan_todas(claims):
+    async def correr():
+        return await asyncio.gather(*(
+            sc.reclamar_slot("P1", "2099-01-01", f"1{h}:00", f"1{h}:30", sc.REF_CITA, f"c{h}")
+            for h in range(4)
+        ))
+
+    asyncio.run(correr())
+    assert claims.slot_claims.count_documents({}) == 4 * 6
+
+
+def test_cita_toma_pre_reserva_del_mismo_usuario(claims):
+    async def correr():
+        await sc.reclamar_slot("P1", "2099-01-01", "10:00", "10:30", sc.REF_PRE_RESERVA, "pr1", reservado_por="u1")
+        with pytest.raises(sc.SlotOcupado):
+            await sc.reclamar_slot("P1", "2099-01-01", "10:00", "10:30", sc.REF_CITA, "c-otro", reservado_por="u2")
+        return await sc.reclamar_slot("P1", "2099-01-01", "10:15", "10:45", sc.REF_CITA, "c1", reservado_por="u1")
+
+    resultado = asyncio.run(correr())
+    assert resultado["reemplazadas"] == ["pr1"]
+    assert claims.slot_claims.count_documents({"ref_id": "pr1"}) == 0
+    assert claims.slot_claims.count_documents({"ref_id": "c-otro"}) == 0
+
+
+def test_backfill_se_registra_una_vez(claims, bd):
+    manana = (date.today() + timedelta(days=1)).isoformat()
+    ayer = (date.today() - timedelta(days=1)).isoformat()
+    bd.sincronica.appointments.insert_many([
+        {"profesional_id": "P1", "fecha": manana, "hora_inicio": "09:00", "hora_fin": "09:30", "estado": "confirmada"},
+        {"profesional_id": "P1", "fecha": manana, "hora_inicio": "09:15", "hora_fin": "09:45", "estado": "confirmada"},
+        {"profesional_id": "P2", "fecha": manana, "hora_inicio": "09:00", "hora_fin": "09:30", "estado": "cancelada"},
+        {"profesional_id": "P3", "fecha": ayer, "hora_inicio": "09:00", "hora_fin": "09:30", "estado": "confirmada"},
+    ])
+    llamadas = []
+
+    async def backfill():
+        llamadas.append(1)
+        return await sc.backfill_citas_futuras()
+
+    async def correr():
+        primero = await migraciones.ejecutar_migracion(sc.MIGRACION_BACKFILL, sc.VERSION_BACKFILL, backfill)
+        segundo = await migraciones.ejecutar_migracion(sc.MIGRACION_BACKFILL, sc.VERSION_BACKFILL, backfill)
+        return primero, segundo
+
+    primero, segundo = asyncio.run(correr())
+    assert primero == {"citas": 2, "reclamadas": 1, "conflictos": 1}
+    assert segundo is None
+    assert len(llamadas) == 1
+    registro = bd.sincronica[SCHEMA_META_COLLECTION].find_one({"_id": sc.MIGRACION_BACKFILL})
+    assert registro["version"] == sc.VERSION_BACKFILL